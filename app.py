@@ -1,21 +1,37 @@
+import os
+
 import aws_cdk as cdk
 from sso import(
     SsoStack,
     SsoConfig
 )
+from sso.environments import load_environments
+from sso.parallel_synth import synth_environments
 
-app = cdk.App()
-SsoStack(
-    app,
-    "SsoStack",
-    env=cdk.Environment(
-        # If you have configured an additional account as a Delegated Administrator
-        # of IAM Identity Center (SSO) in your AWS Organization, you can instead deploy
-        # this stack to that account. Otherwise, you must deploy this in your org's
-        # Management Account in the region where you've set up AWS IAM Identity Center.
-        account=SsoConfig.sso_account.value,
-        region=SsoConfig.sso_region.value
-    ),
-)
+# One environment file (JSON or YAML) per IAM Identity Center instance, e.g. prod.yaml
+# and sandbox.yaml, each deployed as its own SsoStack-<name>. See sso/environments.py.
+ENVIRONMENTS_DIR = "environments"
+
+# Workers are spawned, and re-import this module, so only synthesize when it's run
+if __name__ == "__main__":
+    if os.path.isdir(ENVIRONMENTS_DIR):
+        # The CLI tells the app where to write the cloud assembly
+        synth_environments(
+            load_environments(ENVIRONMENTS_DIR), outdir=os.environ.get("CDK_OUTDIR", "cdk.out")
+        )
+    else:
+        app = cdk.App()
+        SsoStack(
+            app,
+            "SsoStack",
+            env=cdk.Environment(
+                # If you have configured an additional account as a Delegated Administrator
+                # of IAM Identity Center (SSO) in your AWS Organization, you can instead deploy
+                # this stack to that account. Otherwise, you must deploy this in your org's
+                # Management Account in the region where you've set up AWS IAM Identity Center.
+                account=SsoConfig.sso_account.value,
+                region=SsoConfig.sso_region.value
+            ),
+        )
 
-app.synth()
\ No newline at end of file
+        app.synth()
@@ -0,0 +1,245 @@
+"""
+Throughput of the sso_user Lambda handler (index.on_event) for Custom::SsoUser requests,
+run in-process against tests.support's FakeIdentityStore instead of AWS. For each
+user count, four scenarios run in order against the same identity store:
+
+- create: a Create request per new user
+- update: an Update request per user, changing their first name
+- import: a Create request per user that already exists with the same attributes, as
+  when bringing users created outside of CDK into a stack
+- delete: a Delete request per user (with ALLOW_DELETE_USERS on for the run)
+
+Each scenario records requests per second, p50/p99/max request latency, and identitystore
+calls and throttles per API. The user directory is invalidated before every scenario, so
+each one pays for its own list_users() snapshot, as after a cold start.
+
+Run from the repo root with e.g.
+`python benchmarks/handler_throughput.py --users 100 1000 10000 --output results.json`.
+The handler's client-side rate limits are off by default, so the numbers show the
+handler's own overhead; --paced turns them on. --baseline fails (exit status 1) if ops/sec
+dropped, or API calls grew, by more than --tolerance compared with an earlier results file.
+"""
+import argparse
+import contextlib
+import json
+import os
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), "..")
+LAMBDA_DIR = os.path.join(REPO_ROOT, "sso", "constructs", "lambda_functions", "sso_user")
+# Ahead of this directory, whose user_diff.py benchmark would shadow the handler's module
+sys.path.insert(0, LAMBDA_DIR)
+# For the fakes in tests.support
+sys.path.append(REPO_ROOT)
+
+os.environ.setdefault("SSO_IDENTITY_STORE_ID", "d-1234567890")
+os.environ.setdefault("SSO_REGION", "us-east-1")
+# Keep bytecode out of the Lambda source dir, where it would change the asset hash
+sys.dont_write_bytecode = True
+# Logging at INFO is part of the handler's cost in Lambda too, but would flood the terminal
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+import index  # noqa: E402
+
+from tests.support.fake_identitystore import FakeIdentityStore  # noqa: E402
+from tests.support.handler import IDENTITY_STORE_ID, event, use_fake, user_properties  # noqa: E402
+
+SCENARIOS = ("create", "update", "import", "delete")
+DEFAULT_USER_COUNTS = (100, 1000, 10000)
+
+
+def percentile(sorted_values: Sequence[float], fraction: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, int(round(fraction * len(sorted_values) + 0.5)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+def run_scenario(
+    scenario: str,
+    events: List[Dict[str, Any]],
+    fake: FakeIdentityStore,
+    concurrency: int,
+) -> Dict[str, Any]:
+    fake.reset_counts()
+    index.user_directory.invalidate()
+    latencies: List[float] = []
+    # In the order of events, whatever order they complete in
+    responses: List[Optional[Dict[str, Any]]] = [None] * len(events)
+    errors: List[str] = []
+
+    def invoke(position: int) -> None:
+        request = events[position]
+        started_at = time.perf_counter()
+        try:
+            responses[position] = index.on_event(request, None)
+        except Exception as error:
+            errors.append(f"{request['RequestId']}: {error}")
+        latencies.append((time.perf_counter() - started_at) * 1000)
+
+    # EMF records are still serialized and written, as in Lambda, just not to the terminal
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        started_at = time.perf_counter()
+        if concurrency == 1:
+            for position in range(len(events)):
+                invoke(position)
+        else:
+            with ThreadPoolExecutor(max_workers=concurrency) as executor:
+                list(executor.map(invoke, range(len(events))))
+        seconds = time.perf_counter() - started_at
+
+    latencies.sort()
+    return {
+        "scenario": scenario,
+        "requests": len(events),
+        "seconds": round(seconds, 3),
+        "ops_per_second": round(len(events) / seconds, 1) if seconds else None,
+        "latency_ms": {
+            "p50": round(percentile(latencies, 0.50), 3),
+            "p99": round(percentile(latencies, 0.99), 3),
+            "max": round(latencies[-1], 3) if latencies else 0.0,
+        },
+        "api_calls": dict(sorted(fake.calls.items())),
+        "api_throttles": dict(sorted(fake.throttled.items())),
+        "errors": len(errors),
+        "first_errors": errors[:5],
+        "_responses": responses,
+    }
+
+
+def run_user_count(
+    user_count: int,
+    *,
+    latency_ms: float = 0.0,
+    jitter_ms: float = 0.0,
+    throttle_rate: Optional[float] = None,
+    concurrency: int = 1,
+    paced: bool = False,
+    scenarios: Sequence[str] = SCENARIOS,
+) -> List[Dict[str, Any]]:
+    """Runs the scenarios in order for user_count users, each against the state the previous one left."""
+    fake = FakeIdentityStore(latency_ms=latency_ms, jitter_ms=jitter_ms, throttle_rate=throttle_rate)
+    with use_fake(fake, paced):
+        return _run_scenarios(fake, user_count, concurrency, scenarios)
+
+
+def _run_scenarios(
+    fake: FakeIdentityStore, user_count: int, concurrency: int, scenarios: Sequence[str]
+) -> List[Dict[str, Any]]:
+    # User IDs of the users the create scenario made, which the others update and delete
+    user_ids: Dict[int, str] = {}
+    results: List[Dict[str, Any]] = []
+    builders: Dict[str, Callable[[], List[Dict[str, Any]]]] = {
+        "create": lambda: [event("Create", i, user_properties(i)) for i in range(user_count)],
+        "update": lambda: [
+            event(
+                "Update",
+                i,
+                user_properties(i, first_name="Janet"),
+                PhysicalResourceId=user_ids[i],
+                OldResourceProperties=user_properties(i),
+            )
+            for i in range(user_count)
+            if i in user_ids
+        ],
+        # A second set of users, created outside of CloudFormation
+        "import": lambda: [event("Create", i, user_properties(i)) for i in range(user_count, 2 * user_count)],
+        "delete": lambda: [
+            event("Delete", i, user_properties(i), PhysicalResourceId=user_ids[i])
+            for i in range(user_count)
+            if i in user_ids
+        ],
+    }
+    for scenario in scenarios:
+        if scenario == "import":
+            fake.seed_users(
+                [index.toAwsIdentityStoreUserFormat(user_properties(i)) for i in range(user_count, 2 * user_count)],  # type: ignore[arg-type]
+                IDENTITY_STORE_ID,
+            )
+        events = builders[scenario]()
+        allow_delete_users = index.ALLOW_DELETE_USERS
+        index.ALLOW_DELETE_USERS = scenario == "delete"
+        try:
+            result = run_scenario(scenario, events, fake, concurrency)
+        finally:
+            index.ALLOW_DELETE_USERS = allow_delete_users
+        responses = result.pop("_responses")
+        if scenario == "create":
+            user_ids = {i: response["PhysicalResourceId"] for i, response in enumerate(responses) if response}
+        results.append({"users": user_count, **result})
+    return results
+
+
+def benchmark(user_counts: Sequence[int], **options: Any) -> Dict[str, Any]:
+    return {
+        "python": sys.version.split()[0],
+        "config": options,
+        "results": [result for user_count in user_counts for result in run_user_count(user_count, **options)],
+    }
+
+
+def regressions(baseline: Dict[str, Any], current: Dict[str, Any], tolerance: float) -> List[str]:
+    """Scenarios that got slower, or make more API calls, than in baseline by more than tolerance."""
+    previous = {(result["scenario"], result["users"]): result for result in baseline["results"]}
+    found: List[str] = []
+    for result in current["results"]:
+        before = previous.get((result["scenario"], result["users"]))
+        if before is None:
+            continue
+        name = f"{result['scenario']} x {result['users']}"
+        if before["ops_per_second"] and result["ops_per_second"] < before["ops_per_second"] * (1 - tolerance):
+            found.append(f"{name}: {result['ops_per_second']} ops/sec, was {before['ops_per_second']}")
+        for api, calls in result["api_calls"].items():
+            if calls > before["api_calls"].get(api, 0) * (1 + tolerance):
+                found.append(f"{name}: {calls} {api} calls, was {before['api_calls'].get(api, 0)}")
+        if result["errors"] > before["errors"]:
+            found.append(f"{name}: {result['errors']} errors, was {before['errors']}")
+    return found
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, nargs="+", default=list(DEFAULT_USER_COUNTS))
+    parser.add_argument("--scenarios", nargs="+", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--latency-ms", type=float, default=0.0, help="latency of every fake identitystore call")
+    parser.add_argument("--jitter-ms", type=float, default=0.0, help="random +/- added to --latency-ms")
+    parser.add_argument(
+        "--throttle-rate", type=float, help="requests per second, per API, before the fake throttles"
+    )
+    parser.add_argument("--concurrency", type=int, default=1, help="concurrent on_event invocations")
+    parser.add_argument("--paced", action="store_true", help="apply the handler's client-side rate limits")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    parser.add_argument("--baseline", help="results file of an earlier run to compare with")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="allowed regression, as a fraction")
+    args = parser.parse_args(argv)
+
+    results = benchmark(
+        args.users,
+        latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms,
+        throttle_rate=args.throttle_rate,
+        concurrency=args.concurrency,
+        paced=args.paced,
+        scenarios=args.scenarios,
+    )
+    output = json.dumps(results, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    else:
+        print(output)
+    if args.baseline:
+        with open(args.baseline) as f:
+            found = regressions(json.load(f), results, args.tolerance)
+        for regression in found:
+            print(f"Regression: {regression}", file=sys.stderr)
+        return 1 if found else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,355 @@
+"""
+How `cdk synth` time, memory, and template size grow with the size of the directory.
+For each size, synthetic groups, users (each in a couple of groups), and group
+assignments are written as directory files, and SsoStack loads them through the
+sso:groupsFile, sso:usersFile, and sso:assignmentsFile context, as `cdk synth -c ...` does.
+
+Every run is a fresh Python process (and so a fresh jsii kernel), which measures:
+
+- construct_seconds: SsoStack(...), including loading the directory files
+- synth_seconds: app.synth(), i.e. aspects (cdk-nag and AssignmentCompactor), prepare,
+  validation, and writing the cloud assembly. Lambda bundling is skipped.
+- nag_seconds: with --nag both, synth_seconds with AwsSolutionsChecks minus without it, at
+  the same size. --nag-mode scoped checks only the stack's infrastructure (see
+  SsoNagChecks), which shouldn't grow with the directory. cdk-nag runs inside the jsii kernel; timing its visits from Python would
+  add a round trip per construct.
+- peak_rss_mb: peak resident memory of the Python process and of the jsii kernel (node)
+  process, read from /proc where available
+- template_bytes, resource_count: over the stack's template and its nested stacks' templates
+
+Run from the repo root with e.g.
+`python benchmarks/synth_scaling.py --scales 0.1 0.5 1 --output synth-scaling.jsonl`.
+Each run appends one JSON line to --output, tagged with the git revision and aws-cdk-lib
+version, so results from several releases can go in the same file and be plotted as
+scaling curves.
+"""
+import argparse
+import csv
+import json
+import os
+import platform
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from typing import Any, Dict, Iterator, List, Optional, Sequence
+
+REPO_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+
+DEFAULT_USERS = 5000
+DEFAULT_GROUPS = 500
+DEFAULT_ASSIGNMENTS = 20000
+GROUPS_PER_USER = 2
+# The permission sets SsoStack hands to DirectoryLoader
+PERMISSION_SETS = ("AWSReadOnlyAccess", "AWSAdministratorAccess", "DemoPermissionSet")
+FIRST_ACCOUNT_ID = 100000000000
+# Sharded resources per nested stack to aim for, well below CloudFormation's 500 since
+# users hash to shards unevenly
+RESOURCES_PER_SHARD = 300
+# Without sharding, leaves room for the provider, permission sets, and demo resources
+MAX_UNSHARDED_RESOURCES = 450
+
+
+def group_name(i: int) -> str:
+    return f"Synthetic Group {i:04d}"
+
+
+def generate_directory(
+    directory: str,
+    *,
+    users: int,
+    groups: int,
+    assignments: int,
+    groups_per_user: int = GROUPS_PER_USER,
+) -> Dict[str, str]:
+    """
+    Writes groups.jsonl, users.csv, and assignments.jsonl to directory, and returns the
+    context that points SsoStack at them. Assignments are distinct (group, permission
+    set, account) triples, spread over as few accounts as that allows.
+    """
+    if assignments and not groups:
+        raise ValueError("assignments need at least one group")
+    paths = {
+        "sso:groupsFile": os.path.join(directory, "groups.jsonl"),
+        "sso:usersFile": os.path.join(directory, "users.csv"),
+        "sso:assignmentsFile": os.path.join(directory, "assignments.jsonl"),
+    }
+    with open(paths["sso:groupsFile"], "w") as f:
+        for i in range(groups):
+            f.write(json.dumps({"group_name": group_name(i)}) + "\n")
+    with open(paths["sso:usersFile"], "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["username", "email", "first_name", "last_name", "groups"])
+        for i in range(users):
+            memberships = sorted({(i + j * max(1, groups // groups_per_user)) % groups for j in range(groups_per_user)}) if groups else []
+            writer.writerow(
+                [
+                    f"user{i:05d}",
+                    f"user{i:05d}@example.com",
+                    "Synthetic",
+                    f"User{i}",
+                    ";".join(group_name(g) for g in memberships),
+                ]
+            )
+    with open(paths["sso:assignmentsFile"], "w") as f:
+        for i in range(assignments):
+            row = {
+                "group": group_name(i % groups),
+                "permission_set": PERMISSION_SETS[(i // groups) % len(PERMISSION_SETS)],
+                "account": str(FIRST_ACCOUNT_ID + i // (groups * len(PERMISSION_SETS))),
+            }
+            f.write(json.dumps(row) + "\n")
+    return paths
+
+
+def default_shard_count(*, users: int, groups: int, assignments: int) -> Optional[int]:
+    """
+    Enough shards for the users, memberships, and assignments, or None if they all fit in
+    SsoStack itself. Groups stay in the parent stack, so they aren't counted.
+    """
+    sharded = users * (1 + min(groups, GROUPS_PER_USER)) + assignments
+    if sharded + groups <= MAX_UNSHARDED_RESOURCES:
+        return None
+    return -(-sharded // RESOURCES_PER_SHARD)
+
+
+def _descendant_pids(pid: int) -> Iterator[int]:
+    children: Dict[int, List[int]] = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # "pid (comm) state ppid ...", where comm may contain spaces
+                fields = f.read().rsplit(")", 1)[1].split()
+        except OSError:
+            continue
+        children.setdefault(int(fields[1]), []).append(int(entry))
+    pending = list(children.get(pid, []))
+    while pending:
+        child = pending.pop()
+        yield child
+        pending += children.get(child, [])
+
+
+def jsii_kernel_peak_rss_mb() -> Optional[float]:
+    """
+    Peak RSS of this process's descendants, i.e. the jsii runtime and the node process it
+    runs the kernel in, or None without /proc.
+    """
+    if not os.path.isdir("/proc"):
+        return None
+    peak_kb = 0
+    for pid in _descendant_pids(os.getpid()):
+        try:
+            with open(f"/proc/{pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmHWM:"):
+                        peak_kb += int(line.split()[1])
+        except OSError:
+            continue
+    return round(peak_kb / 1024, 1)
+
+
+def python_peak_rss_mb() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Kilobytes on Linux, bytes on macOS
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def measure(
+    *,
+    users: int,
+    groups: int,
+    assignments: int,
+    nag: bool,
+    nag_mode: str = "full",
+    shard_count: Optional[int] = None,
+) -> Dict[str, Any]:
+    """Generates a directory, then builds and synthesizes SsoStack in this process."""
+    started_at = time.perf_counter()
+    import aws_cdk as cdk
+
+    sys.path.insert(0, REPO_ROOT)
+    from sso import SsoConfig, SsoStack
+    from sso.constructs import NagMode
+
+    import_seconds = time.perf_counter() - started_at
+    with tempfile.TemporaryDirectory(prefix="sso-synth-scaling") as directory:
+        context: Dict[str, Any] = {
+            # Bundling the Lambda code would dominate, and doesn't grow with the directory
+            "aws:cdk:bundling-stacks": [],
+            **generate_directory(directory, users=users, groups=groups, assignments=assignments),
+        }
+        app = cdk.App(outdir=os.path.join(directory, "cdk.out"), context=context)
+
+        started_at = time.perf_counter()
+        SsoStack(
+            app,
+            "SsoStack",
+            shard_count=shard_count,
+            nag_checks=nag,
+            nag_mode=NagMode(nag_mode),
+            env=cdk.Environment(account=SsoConfig.sso_account.value, region=SsoConfig.sso_region.value),
+        )
+        construct_seconds = time.perf_counter() - started_at
+
+        started_at = time.perf_counter()
+        assembly = app.synth()
+        synth_seconds = time.perf_counter() - started_at
+
+        template_bytes = 0
+        resource_count = 0
+        for name in os.listdir(assembly.directory):
+            if name.endswith(".template.json"):
+                path = os.path.join(assembly.directory, name)
+                template_bytes += os.path.getsize(path)
+                with open(path) as f:
+                    resource_count += len(json.load(f).get("Resources", {}))
+        peak_rss_mb = {"python": python_peak_rss_mb(), "jsii_kernel": jsii_kernel_peak_rss_mb()}
+
+    return {
+        "users": users,
+        "groups": groups,
+        "assignments": assignments,
+        "nag": nag,
+        "nag_mode": nag_mode,
+        "shard_count": shard_count,
+        "import_seconds": round(import_seconds, 3),
+        "construct_seconds": round(construct_seconds, 3),
+        "synth_seconds": round(synth_seconds, 3),
+        "peak_rss_mb": peak_rss_mb,
+        "template_bytes": template_bytes,
+        "resource_count": resource_count,
+    }
+
+
+def run_worker(**options: Any) -> Dict[str, Any]:
+    """
+    Runs measure() in a fresh interpreter, so peak RSS and jsii state are per run. A synth
+    that fails (e.g. a stack over CloudFormation's limits) is recorded with its error, as
+    where the curve ends is worth tracking too.
+    """
+    arguments = [sys.executable, os.path.abspath(__file__), "--worker"]
+    for key, value in options.items():
+        if value is not None:
+            arguments += [f"--{key.replace('_', '-')}", str(value)]
+    completed = subprocess.run(arguments, capture_output=True, text=True, cwd=REPO_ROOT)
+    if completed.returncode != 0:
+        errors = [line for line in completed.stderr.strip().splitlines() if line.strip()]
+        return {**options, "nag": options["nag"] == "on", "error": errors[-1] if errors else "failed"}
+    # The last line; CDK may print warnings before it
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def git_revision() -> Optional[str]:
+    try:
+        completed = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, cwd=REPO_ROOT
+        )
+    except OSError:
+        return None
+    return completed.stdout.strip() or None
+
+
+def package_version(name: str) -> Optional[str]:
+    from importlib.metadata import PackageNotFoundError, version
+
+    try:
+        return version(name)
+    except PackageNotFoundError:
+        return None
+
+
+def benchmark(
+    *,
+    users: int,
+    groups: int,
+    assignments: int,
+    scales: Sequence[float],
+    nag_modes: Sequence[bool],
+    nag_mode: str = "full",
+    shard_count: Optional[int] = None,
+) -> List[Dict[str, Any]]:
+    metadata = {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "git_revision": git_revision(),
+        "aws_cdk_lib": package_version("aws-cdk-lib"),
+        "cdk_nag": package_version("cdk-nag"),
+        "python": platform.python_version(),
+    }
+    results: List[Dict[str, Any]] = []
+    for scale in scales:
+        sizes = {
+            "users": round(users * scale),
+            "groups": max(1, round(groups * scale)),
+            "assignments": round(assignments * scale),
+        }
+        shards = shard_count if shard_count is not None else default_shard_count(**sizes)
+        runs = {
+            nag: run_worker(**sizes, nag="on" if nag else "off", nag_mode=nag_mode, shard_count=shards)
+            for nag in nag_modes
+        }
+        if "synth_seconds" in runs.get(True, {}) and "synth_seconds" in runs.get(False, {}):
+            runs[True]["nag_seconds"] = round(runs[True]["synth_seconds"] - runs[False]["synth_seconds"], 3)
+        for nag in nag_modes:
+            result = {**metadata, "scale": scale, **runs[nag]}
+            results.append(result)
+            summary = result.get("error") or (
+                f"{result['resource_count']} resources, construct {result['construct_seconds']}s, "
+                f"synth {result['synth_seconds']}s, {result['template_bytes']} template bytes"
+            )
+            print(f"scale={scale} nag={'on' if nag else 'off'} shards={shards}: {summary}", file=sys.stderr)
+    return results
+
+
+def main(argv: Optional[Sequence[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=DEFAULT_USERS)
+    parser.add_argument("--groups", type=int, default=DEFAULT_GROUPS)
+    parser.add_argument("--assignments", type=int, default=DEFAULT_ASSIGNMENTS)
+    parser.add_argument(
+        "--scales", type=float, nargs="+", default=[1.0], help="multipliers of the sizes above, one run each"
+    )
+    parser.add_argument("--nag", choices=["on", "off", "both"], default="both", help="AwsSolutionsChecks")
+    parser.add_argument("--nag-mode", choices=["full", "scoped"], default="full", help="SsoStack's nag_mode")
+    parser.add_argument(
+        "--shard-count", type=int, help="SsoStack's shard_count; by default, enough for the sizes"
+    )
+    parser.add_argument("--output", help="append JSON lines here instead of printing them")
+    parser.add_argument("--worker", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        result = measure(
+            users=args.users,
+            groups=args.groups,
+            assignments=args.assignments,
+            nag=args.nag == "on",
+            nag_mode=args.nag_mode,
+            shard_count=args.shard_count,
+        )
+        print(json.dumps(result))
+        return 0
+
+    results = benchmark(
+        users=args.users,
+        groups=args.groups,
+        assignments=args.assignments,
+        scales=args.scales,
+        nag_modes={"on": [True], "off": [False], "both": [False, True]}[args.nag],
+        nag_mode=args.nag_mode,
+        shard_count=args.shard_count,
+    )
+    lines = "".join(json.dumps(result) + "\n" for result in results)
+    if args.output:
+        with open(args.output, "a") as f:
+            f.write(lines)
+    else:
+        sys.stdout.write(lines)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
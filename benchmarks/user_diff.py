@@ -0,0 +1,116 @@
+"""
+Compares the sso_user Lambda's schema-aware user differ (user_diff.py) with the DeepDiff
+calls it replaced, on the two things that matter to the handler:
+
+- cold start: the import time of each module, measured with `python -X importtime` in a
+  fresh interpreter so nothing is already cached in sys.modules
+- per-call CPU: process time of the update diff (on_update) and the import comparison
+  (try_import_existing_user) for a typical user
+
+Run from the repo root with `python benchmarks/user_diff.py [--output results.json]`.
+DeepDiff is only needed for the "before" numbers; install it with requirements-dev.txt.
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, Optional
+
+LAMBDA_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "sso", "constructs", "lambda_functions", "sso_user"
+)
+sys.path.insert(0, LAMBDA_DIR)
+
+import user_diff  # noqa: E402
+
+OLD_USER = {
+    "UserName": "jdoe",
+    "Name": {"GivenName": "Jane", "FamilyName": "Doe"},
+    "DisplayName": "Jane Doe",
+    "Emails": [{"Value": "jdoe@example.com", "Type": "work", "Primary": True}],
+}
+NEW_USER = dict(OLD_USER, Name={"GivenName": "Janet", "FamilyName": "Doe"}, DisplayName="Janet Doe")
+EXISTING_USER = dict(OLD_USER, UserId="90676f5d1a-0b1c2d3e-4f5a-6b7c-8d9e-0f1a2b3c4d5e", IdentityStoreId="d-1234567890")
+
+
+def import_time_us(module: str, repeat: int) -> Optional[int]:
+    """Best-of-N cumulative import time of a module in a fresh interpreter, in microseconds."""
+    best = None
+    for _ in range(repeat):
+        completed = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c", f"import {module}"],
+            capture_output=True,
+            text=True,
+            env=dict(os.environ, PYTHONPATH=LAMBDA_DIR, PYTHONDONTWRITEBYTECODE="1"),
+        )
+        if completed.returncode != 0:
+            return None
+        # Lines look like "import time:   self [us] | cumulative | imported package"
+        for line in completed.stderr.splitlines():
+            fields = [field.strip() for field in line.split("|")]
+            if len(fields) == 3 and fields[2] == module:
+                cumulative = int(fields[1])
+                best = cumulative if best is None else min(best, cumulative)
+    return best
+
+
+def cpu_us_per_call(function: Callable[[], Any], iterations: int) -> float:
+    started_at = time.process_time()
+    for _ in range(iterations):
+        function()
+    return (time.process_time() - started_at) / iterations * 1_000_000
+
+
+def benchmark(iterations: int, repeat: int) -> Dict[str, Any]:
+    existing_attributes = {
+        key: value for key, value in EXISTING_USER.items() if key not in user_diff.USER_IDENTIFIER_KEYS
+    }
+    results: Dict[str, Any] = {
+        "python": sys.version.split()[0],
+        "iterations": iterations,
+        "after": {
+            "import_time_us": import_time_us("user_diff", repeat),
+            "update_diff_cpu_us": cpu_us_per_call(
+                lambda: user_diff.get_change_operations(OLD_USER, NEW_USER), iterations
+            ),
+            "import_check_cpu_us": cpu_us_per_call(
+                lambda: user_diff.differing_keys(EXISTING_USER, OLD_USER), iterations
+            ),
+        },
+        "before": None,
+    }
+    try:
+        from deepdiff.diff import DeepDiff
+    except ImportError:
+        print("deepdiff not installed, skipping 'before' numbers", file=sys.stderr)
+        return results
+    results["before"] = {
+        "import_time_us": import_time_us("deepdiff.diff", repeat),
+        "update_diff_cpu_us": cpu_us_per_call(
+            lambda: DeepDiff(OLD_USER, NEW_USER).affected_root_keys, iterations
+        ),
+        "import_check_cpu_us": cpu_us_per_call(
+            lambda: DeepDiff(OLD_USER, existing_attributes, ignore_order=True), iterations
+        ),
+    }
+    return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--iterations", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per import measurement")
+    parser.add_argument("--output", help="write JSON results here instead of stdout")
+    args = parser.parse_args()
+    results = json.dumps(benchmark(args.iterations, args.repeat), indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(results + "\n")
+    else:
+        print(results)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,5 @@
 from .config import AwsAccounts as AwsAccounts
 from .config import SsoConfig as SsoConfig
+from .directory_loader import DirectoryLoader as DirectoryLoader
+from .directory_loader import DirectoryLoadError as DirectoryLoadError
 from .sso_stack import SsoStack as SsoStack
\ No newline at end of file
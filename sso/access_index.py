@@ -0,0 +1,446 @@
+"""
+Offline effective-access queries over an SsoStack: which accounts a user can reach with
+which permission sets, who can reach an account, and where a permission set is used.
+
+Build an AccessIndex from the construct tree (AccessIndex.from_stack()) or from a
+synthesized cloud assembly (AccessIndex.from_cloud_assembly("cdk.out")), then query it
+or export the full access matrix. Also a CLI:
+
+    python -m sso.access_index cdk.out user jdoe
+    python -m sso.access_index cdk.out account SANDBOX
+    python -m sso.access_index cdk.out permission-set AWSReadOnlyAccess
+    python -m sso.access_index cdk.out export --format csv --output access.csv
+"""
+import argparse
+import csv
+import json
+import os
+import re
+import sys
+from typing import Any, Dict, IO, Iterator, List, Mapping, NamedTuple, Optional, Set, Tuple
+
+from constructs import Construct
+
+from .config import ENVIRONMENT_METADATA_TYPE, SsoEnvironment
+from .constructs import SsoGroup, SsoPermissionSet, SsoUser, SsoUserBatch
+
+# ("GROUP" or "USER", group name or username)
+Principal = Tuple[str, str]
+
+EXPORT_FORMATS = ("csv", "jsonl")
+
+
+class AccessRow(NamedTuple):
+    """One user's access to one account with one permission set, and where it comes from."""
+
+    username: str
+    account_id: str
+    permission_set: str
+    direct: bool  # assigned to the user directly
+    groups: Tuple[str, ...]  # groups of the user the permission set is assigned to
+
+
+class AccessIndex:
+    """
+    Inverted indexes over users, group memberships, and assignments. Everything is indexed
+    up front, so each query is a few dictionary lookups, independent of the size of the
+    directory. Principals and permission sets are identified by name (an existing
+    permission set or group referenced only by ARN or ID in a template goes by that).
+    """
+
+    def __init__(self) -> None:
+        self.users: Set[str] = set()
+        self.group_members: Dict[str, Set[str]] = {}
+        self._user_groups: Dict[str, Set[str]] = {}
+        # principal -> account -> permission sets
+        self._principal_access: Dict[Principal, Dict[str, Set[str]]] = {}
+        # account -> principal -> permission sets
+        self._account_principals: Dict[str, Dict[Principal, Set[str]]] = {}
+        # permission set -> accounts
+        self._permission_set_accounts: Dict[str, Set[str]] = {}
+        # account -> user -> permission sets, expanded from the above on first use
+        self._account_users: Optional[Dict[str, Dict[str, Set[str]]]] = None
+        # account name -> environment name -> account ID, from the indexed stacks' environments
+        self._account_names: Dict[str, Dict[str, str]] = {}
+
+    def add_environment(self, name: str, accounts: Mapping[str, str]) -> None:
+        """Adds the account names of an indexed stack's SsoEnvironment, for account_id()."""
+        for account_name, account_id in accounts.items():
+            self._account_names.setdefault(account_name, {})[name] = account_id
+
+    def add_user(self, username: str) -> None:
+        self.users.add(username)
+
+    def add_membership(self, group_name: str, username: str) -> None:
+        self._account_users = None
+        self.users.add(username)
+        self.group_members.setdefault(group_name, set()).add(username)
+        self._user_groups.setdefault(username, set()).add(group_name)
+
+    def add_assignment(self, principal_type: str, principal_name: str, permission_set: str, account_id: str) -> None:
+        self._account_users = None
+        principal = (principal_type, principal_name)
+        if principal_type == "USER":
+            self.users.add(principal_name)
+        self._principal_access.setdefault(principal, {}).setdefault(account_id, set()).add(permission_set)
+        self._account_principals.setdefault(account_id, {}).setdefault(principal, set()).add(permission_set)
+        self._permission_set_accounts.setdefault(permission_set, set()).add(account_id)
+
+    @property
+    def accounts(self) -> Set[str]:
+        return set(self._account_principals)
+
+    @property
+    def permission_sets(self) -> Set[str]:
+        return set(self._permission_set_accounts)
+
+    def groups_for_user(self, username: str) -> Set[str]:
+        return self._user_groups.get(username, set())
+
+    def accounts_for_user(self, username: str) -> Dict[str, Dict[str, List[str]]]:
+        """
+        account -> permission set -> sources the user can reach it with that permission
+        set through: "direct" and/or the names of the user's groups.
+        """
+        access: Dict[str, Dict[str, List[str]]] = {}
+        sources = [("direct", ("USER", username))] + [
+            (group, ("GROUP", group)) for group in sorted(self.groups_for_user(username))
+        ]
+        for source, principal in sources:
+            for account_id, permission_sets in self._principal_access.get(principal, {}).items():
+                account_access = access.setdefault(account_id, {})
+                for permission_set in permission_sets:
+                    account_access.setdefault(permission_set, []).append(source)
+        return access
+
+    def account_id(self, account: str) -> str:
+        """
+        The ID of an account given by ID or by an account name of the indexed stacks'
+        environments. Raises ValueError for unknown names, and for names that mean
+        different accounts in different environments.
+        """
+        if len(account) == 12 and account.isdigit():
+            return account
+        account_ids = self._account_names.get(account, {})
+        if len(set(account_ids.values())) > 1:
+            raise ValueError(
+                f"Account {account} is a different account in each of the environments "
+                f"{', '.join(sorted(account_ids))}; index only one of their stacks"
+            )
+        if not account_ids:
+            raise ValueError(f"Account {account} is neither a 12-digit account ID nor an account name of the indexed stacks")
+        return next(iter(account_ids.values()))
+
+    def principals_for_account(self, account_id: str) -> Dict[Principal, Set[str]]:
+        """The groups and users assigned in the account, with their permission sets."""
+        return self._account_principals.get(account_id, {})
+
+    def users_for_account(self, account_id: str) -> Dict[str, Set[str]]:
+        """Every user who can reach the account, directly or through groups, with their permission sets."""
+        if self._account_users is None:
+            self._account_users = {}
+            for account, principals in self._account_principals.items():
+                users = self._account_users[account] = {}
+                for (principal_type, name), permission_sets in principals.items():
+                    usernames = [name] if principal_type == "USER" else self.group_members.get(name, ())
+                    for username in usernames:
+                        users.setdefault(username, set()).update(permission_sets)
+        return self._account_users.get(account_id, {})
+
+    def accounts_for_permission_set(self, permission_set: str) -> Set[str]:
+        return self._permission_set_accounts.get(permission_set, set())
+
+    def rows(self) -> Iterator[AccessRow]:
+        """The full effective access matrix, sorted by username, account, and permission set."""
+        for username in sorted(self.users):
+            access = self.accounts_for_user(username)
+            for account_id in sorted(access):
+                for permission_set, sources in sorted(access[account_id].items()):
+                    yield AccessRow(
+                        username=username,
+                        account_id=account_id,
+                        permission_set=permission_set,
+                        direct=sources[0] == "direct",
+                        groups=tuple(source for source in sources if source != "direct"),
+                    )
+
+    def export(self, output: IO[str], format: str = "csv") -> int:
+        """Writes rows() as CSV (groups ;-separated) or JSON Lines. Returns the row count."""
+        if format not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format {format}, expected one of {', '.join(EXPORT_FORMATS)}")
+        count = 0
+        writer = csv.writer(output) if format == "csv" else None
+        if writer is not None:
+            writer.writerow(AccessRow._fields)
+        for row in self.rows():
+            if writer is not None:
+                writer.writerow(
+                    (row.username, row.account_id, row.permission_set, str(row.direct).lower(), ";".join(row.groups))
+                )
+            else:
+                output.write(json.dumps(row._asdict(), separators=(",", ":")) + "\n")
+            count += 1
+        return count
+
+    @classmethod
+    def from_stack(cls, scope: Construct) -> "AccessIndex":
+        """Indexes every user, membership, and grant made through this repo's constructs under scope."""
+        index = cls()
+        environment = SsoEnvironment.of(scope)
+        index.add_environment(environment.name, environment.accounts)
+        for construct in scope.node.find_all():
+            if isinstance(construct, SsoUser):
+                index.add_user(construct.username)
+            elif isinstance(construct, SsoUserBatch):
+                for user in construct.users:
+                    index.add_user(user.username)
+            elif isinstance(construct, SsoGroup):
+                for username in construct.member_users:
+                    index.add_membership(construct.group_name, username)
+            elif isinstance(construct, SsoPermissionSet):
+                for grant in construct.grants:
+                    index.add_assignment(
+                        grant.principal_type,
+                        grant.principal_name,
+                        construct.permission_set_name,
+                        grant.account_id,
+                    )
+        return index
+
+    @classmethod
+    def from_cloud_assembly(cls, directory: str, stack_name: Optional[str] = None) -> "AccessIndex":
+        """
+        Indexes the synthesized templates in a cloud assembly directory (e.g. cdk.out),
+        following nested stacks. All stacks are indexed unless stack_name is given.
+        Account names are those of the environments the stacks' metadata records, or if
+        none do, of the default environment (SsoConfig and AwsAccounts).
+        """
+        with open(os.path.join(directory, "manifest.json")) as f:
+            manifest = json.load(f)
+        artifacts: Dict[str, Any] = manifest.get("artifacts", {})
+        nested_templates: Dict[str, str] = {}
+        for artifact in artifacts.values():
+            if artifact.get("type") == "cdk:asset-manifest":
+                with open(os.path.join(directory, artifact["properties"]["file"])) as f:
+                    for asset_hash, asset in json.load(f).get("files", {}).items():
+                        if asset["source"].get("packaging") == "file":
+                            nested_templates[asset_hash] = asset["source"]["path"]
+        index = cls()
+        reader = _TemplateReader(index, directory, nested_templates)
+        for name, artifact in artifacts.items():
+            if artifact.get("type") != "aws:cloudformation:stack":
+                continue
+            if stack_name is not None and name != stack_name:
+                continue
+            reader.read(artifact["properties"]["templateFile"])
+            for entries in artifact.get("metadata", {}).values():
+                for entry in entries:
+                    if entry.get("type") == ENVIRONMENT_METADATA_TYPE:
+                        index.add_environment(entry["data"]["name"], entry["data"]["accounts"])
+        if not index._account_names:
+            index._add_default_environment()
+        return index
+
+    @classmethod
+    def from_template(cls, path: str) -> "AccessIndex":
+        """
+        Indexes a single synthesized template, with the default environment's account
+        names. Use from_cloud_assembly() for nested stacks and other environments.
+        """
+        index = cls()
+        _TemplateReader(index, os.path.dirname(path), {}).read(os.path.basename(path))
+        index._add_default_environment()
+        return index
+
+    def _add_default_environment(self) -> None:
+        environment = SsoEnvironment.default()
+        self.add_environment(environment.name, environment.accounts)
+
+
+# A value in a template resolved to where it comes from: a literal, or a resource
+# attribute (template, logical ID, attribute)
+Source = Tuple[str, ...]
+
+# Nested stack templates are file assets, uploaded under their hash
+NESTED_TEMPLATE_URL_PATTERN = re.compile(r"([0-9a-f]{64})\.json")
+
+
+class _Template:
+    def __init__(self, file: str, document: Dict[str, Any], parent: Optional[Tuple["_Template", str]]):
+        self.file = file
+        self.resources: Dict[str, Any] = document.get("Resources", {})
+        self.parameters: Dict[str, Any] = document.get("Parameters", {})
+        self.outputs: Dict[str, Any] = document.get("Outputs", {})
+        self.parent = parent  # (parent template, logical ID of the nested stack resource)
+        self.nested: Dict[str, "_Template"] = {}
+
+
+class _TemplateReader:
+    """
+    Reads users, groups, memberships, and assignments from CloudFormation templates,
+    resolving Ref/GetAtt through nested stack parameters and outputs to the resources
+    that define them.
+    """
+
+    def __init__(self, index: AccessIndex, directory: str, nested_templates: Dict[str, str]):
+        self._index = index
+        self._directory = directory
+        self._nested_templates = nested_templates
+        self._names: Dict[Source, str] = {}
+
+    def read(self, file: str) -> None:
+        templates = self._load(file, None)
+        for template in templates:
+            self._name_resources(template)
+        for template in templates:
+            self._read_relationships(template)
+
+    def _load(self, file: str, parent: Optional[Tuple[_Template, str]]) -> List[_Template]:
+        """Loads a template and its nested stacks, depth first."""
+        with open(os.path.join(self._directory, file)) as f:
+            template = _Template(file, json.load(f), parent)
+        templates = [template]
+        for logical_id, resource in template.resources.items():
+            if resource.get("Type") != "AWS::CloudFormation::Stack":
+                continue
+            match = NESTED_TEMPLATE_URL_PATTERN.search(json.dumps(resource["Properties"].get("TemplateURL")))
+            nested_file = self._nested_templates.get(match.group(1)) if match else None
+            if nested_file is None:
+                continue
+            nested = self._load(nested_file, (template, logical_id))
+            template.nested[logical_id] = nested[0]
+            templates.extend(nested)
+        return templates
+
+    def _name_resources(self, template: _Template) -> None:
+        for logical_id, resource in template.resources.items():
+            properties = resource.get("Properties", {})
+            kind = resource.get("Type")
+            if kind == "Custom::SsoUser":
+                self._names[(template.file, logical_id, "UserId")] = properties["username"]
+                self._index.add_user(properties["username"])
+            elif kind == "Custom::SsoUserBatch":
+                for user in properties["Users"]:
+                    self._names[(template.file, logical_id, f"UserId.{user['username']}")] = user["username"]
+                    self._index.add_user(user["username"])
+            elif kind == "AWS::IdentityStore::Group":
+                self._names[(template.file, logical_id, "GroupId")] = properties["DisplayName"]
+            elif kind == "AWS::SSO::PermissionSet":
+                self._names[(template.file, logical_id, "PermissionSetArn")] = properties["Name"]
+
+    def _read_relationships(self, template: _Template) -> None:
+        index = self._index
+        for resource in template.resources.values():
+            properties = resource.get("Properties", {})
+            kind = resource.get("Type")
+            if kind == "AWS::IdentityStore::GroupMembership":
+                index.add_membership(
+                    self._name(template, properties["GroupId"]),
+                    self._name(template, properties["MemberId"]["UserId"]),
+                )
+            elif kind == "Custom::SsoGroupMembers":
+                group_name = self._name(template, properties["GroupId"])
+                for user_id in properties["MemberUserIds"]:
+                    index.add_membership(group_name, self._name(template, user_id))
+            elif kind == "AWS::SSO::Assignment":
+                self._add_assignment(template, properties)
+            elif kind == "Custom::SsoAssignments":
+                for assignment in properties["Assignments"]:
+                    self._add_assignment(template, assignment)
+
+    def _add_assignment(self, template: _Template, properties: Dict[str, Any]) -> None:
+        self._index.add_assignment(
+            properties["PrincipalType"],
+            self._name(template, properties["PrincipalId"]),
+            self._name(template, properties["PermissionSetArn"]),
+            self._name(template, properties["TargetId"]),
+        )
+
+    def _name(self, template: _Template, value: Any) -> str:
+        source = self._resolve(template, value)
+        if source in self._names:
+            return self._names[source]
+        return source[0] if len(source) == 1 else json.dumps(value, separators=(",", ":"))
+
+    def _resolve(self, template: _Template, value: Any) -> Source:
+        if isinstance(value, str):
+            return (value,)
+        if isinstance(value, dict) and "Ref" in value:
+            parameter = value["Ref"]
+            if parameter in template.parameters and template.parent is not None:
+                parent, logical_id = template.parent
+                parameters = parent.resources[logical_id]["Properties"].get("Parameters", {})
+                if parameter in parameters:
+                    return self._resolve(parent, parameters[parameter])
+            return (template.file, parameter, "Ref")
+        if isinstance(value, dict) and "Fn::GetAtt" in value:
+            logical_id, attribute = value["Fn::GetAtt"]
+            nested = template.nested.get(logical_id)
+            if nested is not None and attribute.startswith("Outputs."):
+                output = nested.outputs.get(attribute[len("Outputs."):])
+                if output is not None:
+                    return self._resolve(nested, output["Value"])
+            return (template.file, logical_id, attribute)
+        return (json.dumps(value, sort_keys=True),)
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(
+        prog="python -m sso.access_index",
+        description="Query effective SSO access in a synthesized cloud assembly (run `cdk synth` first).",
+    )
+    parser.add_argument("assembly", help="cloud assembly directory, e.g. cdk.out")
+    parser.add_argument("--stack", help="only index this stack")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("user", help="accounts and permission sets a user can reach").add_argument("username")
+    commands.add_parser("account", help="principals and users that can reach an account").add_argument(
+        "account", help="account ID, or an account name of the stack's environment"
+    )
+    commands.add_parser("permission-set", help="accounts a permission set is assigned in").add_argument("name")
+    export = commands.add_parser("export", help="the full access matrix, one row per user, account, and permission set")
+    export.add_argument("--format", choices=EXPORT_FORMATS, default="csv")
+    export.add_argument("--output", help="write here instead of stdout")
+    args = parser.parse_args(argv)
+
+    index = AccessIndex.from_cloud_assembly(args.assembly, args.stack)
+    if args.command == "user":
+        if args.username not in index.users:
+            print(f"Unknown user {args.username}", file=sys.stderr)
+            return 1
+        access = index.accounts_for_user(args.username)
+        print(json.dumps({account_id: access[account_id] for account_id in sorted(access)}, indent=2, sort_keys=True))
+    elif args.command == "account":
+        try:
+            account_id = index.account_id(args.account)
+        except ValueError as error:
+            print(error, file=sys.stderr)
+            return 1
+        principals = index.principals_for_account(account_id)
+        print(
+            json.dumps(
+                {
+                    "principals": [
+                        {"type": principal_type, "name": name, "permission_sets": sorted(permission_sets)}
+                        for (principal_type, name), permission_sets in sorted(principals.items())
+                    ],
+                    "users": {
+                        username: sorted(permission_sets)
+                        for username, permission_sets in sorted(index.users_for_account(account_id).items())
+                    },
+                },
+                indent=2,
+            )
+        )
+    elif args.command == "permission-set":
+        print("\n".join(sorted(index.accounts_for_permission_set(args.name))))
+    elif args.output:
+        with open(args.output, "w", newline="") as f:
+            count = index.export(f, args.format)
+        print(f"Wrote {count} rows to {args.output}", file=sys.stderr)
+    else:
+        index.export(sys.stdout, args.format)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
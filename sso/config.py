@@ -1,4 +1,8 @@
 from enum import Enum
+from typing import Any, Mapping, NamedTuple, Optional
+
+from aws_cdk import Stack
+from constructs import Construct
 
 class AwsAccounts(str, Enum):
     """List of your AWS accounts with friendly names.
@@ -16,4 +20,56 @@ class SsoConfig(str, Enum):
     sso_account = "999999999999"
     sso_region = "us-east-1"
     identity_store_id = "d-xxxxxxxxxx"
-    instance_arn = "arn:aws:sso:::instance/ssoins-xxxxxxxxxxxxxxxx"
\ No newline at end of file
+    instance_arn = "arn:aws:sso:::instance/ssoins-xxxxxxxxxxxxxxxx"
+
+
+# Type of the stack metadata entry in which SsoStack records its environment's name and
+# accounts, so tools reading a cloud assembly (e.g. sso.access_index) can resolve names
+ENVIRONMENT_METADATA_TYPE = "sso:environment"
+
+
+class SsoEnvironment(NamedTuple):
+    """
+    One IAM Identity Center instance to deploy an SsoStack for: the SsoConfig values for
+    it, its accounts by friendly name (like AwsAccounts), and context values to set on
+    its stack (e.g. sso:usersFile). Load them from files with load_environments(); the
+    constructs read their stack's with SsoEnvironment.of().
+    """
+
+    name: str
+    sso_account: str
+    sso_region: str
+    identity_store_id: str
+    instance_arn: str
+    accounts: Mapping[str, str] = {}
+    context: Mapping[str, Any] = {}
+
+    @classmethod
+    def default(cls) -> "SsoEnvironment":
+        """The environment configured in SsoConfig and AwsAccounts."""
+        return cls(
+            name="default",
+            sso_account=SsoConfig.sso_account.value,
+            sso_region=SsoConfig.sso_region.value,
+            identity_store_id=SsoConfig.identity_store_id.value,
+            instance_arn=SsoConfig.instance_arn.value,
+            accounts={account.name: account.value for account in AwsAccounts},
+        )
+
+    @classmethod
+    def of(cls, scope: Construct) -> "SsoEnvironment":
+        """
+        The environment of scope's top-level stack (an SsoStack's sso_environment), or
+        the default one for other stacks.
+        """
+        stack = Stack.of(scope)
+        while stack.nested_stack_parent is not None:
+            stack = stack.nested_stack_parent
+        environment: Optional[SsoEnvironment] = getattr(stack, "sso_environment", None)
+        return environment if environment is not None else cls.default()
+
+    def account_id(self, account: str) -> Optional[str]:
+        """The ID of an account given by ID or by one of this environment's names for them."""
+        if len(account) == 12 and account.isdigit():
+            return account
+        return self.accounts.get(account)
@@ -1,6 +1,27 @@
+from .assignment_compactor import AssignmentCompactor as AssignmentCompactor
+from .sso_assignments import SsoAssignments as SsoAssignments
+from .sso_drift_detector import SsoDriftDetector as SsoDriftDetector
 from .sso_group import SsoGroup as SsoGroup
+from .sso_group_members import SsoGroupMembers as SsoGroupMembers
+from .sso_logical_ids import SsoLogicalIds as SsoLogicalIds
+from .sso_nag import (
+    NagMode as NagMode,
+    SsoNagChecks as SsoNagChecks
+)
+from .sso_organizations import (
+    OrganizationsFixture as OrganizationsFixture,
+    SsoOrganizations as SsoOrganizations
+)
 from .sso_permission_set import SsoPermissionSet as SsoPermissionSet
+from .sso_permission_set_provisioning import (
+    SsoPermissionSetProvisioning as SsoPermissionSetProvisioning
+)
+from .sso_shard_router import SsoShardRouter as SsoShardRouter
 from .sso_user import (
     SsoUser as SsoUser,
     SsoUserAttributes as SsoUserAttributes
+)
+from .sso_user_batch import (
+    SsoBatchedUser as SsoBatchedUser,
+    SsoUserBatch as SsoUserBatch
 )
\ No newline at end of file
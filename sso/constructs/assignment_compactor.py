@@ -0,0 +1,97 @@
+from typing import Dict, List, Set, Tuple
+
+import jsii
+from aws_cdk import Annotations, IAspect, Stack
+from constructs import IConstruct
+
+from .sso_group import SsoGroup
+from .sso_permission_set import SsoGrant, SsoPermissionSet
+
+
+@jsii.implements(IAspect)
+class AssignmentCompactor:
+    """
+    Finds assignments that grant nothing new, across every SsoPermissionSet in a stack and
+    its nested stacks:
+
+    - a grant of a permission set to a user for an account, where a group the user was
+      added to (SsoGroup.add_user() or add_members()) already has that permission set
+      for that account
+    - a second grant of a permission set to the same group for the same account
+
+    By default each one is reported as an error annotation, which fails `cdk synth` the
+    same way cdk-nag findings do. With remove=True they are dropped from the template
+    instead, and reported as info annotations. Only users added to groups by this app are
+    considered, as memberships managed elsewhere can change without a deploy.
+
+    SsoStack adds one when given compact_assignments="report" (or "remove", for
+    remove=True). Add it to other stacks with Aspects.of(stack).add(AssignmentCompactor()).
+    """
+
+    def __init__(self, *, remove: bool = False):
+        self.remove = remove
+
+    def visit(self, node: IConstruct) -> None:
+        # Aspects visit parents before children, so the whole tree is still there
+        if isinstance(node, Stack) and not node.nested:
+            for grant, reason in self.find_redundant_grants(node):
+                self._handle(grant, reason)
+
+    @staticmethod
+    def find_redundant_grants(stack: Stack) -> List[Tuple[SsoGrant, str]]:
+        """Every redundant grant in the stack, with the reason it's redundant."""
+        groups: List[SsoGroup] = []
+        grants: List[SsoGrant] = []
+        for construct in stack.node.find_all():
+            if isinstance(construct, SsoGroup):
+                groups.append(construct)
+            elif isinstance(construct, SsoPermissionSet):
+                grants.extend(construct.grants)
+
+        groups_by_username: Dict[str, List[SsoGroup]] = {}
+        for group in groups:
+            for username in group.member_users:
+                groups_by_username.setdefault(username, []).append(group)
+
+        # (permission set ARN, group ID, account) -> the first grant
+        group_grants: Dict[Tuple[str, str, str], SsoGrant] = {}
+        redundant: List[Tuple[SsoGrant, str]] = []
+        for grant in grants:
+            if grant.principal_type != "GROUP":
+                continue
+            key = (grant.permission_set.permission_set_arn, grant.principal.group_id, grant.account_id)
+            if key in group_grants:
+                redundant.append((grant, f"duplicates {group_grants[key]}"))
+            else:
+                group_grants[key] = grant
+
+        seen_user_grants: Set[Tuple[str, str, str]] = set()
+        for grant in grants:
+            if grant.principal_type != "USER":
+                continue
+            arn = grant.permission_set.permission_set_arn
+            user_key = (arn, grant.principal_name, grant.account_id)
+            if user_key in seen_user_grants:
+                redundant.append((grant, "duplicates an earlier grant to the same user"))
+                continue
+            seen_user_grants.add(user_key)
+            for group in groups_by_username.get(grant.principal_name, []):
+                group_grant = group_grants.get((arn, group.group_id, grant.account_id))
+                if group_grant is not None:
+                    redundant.append((grant, f"is covered by {group_grant}"))
+                    break
+        return redundant
+
+    def _handle(self, grant: SsoGrant, reason: str) -> None:
+        construct = grant.assignment or grant.assignments or grant.permission_set
+        if self.remove:
+            grant.remove()
+            Annotations.of(grant.permission_set).add_info(
+                f"[AssignmentCompactor] Removed redundant grant of {grant}: it {reason}"
+            )
+        else:
+            Annotations.of(construct).add_error(
+                f"[AssignmentCompactor] Redundant grant of {grant}: it {reason}. "
+                "Remove it, or drop it at synth time with AssignmentCompactor(remove=True) "
+                "(SsoStack(compact_assignments=\"remove\"))."
+            )
@@ -0,0 +1,182 @@
+import time
+from functools import partial
+from typing import Any, Callable, Dict, Iterable, List, Mapping, Optional, Tuple
+
+from fan_out import FanOutResult, fan_out
+from group_members import error_code
+from request_poller import RequestStatus, submit_and_poll
+from structured_log import fields, get_logger
+
+log = get_logger(__name__)
+
+# Fields of an assignment as passed in ResourceProperties. TargetType is always
+# AWS_ACCOUNT, the only type sso-admin supports.
+ASSIGNMENT_FIELDS = ("PermissionSetArn", "PrincipalType", "PrincipalId", "TargetId")
+
+Assignment = Mapping[str, str]
+
+# IDs of submitted requests still in progress, by action ("create" or "delete"): all that
+# polling them later needs, since statuses say which assignment a request is for
+AssignmentRequests = Mapping[str, List[str]]
+
+
+def assignment_key(assignment: Assignment) -> str:
+    return "|".join(assignment[field] for field in ASSIGNMENT_FIELDS)
+
+
+def assignment_delta(
+    old_assignments: Iterable[Assignment], new_assignments: Iterable[Assignment]
+) -> Tuple[Dict[str, Assignment], Dict[str, Assignment]]:
+    """Assignments to create and to delete, keyed by assignment_key()."""
+    old = {assignment_key(assignment): assignment for assignment in old_assignments}
+    new = {assignment_key(assignment): assignment for assignment in new_assignments}
+    to_create = {key: new[key] for key in sorted(new.keys() - old.keys())}
+    to_delete = {key: old[key] for key in sorted(old.keys() - new.keys())}
+    return to_create, to_delete
+
+
+class AssignmentEngine:
+    """
+    Applies account assignment changes through sso-admin concurrently. Every create and
+    delete request is submitted up front, then the pending ones are polled together each
+    poll_interval_seconds, instead of waiting for each provisioning to finish before
+    starting the next as CloudFormation does for CfnAssignment. apply() does both in one
+    call; submit() and poll() split them across invocations, for async mode.
+    """
+
+    def __init__(
+        self,
+        client_provider: Callable[[], Any],
+        instance_arn: str,
+        *,
+        max_workers: int,
+        poll_interval_seconds: float,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self._client_provider = client_provider
+        self._instance_arn = instance_arn
+        self._max_workers = max_workers
+        self._poll_interval_seconds = poll_interval_seconds
+        self._sleep = sleep
+
+    def apply(
+        self,
+        to_create: Mapping[str, Assignment],
+        to_delete: Mapping[str, Assignment],
+        *,
+        time_left: Optional[Callable[[], float]] = None,
+    ) -> None:
+        """
+        Creates and deletes the given assignments and waits until all of them finished
+        provisioning. Raises a FanOutError listing every failed assignment, or a
+        TimeoutError if time_left() (seconds) runs below two poll intervals first.
+        """
+        submit_and_poll(
+            self._submissions(to_create, to_delete),
+            self._describe,
+            max_workers=self._max_workers,
+            poll_interval_seconds=self._poll_interval_seconds,
+            time_left=time_left,
+            sleep=self._sleep,
+        ).raise_for_errors("Applying account assignments")
+
+    def submit(self, to_create: Mapping[str, Assignment], to_delete: Mapping[str, Assignment]) -> AssignmentRequests:
+        """
+        Creates and deletes the given assignments without waiting for them. Returns the
+        requests still in progress, for poll(). Raises a FanOutError listing every
+        assignment that couldn't be submitted or failed right away.
+        """
+        result = fan_out(self._submissions(to_create, to_delete), max_workers=self._max_workers)
+        requests: Dict[str, List[str]] = {"create": [], "delete": []}
+        for key, status in sorted(result.results.items()):
+            if status is None:
+                continue
+            if status["Status"] == "IN_PROGRESS":
+                requests[key.split(" ", 1)[0]].append(status["RequestId"])
+            elif status["Status"] == "FAILED":
+                result.errors[key] = Exception(status.get("FailureReason") or "FAILED")
+        result.raise_for_errors("Applying account assignments")
+        return requests
+
+    def poll(self, requests: AssignmentRequests, *, should_start: Optional[Callable[[], bool]] = None) -> int:
+        """
+        Checks once, without waiting, on requests returned by submit(). Returns how many
+        are still in progress, counting ones left unchecked because should_start said
+        to stop, or whose status couldn't be read. Once none are, raises a FanOutError
+        listing every assignment that failed.
+        """
+        statuses = fan_out(
+            {
+                f"{action} {request_id}": partial(self._describe, action, request_id)
+                for action, request_ids in requests.items()
+                for request_id in request_ids
+            },
+            max_workers=self._max_workers,
+            should_start=should_start,
+        )
+        for key, error in statuses.errors.items():
+            # The request was accepted, so we just couldn't read its status; retry
+            log.warning("Polling %s failed, retrying: %r", key, error)
+        in_progress = len(statuses.skipped) + len(statuses.errors) + sum(
+            status["Status"] == "IN_PROGRESS" for status in statuses.results.values()
+        )
+        if in_progress:
+            return in_progress
+        outcome: FanOutResult[RequestStatus] = FanOutResult()
+        for key, status in statuses.results.items():
+            # Statuses name the assignment; a missing field mustn't hide the failure
+            assignment = f"{key.split(' ', 1)[0]} " + "|".join(status.get(field, "") for field in ASSIGNMENT_FIELDS)
+            if status["Status"] == "FAILED":
+                outcome.errors[assignment] = Exception(status.get("FailureReason") or "FAILED")
+            else:
+                outcome.results[assignment] = status
+        outcome.raise_for_errors("Applying account assignments")
+        return 0
+
+    def _submissions(
+        self, to_create: Mapping[str, Assignment], to_delete: Mapping[str, Assignment]
+    ) -> Dict[str, Callable[[], Optional[Dict[str, Any]]]]:
+        log.info(
+            "Submitting %d assignment creations and %d deletions",
+            len(to_create),
+            len(to_delete),
+            extra=fields(creations=len(to_create), deletions=len(to_delete)),
+        )
+        return {
+            **{
+                f"create {key}": partial(self._submit, "create", assignment)
+                for key, assignment in to_create.items()
+            },
+            **{
+                f"delete {key}": partial(self._submit, "delete", assignment)
+                for key, assignment in to_delete.items()
+            },
+        }
+
+    def _submit(self, action: str, assignment: Assignment) -> Optional[Dict[str, Any]]:
+        kwargs = dict(
+            InstanceArn=self._instance_arn,
+            TargetType="AWS_ACCOUNT",
+            **{field: assignment[field] for field in ASSIGNMENT_FIELDS},
+        )
+        client = self._client_provider()
+        if action == "create":
+            return client.create_account_assignment(**kwargs)["AccountAssignmentCreationStatus"]
+        try:
+            return client.delete_account_assignment(**kwargs)["AccountAssignmentDeletionStatus"]
+        except Exception as error:
+            if error_code(error) == "ResourceNotFoundException":
+                return None
+            raise
+
+    def _describe(self, operation: str, request_id: str) -> Dict[str, Any]:
+        client = self._client_provider()
+        if operation.startswith("create"):
+            return client.describe_account_assignment_creation_status(
+                InstanceArn=self._instance_arn,
+                AccountAssignmentCreationRequestId=request_id,
+            )["AccountAssignmentCreationStatus"]
+        return client.describe_account_assignment_deletion_status(
+            InstanceArn=self._instance_arn,
+            AccountAssignmentDeletionRequestId=request_id,
+        )["AccountAssignmentDeletionStatus"]
@@ -0,0 +1,170 @@
+from functools import partial
+from typing import Any, Callable, Dict, Iterator, List, Mapping
+
+from fan_out import fan_out
+from group_members import error_code, list_group_memberships
+from user_diff import differing_keys, first_character_to_lower
+
+# What the stack wants, by name, as embedded at synth time by SsoDriftDetector:
+# {"users": {username: attributes}, "groups": {group_name: managed},
+#  "memberships": {group_name: [username, ...]}}. Attributes are in identitystore format;
+# managed groups are created by the stack, others are only referenced by it.
+DesiredState = Mapping[str, Any]
+
+# Drift counts reported as metrics, in report order
+DRIFT_KINDS = ("MissingUsers", "ChangedUsers", "MissingGroups", "MissingMemberships", "ExtraMemberships")
+
+
+class Snapshot:
+    """The identity store's current users, groups, and the members of the desired groups."""
+
+    def __init__(self) -> None:
+        self.users_by_username: Dict[str, Dict[str, Any]] = {}
+        self.group_ids_by_name: Dict[str, str] = {}
+        # group name -> {user ID: membership ID}
+        self.memberships: Dict[str, Dict[str, str]] = {}
+
+    @property
+    def usernames_by_id(self) -> Dict[str, str]:
+        return {user["UserId"]: username for username, user in self.users_by_username.items()}
+
+
+def paginate(client_provider: Callable[[], Any], method: str, key: str, **kwargs: Any) -> Iterator[Dict[str, Any]]:
+    # By hand rather than with get_paginator(), so each page goes through the client
+    # wrapper's rate limiting and retries
+    kwargs["MaxResults"] = 100
+    while True:
+        page = getattr(client_provider(), method)(**kwargs)
+        yield from page.get(key, [])
+        if not page.get("NextToken"):
+            return
+        kwargs["NextToken"] = page["NextToken"]
+
+
+def take_snapshot(
+    client_provider: Callable[[], Any],
+    identity_store_id: str,
+    desired: DesiredState,
+    *,
+    max_workers: int,
+) -> Snapshot:
+    """
+    Lists users and groups concurrently, then the members of every desired group that
+    exists, concurrently. Raises a FanOutError if any listing fails, since a partial
+    snapshot would report drift that isn't there.
+    """
+    snapshot = Snapshot()
+    listings = fan_out(
+        {
+            "users": lambda: list(paginate(client_provider, "list_users", "Users", IdentityStoreId=identity_store_id)),
+            "groups": lambda: list(paginate(client_provider, "list_groups", "Groups", IdentityStoreId=identity_store_id)),
+        },
+        max_workers=2,
+    )
+    listings.raise_for_errors("Listing the identity store")
+    snapshot.users_by_username = {user["UserName"]: user for user in listings.results["users"]}
+    snapshot.group_ids_by_name = {group["DisplayName"]: group["GroupId"] for group in listings.results["groups"]}
+
+    group_names = [name for name in desired["memberships"] if name in snapshot.group_ids_by_name]
+    memberships = fan_out(
+        {
+            name: lambda name=name: list_group_memberships(
+                client_provider, identity_store_id, snapshot.group_ids_by_name[name]
+            )
+            for name in group_names
+        },
+        max_workers=max_workers,
+    )
+    memberships.raise_for_errors("Listing group memberships")
+    snapshot.memberships = memberships.results
+    return snapshot
+
+
+def detect_drift(desired: DesiredState, snapshot: Snapshot) -> Dict[str, Any]:
+    """
+    Differences between the desired state and the snapshot, by kind (see DRIFT_KINDS).
+    Members of a managed group that the stack didn't add are ExtraMemberships; members
+    of referenced groups are none of our business.
+    """
+    usernames_by_id = snapshot.usernames_by_id
+    drift: Dict[str, Any] = {
+        "MissingUsers": sorted(set(desired["users"]) - set(snapshot.users_by_username)),
+        "ChangedUsers": {},
+        "MissingGroups": sorted(set(desired["groups"]) - set(snapshot.group_ids_by_name)),
+        "MissingMemberships": {},
+        "ExtraMemberships": {},
+    }
+    for username, attributes in sorted(desired["users"].items()):
+        user = snapshot.users_by_username.get(username)
+        if user is not None:
+            # Attributes we don't manage (e.g. Addresses set in the console) aren't drift
+            keys = [key for key in differing_keys(user, attributes) if key in attributes]
+            if keys:
+                drift["ChangedUsers"][username] = keys
+    for group_name, usernames in sorted(desired["memberships"].items()):
+        current = snapshot.memberships.get(group_name)
+        if current is None:
+            continue  # the group itself is missing
+        current_usernames = {usernames_by_id.get(user_id, user_id) for user_id in current}
+        missing = sorted(set(usernames) - current_usernames)
+        if missing:
+            drift["MissingMemberships"][group_name] = missing
+        extra = sorted(current_usernames - set(usernames))
+        if extra and desired["groups"].get(group_name):
+            drift["ExtraMemberships"][group_name] = extra
+    return drift
+
+
+def drift_counts(drift: Mapping[str, Any]) -> Dict[str, int]:
+    """Number of drifted users, groups, or memberships of each kind."""
+    counts: Dict[str, int] = {}
+    for kind in DRIFT_KINDS:
+        value = drift[kind]
+        counts[kind] = sum(len(names) for names in value.values()) if kind.endswith("Memberships") else len(value)
+    return counts
+
+
+def reconcile_operations(
+    identity_store_id: str, desired: DesiredState, snapshot: Snapshot, drift: Mapping[str, Any]
+) -> Dict[str, Callable[[Any], Any]]:
+    """
+    Changes that put drifted users and memberships back, keyed by description, each taking
+    the identitystore client. Missing users and groups, and extra members, are only
+    reported: recreating a user or group changes its ID out from under CloudFormation,
+    and removing members could undo a deliberate change.
+    """
+    operations: Dict[str, Callable[[Any], Any]] = {}
+    for username, keys in drift["ChangedUsers"].items():
+        user = snapshot.users_by_username[username]
+        attributes = desired["users"][username]
+        changes: List[Dict[str, Any]] = [
+            {"AttributePath": first_character_to_lower(key), "AttributeValue": attributes[key]} for key in keys
+        ]
+        operations[f"update user {username}"] = partial(
+            _update_user, identity_store_id=identity_store_id, user_id=user["UserId"], changes=changes
+        )
+    for group_name, usernames in drift["MissingMemberships"].items():
+        group_id = snapshot.group_ids_by_name[group_name]
+        for username in usernames:
+            user = snapshot.users_by_username.get(username)
+            if user is None:
+                continue  # reported as a missing user
+            operations[f"add {username} to {group_name}"] = partial(
+                _add_membership, identity_store_id=identity_store_id, group_id=group_id, user_id=user["UserId"]
+            )
+    return operations
+
+
+def _update_user(client: Any, *, identity_store_id: str, user_id: str, changes: List[Dict[str, Any]]) -> None:
+    client.update_user(IdentityStoreId=identity_store_id, UserId=user_id, Operations=changes)
+
+
+def _add_membership(client: Any, *, identity_store_id: str, group_id: str, user_id: str) -> None:
+    try:
+        client.create_group_membership(
+            IdentityStoreId=identity_store_id, GroupId=group_id, MemberId={"UserId": user_id}
+        )
+    except Exception as error:
+        # Added since the snapshot, e.g. by a deploy
+        if error_code(error) != "ConflictException":
+            raise
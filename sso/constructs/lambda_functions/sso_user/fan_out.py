@@ -0,0 +1,85 @@
+from typing import Callable, Dict, Generic, List, Optional, TypeVar
+
+from structured_log import fields, get_logger
+
+log = get_logger(__name__)
+
+T = TypeVar("T")
+
+# Max number of failures spelled out in a FanOutError message. CloudFormation truncates
+# long status reasons anyway, and the full list is logged.
+MAX_ERRORS_IN_MESSAGE = 10
+
+
+class FanOutResult(Generic[T]):
+    """Per-key outcome of fan_out(). Every key ends up in exactly one of the three."""
+
+    def __init__(self):
+        self.results: Dict[str, T] = {}
+        self.errors: Dict[str, Exception] = {}
+        self.skipped: List[str] = []
+
+    @property
+    def complete(self) -> bool:
+        return not self.errors and not self.skipped
+
+    def raise_for_errors(self, description: str) -> None:
+        if self.errors:
+            raise FanOutError(description, self)
+
+
+class FanOutError(Exception):
+    """
+    Raised when some operations of a fan-out failed. Operations that succeeded are not
+    rolled back; result.results says which ones they were.
+    """
+
+    def __init__(self, description: str, result: FanOutResult):
+        self.result = result
+        for key, error in sorted(result.errors.items()):
+            log.error("%s failed for %s: %r", description, key, error, extra=fields(key=key))
+        failures = "; ".join(
+            f"{key}: {error}" for key, error in sorted(result.errors.items())[:MAX_ERRORS_IN_MESSAGE]
+        )
+        total = len(result.errors) + len(result.results) + len(result.skipped)
+        super().__init__(
+            f"{description} failed for {len(result.errors)} of {total} "
+            f"({len(result.results)} succeeded): {failures}"
+        )
+
+
+def fan_out(
+    tasks: Dict[str, Callable[[], T]],
+    *,
+    max_workers: int,
+    should_start: Optional[Callable[[], bool]] = None,
+) -> FanOutResult[T]:
+    """
+    Runs independent tasks (typically one per user) on a bounded thread pool and collects
+    each task's result or exception under its key, so one failure doesn't hide the
+    others or discard work that succeeded. identitystore calls are almost entirely network
+    latency, so overlapping them multiplies per-invocation throughput.
+
+    should_start is checked right before each task runs; tasks it rejects are reported as
+    skipped rather than run, which lets callers stop early (e.g. near the Lambda timeout).
+    """
+    # Deferred to keep it off the cold start path of requests that never fan out
+    from concurrent.futures import ThreadPoolExecutor
+
+    result: FanOutResult[T] = FanOutResult()
+    if not tasks:
+        return result
+
+    def run(key: str, task: Callable[[], T]) -> None:
+        if should_start is not None and not should_start():
+            result.skipped.append(key)
+            return
+        try:
+            result.results[key] = task()
+        except Exception as error:
+            result.errors[key] = error
+
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(tasks))) as executor:
+        for future in [executor.submit(run, key, task) for key, task in tasks.items()]:
+            future.result()
+    return result
@@ -0,0 +1,51 @@
+from typing import Any, Callable, Dict, Iterable, List, Tuple
+
+
+def error_code(error: Exception) -> str:
+    # Duck-typed so we don't have to import botocore just to inspect ClientError
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") or ""
+
+
+def list_group_memberships(
+    client_provider: Callable[[], Any], identity_store_id: str, group_id: str
+) -> Dict[str, str]:
+    """
+    Current members of a group, as {user ID: membership ID}, from one paginated pass over
+    list_group_memberships(). Members that aren't users (i.e. nested groups) are ignored.
+    """
+    memberships: Dict[str, str] = {}
+    kwargs: Dict[str, Any] = {
+        "IdentityStoreId": identity_store_id,
+        "GroupId": group_id,
+        "MaxResults": 100,
+    }
+    while True:
+        response = client_provider().list_group_memberships(**kwargs)
+        for membership in response.get("GroupMemberships", []):
+            user_id = membership.get("MemberId", {}).get("UserId")
+            if user_id:
+                memberships[user_id] = membership["MembershipId"]
+        if not response.get("NextToken"):
+            return memberships
+        kwargs["NextToken"] = response["NextToken"]
+
+
+def membership_delta(
+    current_memberships: Dict[str, str],
+    old_member_user_ids: Iterable[str],
+    new_member_user_ids: Iterable[str],
+) -> Tuple[List[str], List[str]]:
+    """
+    User IDs to add to the group and membership IDs to remove from it. Only users that
+    were in the old member set are ever removed, so members added outside of this
+    resource (e.g. in the console or by a CfnGroupMembership) are left alone.
+    """
+    old_members = set(old_member_user_ids)
+    new_members = set(new_member_user_ids)
+    to_add = sorted(new_members - current_memberships.keys())
+    to_remove = sorted(
+        current_memberships[user_id]
+        for user_id in (old_members - new_members) & current_memberships.keys()
+    )
+    return to_add, to_remove
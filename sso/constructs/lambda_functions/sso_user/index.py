@@ -1,11 +1,44 @@
+import time
+
+# Start of the import phase of a cold start: the rest of the imports, and module setup
+IMPORT_STARTED_AT = time.perf_counter()
+
 import json
 import os
-from pprint import pprint
-from typing import List, Optional, TypedDict, Union, Mapping, Sequence, Any, cast
+import threading
+from functools import partial
+from typing import (
+    Any,
+    Callable,
+    Dict,
+    List,
+    Mapping,
+    NotRequired,
+    Optional,
+    Required,
+    Sequence,
+    Tuple,
+    TypedDict,
+    Union,
+    cast,
+)
 
-import boto3
-from deepdiff.diff import DeepDiff
-from typing_extensions import NotRequired, Required
+from account_assignments import AssignmentEngine, AssignmentRequests, assignment_delta
+from drift_detection import (
+    detect_drift,
+    drift_counts,
+    reconcile_operations,
+    take_snapshot,
+)
+from fan_out import fan_out
+from group_members import error_code, list_group_memberships, membership_delta
+from metrics import Metrics
+from permission_set_provisioning import latency_summary, provision_permission_set
+from request_journal import RequestInProgress, RequestJournal, journal_from_environment
+from structured_log import fields, get_logger, set_context
+from throttled_client import ThrottledClient
+from user_diff import differing_keys, get_change_operations as get_schema_change_operations
+from user_directory import UserDirectory
 
 ALLOW_CREATE_REQUEST_TO_IMPORT_EXISTING_USER = True
 ALLOW_DELETE_USERS = False
@@ -65,6 +98,96 @@ class SsoUserBaseEventFromCloudFormation(TypedDict):
     ResourceProperties: Required[SsoUserAttributesFromCloudFormationEvent]
 
 
+class SsoUserBatchPropertiesFromCloudFormationEvent(TypedDict):
+    Users: Required[List[SsoUserAttributesFromCloudFormationEvent]]
+
+
+class SsoUserBatchEventFromCloudFormation(TypedDict):
+    """
+    Event for a Custom::SsoUserBatch resource. Same shape as the single-user event, except
+    that ResourceProperties (and OldResourceProperties on update) hold a list of users.
+    """
+
+    RequestType: Required[str]
+    LogicalResourceId: Required[str]
+    ResourceType: Required[str]
+    RequestId: Required[str]
+    StackId: Required[str]
+    PhysicalResourceId: NotRequired[str]
+    ResourceProperties: Required[SsoUserBatchPropertiesFromCloudFormationEvent]
+    OldResourceProperties: NotRequired[SsoUserBatchPropertiesFromCloudFormationEvent]
+
+
+class SsoGroupMembersPropertiesFromCloudFormationEvent(TypedDict):
+    GroupId: Required[str]
+    MemberUserIds: Required[List[str]]
+
+
+class SsoGroupMembersEventFromCloudFormation(TypedDict):
+    """
+    Event for a Custom::SsoGroupMembers resource, which holds the full set of users that
+    this stack makes members of one group.
+    """
+
+    RequestType: Required[str]
+    LogicalResourceId: Required[str]
+    ResourceType: Required[str]
+    RequestId: Required[str]
+    StackId: Required[str]
+    PhysicalResourceId: NotRequired[str]
+    ResourceProperties: Required[SsoGroupMembersPropertiesFromCloudFormationEvent]
+    OldResourceProperties: NotRequired[SsoGroupMembersPropertiesFromCloudFormationEvent]
+
+
+class SsoAssignmentFromCloudFormationEvent(TypedDict):
+    PermissionSetArn: Required[str]
+    PrincipalType: Required[str]
+    PrincipalId: Required[str]
+    TargetId: Required[str]
+
+
+class SsoAssignmentsPropertiesFromCloudFormationEvent(TypedDict):
+    Assignments: Required[List[SsoAssignmentFromCloudFormationEvent]]
+
+
+class SsoAssignmentsEventFromCloudFormation(TypedDict):
+    """
+    Event for a Custom::SsoAssignments resource, which holds a whole matrix of
+    (permission set, principal, account) assignments.
+    """
+
+    RequestType: Required[str]
+    LogicalResourceId: Required[str]
+    ResourceType: Required[str]
+    RequestId: Required[str]
+    StackId: Required[str]
+    PhysicalResourceId: NotRequired[str]
+    ResourceProperties: Required[SsoAssignmentsPropertiesFromCloudFormationEvent]
+    OldResourceProperties: NotRequired[SsoAssignmentsPropertiesFromCloudFormationEvent]
+
+
+class SsoPermissionSetProvisioningPropertiesFromCloudFormationEvent(TypedDict):
+    PermissionSetArn: Required[str]
+    AccountIds: Required[List[str]]
+    PolicyHash: Required[str]
+
+
+class SsoPermissionSetProvisioningEventFromCloudFormation(TypedDict):
+    """
+    Event for a Custom::SsoPermissionSetProvisioning resource. PolicyHash changes whenever
+    the permission set's policies do, and AccountIds are the accounts it's assigned in.
+    """
+
+    RequestType: Required[str]
+    LogicalResourceId: Required[str]
+    ResourceType: Required[str]
+    RequestId: Required[str]
+    StackId: Required[str]
+    PhysicalResourceId: NotRequired[str]
+    ResourceProperties: Required[SsoPermissionSetProvisioningPropertiesFromCloudFormationEvent]
+    OldResourceProperties: NotRequired[SsoPermissionSetProvisioningPropertiesFromCloudFormationEvent]
+
+
 class SsoUserCreateEvent(SsoUserBaseEventFromCloudFormation):
     pass
 
@@ -134,23 +257,281 @@ class CdkCustomResourceResponse(TypedDict):
     PhysicalResourceId: Required[str]
     Data: NotRequired[dict]
     NoEcho: NotRequired[bool]
+    # In async mode, the Provider framework hands every field of on_event's response to
+    # is_complete(), but only the ones above to CloudFormation
+    AssignmentRequests: NotRequired[AssignmentRequests]
 
 
 SSO_IDENTITY_STORE_ID = os.environ.get("SSO_IDENTITY_STORE_ID") or ""
 SSO_REGION = os.environ.get("SSO_REGION") or ""
+SSO_INSTANCE_ARN = os.environ.get("SSO_INSTANCE_ARN") or ""
 
 if not SSO_IDENTITY_STORE_ID or not SSO_REGION:
     raise Exception(
         "SSO_IDENTITY_STORE_ID and SSO_REGION environment variables must be set"
     )
 
-identitystore_client = boto3.client("identitystore", region_name=SSO_REGION)
+# When SsoUserProvider is created with async_mode=True, on_event only validates batch
+# requests and is_complete() applies the changes in chunks of at most this many writes
+ASYNC_MODE = (os.environ.get("ASYNC_MODE") or "").lower() == "true"
+MAX_OPERATIONS_PER_IS_COMPLETE = int(os.environ.get("MAX_OPERATIONS_PER_IS_COMPLETE") or 100)
+MIN_REMAINING_TIME_MS = 20_000
+
+# CloudFormation calls us for many users in parallel, so pace each API on the client side
+# (requests per second, per warm container) on top of botocore's adaptive retry mode.
+# Override with e.g. IDENTITYSTORE_RATE_LIMITS='{"CreateUser": 5}'
+IDENTITYSTORE_RATE_LIMITS = {
+    "CreateUser": 10.0,
+    "UpdateUser": 10.0,
+    "DeleteUser": 10.0,
+    "ListUsers": 20.0,
+    "CreateGroupMembership": 10.0,
+    "DeleteGroupMembership": 10.0,
+    "ListGroupMemberships": 20.0,
+    "ListGroups": 20.0,
+    **json.loads(os.environ.get("IDENTITYSTORE_RATE_LIMITS") or "{}"),
+}
+IDENTITYSTORE_DEFAULT_RATE_LIMIT = float(os.environ.get("IDENTITYSTORE_DEFAULT_RATE_LIMIT") or 10)
+IDENTITYSTORE_MAX_ATTEMPTS = int(os.environ.get("IDENTITYSTORE_MAX_ATTEMPTS") or 10)
+
+# sso-admin quotas are per account, shared with everything else provisioning assignments
+SSO_ADMIN_RATE_LIMITS = {
+    "CreateAccountAssignment": 10.0,
+    "DeleteAccountAssignment": 10.0,
+    "DescribeAccountAssignmentCreationStatus": 20.0,
+    "DescribeAccountAssignmentDeletionStatus": 20.0,
+    "ProvisionPermissionSet": 10.0,
+    "DescribePermissionSetProvisioningStatus": 20.0,
+    **json.loads(os.environ.get("SSO_ADMIN_RATE_LIMITS") or "{}"),
+}
+SSO_ADMIN_DEFAULT_RATE_LIMIT = float(os.environ.get("SSO_ADMIN_DEFAULT_RATE_LIMIT") or 10)
+SSO_ADMIN_MAX_ATTEMPTS = int(os.environ.get("SSO_ADMIN_MAX_ATTEMPTS") or 10)
+
+# How often pending account assignment and permission set provisioning requests are
+# polled for their status
+ASSIGNMENT_POLL_SECONDS = float(os.environ.get("ASSIGNMENT_POLL_SECONDS") or 3)
+
+# Set on SsoDriftDetector's scheduled function only: where the desired state embedded at
+# synth time is, whether to fix drifted users and memberships, and where reports go
+DESIRED_STATE_BUCKET = os.environ.get("DESIRED_STATE_BUCKET") or ""
+DESIRED_STATE_KEY = os.environ.get("DESIRED_STATE_KEY") or ""
+DRIFT_RECONCILE = (os.environ.get("DRIFT_RECONCILE") or "").lower() == "true"
+DRIFT_REPORT_BUCKET = os.environ.get("DRIFT_REPORT_BUCKET") or ""
+DRIFT_REPORT_PREFIX = os.environ.get("DRIFT_REPORT_PREFIX") or "sso-drift/"
+DRIFT_METRICS_NAMESPACE = os.environ.get("DRIFT_METRICS_NAMESPACE") or "CdkSso/Drift"
+STACK_NAME = os.environ.get("STACK_NAME") or ""
+
+# Batch operations fan out over this many threads, all sharing the client below. Its
+# connection pool must be at least as large, or threads queue for a connection.
+MAX_CONCURRENT_REQUESTS = int(os.environ.get("MAX_CONCURRENT_REQUESTS") or 8)
+
+
+def create_identitystore_client():
+    return create_client("identitystore", max_attempts=IDENTITYSTORE_MAX_ATTEMPTS)
+
+
+def create_sso_admin_client():
+    return create_client("sso-admin", max_attempts=SSO_ADMIN_MAX_ATTEMPTS)
+
+
+def create_client(service_name: str, *, max_attempts: Optional[int] = None):
+    """
+    A client in adaptive retry mode, with max_attempts if given, else botocore's default
+    (e.g. for the request journal's DynamoDB table and the drift detector's S3 bucket).
+    """
+    # Imported here rather than at module level: boto3 is the bulk of our import time,
+    # and cold starts are on the critical path of every deploy. We rely on the boto3
+    # that ships with the Lambda runtime instead of bundling our own.
+    import boto3
+    from botocore.config import Config
+
+    retries: Dict[str, Any] = {"mode": "adaptive"}
+    if max_attempts is not None:
+        retries["max_attempts"] = max_attempts
+    return boto3.client(
+        service_name,
+        region_name=SSO_REGION,
+        config=Config(
+            retries=retries,
+            max_pool_connections=max(10, MAX_CONCURRENT_REQUESTS),
+        ),
+    )
+
+
+# The boto3 client is only built on the first API call
+identitystore_client = ThrottledClient(
+    create_identitystore_client,
+    rate_limits=IDENTITYSTORE_RATE_LIMITS,
+    default_rate=IDENTITYSTORE_DEFAULT_RATE_LIMIT,
+)
+sso_admin_client = ThrottledClient(
+    create_sso_admin_client,
+    rate_limits=SSO_ADMIN_RATE_LIMITS,
+    default_rate=SSO_ADMIN_DEFAULT_RATE_LIMIT,
+)
+
+# Lives as long as the warm container, so a burst of requests during a deploy shares
+# one paginated snapshot of the identity store instead of listing users per request.
+user_directory = UserDirectory(
+    lambda: identitystore_client,
+    SSO_IDENTITY_STORE_ID,
+    ttl_seconds=float(os.environ.get("USER_DIRECTORY_TTL_SECONDS") or 60),
+    max_users=int(os.environ.get("USER_DIRECTORY_MAX_USERS") or 10000),
+)
+
+
+# Off unless SsoUserProvider(request_journal=True) sets REQUEST_JOURNAL_TABLE (or, for
+# local runs, REQUEST_JOURNAL_PATH is set to a SQLite file)
+request_journal: Optional[RequestJournal] = journal_from_environment(
+    os.environ, lambda: create_client("dynamodb")
+)
+# How long a request is claimed for when there is no Lambda context to tell when the
+# invocation times out: the longest a Lambda invocation can run
+REQUEST_CLAIM_SECONDS = 15 * 60
+
+log = get_logger("sso_user")
+
+# Request, phase, and API metrics go to this CloudWatch namespace, as EMF log records
+METRICS_NAMESPACE = os.environ.get("METRICS_NAMESPACE") or "CdkSso"
+metrics = Metrics(METRICS_NAMESPACE)
+
+# Reported once, by the first invocation of a cold container
+IMPORT_MS = round((time.perf_counter() - IMPORT_STARTED_AT) * 1000, 3)
+_import_reported = False
 
 
 def on_event(event: SsoUserBaseEventFromCloudFormation, context):
-    print(f"Received event:\n{json.dumps(event, indent=2)}")
+    start_invocation(event, "on_event")
+    log.debug("Received event", extra=fields(event=event))
+    try:
+        recorded = claim_request(event, context)
+        if recorded is not None:
+            return recorded
+        try:
+            with metrics.timer(
+                "RequestLatency", ResourceType=event["ResourceType"], RequestType=event["RequestType"]
+            ):
+                response = with_api_stats(handle_event(event, context))
+        except Exception:
+            release_request(event)
+            raise
+        record_response(event, response)
+        return response
+    except Exception:
+        log.exception("Request failed")
+        raise
+    finally:
+        flush_metrics()
+
+
+def claim_request(event: Mapping[str, Any], context: Any) -> Optional[CdkCustomResourceResponse]:
+    """
+    Claims the request in the journal, if there is one, before any work is done. Returns
+    the response to an earlier delivery of the same request, waiting for it while that
+    delivery is still running. The claim lasts until this invocation times out, so a
+    delivery that timed out part-way is taken over. The journal only saves work, so if
+    it can't be read, the request is handled as usual.
+    """
+    if request_journal is None:
+        return None
+    if context is not None:
+        lease_seconds = context.get_remaining_time_in_millis() / 1000
+        max_wait_seconds = max(lease_seconds - MIN_REMAINING_TIME_MS / 1000, 0)
+    else:
+        lease_seconds, max_wait_seconds = REQUEST_CLAIM_SECONDS, 0
+    try:
+        recorded = request_journal.claim(event["RequestId"], lease_seconds, max_wait_seconds=max_wait_seconds)
+    except RequestInProgress:
+        raise
+    except Exception as error:
+        log.warning("Reading the request journal failed: %r", error)
+        return None
+    if recorded is not None:
+        log.info("Returning the response recorded for an earlier delivery of this request")
+        metrics.put(
+            "RequestReplays", 1, ResourceType=event["ResourceType"], RequestType=event["RequestType"]
+        )
+    return cast(Optional[CdkCustomResourceResponse], recorded)
+
+
+def release_request(event: Mapping[str, Any]) -> None:
+    """Releases the claim on a failed request, so a retry is handled in full right away."""
+    if request_journal is None:
+        return
+    try:
+        request_journal.release(event["RequestId"])
+    except Exception as error:
+        # The claim expires when this invocation would have timed out anyway
+        log.warning("Releasing the request journal claim failed: %r", error)
+
+
+def record_response(event: Mapping[str, Any], response: CdkCustomResourceResponse) -> None:
+    if request_journal is None:
+        return
+    try:
+        request_journal.put(event["RequestId"], response)
+    except Exception as error:
+        # The changes are made, so failing the request now would only make things worse
+        log.warning("Writing to the request journal failed: %r", error)
+
+
+def start_invocation(event: Mapping[str, Any], handler: str) -> None:
+    """Resets the per-invocation API counters, and tags every log record with the request."""
+    global _import_reported
+    identitystore_client.reset_stats()
+    sso_admin_client.reset_stats()
+    set_context(
+        handler=handler,
+        request_id=event.get("RequestId"),
+        logical_resource_id=event.get("LogicalResourceId"),
+        resource_type=event.get("ResourceType"),
+        request_type=event.get("RequestType"),
+    )
+    if not _import_reported:
+        _import_reported = True
+        metrics.put("PhaseLatency", IMPORT_MS, "Milliseconds", Phase="import")
+
+
+def flush_metrics() -> None:
+    """Adds per-API call, retry, throttle, and latency metrics, and writes out all metrics."""
+    for service, client in [("identitystore", identitystore_client), ("sso-admin", sso_admin_client)]:
+        for api, stats in sorted(client.api_stats().items()):
+            metrics.put("ApiCalls", stats.calls, Service=service, Api=api)
+            metrics.put("ApiRetries", stats.retries, Service=service, Api=api)
+            metrics.put("ApiThrottles", stats.throttles, Service=service, Api=api)
+            if stats.calls:
+                metrics.put(
+                    "ApiLatency",
+                    round(stats.latency_ms / stats.calls, 3),
+                    "Milliseconds",
+                    Service=service,
+                    Api=api,
+                )
+    metrics.flush()
+
+
+def with_api_stats(response: CdkCustomResourceResponse) -> CdkCustomResourceResponse:
+    """Adds identitystore and sso-admin call, retry, and latency counters to the response Data."""
+    api_stats = {**identitystore_client.stats_data(), **sso_admin_client.stats_data()}
+    log.info("API stats", extra=fields(api_stats=api_stats))
+    response["Data"] = {**response.get("Data", {}), **api_stats}
+    return response
+
+
+def handle_event(
+    event: SsoUserBaseEventFromCloudFormation, context: Any = None
+) -> CdkCustomResourceResponse:
     request_type = event["RequestType"]
-    print(f"Request type: {request_type}")
+    if event["ResourceType"] == "Custom::SsoUserBatch":
+        return on_batch_event(cast(SsoUserBatchEventFromCloudFormation, event))
+    if event["ResourceType"] == "Custom::SsoGroupMembers":
+        return on_group_members_event(cast(SsoGroupMembersEventFromCloudFormation, event))
+    if event["ResourceType"] == "Custom::SsoAssignments":
+        return on_assignments_event(cast(SsoAssignmentsEventFromCloudFormation, event), context)
+    if event["ResourceType"] == "Custom::SsoPermissionSetProvisioning":
+        return on_permission_set_provisioning_event(
+            cast(SsoPermissionSetProvisioningEventFromCloudFormation, event), context
+        )
     if request_type == "Create":
         return on_create(cast(SsoUserCreateEvent, event))
     if request_type == "Update":
@@ -160,9 +541,6 @@ def on_event(event: SsoUserBaseEventFromCloudFormation, context):
     raise Exception("Invalid request type: %s" % request_type)
 
 
-def firstCharacterToLower(s: str) -> str:
-    return s[0].lower() + s[1:]
-
 def toAwsIdentityStoreUserFormat(
     cdk_user_attr: SsoUserAttributesFromCloudFormationEvent,
 ) -> IdentityStoreUserAttributes:
@@ -194,12 +572,13 @@ def on_create(event: SsoUserCreateEvent) -> CdkCustomResourceResponse:
     existing_user = get_existing_user_if_exists(new_user_attributes["UserName"])
     if existing_user:
         return try_import_existing_user(existing_user, new_user_attributes)
-    print(f"Creating user with attributes: {json.dumps(new_user_attributes, indent=2)}")
-    response = identitystore_client.create_user(
-        IdentityStoreId=SSO_IDENTITY_STORE_ID, **new_user_attributes
-    )
-    physical_id = response["UserId"]
-    print(f'Created user {response["UserId"]}')
+    email = new_user_attributes["Emails"][0]["Value"]
+    user_with_same_email = user_directory.get_by_email(email)
+    if user_with_same_email:
+        log.warning(
+            "Email %s is already used by existing user %s", email, user_with_same_email["UserName"]
+        )
+    physical_id = create_or_import_user(new_user_attributes)
     return CdkCustomResourceResponse(
         PhysicalResourceId=physical_id,
         Data={
@@ -210,72 +589,122 @@ def on_create(event: SsoUserCreateEvent) -> CdkCustomResourceResponse:
     )
 
 
+def create_user(new_user_attributes: IdentityStoreUserAttributes) -> str:
+    log.info("Creating user %s", new_user_attributes["UserName"])
+    log.debug("New user attributes", extra=fields(attributes=new_user_attributes))
+    response = identitystore_client.create_user(
+        IdentityStoreId=SSO_IDENTITY_STORE_ID, **new_user_attributes
+    )
+    log.info("Created user %s", response["UserId"], extra=fields(user_id=response["UserId"]))
+    user_directory.record_create(
+        dict(
+            new_user_attributes,
+            UserId=response["UserId"],
+            IdentityStoreId=SSO_IDENTITY_STORE_ID,
+        )
+    )
+    return response["UserId"]
+
+
+def create_or_import_user(new_user_attributes: IdentityStoreUserAttributes) -> str:
+    """
+    Creates the user, or if the username was taken after all (by a user created
+    elsewhere since the directory snapshot was taken), imports the existing user as
+    on_create() would have, had the snapshot been up to date.
+    """
+    try:
+        return create_user(new_user_attributes)
+    except Exception as error:
+        if error_code(error) != "ConflictException":
+            raise
+        username = new_user_attributes["UserName"]
+        log.info("Username %s was taken since the directory snapshot, looking it up again", username)
+        user_directory.invalidate()
+        existing_user = get_existing_user_if_exists(username)
+        if not existing_user:
+            raise
+        return try_import_existing_user(existing_user, new_user_attributes)["PhysicalResourceId"]
+
+
 def on_update(event: SsoUserUpdateEvent) -> CdkCustomResourceResponse:
     physical_id = event["PhysicalResourceId"]
     new_user_attr = toAwsIdentityStoreUserFormat(event["ResourceProperties"])
     old_user_attr = toAwsIdentityStoreUserFormat(event["OldResourceProperties"])
-    change_operations: List[AttributeOperationTypeDef] = []
-    ddiff = DeepDiff(old_user_attr, new_user_attr)
-    print("Differences between new and old attributes:")
-    pprint(ddiff, indent=2)
-    for changed_key in ddiff.affected_root_keys:
-        key = cast(str, changed_key)
-        newValue = cast(Mapping[str, Any], new_user_attr.get(key))
-        change_operations.append({
-                # identitystore.update_user() expects lower camel case whereas
-                # identitystore.create_user() expects upper camel case
-                "AttributePath":firstCharacterToLower(key),
-                "AttributeValue": newValue,
-        }
+    change_operations = get_change_operations(old_user_attr, new_user_attr)
+    update_user(physical_id, change_operations)
+    return CdkCustomResourceResponse(
+        PhysicalResourceId=physical_id,
+    )
+
+
+def get_change_operations(
+    old_user_attr: IdentityStoreUserAttributes,
+    new_user_attr: IdentityStoreUserAttributes,
+) -> List[AttributeOperationTypeDef]:
+    with metrics.timer("PhaseLatency", Phase="diff"):
+        change_operations = cast(
+            List[AttributeOperationTypeDef],
+            get_schema_change_operations(old_user_attr, new_user_attr),
         )
-    print("Change operations for identitystore.update_user() API:")
-    pprint(change_operations, indent=2)
+    log.info(
+        "Attributes changed between old and new properties",
+        extra=fields(attributes=[operation["AttributePath"] for operation in change_operations]),
+    )
+    return change_operations
+
+
+def update_user(user_id: str, change_operations: List[AttributeOperationTypeDef]) -> None:
+    log.debug(
+        "Change operations for identitystore.update_user() API",
+        extra=fields(user_id=user_id, operations=change_operations),
+    )
     identitystore_client.update_user(
         IdentityStoreId=SSO_IDENTITY_STORE_ID,
-        UserId=physical_id,
+        UserId=user_id,
         Operations=change_operations,
     )
-    print("Update completed.")
+    user_directory.record_update(user_id, change_operations)
+    log.info("Updated user %s", user_id, extra=fields(user_id=user_id))
+
+
+def on_delete(event: SsoUserDeleteEvent) -> CdkCustomResourceResponse:
+    physical_id = event["PhysicalResourceId"]
+    delete_user(physical_id)
     return CdkCustomResourceResponse(
         PhysicalResourceId=physical_id,
     )
 
 
-def on_delete(event: SsoUserDeleteEvent) -> CdkCustomResourceResponse:
-    # One of several ways to approach this...
-    physical_id = event["PhysicalResourceId"]
-    print("Deleting user {physical_id}")
-    if not ALLOW_DELETE_USERS:
-        if not RETURN_DELETE_SUCCESS_EVEN_IF_DELETE_NOT_ALLOWED:
-            raise Exception(
-                "Deleting users not allowed. Either set ALLOW_DELETE_USERS = True, or to remove a user from a stack but not delete them, set RETURN_DELETE_SUCCESS_EVEN_IF_DELETE_NOT_ALLOWED = True"
-            )
-    else:
+def delete_user(user_id: str) -> None:
+    log.info("Deleting user %s", user_id, extra=fields(user_id=user_id))
+    if delete_allowed():
         identitystore_client.delete_user(
-            IdentityStoreId=SSO_IDENTITY_STORE_ID, UserId=physical_id
+            IdentityStoreId=SSO_IDENTITY_STORE_ID, UserId=user_id
         )
+        user_directory.record_delete(user_id)
 
-    return CdkCustomResourceResponse(
-        PhysicalResourceId=physical_id,
-    )
+
+def delete_allowed() -> bool:
+    # One of several ways to approach this...
+    if ALLOW_DELETE_USERS:
+        return True
+    if not RETURN_DELETE_SUCCESS_EVEN_IF_DELETE_NOT_ALLOWED:
+        raise Exception(
+            "Deleting users not allowed. Either set ALLOW_DELETE_USERS = True, or to remove a user from a stack but not delete them, set RETURN_DELETE_SUCCESS_EVEN_IF_DELETE_NOT_ALLOWED = True"
+        )
+    return False
 
 
 def get_existing_user_if_exists(username):
     """If user doesn't exist, return False"""
-    print("Checking if {username} already exists...")
-    response = identitystore_client.list_users(
-        IdentityStoreId=SSO_IDENTITY_STORE_ID,
-        Filters=[{"AttributePath": "UserName", "AttributeValue": username}],
-    )
-    user_exists = len(response.get("Users", [])) > 0
-    if user_exists:
-        existing_user = cast(IdentityStoreUser, response["Users"][0])
-        print(
-            f"Found existing user ID {existing_user['UserId']} for username {username}"
-        )
+    with metrics.timer("PhaseLatency", Phase="lookup"):
+        user = user_directory.get_by_username(username)
+    if user:
+        existing_user = cast(IdentityStoreUser, user)
+        log.info("Found existing user ID %s for username %s", existing_user["UserId"], username)
         return existing_user
     else:
-        print(f"Username {username} does not exist")
+        log.info("Username %s does not exist", username)
         return False
 
 
@@ -292,17 +721,8 @@ def try_import_existing_user(
     exception basis.
     Use ALLOW_CREATE_REQUEST_TO_IMPORT_EXISTING_USER=True to allow this feature.
     """
-    # downcast so we can perform a fair comparison
     existing_user_id = existing_user["UserId"]
     username = new_user_attributes["UserName"]
-    existing_user_attributes = cast(
-        IdentityStoreUserAttributes,
-        {
-            key: value
-            for key, value in existing_user.items()
-            if key not in ["IdentityStoreId", "UserId"]
-        },
-    )
     if not ALLOW_CREATE_REQUEST_TO_IMPORT_EXISTING_USER:
         raise Exception(
             f"Conflict: Requested UserName {username} taken by existing user ID "
@@ -310,23 +730,17 @@ def try_import_existing_user(
             "bring them in to CDK management, set ALLOW_CREATE_REQUEST_TO_IMPORT_EXISTING_USER=True"
             "in Lambda resource handler"
         )
-    diff = DeepDiff(
-        new_user_attributes,
-        existing_user_attributes,
-        ignore_order=True,
-    )
-    pprint(diff, indent=2)
-    if diff:
+    if existing_user_differs(existing_user, new_user_attributes):
         raise Exception(
             f"Username {username} already taken by pre-existing user ID {existing_user_id}. "
             "Attempt to import skipped because user properties in template do not match "
             "pre-existing user properties"
         )
     else:
-        print(
+        log.info(
             "New user requested, but username already taken. Returning existing user ID "
-            f"{existing_user_id} as PhysicalResourceId to CloudFormation to 'import' the "
-            "user to your stack"
+            "%s as PhysicalResourceId to CloudFormation to 'import' the user to your stack",
+            existing_user_id,
         )
         return CdkCustomResourceResponse(
             PhysicalResourceId=existing_user_id,
@@ -335,4 +749,524 @@ def try_import_existing_user(
                 "Arn": f"arn:{SSO_REGION}:identitystore:::user/{existing_user_id}",
                 "IdentityStoreId": SSO_IDENTITY_STORE_ID,
             },
-        )
\ No newline at end of file
+        )
+
+
+def existing_user_differs(
+    existing_user: IdentityStoreUser, new_user_attributes: IdentityStoreUserAttributes
+) -> bool:
+    with metrics.timer("PhaseLatency", Phase="diff"):
+        keys = differing_keys(existing_user, new_user_attributes)
+    if keys:
+        log.info(
+            "Existing user %s differs in attributes",
+            existing_user["UserName"],
+            extra=fields(attributes=keys),
+        )
+    return bool(keys)
+
+
+def list_all_users() -> Dict[str, IdentityStoreUser]:
+    """
+    Snapshot of every user in the identity store, keyed by username. Batch operations use
+    one snapshot per invocation instead of issuing a filtered list_users() call for each
+    user in the batch, and the snapshot itself is served from the warm directory index.
+    """
+    with metrics.timer("PhaseLatency", Phase="lookup"):
+        users = cast(Dict[str, IdentityStoreUser], user_directory.all_users())
+    log.info("Identity store snapshot contains %d users", len(users))
+    return users
+
+
+def batch_user_id_attribute_name(username: str) -> str:
+    """Must match SsoUserBatch.user_id_attribute_name() in the CDK construct."""
+    return f"UserId.{username}"
+
+
+def users_by_username(
+    properties: Optional[SsoUserBatchPropertiesFromCloudFormationEvent],
+) -> Dict[str, IdentityStoreUserAttributes]:
+    if not properties:
+        return {}
+    return {
+        user["username"]: toAwsIdentityStoreUserFormat(user)
+        for user in properties.get("Users", [])
+    }
+
+
+def diff_user_batches(
+    old_users: Dict[str, IdentityStoreUserAttributes],
+    new_users: Dict[str, IdentityStoreUserAttributes],
+) -> Tuple[List[str], List[str], Dict[str, List[AttributeOperationTypeDef]]]:
+    """
+    Per-user diff between the old and new batch, keyed by username. Returns the usernames
+    to add, the usernames to remove, and update_user() operations for users whose
+    attributes changed. A renamed user shows up as one removal plus one addition.
+    """
+    with metrics.timer("PhaseLatency", Phase="diff"):
+        added = [username for username in new_users if username not in old_users]
+        removed = [username for username in old_users if username not in new_users]
+        changed: Dict[str, List[AttributeOperationTypeDef]] = {}
+        for username, new_user_attr in new_users.items():
+            if username not in old_users or old_users[username] == new_user_attr:
+                continue
+            changed[username] = cast(
+                List[AttributeOperationTypeDef],
+                get_schema_change_operations(old_users[username], new_user_attr),
+            )
+    log.info(
+        "Batch diff: %d added, %d removed, %d changed",
+        len(added),
+        len(removed),
+        len(changed),
+        extra=fields(added=len(added), removed=len(removed), changed=len(changed)),
+    )
+    return added, removed, changed
+
+
+def batch_response(
+    physical_id: str, user_ids: Dict[str, str]
+) -> CdkCustomResourceResponse:
+    data = {
+        batch_user_id_attribute_name(username): user_id
+        for username, user_id in user_ids.items()
+    }
+    data["IdentityStoreId"] = SSO_IDENTITY_STORE_ID
+    return CdkCustomResourceResponse(PhysicalResourceId=physical_id, Data=data)
+
+
+def batch_physical_id(event: SsoUserBatchEventFromCloudFormation) -> str:
+    return event.get("PhysicalResourceId") or event["RequestId"]
+
+
+def batch_old_and_new_users(
+    event: SsoUserBatchEventFromCloudFormation,
+) -> Tuple[Dict[str, IdentityStoreUserAttributes], Dict[str, IdentityStoreUserAttributes]]:
+    if event["RequestType"] == "Delete":
+        return users_by_username(event["ResourceProperties"]), {}
+    return (
+        users_by_username(event.get("OldResourceProperties")),
+        users_by_username(event["ResourceProperties"]),
+    )
+
+
+def on_batch_event(event: SsoUserBatchEventFromCloudFormation) -> CdkCustomResourceResponse:
+    request_type = event["RequestType"]
+    if request_type not in ["Create", "Update", "Delete"]:
+        raise Exception("Invalid request type: %s" % request_type)
+    validate_batch(event)
+    if ASYNC_MODE:
+        # is_complete() does the actual work, a chunk at a time
+        return CdkCustomResourceResponse(PhysicalResourceId=batch_physical_id(event))
+    user_ids = advance_batch(event, OperationBudget())
+    return batch_response(batch_physical_id(event), cast(Dict[str, str], user_ids))
+
+
+def validate_batch(event: SsoUserBatchEventFromCloudFormation) -> None:
+    """
+    Read-only checks that must pass before we change anything. In async mode these run in
+    on_event so a conflict fails the deploy immediately, and so that is_complete() can
+    tell users it created in an earlier chunk apart from pre-existing users.
+    """
+    old_users, new_users = batch_old_and_new_users(event)
+    added, removed, _ = diff_user_batches(old_users, new_users)
+    if removed:
+        delete_allowed()  # raises if deleting is not allowed
+    if not added:
+        return
+    existing_users = list_all_users()
+    for username in added:
+        if username in existing_users:
+            try_import_existing_user(existing_users[username], new_users[username])
+
+
+class OperationBudget:
+    """
+    Bounds the identitystore writes made by one invocation so that, in async mode,
+    is_complete() returns before the Lambda timeout and the next poll resumes the work.
+    With no limits, advance_batch() runs to completion in a single invocation.
+    """
+
+    def __init__(self, max_operations: Optional[int] = None, context: Any = None):
+        self.max_operations = max_operations
+        self.context = context
+        self.used = 0
+        self._lock = threading.Lock()
+
+    def take(self) -> bool:
+        """Thread-safe, since fan_out() workers call this before each operation."""
+        with self._lock:
+            if self.max_operations is not None and self.used >= self.max_operations:
+                return False
+            if (
+                self.context is not None
+                and self.context.get_remaining_time_in_millis() < MIN_REMAINING_TIME_MS
+            ):
+                return False
+            self.used += 1
+            return True
+
+
+def advance_batch(
+    event: SsoUserBatchEventFromCloudFormation, budget: OperationBudget
+) -> Optional[Dict[str, str]]:
+    """
+    Applies pending changes for a batch request until done or out of budget. Progress is
+    derived from the identity store itself rather than stored anywhere, so calling this
+    again after running out of budget resumes where the previous call stopped. Returns
+    the user IDs of the batch once every change is applied, or None if work remains.
+
+    Per-user operations run concurrently. If some of them fail, the rest still complete
+    and a FanOutError listing every failed user is raised afterwards.
+    """
+    old_users, new_users = batch_old_and_new_users(event)
+    added, removed, changed = diff_user_batches(old_users, new_users)
+    existing_users = list_all_users()
+
+    if removed and delete_allowed():
+        deletes: Dict[str, Callable[[], Any]] = {
+            username: partial(delete_user, existing_users[username]["UserId"])
+            for username in removed
+            if username in existing_users
+        }
+        result = fan_out(deletes, max_workers=MAX_CONCURRENT_REQUESTS, should_start=budget.take)
+        for username in result.results:
+            existing_users.pop(username)
+        result.raise_for_errors("Deleting users")
+        if not result.complete:
+            return None
+
+    user_ids: Dict[str, str] = {}
+    writes: Dict[str, Callable[[], Any]] = {}
+    for username, new_user_attr in new_users.items():
+        existing_user = existing_users.get(username)
+        if not existing_user:
+            # Also covers users that were deleted outside of CloudFormation
+            writes[username] = partial(create_or_import_user, new_user_attr)
+            continue
+        user_ids[username] = existing_user["UserId"]
+        if username in added and existing_user_differs(existing_user, new_user_attr):
+            # Only possible if the user changed since validate_batch() ran
+            try_import_existing_user(existing_user, new_user_attr)
+        if changed.get(username) and existing_user_differs(existing_user, new_user_attr):
+            writes[username] = partial(update_user, existing_user["UserId"], changed[username])
+    result = fan_out(writes, max_workers=MAX_CONCURRENT_REQUESTS, should_start=budget.take)
+    for username, created_user_id in result.results.items():
+        if created_user_id:
+            user_ids[username] = created_user_id
+    result.raise_for_errors("Creating or updating users")
+    if not result.complete:
+        return None
+    return user_ids
+
+
+def on_group_members_event(
+    event: SsoGroupMembersEventFromCloudFormation,
+) -> CdkCustomResourceResponse:
+    """
+    Reconciles a group's members with the resource's member set: the group's current
+    memberships are listed once, and only the difference is created or deleted,
+    concurrently. Members this resource didn't add are never removed.
+    """
+    request_type = event["RequestType"]
+    if request_type not in ["Create", "Update", "Delete"]:
+        raise Exception("Invalid request type: %s" % request_type)
+    properties = event["ResourceProperties"]
+    group_id = properties["GroupId"]
+    physical_id = f"{group_id}/members"
+    if request_type == "Delete":
+        old_member_user_ids, new_member_user_ids = properties["MemberUserIds"], []
+    elif request_type == "Update" and event["OldResourceProperties"]["GroupId"] == group_id:
+        old_member_user_ids = event["OldResourceProperties"]["MemberUserIds"]
+        new_member_user_ids = properties["MemberUserIds"]
+    else:
+        # A new group gets a new physical ID, so CloudFormation deletes the old resource,
+        # which removes its members from the old group
+        old_member_user_ids, new_member_user_ids = [], properties["MemberUserIds"]
+
+    try:
+        with metrics.timer("PhaseLatency", Phase="lookup"):
+            current_memberships = list_group_memberships(
+                lambda: identitystore_client, SSO_IDENTITY_STORE_ID, group_id
+            )
+    except Exception as error:
+        if request_type == "Delete" and error_code(error) == "ResourceNotFoundException":
+            log.info("Group %s no longer exists, nothing to remove", group_id)
+            return CdkCustomResourceResponse(PhysicalResourceId=physical_id)
+        raise
+    with metrics.timer("PhaseLatency", Phase="diff"):
+        to_add, to_remove = membership_delta(
+            current_memberships, old_member_user_ids, new_member_user_ids
+        )
+    log.info(
+        "Group %s has %d user members; adding %d, removing %d",
+        group_id,
+        len(current_memberships),
+        len(to_add),
+        len(to_remove),
+        extra=fields(group_id=group_id, added=len(to_add), removed=len(to_remove)),
+    )
+
+    removes: Dict[str, Callable[[], Any]] = {
+        membership_id: partial(delete_group_membership, membership_id)
+        for membership_id in to_remove
+    }
+    fan_out(removes, max_workers=MAX_CONCURRENT_REQUESTS).raise_for_errors(
+        f"Removing members from group {group_id}"
+    )
+    adds: Dict[str, Callable[[], Any]] = {
+        user_id: partial(create_group_membership, group_id, user_id) for user_id in to_add
+    }
+    fan_out(adds, max_workers=MAX_CONCURRENT_REQUESTS).raise_for_errors(
+        f"Adding members to group {group_id}"
+    )
+    return CdkCustomResourceResponse(
+        PhysicalResourceId=physical_id,
+        Data={"GroupId": group_id},
+    )
+
+
+def create_group_membership(group_id: str, user_id: str) -> None:
+    try:
+        identitystore_client.create_group_membership(
+            IdentityStoreId=SSO_IDENTITY_STORE_ID,
+            GroupId=group_id,
+            MemberId={"UserId": user_id},
+        )
+    except Exception as error:
+        # Added since we listed the group, e.g. by a retry of this same request
+        if error_code(error) != "ConflictException":
+            raise
+
+
+def delete_group_membership(membership_id: str) -> None:
+    try:
+        identitystore_client.delete_group_membership(
+            IdentityStoreId=SSO_IDENTITY_STORE_ID, MembershipId=membership_id
+        )
+    except Exception as error:
+        if error_code(error) != "ResourceNotFoundException":
+            raise
+
+
+def on_assignments_event(
+    event: SsoAssignmentsEventFromCloudFormation, context: Any = None
+) -> CdkCustomResourceResponse:
+    """
+    Applies only the assignments that differ between the old and new matrix, all
+    concurrently, and waits for them to finish provisioning before returning. In async
+    mode, it only submits them, and is_complete() polls them until they finish.
+    """
+    request_type = event["RequestType"]
+    if request_type == "Create":
+        old_assignments, new_assignments = [], event["ResourceProperties"]["Assignments"]
+    elif request_type == "Update":
+        old_assignments = event["OldResourceProperties"]["Assignments"]
+        new_assignments = event["ResourceProperties"]["Assignments"]
+    elif request_type == "Delete":
+        old_assignments, new_assignments = event["ResourceProperties"]["Assignments"], []
+    else:
+        raise Exception("Invalid request type: %s" % request_type)
+    with metrics.timer("PhaseLatency", Phase="diff"):
+        to_create, to_delete = assignment_delta(old_assignments, new_assignments)
+    response = CdkCustomResourceResponse(
+        PhysicalResourceId=batch_physical_id(cast(SsoUserBatchEventFromCloudFormation, event)),
+        Data={"AssignmentCount": len(new_assignments)},
+    )
+    if ASYNC_MODE:
+        response["AssignmentRequests"] = assignment_engine().submit(to_create, to_delete)
+        return response
+    assignment_engine().apply(
+        to_create,
+        to_delete,
+        time_left=(lambda: context.get_remaining_time_in_millis() / 1000) if context else None,
+    )
+    return response
+
+
+def assignment_engine() -> AssignmentEngine:
+    return AssignmentEngine(
+        lambda: sso_admin_client,
+        SSO_INSTANCE_ARN,
+        max_workers=MAX_CONCURRENT_REQUESTS,
+        poll_interval_seconds=ASSIGNMENT_POLL_SECONDS,
+    )
+
+
+def on_permission_set_provisioning_event(
+    event: SsoPermissionSetProvisioningEventFromCloudFormation, context: Any = None
+) -> CdkCustomResourceResponse:
+    """
+    Re-provisions a permission set after its policies change, to just the accounts the
+    stack assigns it in, all at once. New assignments provision the permission set
+    themselves, so nothing happens on create, when only the accounts change, or on delete.
+    """
+    request_type = event["RequestType"]
+    if request_type not in ["Create", "Update", "Delete"]:
+        raise Exception("Invalid request type: %s" % request_type)
+    properties = event["ResourceProperties"]
+    permission_set_arn = properties["PermissionSetArn"]
+    physical_id = f"{permission_set_arn}/provisioning"
+    if (
+        request_type != "Update"
+        or event["OldResourceProperties"]["PolicyHash"] == properties["PolicyHash"]
+    ):
+        log.info("Policies of %s unchanged, nothing to provision", permission_set_arn)
+        return CdkCustomResourceResponse(PhysicalResourceId=physical_id)
+    latencies = provision_permission_set(
+        lambda: sso_admin_client,
+        SSO_INSTANCE_ARN,
+        permission_set_arn,
+        properties["AccountIds"],
+        max_workers=MAX_CONCURRENT_REQUESTS,
+        poll_interval_seconds=ASSIGNMENT_POLL_SECONDS,
+        time_left=(lambda: context.get_remaining_time_in_millis() / 1000) if context else None,
+    )
+    return CdkCustomResourceResponse(
+        PhysicalResourceId=physical_id,
+        Data=latency_summary(latencies),
+    )
+
+
+def is_complete(event: Dict[str, Any], context) -> Dict[str, Any]:
+    """
+    Registered as the Provider framework's is_complete handler when SsoUserProvider is
+    created with async_mode=True. Called repeatedly until it returns IsComplete=True.
+    """
+    handlers: Dict[str, Callable[[Any, Any], Dict[str, Any]]] = {
+        "Custom::SsoUserBatch": is_batch_complete,
+        "Custom::SsoAssignments": is_assignments_complete,
+    }
+    handler = handlers.get(event["ResourceType"])
+    if handler is None:
+        # Everything else is handled entirely by on_event
+        return {"IsComplete": True}
+    start_invocation(event, "is_complete")
+    log.debug("Received is_complete event", extra=fields(event=event))
+    try:
+        with metrics.timer("RequestLatency", ResourceType=event["ResourceType"], RequestType="IsComplete"):
+            return handler(event, context)
+    except Exception:
+        log.exception("Request failed")
+        raise
+    finally:
+        flush_metrics()
+
+
+def is_batch_complete(event: SsoUserBatchEventFromCloudFormation, context: Any) -> Dict[str, Any]:
+    budget = OperationBudget(MAX_OPERATIONS_PER_IS_COMPLETE, context)
+    user_ids = advance_batch(event, budget)
+    if user_ids is None:
+        log.info(
+            "Applied %d operations, more remain",
+            budget.used,
+            extra=fields(api_stats=identitystore_client.stats_data()),
+        )
+        return {"IsComplete": False}
+    log.info("Applied %d operations, batch complete", budget.used)
+    response = batch_response(batch_physical_id(event), user_ids or {})
+    if event["RequestType"] == "Delete":
+        response["Data"] = {}
+    return {"IsComplete": True, "Data": with_api_stats(response)["Data"]}
+
+
+def is_assignments_complete(event: Dict[str, Any], context: Any) -> Dict[str, Any]:
+    """
+    Polls the assignment requests on_event submitted, each once, stopping early if the
+    invocation runs low on time. Nothing is stored between polls: every poll checks
+    all of them again, until none are in progress.
+    """
+    requests: AssignmentRequests = event.get("AssignmentRequests") or {}
+    in_progress = assignment_engine().poll(requests, should_start=OperationBudget(None, context).take)
+    if in_progress:
+        log.info("%d assignment requests still in progress", in_progress)
+        return {"IsComplete": False}
+    log.info("Assignment requests complete")
+    response = CdkCustomResourceResponse(PhysicalResourceId=event["PhysicalResourceId"])
+    return {"IsComplete": True, "Data": with_api_stats(response)["Data"]}
+
+
+def on_schedule(event: Dict[str, Any], context: Any = None) -> Dict[str, Any]:
+    """
+    Handler of SsoDriftDetector's scheduled function. Snapshots the identity store, diffs
+    it against the stack's desired state, emits drift counts as CloudWatch metrics (EMF),
+    writes the full report to S3 if DRIFT_REPORT_BUCKET is set, and with DRIFT_RECONCILE
+    puts drifted user attributes and memberships back. Returns the drift counts.
+    """
+    start_invocation(event, "on_schedule")
+    started_at = time.time()
+    desired = load_desired_state()
+    snapshot = take_snapshot(
+        lambda: identitystore_client,
+        SSO_IDENTITY_STORE_ID,
+        desired,
+        max_workers=MAX_CONCURRENT_REQUESTS,
+    )
+    snapshot_seconds = time.time() - started_at
+    drift = detect_drift(desired, snapshot)
+    counts = drift_counts(drift)
+    log.info("Drift detected" if any(counts.values()) else "No drift", extra=fields(drift=counts))
+
+    reconciled: Dict[str, Any] = {"Applied": [], "Failed": {}}
+    if DRIFT_RECONCILE:
+        operations = reconcile_operations(SSO_IDENTITY_STORE_ID, desired, snapshot, drift)
+        result = fan_out(
+            {key: partial(operation, identitystore_client) for key, operation in operations.items()},
+            max_workers=MAX_CONCURRENT_REQUESTS,
+        )
+        reconciled = {
+            "Applied": sorted(result.results),
+            "Failed": {key: str(error) for key, error in sorted(result.errors.items())},
+        }
+        log.info(
+            "Reconciled %d of %d drifted users and memberships",
+            len(result.results),
+            len(operations),
+            extra=fields(failed=reconciled["Failed"]),
+        )
+
+    values: Dict[str, float] = {
+        **counts,
+        "DriftTotal": sum(counts.values()),
+        "Reconciled": len(reconciled["Applied"]),
+        "ReconcileFailures": len(reconciled["Failed"]),
+        "SnapshotSeconds": round(snapshot_seconds, 3),
+    }
+    drift_metrics = Metrics(DRIFT_METRICS_NAMESPACE)
+    for name, value in values.items():
+        drift_metrics.put(name, value, "Seconds" if name.endswith("Seconds") else "Count", StackName=STACK_NAME)
+    drift_metrics.flush()
+    flush_metrics()
+    report = {
+        "StackName": STACK_NAME,
+        "IdentityStoreId": SSO_IDENTITY_STORE_ID,
+        "CheckedAt": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime(started_at)),
+        "Counts": values,
+        "Drift": drift,
+        "Reconciled": reconciled,
+        "ApiStats": identitystore_client.stats_data(),
+    }
+    if DRIFT_REPORT_BUCKET:
+        write_drift_report(report)
+    return {"Counts": values}
+
+
+def load_desired_state() -> Dict[str, Any]:
+    """The stack's desired state, with user attributes in identitystore format."""
+    body = create_client("s3").get_object(Bucket=DESIRED_STATE_BUCKET, Key=DESIRED_STATE_KEY)["Body"]
+    desired = json.loads(body.read())
+    desired["users"] = {
+        username: toAwsIdentityStoreUserFormat(attributes)
+        for username, attributes in desired["users"].items()
+    }
+    return desired
+
+
+def write_drift_report(report: Dict[str, Any]) -> None:
+    """Writes the report under a timestamped key, and as latest.json next to it."""
+    body = json.dumps(report, indent=2, sort_keys=True).encode("utf-8")
+    prefix = f"{DRIFT_REPORT_PREFIX}{STACK_NAME}/"
+    s3 = create_client("s3")
+    for key in [f"{prefix}{report['CheckedAt']}.json", f"{prefix}latest.json"]:
+        s3.put_object(Bucket=DRIFT_REPORT_BUCKET, Key=key, Body=body, ContentType="application/json")
+    log.info("Wrote drift report to s3://%s/%slatest.json", DRIFT_REPORT_BUCKET, prefix)
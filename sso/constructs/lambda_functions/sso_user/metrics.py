@@ -0,0 +1,97 @@
+import json
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+# CloudWatch accepts at most this many values per metric in one EMF record
+MAX_VALUES_PER_RECORD = 100
+
+
+def embedded_metrics(
+    namespace: str,
+    dimensions: Dict[str, str],
+    values: Dict[str, Any],
+    timestamp_ms: int,
+    units: Optional[Dict[str, str]] = None,
+) -> Dict[str, Any]:
+    """
+    A CloudWatch embedded metric format (EMF) log record: printed as JSON from Lambda,
+    CloudWatch turns it into metrics without any PutMetricData calls or permissions.
+    A value may be a list, for several samples of the same metric.
+    """
+    return {
+        "_aws": {
+            "Timestamp": timestamp_ms,
+            "CloudWatchMetrics": [
+                {
+                    "Namespace": namespace,
+                    "Dimensions": [sorted(dimensions)],
+                    "Metrics": [
+                        {"Name": name, "Unit": (units or {}).get(name) or ("Seconds" if name.endswith("Seconds") else "Count")}
+                        for name in values
+                    ],
+                }
+            ],
+        },
+        **dimensions,
+        **values,
+    }
+
+
+class Metrics:
+    """
+    Collects metric samples during one invocation and writes them as EMF records on
+    flush(), one per set of dimensions. Safe to use from fan-out threads.
+    """
+
+    def __init__(self, namespace: str):
+        self.namespace = namespace
+        # (dimensions) -> metric name -> (unit, samples)
+        self._samples: Dict[Tuple[Tuple[str, str], ...], Dict[str, Tuple[str, List[float]]]] = {}
+        self._lock = threading.Lock()
+
+    def put(self, name: str, value: float, unit: str = "Count", **dimensions: str) -> None:
+        key = tuple(sorted(dimensions.items()))
+        with self._lock:
+            metrics = self._samples.setdefault(key, {})
+            metrics.setdefault(name, (unit, []))[1].append(value)
+
+    @contextmanager
+    def timer(self, name: str, **dimensions: str) -> Iterator[None]:
+        """Records the time spent in the block, in milliseconds, even if it raises."""
+        started_at = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.put(name, round((time.perf_counter() - started_at) * 1000, 3), "Milliseconds", **dimensions)
+
+    def records(self) -> List[Dict[str, Any]]:
+        timestamp_ms = int(time.time() * 1000)
+        records: List[Dict[str, Any]] = []
+        with self._lock:
+            for key, metrics in sorted(self._samples.items()):
+                longest = max(len(samples) for _, samples in metrics.values())
+                for start in range(0, longest, MAX_VALUES_PER_RECORD):
+                    values: Dict[str, Any] = {}
+                    for name, (_, samples) in metrics.items():
+                        chunk: Sequence[float] = samples[start : start + MAX_VALUES_PER_RECORD]
+                        if chunk:
+                            values[name] = chunk[0] if len(chunk) == 1 else list(chunk)
+                    records.append(
+                        embedded_metrics(
+                            self.namespace,
+                            dict(key),
+                            values,
+                            timestamp_ms,
+                            {name: unit for name, (unit, _) in metrics.items()},
+                        )
+                    )
+        return records
+
+    def flush(self) -> None:
+        """Prints all samples as EMF records, and starts over."""
+        for record in self.records():
+            print(json.dumps(record, separators=(",", ":")))
+        with self._lock:
+            self._samples = {}
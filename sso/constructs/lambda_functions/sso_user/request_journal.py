@@ -0,0 +1,249 @@
+import json
+import threading
+import time
+from abc import ABC, abstractmethod
+from typing import Any, Callable, Dict, Mapping, Optional, Tuple
+
+from group_members import error_code
+
+# How long a response is replayed for. CloudFormation gives up on a custom resource
+# after an hour, so a redelivery never comes later than that.
+DEFAULT_TTL_SECONDS = 2 * 60 * 60
+
+# How often claim() checks on a request another invocation is handling
+CLAIM_POLL_SECONDS = 1.0
+
+# A journal entry: the recorded response, or None while the request is being handled,
+# and when the entry (or the claim) expires
+Entry = Tuple[Optional[str], float]
+
+
+class RequestInProgress(Exception):
+    """Raised by claim() when another invocation is still handling the same request."""
+
+    def __init__(self, request_id: str, seconds_left: float):
+        super().__init__(
+            f"Request {request_id} is being handled by another invocation, "
+            f"whose claim on it expires in {seconds_left:.0f}s"
+        )
+        self.request_id = request_id
+
+
+class RequestJournal(ABC):
+    """
+    Claims each CloudFormation request by RequestId before it's handled, then records its
+    response, so that a redelivery of the same request (e.g. by the Provider framework
+    after a handler timeout) never repeats identitystore calls: it gets the recorded
+    response if the first delivery finished, waits for it if that is still running, and
+    takes over once the first delivery's claim expired (it timed out part-way). Only
+    successful responses are recorded; a request that failed releases its claim and is
+    retried in full. Subclasses store the entries.
+    """
+
+    def __init__(
+        self,
+        *,
+        ttl_seconds: float = DEFAULT_TTL_SECONDS,
+        clock: Callable[[], float] = time.time,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self._clock = clock
+        self._sleep = sleep
+
+    def get(self, request_id: str) -> Optional[Dict[str, Any]]:
+        """The response recorded for request_id, or None if there is none (yet) or it expired."""
+        entry = self._read(request_id)
+        if entry is None:
+            return None
+        response, expires_at = entry
+        if response is None or expires_at <= self._clock():
+            return None
+        return json.loads(response)
+
+    def claim(self, request_id: str, lease_seconds: float, *, max_wait_seconds: float = 0) -> Optional[Dict[str, Any]]:
+        """
+        Atomically claims request_id for lease_seconds (until this invocation times out),
+        unless it's already claimed. Returns None once claimed, or the response recorded
+        by an earlier delivery. While another unexpired claim holds it, waits for its
+        response or for it to expire, up to max_wait_seconds, then raises RequestInProgress.
+        """
+        deadline = self._clock() + max_wait_seconds
+        while True:
+            now = self._clock()
+            entry = self._claim(request_id, now, now + lease_seconds)
+            if entry is None:
+                return None
+            response, expires_at = entry
+            if response is not None:
+                return json.loads(response)
+            if expires_at > deadline:
+                raise RequestInProgress(request_id, expires_at - now)
+            self._sleep(max(min(CLAIM_POLL_SECONDS, expires_at - now), 0))
+
+    def put(self, request_id: str, response: Mapping[str, Any]) -> None:
+        """Records the response to a claimed request, replacing the claim."""
+        self._write(request_id, json.dumps(response, sort_keys=True), self._clock() + self.ttl_seconds)
+
+    def release(self, request_id: str) -> None:
+        """Gives up a claim without recording a response, e.g. when the request failed."""
+        self._release(request_id)
+
+    @abstractmethod
+    def _read(self, request_id: str) -> Optional[Entry]:
+        """The entry for request_id, expired or not, or None if there is none."""
+
+    @abstractmethod
+    def _claim(self, request_id: str, now: float, claimed_until: float) -> Optional[Entry]:
+        """Writes a claim unless an entry that expires after now exists; returns that entry if so."""
+
+    @abstractmethod
+    def _write(self, request_id: str, response: str, expires_at: float) -> None:
+        """Writes the response, replacing the claim."""
+
+    @abstractmethod
+    def _release(self, request_id: str) -> None:
+        """Deletes the entry if it's still a claim, never a recorded response."""
+
+
+class DynamoDbJournal(RequestJournal):
+    """
+    Entries in a DynamoDB table with partition key RequestId and TTL attribute ExpiresAt,
+    as created by SsoUserProvider(request_journal=True). A claim is an item without a
+    Response, written with a conditional PutItem so only one invocation gets it. DynamoDB
+    deletes expired items within a day or two, not right away, so ExpiresAt is checked
+    here too.
+    """
+
+    def __init__(self, client_factory: Callable[[], Any], table_name: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.table_name = table_name
+        # Built on first use, so importing the handler doesn't pay for creating a client
+        self._client_factory = client_factory
+        self._client: Any = None
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            self._client = self._client_factory()
+        return self._client
+
+    def _read(self, request_id: str) -> Optional[Entry]:
+        item = self.client.get_item(
+            TableName=self.table_name, Key={"RequestId": {"S": request_id}}, ConsistentRead=True
+        ).get("Item")
+        if item is None:
+            return None
+        response = item.get("Response")
+        return (response["S"] if response else None), float(item["ExpiresAt"]["N"])
+
+    def _claim(self, request_id: str, now: float, claimed_until: float) -> Optional[Entry]:
+        while True:
+            try:
+                self.client.put_item(
+                    TableName=self.table_name,
+                    Item={"RequestId": {"S": request_id}, "ExpiresAt": {"N": str(int(claimed_until))}},
+                    ConditionExpression="attribute_not_exists(RequestId) OR ExpiresAt <= :now",
+                    ExpressionAttributeValues={":now": {"N": str(int(now))}},
+                )
+                return None
+            except Exception as error:
+                if error_code(error) != "ConditionalCheckFailedException":
+                    raise
+            entry = self._read(request_id)
+            # Unless the claim was released in the meantime
+            if entry is not None:
+                return entry
+
+    def _write(self, request_id: str, response: str, expires_at: float) -> None:
+        self.client.put_item(
+            TableName=self.table_name,
+            Item={
+                "RequestId": {"S": request_id},
+                "Response": {"S": response},
+                "ExpiresAt": {"N": str(int(expires_at))},
+            },
+        )
+
+    def _release(self, request_id: str) -> None:
+        try:
+            self.client.delete_item(
+                TableName=self.table_name,
+                Key={"RequestId": {"S": request_id}},
+                ConditionExpression="attribute_not_exists(#response)",
+                ExpressionAttributeNames={"#response": "Response"},
+            )
+        except Exception as error:
+            if error_code(error) != "ConditionalCheckFailedException":
+                raise
+
+
+class SqliteJournal(RequestJournal):
+    """Entries in a local SQLite file, for running the handler and its tests without AWS."""
+
+    def __init__(self, path: str, **kwargs: Any):
+        super().__init__(**kwargs)
+        # Imported here so the Lambda's cold start doesn't pay for it unless it's used
+        import sqlite3
+
+        self.path = path
+        self._connection = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS request_journal "
+            "(request_id TEXT PRIMARY KEY, response TEXT, expires_at REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+
+    def _read(self, request_id: str) -> Optional[Entry]:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT response, expires_at FROM request_journal WHERE request_id = ?", (request_id,)
+            ).fetchone()
+        return (row[0], row[1]) if row else None
+
+    def _claim(self, request_id: str, now: float, claimed_until: float) -> Optional[Entry]:
+        with self._lock:
+            # IMMEDIATE takes the write lock up front, so other processes can't claim in between
+            self._connection.execute("BEGIN IMMEDIATE")
+            try:
+                row = self._connection.execute(
+                    "SELECT response, expires_at FROM request_journal WHERE request_id = ?", (request_id,)
+                ).fetchone()
+                if row is not None and row[1] > now:
+                    return row[0], row[1]
+                self._connection.execute(
+                    "INSERT OR REPLACE INTO request_journal (request_id, response, expires_at) VALUES (?, NULL, ?)",
+                    (request_id, claimed_until),
+                )
+                return None
+            finally:
+                self._connection.execute("COMMIT")
+
+    def _write(self, request_id: str, response: str, expires_at: float) -> None:
+        with self._lock:
+            self._connection.execute("DELETE FROM request_journal WHERE expires_at <= ?", (self._clock(),))
+            self._connection.execute(
+                "INSERT OR REPLACE INTO request_journal (request_id, response, expires_at) VALUES (?, ?, ?)",
+                (request_id, response, expires_at),
+            )
+
+    def _release(self, request_id: str) -> None:
+        with self._lock:
+            self._connection.execute(
+                "DELETE FROM request_journal WHERE request_id = ? AND response IS NULL", (request_id,)
+            )
+
+
+def journal_from_environment(
+    environ: Mapping[str, str], dynamodb_client_factory: Callable[[], Any]
+) -> Optional[RequestJournal]:
+    """
+    A DynamoDbJournal if REQUEST_JOURNAL_TABLE is set, else a SqliteJournal if
+    REQUEST_JOURNAL_PATH is, else None: the journal is off by default.
+    """
+    ttl_seconds = float(environ.get("REQUEST_JOURNAL_TTL_SECONDS") or DEFAULT_TTL_SECONDS)
+    if environ.get("REQUEST_JOURNAL_TABLE"):
+        return DynamoDbJournal(dynamodb_client_factory, environ["REQUEST_JOURNAL_TABLE"], ttl_seconds=ttl_seconds)
+    if environ.get("REQUEST_JOURNAL_PATH"):
+        return SqliteJournal(environ["REQUEST_JOURNAL_PATH"], ttl_seconds=ttl_seconds)
+    return None
@@ -0,0 +1,77 @@
+import time
+from functools import partial
+from typing import Any, Callable, Dict, Optional
+
+from fan_out import FanOutResult, fan_out
+from structured_log import get_logger
+
+log = get_logger(__name__)
+
+# An sso-admin asynchronous request status, e.g. AccountAssignmentCreationStatus or
+# PermissionSetProvisioningStatus: {"Status": "IN_PROGRESS", "RequestId": ..., ...}
+RequestStatus = Dict[str, Any]
+
+
+def submit_and_poll(
+    submissions: Dict[str, Callable[[], Optional[RequestStatus]]],
+    describe: Callable[[str, str], RequestStatus],
+    *,
+    max_workers: int,
+    poll_interval_seconds: float,
+    time_left: Optional[Callable[[], float]] = None,
+    sleep: Callable[[float], None] = time.sleep,
+) -> FanOutResult[float]:
+    """
+    Submits every asynchronous sso-admin request at once, then polls all pending ones
+    together each poll_interval_seconds with describe(key, request_id) until each has
+    succeeded or failed, rather than waiting for one to finish before submitting the
+    next. A submission that returns None had nothing to do.
+
+    Returns each request's latency in seconds (from submission until it was seen to
+    finish) under its key in results, and failures in errors. Raises a TimeoutError if
+    time_left() (seconds) runs below two poll intervals while requests are pending.
+    """
+    submitted_at: Dict[str, float] = {}
+
+    def submit(key: str, submission: Callable[[], Optional[RequestStatus]]) -> Optional[RequestStatus]:
+        submitted_at[key] = time.monotonic()
+        return submission()
+
+    result = fan_out(
+        {key: partial(submit, key, submission) for key, submission in submissions.items()},
+        max_workers=max_workers,
+    )
+    outcome: FanOutResult[float] = FanOutResult()
+    outcome.errors.update(result.errors)
+    pending: Dict[str, str] = {}
+
+    def collect(key: str, status: Optional[RequestStatus]) -> None:
+        if status is None:
+            outcome.results[key] = 0.0
+        elif status["Status"] == "IN_PROGRESS":
+            pending[key] = status["RequestId"]
+        elif status["Status"] == "FAILED":
+            outcome.errors[key] = Exception(status.get("FailureReason") or "FAILED")
+        else:
+            outcome.results[key] = time.monotonic() - submitted_at[key]
+
+    for key, status in result.results.items():
+        collect(key, status)
+
+    while pending:
+        if time_left is not None and time_left() < 2 * poll_interval_seconds:
+            raise TimeoutError(
+                f"{len(pending)} requests still in progress: " + ", ".join(sorted(pending)[:10])
+            )
+        sleep(poll_interval_seconds)
+        statuses = fan_out(
+            {key: partial(describe, key, request_id) for key, request_id in pending.items()},
+            max_workers=max_workers,
+        )
+        for key, error in statuses.errors.items():
+            # The request was accepted, so we just couldn't read its status; retry
+            log.warning("Polling %s failed, retrying: %r", key, error)
+        for key, status in statuses.results.items():
+            del pending[key]
+            collect(key, status)
+    return outcome
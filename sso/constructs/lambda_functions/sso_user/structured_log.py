@@ -0,0 +1,58 @@
+import json
+import logging
+import os
+import sys
+import time
+from typing import Any, Dict
+
+# DEBUG logs full events and API payloads; INFO (the default) one line per step
+LOG_LEVEL = (os.environ.get("LOG_LEVEL") or "INFO").upper()
+
+# Added to every record until changed, e.g. the CloudFormation request being handled
+_context: Dict[str, Any] = {}
+
+
+class JsonFormatter(logging.Formatter):
+    """
+    One JSON object per line, which CloudWatch Logs Insights parses into fields. The
+    message's %-arguments and the record's fields are only formatted and serialized if
+    the record passes the level check, so debug logging of large events costs nothing
+    when it's off.
+    """
+
+    def format(self, record: logging.LogRecord) -> str:
+        entry: Dict[str, Any] = {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S", time.gmtime(record.created))
+            + f".{int(record.msecs):03d}Z",
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+            **_context,
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str, separators=(",", ":"))
+
+
+def get_logger(name: str) -> logging.Logger:
+    """A logger writing JSON lines to stdout at LOG_LEVEL, bypassing the Lambda runtime's text handler."""
+    logger = logging.getLogger(name)
+    if not logger.handlers:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(JsonFormatter())
+        logger.addHandler(handler)
+        logger.setLevel(LOG_LEVEL)
+        logger.propagate = False
+    return logger
+
+
+def fields(**values: Any) -> Dict[str, Any]:
+    """Structured fields for a log call: log.info("Created user", extra=fields(user_id=...))."""
+    return {"fields": values}
+
+
+def set_context(**values: Any) -> None:
+    """Replaces the fields added to every record, e.g. at the start of each invocation. None values are left out."""
+    _context.clear()
+    _context.update({key: value for key, value in values.items() if value is not None})
@@ -0,0 +1,188 @@
+import copy
+import random
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+THROTTLING_ERROR_CODES = {
+    "ThrottlingException",
+    "TooManyRequestsException",
+    "RequestLimitExceeded",
+}
+
+# Client methods that don't call an API, so they are passed through untouched
+PASSTHROUGH_ATTRIBUTES = {"can_paginate", "close", "exceptions", "get_paginator", "get_waiter", "meta"}
+
+
+def api_name(method_name: str) -> str:
+    """create_user -> CreateUser"""
+    return "".join(part.capitalize() for part in method_name.split("_"))
+
+
+def is_throttling_error(error: Exception) -> bool:
+    # Duck-typed so we don't have to import botocore just to inspect ClientError
+    response = getattr(error, "response", None) or {}
+    return response.get("Error", {}).get("Code") in THROTTLING_ERROR_CODES
+
+
+class TokenBucket:
+    """
+    Client-side rate limiter. Callers reserve a token and sleep outside the lock until it
+    is due, so concurrent callers are spaced out evenly instead of retrying in lockstep.
+    """
+
+    def __init__(
+        self,
+        rate_per_second: float,
+        capacity: Optional[float] = None,
+        *,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], None] = time.sleep,
+    ):
+        self.rate_per_second = rate_per_second
+        self.capacity = capacity if capacity is not None else max(1.0, rate_per_second)
+        self._clock = clock
+        self._sleep = sleep
+        self._tokens = self.capacity
+        self._updated_at = clock()
+        self._lock = threading.Lock()
+
+    def acquire(self) -> float:
+        """Blocks until a token is available. Returns the number of seconds waited."""
+        with self._lock:
+            now = self._clock()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._updated_at) * self.rate_per_second
+            )
+            self._updated_at = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate_per_second if self._tokens < 0 else 0.0
+        if wait:
+            self._sleep(wait)
+        return wait
+
+
+class ApiCallStats:
+    def __init__(self):
+        self.calls = 0
+        self.retries = 0
+        self.throttles = 0
+        self.latency_ms = 0.0
+
+
+class ThrottledClient:
+    """
+    Wraps a boto3 client so every API call first takes a token from a per-API token
+    bucket, and calls that are still throttled after botocore's own (adaptive) retries
+    are retried again with full-jitter exponential backoff. Per-API call, retry, and
+    latency counters are kept until reset_stats() so the handler can report them. All
+    waiting goes through sleep, and all timing through clock.
+    """
+
+    def __init__(
+        self,
+        client_factory: Callable[[], Any],
+        *,
+        rate_limits: Dict[str, float],
+        default_rate: float,
+        max_throttle_retries: int = 3,
+        base_delay_seconds: float = 0.5,
+        max_delay_seconds: float = 20.0,
+        sleep: Callable[[float], None] = time.sleep,
+        clock: Callable[[], float] = time.monotonic,
+    ):
+        # Built on first use, so importing the handler doesn't pay for creating a client
+        self._client_factory = client_factory
+        self._client: Any = None
+        self._rate_limits = rate_limits
+        self._default_rate = default_rate
+        self._max_throttle_retries = max_throttle_retries
+        self._base_delay_seconds = base_delay_seconds
+        self._max_delay_seconds = max_delay_seconds
+        self._sleep = sleep
+        self._clock = clock
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._stats: Dict[str, ApiCallStats] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def client(self) -> Any:
+        """The wrapped client, created on first access."""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._client = self._client_factory()
+        return self._client
+
+    def __getattr__(self, name: str) -> Any:
+        attribute = getattr(self.client, name)
+        if name.startswith("_") or name in PASSTHROUGH_ATTRIBUTES or not callable(attribute):
+            return attribute
+
+        def call(**kwargs: Any) -> Any:
+            return self._call(api_name(name), attribute, kwargs)
+
+        return call
+
+    def _bucket(self, api: str) -> TokenBucket:
+        with self._lock:
+            if api not in self._buckets:
+                self._buckets[api] = TokenBucket(
+                    self._rate_limits.get(api, self._default_rate), clock=self._clock, sleep=self._sleep
+                )
+            return self._buckets[api]
+
+    def _record(self, api: str, latency_ms: float, retries: int, throttled: bool) -> None:
+        with self._lock:
+            stats = self._stats.setdefault(api, ApiCallStats())
+            stats.calls += 1
+            stats.retries += retries
+            stats.throttles += int(throttled)
+            stats.latency_ms += latency_ms
+
+    def _call(self, api: str, method: Callable[..., Any], kwargs: Dict[str, Any]) -> Any:
+        bucket = self._bucket(api)
+        attempt = 0
+        while True:
+            bucket.acquire()
+            started_at = self._clock()
+            try:
+                response = method(**kwargs)
+            except Exception as error:
+                latency_ms = (self._clock() - started_at) * 1000
+                throttled = is_throttling_error(error)
+                if not throttled or attempt >= self._max_throttle_retries:
+                    self._record(api, latency_ms, attempt, throttled)
+                    raise
+                attempt += 1
+                self._record(api, latency_ms, 0, True)
+                delay = min(self._max_delay_seconds, self._base_delay_seconds * 2**attempt)
+                self._sleep(random.uniform(0, delay))
+                continue
+            latency_ms = (self._clock() - started_at) * 1000
+            sdk_retries = (response or {}).get("ResponseMetadata", {}).get("RetryAttempts", 0)
+            self._record(api, latency_ms, attempt + sdk_retries, False)
+            return response
+
+    def reset_stats(self) -> None:
+        with self._lock:
+            self._stats = {}
+
+    def api_stats(self) -> Dict[str, ApiCallStats]:
+        """A copy of the per-API counters since the last reset_stats(), e.g. for metrics."""
+        with self._lock:
+            return {api: copy.copy(stats) for api, stats in self._stats.items()}
+
+    def stats_data(self) -> Dict[str, str]:
+        """
+        Compact per-API counters for a custom resource response's Data. One short string
+        per API keeps us well within CloudFormation's 4KB response limit.
+        """
+        with self._lock:
+            return {
+                f"ApiStats.{api}": (
+                    f"calls={stats.calls} retries={stats.retries} "
+                    f"throttles={stats.throttles} latencyMs={round(stats.latency_ms)}"
+                )
+                for api, stats in sorted(self._stats.items())
+            }
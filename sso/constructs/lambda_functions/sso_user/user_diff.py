@@ -0,0 +1,70 @@
+import json
+from typing import Any, List, Mapping
+
+# Top-level IdentityStoreUserAttributes keys we manage, in the order update operations
+# are emitted. Only these keys ever appear in ResourceProperties-derived attributes.
+USER_ATTRIBUTE_KEYS = ("UserName", "Name", "DisplayName", "Emails")
+
+# Keys list_users() returns that identify the user rather than describe it
+USER_IDENTIFIER_KEYS = ("IdentityStoreId", "UserId")
+
+
+def first_character_to_lower(s: str) -> str:
+    return s[0].lower() + s[1:]
+
+
+def _unordered(value: Any) -> Any:
+    """
+    Canonical form of a value for order-insensitive comparison: list order is ignored at
+    every level (e.g. the order of Emails), dict key order never matters in Python.
+    """
+    if isinstance(value, Mapping):
+        return {key: _unordered(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return sorted(
+            (_unordered(item) for item in value),
+            key=lambda item: json.dumps(item, sort_keys=True, default=str),
+        )
+    return value
+
+
+def get_change_operations(
+    old_user_attr: Mapping[str, Any], new_user_attr: Mapping[str, Any]
+) -> List[dict]:
+    """
+    update_user() operations that turn old_user_attr into new_user_attr. identitystore
+    only accepts top-level attribute paths, so a change anywhere inside Name or Emails
+    replaces that whole attribute.
+    """
+    return [
+        {
+            # identitystore.update_user() expects lower camel case whereas
+            # identitystore.create_user() expects upper camel case
+            "AttributePath": first_character_to_lower(key),
+            "AttributeValue": new_user_attr.get(key),
+        }
+        for key in USER_ATTRIBUTE_KEYS
+        if old_user_attr.get(key) != new_user_attr.get(key)
+    ]
+
+
+def differing_keys(existing_user: Mapping[str, Any], new_user_attr: Mapping[str, Any]) -> List[str]:
+    """
+    Top-level keys whose values differ between a user returned by list_users() and the
+    attributes we'd create it with, ignoring the user's identifiers and list order. Keys
+    the existing user has but we don't manage (e.g. Addresses set in the console) count
+    as differences, so we never silently adopt a user with attributes we can't see.
+    """
+    keys = [key for key in new_user_attr]
+    keys += [
+        key
+        for key in existing_user
+        if key not in new_user_attr and key not in USER_IDENTIFIER_KEYS
+    ]
+    return [
+        key
+        for key in keys
+        if key not in existing_user
+        or key not in new_user_attr
+        or _unordered(existing_user[key]) != _unordered(new_user_attr[key])
+    ]
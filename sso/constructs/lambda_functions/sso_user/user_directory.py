@@ -0,0 +1,183 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, List, Mapping, Optional
+
+from structured_log import get_logger
+
+log = get_logger(__name__)
+
+
+class UserDirectory:
+    """
+    Username -> user and email -> user index of the identity store that lives in the warm
+    Lambda container. CloudFormation sends us many create/update/delete requests in quick
+    succession during a deploy, so instead of one filtered list_users() call per request,
+    we take one paginated snapshot and answer lookups from memory until it expires.
+
+    The index is bounded by max_users. If the identity store holds more users than that,
+    the snapshot is marked partial: cached entries are still served, but a cache miss no
+    longer proves a user doesn't exist, so misses fall back to a filtered list_users() call
+    and the least-recently-used entries are evicted to stay within the bound.
+
+    The handler must call record_create(), record_update(), and record_delete() after it
+    changes a user so the index never serves its own stale writes. All public methods are
+    safe to call from the handler's fan-out threads.
+    """
+
+    def __init__(
+        self,
+        client_provider: Callable[[], Any],
+        identity_store_id: str,
+        *,
+        ttl_seconds: float,
+        max_users: int,
+    ):
+        # A provider rather than a client, so the client can be swapped after import
+        self._client_provider = client_provider
+        self._identity_store_id = identity_store_id
+        self.ttl_seconds = ttl_seconds
+        self.max_users = max_users
+        self._users_by_username: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._usernames_by_email: Dict[str, str] = {}
+        self._usernames_by_id: Dict[str, str] = {}
+        self._loaded_at: Optional[float] = None
+        self._complete = False
+        # Bumped by every change to the index, so a lookup made without the lock can
+        # tell whether its answer may be stale by the time it's cached
+        self._version = 0
+        self._lock = threading.RLock()
+
+    def invalidate(self) -> None:
+        """Drop the whole index; the next lookup takes a fresh snapshot."""
+        with self._lock:
+            self._users_by_username.clear()
+            self._usernames_by_email.clear()
+            self._usernames_by_id.clear()
+            self._loaded_at = None
+            self._complete = False
+            self._version += 1
+
+    def get_by_username(self, username: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            self._refresh_if_stale()
+            user = self._users_by_username.get(username)
+            if user is not None:
+                self._users_by_username.move_to_end(username)
+                return user
+            if self._complete:
+                return None
+            version = self._version
+        # Not under the lock: the client's rate limiting may sleep, and other fan-out
+        # threads' lookups shouldn't wait behind it
+        response = self._client_provider().list_users(
+            IdentityStoreId=self._identity_store_id,
+            Filters=[{"AttributePath": "UserName", "AttributeValue": username}],
+        )
+        users = response.get("Users", [])
+        if not users:
+            return None
+        with self._lock:
+            # Unless the index changed meanwhile, e.g. the handler deleted this user
+            if self._version == version:
+                self._put(users[0])
+        return users[0]
+
+    def get_by_email(self, email: str) -> Optional[Dict[str, Any]]:
+        """
+        Only answers from the index. identitystore can't filter list_users() on email, so
+        on a partial snapshot a miss here does not prove no user has this email.
+        """
+        with self._lock:
+            self._refresh_if_stale()
+            username = self._usernames_by_email.get(email.lower())
+            return self._users_by_username.get(username) if username else None
+
+    def all_users(self) -> Dict[str, Dict[str, Any]]:
+        """Every user in the identity store, keyed by username."""
+        with self._lock:
+            self._refresh_if_stale()
+            if self._complete:
+                return dict(self._users_by_username)
+            # Too big to cache, so page through everything without keeping it
+            users: Dict[str, Dict[str, Any]] = {}
+            for user in self._paginate_users():
+                users[user["UserName"]] = user
+            return users
+
+    def record_create(self, user: Dict[str, Any]) -> None:
+        with self._lock:
+            self._version += 1
+            if self._loaded_at is not None:
+                self._put(user)
+
+    def record_update(self, user_id: str, operations: List[Mapping[str, Any]]) -> None:
+        with self._lock:
+            self._version += 1
+            username = self._usernames_by_id.get(user_id)
+            if username is None:
+                return
+            user = dict(self._users_by_username[username])
+            for operation in operations:
+                # update_user() paths are lower camel case, list_users() keys upper camel case
+                path = operation["AttributePath"]
+                user[path[0].upper() + path[1:]] = operation.get("AttributeValue")
+            self._remove(username)
+            self._put(user)
+
+    def record_delete(self, user_id: str) -> None:
+        with self._lock:
+            self._version += 1
+            username = self._usernames_by_id.get(user_id)
+            if username is not None:
+                self._remove(username)
+
+    def _refresh_if_stale(self) -> None:
+        if self._loaded_at is not None and time.monotonic() - self._loaded_at < self.ttl_seconds:
+            return
+        self.invalidate()
+        self._complete = True
+        for user in self._paginate_users():
+            if len(self._users_by_username) >= self.max_users:
+                # Stop paging; anything we didn't see is looked up on demand
+                self._complete = False
+                break
+            self._put(user)
+        self._loaded_at = time.monotonic()
+        log.info(
+            "Loaded %d users into directory index (%s snapshot)",
+            len(self._users_by_username),
+            "complete" if self._complete else "partial",
+        )
+
+    def _paginate_users(self):
+        # Paginate by hand rather than with get_paginator(), so each page goes through the
+        # client wrapper's rate limiting and retries
+        kwargs: Dict[str, Any] = {"IdentityStoreId": self._identity_store_id, "MaxResults": 100}
+        while True:
+            page = self._client_provider().list_users(**kwargs)
+            yield from page.get("Users", [])
+            if not page.get("NextToken"):
+                return
+            kwargs["NextToken"] = page["NextToken"]
+
+    def _put(self, user: Dict[str, Any]) -> None:
+        username = user["UserName"]
+        if username in self._users_by_username:
+            self._remove(username)
+        self._users_by_username[username] = user
+        self._usernames_by_id[user["UserId"]] = username
+        for email in user.get("Emails") or []:
+            if email.get("Value"):
+                self._usernames_by_email[email["Value"].lower()] = username
+        while len(self._users_by_username) > self.max_users:
+            # Once we evict, a miss no longer proves a user doesn't exist
+            self._complete = False
+            self._remove(next(iter(self._users_by_username)))
+
+    def _remove(self, username: str) -> None:
+        user = self._users_by_username.pop(username)
+        self._usernames_by_id.pop(user["UserId"], None)
+        for email in user.get("Emails") or []:
+            if email.get("Value") and self._usernames_by_email.get(email["Value"].lower()) == username:
+                del self._usernames_by_email[email["Value"].lower()]
@@ -0,0 +1,156 @@
+import compileall
+import hashlib
+import os
+import py_compile
+import shutil
+import subprocess
+import sys
+import tempfile
+from typing import Any, Optional
+
+import jsii
+from aws_cdk import ILocalBundling
+
+# Bump when the layout of bundles produced below changes, to invalidate old cache entries
+CACHE_FORMAT_VERSION = "1"
+
+DEFAULT_CACHE_DIR = os.path.join(
+    os.environ.get("XDG_CACHE_HOME") or os.path.join(os.path.expanduser("~"), ".cache"),
+    "cdk-sso-lambda-bundles",
+)
+
+# Same pruning as SLIM_BUNDLING_COMMAND in sso_user_provider.py
+PRUNED_DIRECTORIES = {"tests", "test", "__pycache__"}
+PRUNED_DIRECTORY_SUFFIXES = (".dist-info", ".egg-info")
+PRUNED_FILES = {"requirements.txt"}
+PRUNED_FILE_SUFFIXES = (".md",)
+
+
+@jsii.implements(ILocalBundling)
+class LocalPythonBundling:
+    """
+    Bundles a Python Lambda directory with the local interpreter instead of Docker, when
+    the local Python matches the Lambda runtime's version. Produces the same output as
+    the Docker command in SsoUserProvider: requirements installed into the asset, the
+    sources copied alongside, and (when slim) pruned and precompiled.
+
+    Bundles are cached in cache_dir under a hash of requirements.txt, every source file,
+    and the bundling options, so an unchanged handler is copied from the cache instead
+    of being rebuilt on every synth. If anything goes wrong, try_bundle() returns False
+    and CDK falls back to Docker.
+    """
+
+    def __init__(
+        self,
+        source_dir: str,
+        *,
+        python_version: str,
+        slim: bool = False,
+        cache_dir: Optional[str] = None,
+    ):
+        self.source_dir = source_dir
+        self.python_version = python_version
+        self.slim = slim
+        self.cache_dir = cache_dir or os.environ.get("SSO_BUNDLING_CACHE_DIR") or DEFAULT_CACHE_DIR
+
+    def try_bundle(self, output_dir: str, *, image: Any = None, **kwargs: Any) -> bool:
+        local_version = f"{sys.version_info.major}.{sys.version_info.minor}"
+        if local_version != self.python_version:
+            print(
+                f"Local Python {local_version} doesn't match Lambda runtime Python "
+                f"{self.python_version}, bundling {self.source_dir} with Docker",
+                file=sys.stderr,
+            )
+            return False
+        try:
+            cached_bundle_dir = os.path.join(self.cache_dir, self.content_hash())
+            if not os.path.isdir(cached_bundle_dir):
+                self._build_into_cache(cached_bundle_dir)
+            shutil.copytree(cached_bundle_dir, output_dir, dirs_exist_ok=True)
+        except Exception as error:
+            print(f"Local bundling of {self.source_dir} failed, falling back to Docker: {error}", file=sys.stderr)
+            return False
+        return True
+
+    def content_hash(self) -> str:
+        digest = hashlib.sha256()
+        digest.update(f"{CACHE_FORMAT_VERSION}|{self.python_version}|slim={self.slim}".encode())
+        for relative_path in self._source_files():
+            digest.update(relative_path.encode())
+            with open(os.path.join(self.source_dir, relative_path), "rb") as f:
+                digest.update(hashlib.sha256(f.read()).digest())
+        return digest.hexdigest()
+
+    def _source_files(self):
+        """Relative paths of every source file (including requirements.txt), sorted."""
+        paths = []
+        for root, dirs, files in os.walk(self.source_dir):
+            dirs[:] = sorted(d for d in dirs if d != "__pycache__")
+            for file in files:
+                if not file.endswith(".pyc"):
+                    paths.append(os.path.relpath(os.path.join(root, file), self.source_dir))
+        return sorted(paths)
+
+    def _build_into_cache(self, cached_bundle_dir: str) -> None:
+        os.makedirs(self.cache_dir, exist_ok=True)
+        # Build next to the final location and rename, so a failed or concurrent build
+        # never leaves a half-written bundle in the cache
+        build_dir = tempfile.mkdtemp(dir=self.cache_dir, prefix=".build-")
+        try:
+            self._pip_install(build_dir)
+            for relative_path in self._source_files():
+                destination = os.path.join(build_dir, relative_path)
+                os.makedirs(os.path.dirname(destination), exist_ok=True)
+                shutil.copy2(os.path.join(self.source_dir, relative_path), destination)
+            if self.slim:
+                self._prune(build_dir)
+                compileall.compile_dir(
+                    build_dir,
+                    quiet=1,
+                    invalidation_mode=py_compile.PycInvalidationMode.UNCHECKED_HASH,
+                )
+            try:
+                os.rename(build_dir, cached_bundle_dir)
+            except OSError:
+                # Another synth finished the same bundle first
+                if not os.path.isdir(cached_bundle_dir):
+                    raise
+        finally:
+            shutil.rmtree(build_dir, ignore_errors=True)
+
+    def _pip_install(self, build_dir: str) -> None:
+        requirements_file = os.path.join(self.source_dir, "requirements.txt")
+        if not os.path.exists(requirements_file):
+            return
+        with open(requirements_file) as f:
+            requirements = [line for line in f if line.strip() and not line.strip().startswith("#")]
+        if not requirements:
+            return
+        # Ask for wheels built for Lambda's platform, so we don't ship binaries for the
+        # machine running synth. Requirements only available as sdists fail here, and
+        # fall back to Docker.
+        subprocess.run(
+            [
+                sys.executable, "-m", "pip", "install",
+                "--quiet",
+                "--no-compile",
+                "--platform", "manylinux2014_x86_64",
+                "--implementation", "cp",
+                "--python-version", self.python_version,
+                "--only-binary=:all:",
+                "-r", requirements_file,
+                "-t", build_dir,
+            ],
+            check=True,
+        )
+
+    def _prune(self, build_dir: str) -> None:
+        for root, dirs, files in os.walk(build_dir, topdown=True):
+            for directory in list(dirs):
+                if directory in PRUNED_DIRECTORIES or directory.endswith(PRUNED_DIRECTORY_SUFFIXES):
+                    shutil.rmtree(os.path.join(root, directory))
+                    dirs.remove(directory)
+            if root == build_dir:
+                for file in files:
+                    if file in PRUNED_FILES or file.endswith(PRUNED_FILE_SUFFIXES):
+                        os.remove(os.path.join(root, file))
@@ -0,0 +1,22 @@
+from typing import Callable, List
+
+import jsii
+from constructs import Construct, IValidation
+
+
+@jsii.implements(IValidation)
+class _Save:
+    def __init__(self, save: Callable[[], None]):
+        self._save = save
+
+    def validate(self) -> List[str]:
+        self._save()
+        return []
+
+
+def save_on_synth(scope: Construct, save: Callable[[], None]) -> None:
+    """
+    Calls save() when the app is synthesized, once every construct has been added. CDK
+    has no after-synth hook, so this runs as one of scope's validations and never fails.
+    """
+    scope.node.add_validation(_Save(save))
@@ -0,0 +1,91 @@
+from typing import Any, Dict, List, Optional, Tuple, cast
+
+import jsii
+from aws_cdk import CustomResource, IAnyProducer, IResolveContext, Lazy, Stack
+from constructs import Construct
+
+from .sso_user_provider import SsoUserProvider
+
+
+@jsii.implements(IAnyProducer)
+class _Assignments:
+    """Produces the assignment matrix at synth time, so grants can be added after creation."""
+
+    def __init__(self, assignments: "SsoAssignments"):
+        self._assignments = assignments
+
+    def produce(self, context: IResolveContext) -> List[Dict[str, str]]:
+        return [dict(assignment) for _, assignment in sorted(self._assignments._assignments.items())]
+
+
+class SsoAssignments(Construct):
+    """
+    Manages a whole matrix of (permission set, principal, account) assignments with a
+    single Custom::SsoAssignments resource, instead of one CfnAssignment per assignment.
+    CloudFormation provisions CfnAssignments one at a time, each waiting for sso-admin to
+    finish; the Lambda handler instead submits every changed assignment at once and polls
+    their status together, and on update only touches assignments that were added or
+    removed.
+
+    Pass an instance as assignments= to the SsoPermissionSet.grant_*() methods, or use
+    SsoAssignments.get_or_create() for one matrix per stack.
+    """
+
+    ID = "SsoAssignments"
+
+    @classmethod
+    def get_or_create(cls, scope: Construct) -> "SsoAssignments":
+        """Returns the stack's default assignment matrix, creating it on first use."""
+        stack = Stack.of(scope)
+        assignments = cast(Optional[SsoAssignments], stack.node.try_find_child(cls.ID))
+        if assignments is None:
+            assignments = SsoAssignments(stack, cls.ID)
+        return assignments
+
+    def __init__(self, scope: Construct, id: str, **kwargs: Any):
+        super().__init__(scope, id)
+        self._assignments: Dict[Tuple[str, str, str, str], Dict[str, str]] = {}
+        provider = SsoUserProvider.get_or_create(self)
+        CustomResource(
+            self,
+            id="Resource",
+            resource_type="Custom::SsoAssignments",
+            service_token=provider.service_token,
+            properties={"Assignments": Lazy.any(_Assignments(self))},
+        )
+
+    def add(
+        self,
+        *,
+        permission_set_name: str,
+        permission_set_arn: str,
+        principal_type: str,
+        principal_name: str,
+        principal_id: str,
+        account_id: str,
+    ) -> None:
+        """
+        Adds one assignment. The names only order the matrix (the IDs and ARN are usually
+        unresolved tokens at synth time), so the template is stable across synths.
+        Adding the same assignment twice has no effect.
+        """
+        self._assignments[(permission_set_name, principal_type, principal_name, account_id)] = {
+            "PermissionSetArn": permission_set_arn,
+            "PrincipalType": principal_type,
+            "PrincipalId": principal_id,
+            "TargetId": account_id,
+        }
+
+    def remove(
+        self,
+        *,
+        permission_set_name: str,
+        principal_type: str,
+        principal_name: str,
+        account_id: str,
+    ) -> None:
+        """Removes an assignment added with add(). Removing a missing one has no effect."""
+        self._assignments.pop((permission_set_name, principal_type, principal_name, account_id), None)
+
+    def __len__(self) -> int:
+        return len(self._assignments)
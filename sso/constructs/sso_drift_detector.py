@@ -0,0 +1,237 @@
+import json
+import os
+import tempfile
+from typing import Any, Dict, List, Optional, cast
+
+import jsii
+from aws_cdk import Aspects, Duration, IAspect, Stack, Token
+from aws_cdk import aws_events as events
+from aws_cdk import aws_events_targets as targets
+from aws_cdk import aws_iam as iam
+from aws_cdk import aws_lambda as lambda_
+from aws_cdk import aws_s3 as s3
+from aws_cdk import aws_s3_assets as s3_assets
+from cdk_nag import NagPackSuppression as Nag
+from cdk_nag import NagSuppressions
+from cdk_nag import RegexAppliesTo as NagRegex
+from constructs import Construct, IConstruct
+
+from ..config import SsoEnvironment
+from .sso_group import SsoGroup
+from .sso_nag import SsoNagChecks
+from .sso_shard_router import top_level_stack
+from .sso_user import SsoUser
+from .sso_user_batch import SsoUserBatch
+from .sso_user_provider import SsoUserProvider
+
+
+def desired_state(scope: Construct) -> Dict[str, Any]:
+    """
+    The users, groups, and memberships defined under scope, by name, as the drift
+    detector's handler expects them: {"users": {username: SsoUserAttributes},
+    "groups": {group_name: created by this app}, "memberships": {group_name: [username]}}.
+    """
+    users: Dict[str, Any] = {}
+    groups: Dict[str, bool] = {}
+    memberships: Dict[str, List[str]] = {}
+    for construct in scope.node.find_all():
+        if isinstance(construct, SsoUser):
+            users[construct.username] = dict(construct.attributes)
+        elif isinstance(construct, SsoUserBatch):
+            for user in construct.users:
+                if user.attributes is not None:
+                    users[user.username] = dict(user.attributes)
+        elif isinstance(construct, SsoGroup):
+            # Referenced groups have a literal ID, created ones a token
+            groups[construct.group_name] = Token.is_unresolved(construct.group_id)
+            if construct.member_users:
+                memberships[construct.group_name] = sorted(construct.member_users)
+    return {
+        "users": {username: users[username] for username in sorted(users)},
+        "groups": {group_name: groups[group_name] for group_name in sorted(groups)},
+        "memberships": {group_name: memberships[group_name] for group_name in sorted(memberships)},
+    }
+
+
+@jsii.implements(IAspect)
+class _DesiredStateWriter:
+    """
+    Embeds the desired state once the construct tree is complete: aspects run after all
+    app code, but before assets are synthesized.
+    """
+
+    def __init__(self, detector: "SsoDriftDetector"):
+        self._detector = detector
+
+    def visit(self, node: IConstruct) -> None:
+        if node.node.path == self._detector.node.path and self._detector.desired_state_asset is None:
+            self._detector._embed_desired_state()
+
+
+class SsoDriftDetector(Construct):
+    """
+    A scheduled Lambda function, alongside SsoUserProvider and running the same handler
+    code, that checks the identity store for changes made outside of CloudFormation (e.g.
+    in the console). CloudFormation only re-reads users when they change in the template,
+    so otherwise such drift goes unnoticed until a deploy trips over it.
+
+    Each run lists users and groups concurrently, then the members of the stack's groups
+    concurrently, and compares them with the users, groups, and memberships defined in
+    the stack, embedded as an S3 asset at synth time. Drift counts are emitted as
+    CloudWatch metrics (embedded metric format, namespace "CdkSso/Drift", dimension
+    StackName) and the full report is logged, and also written to report_bucket if given.
+
+    With reconcile=True, drifted user attributes and missing memberships are put back.
+    Missing users and groups, and members added outside of the stack, are only reported.
+    """
+
+    ID = "SsoDriftDetector"
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str = ID,
+        *,
+        schedule: Optional[events.Schedule] = None,
+        reconcile: bool = False,
+        report_bucket: Optional[s3.IBucket] = None,
+        report_prefix: str = "sso-drift/",
+        **kwargs: Any,
+    ):
+        super().__init__(scope, id)
+        sso_environment = SsoEnvironment.of(self)
+        stack = Stack.of(self)
+        region = stack.region
+        account = stack.account
+        function_name = f"{stack.stack_name}-SsoDriftDetector"
+        provider = cast(SsoUserProvider, SsoUserProvider.get_or_create(self))
+
+        identitystore_actions = [
+            "identitystore:ListUsers",
+            "identitystore:ListGroups",
+            "identitystore:ListGroupMemberships",
+        ]
+        if reconcile:
+            identitystore_actions += ["identitystore:UpdateUser", "identitystore:CreateGroupMembership"]
+        role = iam.Role(
+            self,
+            id="FunctionRole",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            inline_policies={
+                "CloudWatchLogPolicy": iam.PolicyDocument(
+                    statements=[
+                        iam.PolicyStatement(
+                            effect=iam.Effect.ALLOW,
+                            resources=[f"arn:aws:logs:{region}:{account}:*"],
+                            actions=["logs:CreateLogGroup"],
+                        ),
+                        iam.PolicyStatement(
+                            effect=iam.Effect.ALLOW,
+                            actions=["logs:CreateLogStream", "logs:PutLogEvents"],
+                            resources=[
+                                f"arn:aws:logs:{region}:{account}:log-group:/aws/lambda/{function_name}*",
+                            ],
+                        ),
+                    ]
+                ),
+                "SsoDriftPolicy": iam.PolicyDocument(
+                    statements=[
+                        iam.PolicyStatement(
+                            effect=iam.Effect.ALLOW,
+                            actions=identitystore_actions,
+                            resources=[
+                                f"arn:aws:identitystore::{account}:identitystore/{sso_environment.identity_store_id}",
+                                "arn:aws:identitystore:::user/*",
+                                "arn:aws:identitystore:::group/*",
+                                "arn:aws:identitystore:::membership/*",
+                            ],
+                        ),
+                    ]
+                ),
+            },
+        )
+
+        environment = {
+            "SSO_IDENTITY_STORE_ID": sso_environment.identity_store_id,
+            "SSO_INSTANCE_ARN": sso_environment.instance_arn,
+            "SSO_REGION": sso_environment.sso_region,
+            "STACK_NAME": stack.stack_name,
+        }
+        if reconcile:
+            environment["DRIFT_RECONCILE"] = "true"
+        if report_bucket is not None:
+            environment["DRIFT_REPORT_BUCKET"] = report_bucket.bucket_name
+            environment["DRIFT_REPORT_PREFIX"] = report_prefix
+
+        self.function = lambda_.Function(
+            self,
+            id="Function",
+            function_name=function_name,
+            runtime=lambda_.Runtime.PYTHON_3_11,
+            role=role,
+            code=provider.code,
+            handler="index.on_schedule",
+            # Snapshots take a few paginated calls per 100 users and per group
+            timeout=Duration.minutes(15),
+            environment=environment,
+        )
+        if report_bucket is not None:
+            report_bucket.grant_put(self.function, f"{report_prefix}*")
+
+        events.Rule(
+            self,
+            id="Schedule",
+            schedule=schedule or events.Schedule.rate(Duration.hours(1)),
+            targets=[targets.LambdaFunction(self.function, retry_attempts=0)],
+        )
+
+        self.desired_state_asset: Optional[s3_assets.Asset] = None
+        Aspects.of(top_level_stack(self)).add(_DesiredStateWriter(self))
+        SsoNagChecks.check(self)
+
+        NagSuppressions.add_resource_suppressions(
+            construct=role,
+            apply_to_children=True,
+            suppressions=[
+                Nag(
+                    id="AwsSolutions-IAM5",
+                    reason="minimum ability for Lambda to write logs to CloudWatch",
+                    applies_to=[
+                        f"Resource::arn:aws:logs:{region}:{account}:*",
+                        f"Resource::arn:aws:logs:{region}:{account}:log-group:/aws/lambda/{function_name}*",
+                    ],
+                ),
+                Nag(
+                    id="AwsSolutions-IAM5",
+                    reason="Allow the drift detector to read all SSO users, groups, and memberships, and to fix the ones the stack defines",
+                    applies_to=[
+                        "Resource::arn:aws:identitystore:::user/*",
+                        "Resource::arn:aws:identitystore:::group/*",
+                        "Resource::arn:aws:identitystore:::membership/*",
+                    ],
+                ),
+                Nag(
+                    id="AwsSolutions-IAM5",
+                    reason="CDK grants to read the desired state asset, and to write reports under report_prefix",
+                    applies_to=[
+                        "Action::s3:GetBucket*",
+                        "Action::s3:GetObject*",
+                        "Action::s3:List*",
+                        "Action::s3:Abort*",
+                        NagRegex(regex="/^Resource::.*\\/\\*$/"),
+                    ],
+                ),
+            ],
+        )
+
+    def _embed_desired_state(self) -> None:
+        """Writes the stack's desired state to a file asset the function reads on each run."""
+        state = desired_state(top_level_stack(self))
+        directory = tempfile.mkdtemp(prefix="sso-desired-state")
+        path = os.path.join(directory, "desired-state.json")
+        with open(path, "w") as f:
+            json.dump(state, f, separators=(",", ":"), sort_keys=True)
+        self.desired_state_asset = s3_assets.Asset(self, "DesiredState", path=path)
+        self.desired_state_asset.grant_read(self.function)
+        self.function.add_environment("DESIRED_STATE_BUCKET", self.desired_state_asset.s3_bucket_name)
+        self.function.add_environment("DESIRED_STATE_KEY", self.desired_state_asset.s3_object_key)
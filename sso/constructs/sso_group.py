@@ -1,11 +1,15 @@
 import os
-from typing import Any, cast
+from typing import Any, Dict, Optional, Sequence, Union, cast
 
 from aws_cdk.aws_identitystore import CfnGroup, CfnGroupMembership
 from constructs import Construct
 
-from .. import SsoConfig
+from ..config import SsoEnvironment
+from .sso_group_members import SsoGroupMembers
+from .sso_logical_ids import SsoLogicalIds
+from .sso_shard_router import SsoShardRouter
 from .sso_user import SsoUser
+from .sso_user_batch import SsoBatchedUser
 
 dirname = os.path.dirname(__file__)
 
@@ -30,11 +34,14 @@ class SsoGroup(Construct):
         group = CfnGroup(
             self,
             id=id,
-            identity_store_id=SsoConfig.identity_store_id.value,
+            identity_store_id=SsoEnvironment.of(self).identity_store_id,
             description=description,
             display_name=group_name,
         )
         self.group_name = group_name  # provided by user
+        self._members: Optional[SsoGroupMembers] = None
+        # Every user this app adds to the group, by username, e.g. for AssignmentCompactor
+        self.member_users: Dict[str, Union[SsoUser, SsoBatchedUser]] = {}
         self.group_id = (
             group.attr_group_id
         )  # token that will resolve to string when deployed
@@ -52,19 +59,42 @@ class SsoGroup(Construct):
         super(SsoGroup, instance).__init__(scope, id)
         instance.group_name = group_name
         instance.group_id = group_id
+        instance._members = None
+        instance.member_users = {}
         return cast("SsoGroup", instance)
 
-    def add_user(self, user: SsoUser) -> None:
-        """Add user (class=SsoUser) to this group."""
-        CfnGroupMembership(
-            self,
-            id=f"GroupMember_{user.username}",
+    def add_user(self, user: Union[SsoUser, SsoBatchedUser]) -> None:
+        """
+        Add user (class=SsoUser or SsoBatchedUser) to this group. In a sharded stack, the
+        membership is created in the user's shard. With SsoLogicalIds, it gets a compact ID.
+        """
+        self.member_users[user.username] = user
+        id = f"GroupMember_{user.username}"
+        compact_id = SsoLogicalIds.compact_id(self, id, prefix="Member")
+        membership = CfnGroupMembership(
+            SsoShardRouter.route(self, user.username),
+            id=compact_id or id,
             group_id=self.group_id,
-            identity_store_id=SsoConfig.identity_store_id.value,
+            identity_store_id=SsoEnvironment.of(self).identity_store_id,
             member_id=CfnGroupMembership.MemberIdProperty(user_id=user.user_id),
         )
+        if compact_id is not None:
+            membership.override_logical_id(compact_id)
 
-    def add_users(self, users: list[SsoUser]) -> None:
-        """Add multiple users (class=SsoUser) to this group"""
+    def add_users(self, users: Sequence[Union[SsoUser, SsoBatchedUser]]) -> None:
+        """Add multiple users (class=SsoUser or SsoBatchedUser) to this group"""
+        for user in users:
+            self.add_user(user)
+
+    def add_members(self, users: Sequence[Union[SsoUser, SsoBatchedUser]]) -> None:
+        """
+        Add users (class=SsoUser or SsoBatchedUser) to this group's member set, which is
+        managed by a single Custom::SsoGroupMembers resource instead of one
+        CfnGroupMembership per user. Can be called repeatedly; all calls share the one
+        resource. Prefer this over add_users() for large groups.
+        """
+        if self._members is None:
+            self._members = SsoGroupMembers(self, "Members", group_id=self.group_id)
+        self._members.add_users(users)
         for user in users:
-            self.add_user(user)
\ No newline at end of file
+            self.member_users[user.username] = user
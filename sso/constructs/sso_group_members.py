@@ -0,0 +1,67 @@
+from typing import Any, Dict, List, Sequence, Union
+
+import jsii
+from aws_cdk import CustomResource, IListProducer, IResolveContext, Lazy
+from constructs import Construct
+
+from .sso_user import SsoUser
+from .sso_user_batch import SsoBatchedUser
+from .sso_user_provider import SsoUserProvider
+
+
+@jsii.implements(IListProducer)
+class _MemberUserIds:
+    """Produces the member user IDs at synth time, so users can be added after creation."""
+
+    def __init__(self, members: "SsoGroupMembers"):
+        self._members = members
+
+    def produce(self, context: IResolveContext) -> List[str]:
+        return [user.user_id for user in self._members.users]
+
+
+class SsoGroupMembers(Construct):
+    """
+    Manages the members of one group with a single Custom::SsoGroupMembers resource that
+    holds the full set of member user IDs, instead of one CfnGroupMembership per user.
+    The Lambda handler lists the group's current memberships once and only adds or
+    removes the difference, concurrently, so a change costs API calls in proportion to
+    the change rather than to the size of the group. Members added outside of this
+    resource are left alone.
+
+    Usually created through SsoGroup.add_members() rather than directly.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        *,
+        group_id: str,
+        users: Sequence[Union[SsoUser, SsoBatchedUser]] = (),
+        **kwargs: Any,
+    ):
+        super().__init__(scope, id)
+        self._users: Dict[str, Union[SsoUser, SsoBatchedUser]] = {}
+        provider = SsoUserProvider.get_or_create(self)
+        CustomResource(
+            self,
+            id="Resource",
+            resource_type="Custom::SsoGroupMembers",
+            service_token=provider.service_token,
+            properties={
+                "GroupId": group_id,
+                "MemberUserIds": Lazy.list(_MemberUserIds(self)),
+            },
+        )
+        self.add_users(users)
+
+    def add_users(self, users: Sequence[Union[SsoUser, SsoBatchedUser]]) -> None:
+        """Adds users to the member set. Adding the same user twice has no effect."""
+        for user in users:
+            self._users[user.username] = user
+
+    @property
+    def users(self) -> List[Union[SsoUser, SsoBatchedUser]]:
+        """All members, sorted by username so the template is stable across synths."""
+        return [self._users[username] for username in sorted(self._users)]
@@ -0,0 +1,155 @@
+import hashlib
+import json
+import os
+import re
+from typing import Dict, List, Optional, Set, cast
+
+from aws_cdk import Stack
+from constructs import Construct
+
+from .save_on_synth import save_on_synth
+from .sso_shard_router import top_level_stack
+
+# What CDK's makeUniqueId() leaves out of logical IDs: "Default" entirely, "Resource"
+# from the human-readable part only
+HIDDEN_ID = "Default"
+HIDDEN_FROM_HUMAN_ID = "Resource"
+MAX_HUMAN_LEN = 240
+MAX_ID_LEN = 255
+
+NON_ALPHANUMERIC = re.compile(r"[^A-Za-z0-9]")
+
+# Hex digits of a compact ID's hash: 48 bits, so a collision (which fails the synth) is
+# unlikely even with hundreds of thousands of resources
+HASH_LENGTH = 12
+
+
+def logical_id(*path: str) -> str:
+    """
+    The logical ID CDK gives a resource at this construct path below its stack, e.g.
+    logical_id("SsoGroup-Admins", "GroupMember_jdoe"). A port of CDK's makeUniqueId().
+    """
+    components = [component for component in path if component != HIDDEN_ID]
+    if not components:
+        raise ValueError("Unable to calculate a unique id for an empty set of components")
+    if len(components) == 1:
+        candidate = NON_ALPHANUMERIC.sub("", components[0])
+        if len(candidate) <= MAX_ID_LEN:
+            return candidate
+    path_hash = hashlib.md5("/".join(components).encode("utf-8")).hexdigest()[:8].upper()
+    human: List[str] = []
+    for component in components:
+        if not human or not human[-1].endswith(component):
+            human.append(component)
+    return (
+        "".join(NON_ALPHANUMERIC.sub("", component) for component in human if component != HIDDEN_FROM_HUMAN_ID)[
+            :MAX_HUMAN_LEN
+        ]
+        + path_hash
+    )
+
+
+def compact_logical_id(key: str, prefix: str) -> str:
+    return prefix + hashlib.sha256(key.encode("utf-8")).hexdigest()[:HASH_LENGTH].upper()
+
+
+class LogicalIdMap:
+    """
+    Logical IDs by key, the resource's construct path relative to its owner's stack with
+    its original (long) construct ID, e.g. "SsoGroup-Admins/GroupMember_jdoe". Keys in
+    the mapping file keep the logical ID recorded there, so resources that are already
+    deployed aren't replaced; new keys get a compact ID, a prefix and a hash of the key.
+    If the mapping file doesn't exist yet, every key is recorded with its original
+    logical ID, i.e. switching to compact IDs changes nothing that's in the app so far.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.existing: Optional[Dict[str, str]] = None
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self.existing = json.load(f)
+        # Keys allocated in this synth, i.e. what the mapping file is rewritten with
+        self.logical_ids: Dict[str, str] = {}
+        self._compact_ids: Set[str] = set()
+
+    def allocate(self, key: str, prefix: str, original_logical_id: str) -> Optional[str]:
+        """
+        The compact logical ID for key, or None if the resource keeps its original
+        construct ID and logical ID.
+        """
+        compact_id = compact_logical_id(key, prefix)
+        if self.existing is None:
+            recorded = original_logical_id
+        else:
+            recorded = self.existing.get(key, compact_id)
+        if key in self.logical_ids:
+            # Created twice, so it fails with the usual duplicate construct ID error
+            return None if recorded != compact_id else compact_id
+        self.logical_ids[key] = recorded
+        if recorded != compact_id:
+            return None
+        if compact_id in self._compact_ids:
+            raise ValueError(f"Compact logical ID {compact_id} of {key} collides with another key's")
+        self._compact_ids.add(compact_id)
+        return compact_id
+
+    def save(self) -> None:
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.logical_ids, f, indent=2, sort_keys=True, ensure_ascii=False)
+            f.write("\n")
+
+
+class SsoLogicalIds(Construct):
+    """
+    Opts a stack into short, stable logical IDs for group memberships and assignments,
+    instead of ones spelling out the group, user, permission set, and account names,
+    which can make up most of a large template's size. Names are tracked in a mapping
+    file (see LogicalIdMap), which is rewritten on every synth and should be committed
+    along with the app: resources recorded in it keep their logical ID, so turning this
+    on for a deployed stack doesn't replace anything, and only resources added afterwards
+    get compact IDs. To use compact IDs for everything, start with a file containing {}
+    before the first deploy.
+    """
+
+    ID = "SsoLogicalIds"
+
+    @classmethod
+    def get_or_create(cls, scope: Construct, *, mapping_file: str) -> "SsoLogicalIds":
+        """
+        Returns the top-level stack's SsoLogicalIds, creating it on first use. Call this
+        before adding any group members or granting any permission sets.
+        """
+        stack = top_level_stack(scope)
+        logical_ids = cast(Optional[SsoLogicalIds], stack.node.try_find_child(cls.ID))
+        if logical_ids is None:
+            logical_ids = SsoLogicalIds(stack, cls.ID, mapping_file=mapping_file)
+        elif logical_ids.map.path != mapping_file:
+            raise ValueError(
+                f"Stack {stack.stack_name} already uses the logical ID mapping file {logical_ids.map.path}"
+            )
+        return logical_ids
+
+    @classmethod
+    def find(cls, scope: Construct) -> Optional["SsoLogicalIds"]:
+        """The SsoLogicalIds of scope's top-level stack, or None if it doesn't use compact IDs."""
+        return cast(Optional[SsoLogicalIds], top_level_stack(scope).node.try_find_child(cls.ID))
+
+    @classmethod
+    def compact_id(cls, owner: Construct, id: str, *, prefix: str) -> Optional[str]:
+        """
+        The compact logical ID (also to be used as the construct ID) of owner's child
+        resource id, or None to create it as usual.
+        """
+        logical_ids = cls.find(owner)
+        if logical_ids is None:
+            return None
+        # The resource's path below its stack, as in SsoShardRouter.mirror()
+        stack_depth = len(Stack.of(owner).node.scopes)
+        path = [scope.node.id for scope in owner.node.scopes[stack_depth:]] + [id]
+        return logical_ids.map.allocate("/".join(path), prefix, logical_id(*path))
+
+    def __init__(self, scope: Construct, id: str, *, mapping_file: str) -> None:
+        super().__init__(scope, id)
+        self.map = LogicalIdMap(mapping_file)
+        save_on_synth(self, self.map.save)
@@ -0,0 +1,203 @@
+import hashlib
+import json
+import os
+from enum import Enum
+from importlib.metadata import version
+from typing import Any, Dict, List, Optional, Set, cast
+
+import jsii
+from aws_cdk import Aspects, CfnResource, IAspect, Stack
+from cdk_nag import AwsSolutionsChecks
+from constructs import Construct, IConstruct
+
+from .save_on_synth import save_on_synth
+from .sso_shard_router import top_level_stack
+
+# Resources the directory is made of: no AwsSolutions rule applies to them, so they're
+# skipped even in scopes that are checked
+NO_RULE_TYPES = frozenset(
+    {
+        "AWS::IdentityStore::Group",
+        "AWS::IdentityStore::GroupMembership",
+        "AWS::SSO::Assignment",
+        "AWS::SSO::PermissionSet",
+        "Custom::SsoAssignments",
+        "Custom::SsoGroupMembers",
+        "Custom::SsoPermissionSetProvisioning",
+        "Custom::SsoUser",
+        "Custom::SsoUserBatch",
+    }
+)
+
+# Annotations cdk-nag reports findings (and with log_ignores, suppressions) with
+ANNOTATION_TYPES = ("aws:cdk:error", "aws:cdk:warning", "aws:cdk:info")
+
+
+class NagMode(str, Enum):
+    """How SsoStack runs cdk-nag's AwsSolutionsChecks."""
+
+    # On every construct in the stack
+    FULL = "full"
+    # Only on the stack's infrastructure: SsoUserProvider, its Provider, SsoDriftDetector
+    SCOPED = "scoped"
+    OFF = "off"
+
+
+@jsii.implements(IAspect)
+class _NagChecks:
+    """
+    Runs checks on the resources of the scopes it's added to, skipping NO_RULE_TYPES.
+    Given a cache, each scope's findings are recorded under a hash of the resources in
+    it, and replayed instead of checking the scope again while that hash is unchanged.
+    """
+
+    def __init__(self, checks: AwsSolutionsChecks, cache: Optional["_NagCache"] = None):
+        self._checks = checks
+        self._cache = cache
+        # Paths of the scopes added with add_scope() -> their cache key, if not cached
+        self._scopes: Dict[str, Optional[str]] = {}
+        self._cached_scopes: Set[str] = set()
+
+    def add_scope(self, scope: Construct) -> None:
+        self._scopes[scope.node.path] = None
+        Aspects.of(scope).add(self)
+
+    def visit(self, node: IConstruct) -> None:
+        scope_path = self._scope_path(node)
+        if scope_path in self._cached_scopes:
+            return
+        if self._cache is not None and scope_path == node.node.path:
+            key = self._cache.key(node)
+            if self._cache.replay(key, node):
+                self._cached_scopes.add(scope_path)
+                return
+            self._scopes[scope_path] = key
+            self._cache.findings[key] = []
+        if not isinstance(node, CfnResource) or node.cfn_resource_type in NO_RULE_TYPES:
+            return
+        annotations = len(node.node.metadata)
+        self._checks.visit(node)
+        key = self._scopes.get(scope_path) if scope_path is not None else None
+        if self._cache is not None and key is not None:
+            self._cache.record(key, node, node.node.metadata[annotations:])
+
+    def _scope_path(self, node: IConstruct) -> Optional[str]:
+        for scope in reversed(node.node.scopes):
+            if scope.node.path in self._scopes:
+                return scope.node.path
+        return None
+
+
+class _NagCache:
+    """
+    Findings by scope hash, kept in a JSON file: only the scopes of the latest synth are
+    written back, so it doesn't grow.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._cached: Dict[str, List[List[str]]] = {}
+        if os.path.exists(path):
+            with open(path, encoding="utf-8") as f:
+                self._cached = json.load(f)
+        self.findings: Dict[str, List[List[str]]] = {}
+
+    @staticmethod
+    def key(scope: IConstruct) -> str:
+        """
+        A hash of everything rules look at in scope: each resource's type, path,
+        properties, and metadata (where suppressions go), the stack's suppressions, and
+        the cdk-nag version.
+        """
+        stack = Stack.of(scope)
+        resources = [
+            [
+                node.node.path,
+                node.cfn_resource_type,
+                stack.resolve(node._cfn_properties),
+                stack.resolve(node.cfn_options.metadata),
+            ]
+            for node in scope.node.find_all()
+            if isinstance(node, CfnResource)
+        ]
+        content = [version("cdk-nag"), stack.resolve(stack.template_options.metadata), resources]
+        return hashlib.sha256(json.dumps(content, sort_keys=True).encode("utf-8")).hexdigest()
+
+    def replay(self, key: str, scope: IConstruct) -> bool:
+        """Re-adds scope's findings if it's cached, returning whether it was."""
+        findings = self._cached.get(key)
+        if findings is None:
+            return False
+        nodes = {node.node.path: node for node in scope.node.find_all()}
+        for path, type, data in findings:
+            nodes[path].node.add_metadata(type, data)
+        self.findings[key] = findings
+        return True
+
+    def record(self, key: str, node: IConstruct, metadata: Any) -> None:
+        self.findings[key].extend(
+            [node.node.path, entry.type, entry.data] for entry in metadata if entry.type in ANNOTATION_TYPES
+        )
+
+    def save(self) -> None:
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump(self.findings, f, indent=1, sort_keys=True)
+            f.write("\n")
+
+
+class SsoNagChecks(Construct):
+    """
+    Runs cdk-nag's AwsSolutionsChecks on a stack in one of the NagModes. FULL visits every
+    construct, so nag's share of synth time grows with the directory, although none of
+    the users, groups, memberships, or assignments can have findings. SCOPED only checks
+    the infrastructure constructs register with check(), skipping NO_RULE_TYPES, so it
+    takes the same time however large the directory is; resources you add to the stack
+    yourself aren't checked unless you register them too.
+
+    With SCOPED, cache_file keeps each scope's findings between synths under a hash of
+    the scope's resources, and scopes that haven't changed aren't checked again. Cached
+    scopes don't make it into cdk-nag's CSV report, so reports are turned off.
+    """
+
+    ID = "SsoNagChecks"
+
+    @classmethod
+    def get_or_create(
+        cls, scope: Construct, *, mode: NagMode = NagMode.FULL, cache_file: Optional[str] = None
+    ) -> "SsoNagChecks":
+        """
+        Returns the top-level stack's SsoNagChecks, creating it on first use. Call this
+        before creating any constructs.
+        """
+        stack = top_level_stack(scope)
+        nag_checks = cast(Optional[SsoNagChecks], stack.node.try_find_child(cls.ID))
+        if nag_checks is None:
+            nag_checks = SsoNagChecks(stack, cls.ID, mode=mode, cache_file=cache_file)
+        elif nag_checks.mode != mode:
+            raise ValueError(f"Stack {stack.stack_name} already runs cdk-nag in {nag_checks.mode.value} mode")
+        return nag_checks
+
+    @classmethod
+    def check(cls, scope: Construct) -> None:
+        """
+        Registers infrastructure to check in SCOPED mode, e.g. a construct's Lambda
+        functions and IAM roles; does nothing otherwise.
+        """
+        nag_checks = cast(Optional[SsoNagChecks], top_level_stack(scope).node.try_find_child(cls.ID))
+        if nag_checks is not None and nag_checks.mode == NagMode.SCOPED:
+            cast(_NagChecks, nag_checks._aspect).add_scope(scope)
+
+    def __init__(self, scope: Construct, id: str, *, mode: NagMode, cache_file: Optional[str] = None) -> None:
+        super().__init__(scope, id)
+        if cache_file is not None and mode != NagMode.SCOPED:
+            raise ValueError("cache_file only works with NagMode.SCOPED")
+        self.mode = NagMode(mode)
+        self._aspect: Optional[_NagChecks] = None
+        if self.mode == NagMode.FULL:
+            Aspects.of(scope).add(AwsSolutionsChecks())
+        elif self.mode == NagMode.SCOPED:
+            cache = None
+            if cache_file is not None:
+                cache = _NagCache(cache_file)
+                save_on_synth(self, cache.save)
+            self._aspect = _NagChecks(AwsSolutionsChecks(reports=cache is None), cache)
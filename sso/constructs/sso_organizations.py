@@ -0,0 +1,234 @@
+import json
+import os
+import re
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Union, cast
+
+try:
+    import fcntl
+except ImportError:  # Windows: writes are still atomic, but concurrent ones can drop entries
+    fcntl = None  # type: ignore[assignment]
+
+from aws_cdk import Annotations
+from constructs import Construct
+
+from .sso_shard_router import top_level_stack
+
+# An organizational unit, or the organization's root
+OU_ID_PATTERN = re.compile(r"^(ou-[0-9a-z]{4,32}-[a-z0-9]{8,32}|r-[0-9a-z]{4,32})$")
+
+# Where the CDK CLI keeps context values, e.g. the results of lookups; synth runs in the
+# project directory, so relative to it
+CONTEXT_FILE = "cdk.context.json"
+
+# Context keys: cached accounts are stored under "<prefix>:<ou_id>:recursive" (or
+# ":direct"); the other two are meant to be set on the command line with -c
+CONTEXT_KEY_PREFIX = "sso:organizations:accounts"
+REFRESH_CONTEXT_KEY = "sso:organizations:refresh"
+FIXTURE_CONTEXT_KEY = "sso:organizations:fixture"
+
+
+class OrganizationsSource(ABC):
+    """Where SsoOrganizations looks up the accounts in an OU that aren't cached yet."""
+
+    @abstractmethod
+    def list_accounts(self, parent_id: str) -> List[str]:
+        """IDs of the active accounts directly in parent_id."""
+
+    @abstractmethod
+    def list_organizational_units(self, parent_id: str) -> List[str]:
+        """IDs of the OUs directly in parent_id."""
+
+    def accounts_for_ou(self, ou_id: str, *, recursive: bool = True) -> List[str]:
+        """Account IDs in ou_id, and with recursive, in the OUs below it; sorted."""
+        account_ids: List[str] = []
+        parent_ids = [ou_id]
+        while parent_ids:
+            parent_id = parent_ids.pop()
+            account_ids.extend(self.list_accounts(parent_id))
+            if recursive:
+                parent_ids.extend(self.list_organizational_units(parent_id))
+        return sorted(set(account_ids))
+
+
+class OrganizationsApi(OrganizationsSource):
+    """
+    Looks accounts up with the AWS Organizations API, using the credentials synth runs
+    with, which need organizations:ListAccountsForParent and
+    organizations:ListOrganizationalUnitsForParent in the management account (or a
+    delegated administrator). Suspended accounts are left out.
+    """
+
+    def __init__(self, client: Any = None):
+        self._client = client
+
+    @property
+    def client(self) -> Any:
+        if self._client is None:
+            # Only needed when the cache misses, so synth doesn't depend on boto3 otherwise
+            import boto3
+
+            self._client = boto3.client("organizations")
+        return self._client
+
+    def list_accounts(self, parent_id: str) -> List[str]:
+        paginator = self.client.get_paginator("list_accounts_for_parent")
+        return [
+            account["Id"]
+            for page in paginator.paginate(ParentId=parent_id)
+            for account in page["Accounts"]
+            if account.get("Status", "ACTIVE") == "ACTIVE"
+        ]
+
+    def list_organizational_units(self, parent_id: str) -> List[str]:
+        paginator = self.client.get_paginator("list_organizational_units_for_parent")
+        return [ou["Id"] for page in paginator.paginate(ParentId=parent_id) for ou in page["OrganizationalUnits"]]
+
+
+class OrganizationsFixture(OrganizationsSource):
+    """
+    A stand-in for the Organizations API, for tests and offline synth: a mapping (or a
+    JSON file of one) from each parent ID to its active accounts and child OUs, e.g.
+    {"ou-ab12-prod0001": {"accounts": ["123456789012"], "organizational_units": [...]}}.
+    Parents that aren't listed are empty.
+    """
+
+    def __init__(self, organization: Union[str, Mapping[str, Mapping[str, List[str]]]]):
+        if isinstance(organization, str):
+            with open(organization, encoding="utf-8") as f:
+                organization = cast(Mapping[str, Mapping[str, List[str]]], json.load(f))
+        self.organization = organization
+        # Lookups made, so tests can check what was served from the cache
+        self.lookups: List[str] = []
+
+    def list_accounts(self, parent_id: str) -> List[str]:
+        self.lookups.append(parent_id)
+        return list(self.organization.get(parent_id, {}).get("accounts", []))
+
+    def list_organizational_units(self, parent_id: str) -> List[str]:
+        return list(self.organization.get(parent_id, {}).get("organizational_units", []))
+
+
+class SsoOrganizations(Construct):
+    """
+    Resolves organizational units to the accounts in them at synth time, for
+    SsoPermissionSet.grant_to_group_for_ou() and grant_to_user_for_ou(). Results are
+    cached in cdk.context.json, like CDK's own lookups, so only the first synth after
+    granting an OU calls the Organizations API, and later synths (and CI) run offline
+    from the committed file.
+
+    The cache isn't refreshed by itself: to pick up accounts added to or removed from an
+    OU, synth with -c sso:organizations:refresh=true, which looks every OU up again and
+    rewrites its entry, or drop entries with cdk context --reset <key>. The assignments
+    then follow on the next deploy. With -c sso:organizations:fixture=<file>, lookups
+    are served from an OrganizationsFixture instead of the API, and aren't cached.
+    """
+
+    ID = "SsoOrganizations"
+
+    @classmethod
+    def get_or_create(
+        cls,
+        scope: Construct,
+        *,
+        source: Optional[OrganizationsSource] = None,
+        context_file: str = CONTEXT_FILE,
+    ) -> "SsoOrganizations":
+        """Returns the top-level stack's SsoOrganizations, creating it on first use."""
+        stack = top_level_stack(scope)
+        organizations = cast(Optional[SsoOrganizations], stack.node.try_find_child(cls.ID))
+        if organizations is None:
+            organizations = SsoOrganizations(stack, cls.ID, source=source, context_file=context_file)
+        elif source is not None and source is not organizations._source:
+            raise ValueError(f"Stack {stack.stack_name} already resolves OUs with another source")
+        return organizations
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        *,
+        source: Optional[OrganizationsSource] = None,
+        context_file: str = CONTEXT_FILE,
+    ) -> None:
+        super().__init__(scope, id)
+        self._source = source
+        self.context_file = context_file
+        self.refresh = str(self.node.try_get_context(REFRESH_CONTEXT_KEY)).lower() == "true"
+        # Keys looked up in this synth, so refresh looks each up only once
+        self._resolved: Dict[str, List[str]] = {}
+
+    @property
+    def source(self) -> OrganizationsSource:
+        if self._source is None:
+            fixture = self.node.try_get_context(FIXTURE_CONTEXT_KEY)
+            self._source = OrganizationsFixture(fixture) if fixture else OrganizationsApi()
+        return self._source
+
+    @staticmethod
+    def context_key(ou_id: str, *, recursive: bool = True) -> str:
+        return f"{CONTEXT_KEY_PREFIX}:{ou_id}:{'recursive' if recursive else 'direct'}"
+
+    def accounts_for_ou(self, ou_id: str, *, recursive: bool = True) -> List[str]:
+        """
+        IDs of the accounts in ou_id (and with recursive, in the OUs below it), from the
+        cache if they're in it, else looked up and cached.
+        """
+        if not OU_ID_PATTERN.match(ou_id):
+            raise ValueError(f"{ou_id} is neither an organizational unit ID (ou-...) nor a root ID (r-...)")
+        key = self.context_key(ou_id, recursive=recursive)
+        if key in self._resolved:
+            return self._resolved[key]
+        account_ids: Optional[List[str]] = None
+        if not self.refresh:
+            # The CLI passes cdk.context.json in as context; an app run directly (or a
+            # test) reads it itself
+            account_ids = self.node.try_get_context(key)
+            if account_ids is None:
+                account_ids = self._read_context_file().get(key)
+        if account_ids is None:
+            account_ids = self.source.accounts_for_ou(ou_id, recursive=recursive)
+            # A fixture's accounts aren't the organization's, so they mustn't end up in
+            # the committed cache that later real synths read
+            if not isinstance(self.source, OrganizationsFixture):
+                self._write_context_file(key, account_ids)
+                Annotations.of(self).add_info(
+                    f"Looked up {len(account_ids)} accounts in {ou_id}; cached in {self.context_file} as {key}"
+                )
+        if not account_ids:
+            Annotations.of(self).add_warning(f"Organizational unit {ou_id} has no active accounts to grant access to")
+        self._resolved[key] = list(account_ids)
+        return self._resolved[key]
+
+    def _read_context_file(self) -> Dict[str, Any]:
+        if not os.path.exists(self.context_file):
+            return {}
+        with open(self.context_file, encoding="utf-8") as f:
+            return cast(Dict[str, Any], json.load(f))
+
+    @contextmanager
+    def _context_file_lock(self) -> Iterator[None]:
+        """Serializes writers, e.g. parallel_synth's workers, each looking up OUs."""
+        if fcntl is None:
+            yield
+            return
+        with open(f"{self.context_file}.lock", "a") as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_context_file(self, key: str, account_ids: List[str]) -> None:
+        with self._context_file_lock():
+            # Re-read under the lock so other entries (written by the CLI or another
+            # worker since) are kept
+            context = self._read_context_file()
+            context[key] = account_ids
+            # Replaced rather than rewritten, so readers never see a partial file
+            temporary = f"{self.context_file}.{os.getpid()}.tmp"
+            with open(temporary, "w", encoding="utf-8") as f:
+                json.dump(context, f, indent=2)
+                f.write("\n")
+            os.replace(temporary, self.context_file)
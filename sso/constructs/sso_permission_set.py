@@ -1,17 +1,81 @@
 import os
-from typing import Optional, Union, Sequence, Dict, Any
+from typing import Optional, Union, Sequence, Dict, Any, List, Set, Tuple, cast
 
-from aws_cdk import IResolvable
+from aws_cdk import CfnResource, IResolvable
 from aws_cdk.aws_sso import CfnAssignment, CfnPermissionSet
 from constructs import Construct
 
-from ..config import SsoConfig
+from ..config import SsoEnvironment
+from .sso_assignments import SsoAssignments
 from .sso_group import SsoGroup
+from .sso_logical_ids import SsoLogicalIds
+from .sso_organizations import SsoOrganizations
+from .sso_permission_set_provisioning import SsoPermissionSetProvisioning
+from .sso_shard_router import SsoShardRouter
 from .sso_user import SsoUser
+from .sso_user_batch import SsoBatchedUser
 
 dirname = os.path.dirname(__file__)
 
 
+class SsoGrant:
+    """
+    One grant made through an SsoPermissionSet's grant_*() methods: either a CfnAssignment
+    or an entry in an SsoAssignments matrix. Kept so grants can be analyzed at synth time,
+    e.g. by AssignmentCompactor.
+    """
+
+    def __init__(
+        self,
+        *,
+        permission_set: "SsoPermissionSet",
+        principal_type: str,
+        principal: Union[SsoGroup, SsoUser, SsoBatchedUser],
+        account_id: str,
+        assignment: Optional[CfnAssignment] = None,
+        assignments: Optional[SsoAssignments] = None,
+    ):
+        self.permission_set = permission_set
+        self.principal_type = principal_type
+        self.principal = principal
+        self.account_id = account_id
+        self.assignment = assignment
+        self.assignments = assignments
+
+    @property
+    def principal_name(self) -> str:
+        if isinstance(self.principal, SsoGroup):
+            return self.principal.group_name
+        return self.principal.username
+
+    def __str__(self) -> str:
+        return (
+            f"{self.permission_set.permission_set_name} to {self.principal_type.lower()} "
+            f"{self.principal_name} for {self.account_id}"
+        )
+
+    def remove(self) -> None:
+        """Takes the grant back out of the app."""
+        self.permission_set.grants.remove(self)
+        # An SsoAssignments matrix holds each assignment once, however often it's granted
+        if self.assignments is not None and not any(
+            grant.assignments is self.assignments and grant._matrix_key() == self._matrix_key()
+            for grant in self.permission_set.grants
+        ):
+            self.assignments.remove(
+                permission_set_name=self.permission_set.permission_set_name,
+                principal_type=self.principal_type,
+                principal_name=self.principal_name,
+                account_id=self.account_id,
+            )
+        if self.assignment is not None:
+            self.permission_set._forget_assignment(self.assignment)
+            self.assignment.node.scope.node.try_remove_child(self.assignment.node.id)
+
+    def _matrix_key(self) -> Tuple[str, str, str]:
+        return (self.principal_type, self.principal_name, self.account_id)
+
+
 class SsoPermissionSet(Construct):
     def __init__(self, scope: Construct, *,
         name: str,
@@ -22,16 +86,21 @@ class SsoPermissionSet(Construct):
         permissions_boundary: Optional[Union[IResolvable, Union[CfnPermissionSet.PermissionsBoundaryProperty, Dict[str, Any]]]] = None,
         relay_state_type: Optional[str] = None,
         session_duration: Optional[str] = None,
+        targeted_provisioning: bool = False,
     ):
         """
         Instantiate a new permission set. If a permission set already exists and you just
         want to use that, use the SsoPermissionSet.from_existing_permission_set() class method
+
+        With targeted_provisioning=True, policy changes are re-provisioned in parallel to
+        just the accounts this app assigns the permission set in (see
+        SsoPermissionSetProvisioning).
         """
         id = "SsoPermissionSet_" + name
         super().__init__(scope, id)
 
         permission_set = CfnPermissionSet(self, id=id,
-            name=name, instance_arn=SsoConfig.instance_arn.value,
+            name=name, instance_arn=SsoEnvironment.of(self).instance_arn,
             customer_managed_policy_references=customer_managed_policy_references,
             description=description,
             inline_policy=inline_policy,
@@ -42,6 +111,16 @@ class SsoPermissionSet(Construct):
         )
         self.permission_set_name = name
         self.permission_set_arn = permission_set.attr_permission_set_arn
+        self.assigned_account_ids: Set[str] = set()
+        self.grants: List[SsoGrant] = []
+        self._provisioning: Optional[SsoPermissionSetProvisioning] = None
+        if targeted_provisioning:
+            self._provisioning = SsoPermissionSetProvisioning(
+                self,
+                "Provisioning",
+                permission_set=permission_set,
+                account_ids=self.assigned_account_ids,
+            )
 
     @classmethod
     def from_existing_permission_set(
@@ -60,56 +139,180 @@ class SsoPermissionSet(Construct):
         super(SsoPermissionSet, instance).__init__(scope, id)
         instance.permission_set_name = permission_set_name
         instance.permission_set_arn = permission_set_arn
+        instance.assigned_account_ids = set()
+        instance.grants = []
+        instance._provisioning = None
         return instance
 
-    def grant_to_group_for_account(self, group: SsoGroup, account_id: str):
+    def _record_assignment(
+        self,
+        principal_type: str,
+        principal: Union[SsoGroup, SsoUser, SsoBatchedUser],
+        account_id: str,
+        *,
+        assignment: Optional[CfnAssignment] = None,
+        assignments: Optional[SsoAssignments] = None,
+    ) -> None:
+        """Indexes grants, and the accounts this permission set is assigned in for provisioning."""
+        self.grants.append(
+            SsoGrant(
+                permission_set=self,
+                principal_type=principal_type,
+                principal=principal,
+                account_id=account_id,
+                assignment=assignment,
+                assignments=assignments,
+            )
+        )
+        self.assigned_account_ids.add(account_id)
+        if self._provisioning is None:
+            return
+        # First-time assignments provision the permission set themselves. CfnAssignments
+        # are depended on directly so the dependency can be removed with the assignment.
+        if assignment is not None:
+            self._provisioning_resource().add_dependency(assignment)
+        else:
+            self._provisioning.node.add_dependency(assignments)
+
+    def _forget_assignment(self, assignment: CfnAssignment) -> None:
+        if self._provisioning is None:
+            return
+        resource = self._provisioning_resource()
+        resource.remove_dependency(assignment)
+        # Across nested stacks that removes the dependency on the whole shard, which other
+        # assignments may still be in
+        for grant in self.grants:
+            if grant.assignment is not None and grant.assignment is not assignment:
+                resource.add_dependency(grant.assignment)
+
+    def _provisioning_resource(self) -> CfnResource:
+        return cast(CfnResource, cast(Construct, self._provisioning).resource.node.default_child)
+
+    def grant_to_group_for_account(
+        self, group: SsoGroup, account_id: str, *, assignments: Optional[SsoAssignments] = None
+    ):
         """
         Allow members of the provided group to use this permission set for given account ID.
+        In a sharded stack, the assignment is created in the group's shard, and with
+        SsoLogicalIds, it gets a compact ID. If assignments is given, the assignment is
+        added to that matrix instead of creating a CfnAssignment.
         """
-        CfnAssignment(
-            self,
-            id="Assign_"
-            + self.permission_set_name
-            + "_toGroup_"
-            + group.group_name
-            + "_for_"
-            + account_id,
-            instance_arn=SsoConfig.instance_arn.value,
+        if assignments is not None:
+            assignments.add(
+                permission_set_name=self.permission_set_name,
+                permission_set_arn=self.permission_set_arn,
+                principal_type="GROUP",
+                principal_name=group.group_name,
+                principal_id=group.group_id,
+                account_id=account_id,
+            )
+            self._record_assignment("GROUP", group, account_id, assignments=assignments)
+            return
+        id = "Assign_" + self.permission_set_name + "_toGroup_" + group.group_name + "_for_" + account_id
+        compact_id = SsoLogicalIds.compact_id(self, id, prefix="Assign")
+        assignment = CfnAssignment(
+            SsoShardRouter.route(self, group.group_name),
+            id=compact_id or id,
+            instance_arn=SsoEnvironment.of(self).instance_arn,
             permission_set_arn=self.permission_set_arn,
             principal_id=group.group_id,
             principal_type="GROUP",
             target_id=account_id,
             target_type="AWS_ACCOUNT",
         )
+        if compact_id is not None:
+            assignment.override_logical_id(compact_id)
+        self._record_assignment("GROUP", group, account_id, assignment=assignment)
 
-    # def grantToGroupForAccounts(self, group: SsoGroup, account_ids: list[str]):
-    #     """
-    #     Allow members of the provided group to use this permission set for one or more account IDs.
-    #     """
-    #     for account_id in account_ids:
-    #         self.grantToUserForAccount(group, account_id)
+    def grant_to_group_for_accounts(
+        self,
+        group: SsoGroup,
+        account_ids: Sequence[str],
+        *,
+        assignments: Optional[SsoAssignments] = None,
+    ):
+        """
+        Allow members of the provided group to use this permission set for one or more account IDs.
+        For many accounts, pass assignments so they are provisioned concurrently.
+        """
+        for account_id in account_ids:
+            self.grant_to_group_for_account(group, account_id, assignments=assignments)
 
-    def grant_to_user_for_account(self, user: SsoUser, account_id: str):
+    def grant_to_group_for_ou(
+        self,
+        group: SsoGroup,
+        ou_id: str,
+        *,
+        recursive: bool = True,
+        assignments: Optional[SsoAssignments] = None,
+    ):
+        """
+        Allow members of the provided group to use this permission set for every account
+        in an organizational unit, and with recursive, in the OUs below it. The accounts
+        are resolved at synth time and cached in cdk.context.json (see SsoOrganizations).
+        """
+        account_ids = SsoOrganizations.get_or_create(self).accounts_for_ou(ou_id, recursive=recursive)
+        self.grant_to_group_for_accounts(group, account_ids, assignments=assignments)
+
+    def grant_to_user_for_account(
+        self,
+        user: Union[SsoUser, SsoBatchedUser],
+        account_id: str,
+        *,
+        assignments: Optional[SsoAssignments] = None,
+    ):
         """
         Assign a permission set to a specific user for a specific account.
         Best practice is to use group-based access over individual user assignments.
+        In a sharded stack, the assignment is created in the user's shard, and with
+        SsoLogicalIds, it gets a compact ID. If assignments is given, the assignment is
+        added to that matrix instead of creating a CfnAssignment.
         """
-        CfnAssignment(
-            self,
-            id="Assign_"
-            + self.permission_set_name
-            + "_toUser_"
-            + user.username
-            + "_for_"
-            + account_id,
-            instance_arn=SsoConfig.instance_arn.value,
+        if assignments is not None:
+            assignments.add(
+                permission_set_name=self.permission_set_name,
+                permission_set_arn=self.permission_set_arn,
+                principal_type="USER",
+                principal_name=user.username,
+                principal_id=user.user_id,
+                account_id=account_id,
+            )
+            self._record_assignment("USER", user, account_id, assignments=assignments)
+            return
+        id = "Assign_" + self.permission_set_name + "_toUser_" + user.username + "_for_" + account_id
+        compact_id = SsoLogicalIds.compact_id(self, id, prefix="Assign")
+        assignment = CfnAssignment(
+            SsoShardRouter.route(self, user.username),
+            id=compact_id or id,
+            instance_arn=SsoEnvironment.of(self).instance_arn,
             permission_set_arn=self.permission_set_arn,
             principal_id=user.user_id,
             principal_type="USER",
             target_id=account_id,
             target_type="AWS_ACCOUNT",
         )
+        if compact_id is not None:
+            assignment.override_logical_id(compact_id)
+        self._record_assignment("USER", user, account_id, assignment=assignment)
 
-    def grant_to_user_for_accounts(self, user: SsoUser, account_ids: list[str]):
+    def grant_to_user_for_accounts(
+        self,
+        user: Union[SsoUser, SsoBatchedUser],
+        account_ids: list[str],
+        *,
+        assignments: Optional[SsoAssignments] = None,
+    ):
         for account_id in account_ids:
-            self.grant_to_user_for_account(user, account_id)
\ No newline at end of file
+            self.grant_to_user_for_account(user, account_id, assignments=assignments)
+
+    def grant_to_user_for_ou(
+        self,
+        user: Union[SsoUser, SsoBatchedUser],
+        ou_id: str,
+        *,
+        recursive: bool = True,
+        assignments: Optional[SsoAssignments] = None,
+    ):
+        """Like grant_to_group_for_ou(), for a single user."""
+        account_ids = SsoOrganizations.get_or_create(self).accounts_for_ou(ou_id, recursive=recursive)
+        self.grant_to_user_for_accounts(user, account_ids, assignments=assignments)
@@ -0,0 +1,78 @@
+import hashlib
+import json
+from typing import Any, List, Set
+
+import jsii
+from aws_cdk import CustomResource, IListProducer, IResolveContext, IStringProducer, Lazy, Stack
+from aws_cdk.aws_sso import CfnPermissionSet
+from constructs import Construct
+
+from .sso_user_provider import SsoUserProvider
+
+
+@jsii.implements(IStringProducer)
+class _PolicyHash:
+    """Hash of the permission set's resolved policies, so any policy edit changes it."""
+
+    def __init__(self, permission_set: CfnPermissionSet):
+        self._permission_set = permission_set
+
+    def produce(self, context: IResolveContext) -> str:
+        permission_set = self._permission_set
+        policies = Stack.of(permission_set).resolve(
+            {
+                "InlinePolicy": permission_set.inline_policy,
+                "ManagedPolicies": permission_set.managed_policies,
+                "CustomerManagedPolicyReferences": permission_set.customer_managed_policy_references,
+                "PermissionsBoundary": permission_set.permissions_boundary,
+                "SessionDuration": permission_set.session_duration,
+                "RelayStateType": permission_set.relay_state_type,
+            }
+        )
+        return hashlib.sha256(json.dumps(policies, sort_keys=True).encode()).hexdigest()
+
+
+@jsii.implements(IListProducer)
+class _AccountIds:
+    def __init__(self, account_ids: Set[str]):
+        self._account_ids = account_ids
+
+    def produce(self, context: IResolveContext) -> List[str]:
+        return sorted(self._account_ids)
+
+
+class SsoPermissionSetProvisioning(Construct):
+    """
+    Re-provisions a permission set to the accounts it's assigned in whenever its policies
+    change, with a Custom::SsoPermissionSetProvisioning resource. The accounts come from
+    the assignments made through SsoPermissionSet's grant_*() methods in this app, so a
+    policy edit is only pushed to where the permission set is actually used. The Lambda
+    handler provisions every account at once, polls their status together, and reports
+    per-account provisioning latency in its logs (and p50/max in the resource's
+    ProvisionedAccounts and ProvisioningLatencyMs attributes).
+
+    Created by SsoPermissionSet(targeted_provisioning=True) rather than directly.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        *,
+        permission_set: CfnPermissionSet,
+        account_ids: Set[str],
+        **kwargs: Any,
+    ):
+        super().__init__(scope, id)
+        provider = SsoUserProvider.get_or_create(self)
+        self.resource = CustomResource(
+            self,
+            id="Resource",
+            resource_type="Custom::SsoPermissionSetProvisioning",
+            service_token=provider.service_token,
+            properties={
+                "PermissionSetArn": permission_set.attr_permission_set_arn,
+                "AccountIds": Lazy.list(_AccountIds(account_ids)),
+                "PolicyHash": Lazy.string(_PolicyHash(permission_set)),
+            },
+        )
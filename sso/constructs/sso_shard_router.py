@@ -0,0 +1,102 @@
+import zlib
+from typing import Dict, List, Optional, cast
+
+from aws_cdk import NestedStack, Stack
+from constructs import Construct
+
+
+class SsoShardRouter(Construct):
+    """
+    Spreads users, group memberships, and assignments over shard_count nested stacks, so
+    large directories stay within CloudFormation's per-stack resource and template size
+    limits, and CloudFormation can deploy the shards concurrently.
+
+    Resources are assigned to a shard by a stable hash of a key: the username for users,
+    their group memberships, and their assignments, and the group name for group
+    assignments. A user's memberships and assignments therefore land in the same shard as
+    the user, so the user ID never crosses a stack boundary. References that do cross
+    (group IDs, permission set ARNs, the provider's service token) are passed from the
+    parent stack as nested stack parameters by CDK.
+
+    Adding or removing users never moves other resources between shards, but changing
+    shard_count moves most of them, and moving an SsoUser deletes and recreates the user.
+    Enable sharding (and pick shard_count with headroom) before the first deploy.
+    """
+
+    ID = "SsoShards"
+
+    @classmethod
+    def get_or_create(cls, scope: Construct, *, shard_count: int) -> "SsoShardRouter":
+        """
+        Returns the top-level stack's router, creating it on first use. Call this before
+        creating any SsoUser, SsoGroup membership, or assignment that should be sharded.
+        """
+        stack = top_level_stack(scope)
+        router = cast(Optional[SsoShardRouter], stack.node.try_find_child(cls.ID))
+        if router is None:
+            router = SsoShardRouter(stack, cls.ID, shard_count=shard_count)
+        elif router.shard_count != shard_count:
+            raise ValueError(
+                f"Stack {stack.stack_name} is already sharded {router.shard_count} ways, "
+                f"not {shard_count}"
+            )
+        return router
+
+    @classmethod
+    def find(cls, scope: Construct) -> Optional["SsoShardRouter"]:
+        """The router of scope's top-level stack, or None if it isn't sharded."""
+        return cast(
+            Optional[SsoShardRouter], top_level_stack(scope).node.try_find_child(cls.ID)
+        )
+
+    @classmethod
+    def route(cls, owner: Construct, key: str) -> Construct:
+        """
+        Scope in which to create a resource that belongs to owner (e.g. a membership of an
+        SsoGroup). If the stack is sharded, that's a construct in key's shard mirroring
+        owner's path, so construct IDs stay unique. Otherwise it's owner itself.
+        """
+        router = cls.find(owner)
+        if router is None or Stack.of(owner).node.path != Stack.of(router).node.path:
+            # Not sharded, or the caller already put owner in a nested stack of their own
+            return owner
+        return router.mirror(owner, router.shard(router.shard_for_key(key)))
+
+    def __init__(self, scope: Construct, id: str, *, shard_count: int) -> None:
+        super().__init__(scope, id)
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+        self.shard_count = shard_count
+        self._shards: Dict[int, NestedStack] = {}
+
+    def shard_for_key(self, key: str) -> int:
+        """Stable across synths and Python versions, unlike the builtin hash()."""
+        return zlib.crc32(key.encode("utf-8")) % self.shard_count
+
+    def shard(self, shard_number: int) -> NestedStack:
+        """The nested stack for shard_number, created on first use."""
+        if shard_number not in self._shards:
+            self._shards[shard_number] = NestedStack(self, f"Shard{shard_number}")
+        return self._shards[shard_number]
+
+    @property
+    def shards(self) -> List[NestedStack]:
+        """Shards that hold at least one resource, in shard order."""
+        return [self._shards[shard_number] for shard_number in sorted(self._shards)]
+
+    def mirror(self, owner: Construct, shard: NestedStack) -> Construct:
+        """The construct at owner's path (relative to its stack) inside shard."""
+        scope: Construct = shard
+        owner_stack_depth = len(Stack.of(owner).node.scopes)
+        for owner_scope in owner.node.scopes[owner_stack_depth:]:
+            id = owner_scope.node.id
+            scope = scope.node.try_find_child(id) or Construct(scope, id)
+        return scope
+
+
+def top_level_stack(scope: Construct) -> Stack:
+    """The stack that scope is in, or the outermost parent of a nested stack."""
+    stack = Stack.of(scope)
+    while stack.nested_stack_parent is not None:
+        stack = stack.nested_stack_parent
+    return stack
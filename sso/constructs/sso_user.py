@@ -4,6 +4,7 @@ from typing import Any, TypedDict
 from aws_cdk import CustomResource
 from constructs import Construct
 
+from .sso_shard_router import SsoShardRouter
 from .sso_user_provider import SsoUserProvider
 
 dirname = os.path.dirname(__file__)
@@ -23,6 +24,9 @@ class SsoUser(Construct):
     AWS CloudFormation (and thus CDK) does not support creation of users natively.
     This construct only supports a handful of the attributes actually available for users and can
     be extended if needed.
+
+    If the stack is sharded with SsoShardRouter, the user is created in its shard's nested
+    stack rather than in scope.
     """
 
     def __init__(
@@ -34,7 +38,7 @@ class SsoUser(Construct):
     ):
         print(user_attributes)
         id = "SsoUser-" + user_attributes["username"]
-        super().__init__(scope, id)
+        super().__init__(SsoShardRouter.route(scope, user_attributes["username"]), id)
         provider = SsoUserProvider.get_or_create(self)
         user = CustomResource(
             self,
@@ -47,6 +51,7 @@ class SsoUser(Construct):
         self._arn = user.get_att_string("Arn")
         self._email = user_attributes["email"]
         self._username = user_attributes["username"]
+        self._attributes = user_attributes
 
     @property
     def user_id(self):
@@ -73,6 +78,13 @@ class SsoUser(Construct):
         """
         return self._email
 
+    @property
+    def attributes(self) -> SsoUserAttributes:
+        """
+        The attributes the user is created with.
+        """
+        return self._attributes
+
     @property
     def username(self):
         """
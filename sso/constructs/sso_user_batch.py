@@ -0,0 +1,166 @@
+import json
+import zlib
+from typing import Any, Dict, List, Optional, Sequence
+
+from aws_cdk import CustomResource
+from constructs import Construct
+
+from ..config import SsoEnvironment
+from .sso_user import SsoUserAttributes
+from .sso_user_provider import SsoUserProvider
+
+# CloudFormation rejects custom resource responses larger than 4096 bytes. The
+# Provider framework adds its own fields (RequestId, StackId, etc.) to the response,
+# and the handler adds identitystore API stats, so we keep the per-user attributes
+# well under that.
+MAX_RESPONSE_DATA_BYTES = 2500
+
+# identitystore user IDs look like "xxxxxxxxxx-xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx"
+MAX_USER_ID_LENGTH = 47
+
+
+class SsoBatchedUser:
+    """
+    A single user managed by an SsoUserBatch. Exposes the same properties as SsoUser, so
+    it can be passed anywhere an SsoUser is accepted (e.g. SsoGroup.add_user() or
+    SsoPermissionSet.grant_to_user_for_account()).
+    """
+
+    def __init__(
+        self,
+        *,
+        user_id: str,
+        user_arn: str,
+        email: str,
+        username: str,
+        attributes: Optional[SsoUserAttributes] = None,
+    ):
+        self._user_id = user_id
+        self._arn = user_arn
+        self._email = email
+        self._username = username
+        self._attributes = attributes
+
+    @property
+    def user_id(self):
+        """Token that resolves to the identity store user ID once deployed."""
+        return self._user_id
+
+    @property
+    def user_arn(self):
+        """Token that resolves to the identity store user ARN once deployed."""
+        return self._arn
+
+    @property
+    def email(self):
+        """The user's email address."""
+        return self._email
+
+    @property
+    def username(self):
+        """The user's username for logging in to SSO."""
+        return self._username
+
+    @property
+    def attributes(self) -> Optional[SsoUserAttributes]:
+        """The attributes the user is created with, if known."""
+        return self._attributes
+
+
+class SsoUserBatch(Construct):
+    """
+    Manages many SSO users with a single Custom::SsoUserBatch resource instead of one
+    Custom::SsoUser resource per user. The Lambda handler diffs the old and new user lists
+    and only creates, updates, or deletes the users that actually changed.
+
+    Each user's ID is returned as a separate attribute of the custom resource, and
+    CloudFormation limits custom resource responses to 4KB. That caps a single resource
+    at roughly 30-50 users depending on username length, so larger batches must be
+    spread over several resources with shard_count. Users are assigned to shards by a
+    stable hash of their username, so adding or removing users never moves other users
+    between shards. Changing shard_count does move users, so pick a value with headroom.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        *,
+        batch_name: str,
+        users: Sequence[SsoUserAttributes],
+        shard_count: int = 1,
+        **kwargs: Any,
+    ):
+        id = "SsoUserBatch-" + batch_name
+        super().__init__(scope, id)
+        sso_environment = SsoEnvironment.of(self)
+        if shard_count < 1:
+            raise ValueError("shard_count must be at least 1")
+
+        shards: List[List[SsoUserAttributes]] = [[] for _ in range(shard_count)]
+        for user_attributes in users:
+            shards[self.shard_for_username(user_attributes["username"], shard_count)].append(
+                user_attributes
+            )
+
+        provider = SsoUserProvider.get_or_create(self)
+        self._users: Dict[str, SsoBatchedUser] = {}
+        for shard_number, shard_users in enumerate(shards):
+            if not shard_users:
+                continue
+            shard_users = sorted(shard_users, key=lambda user: user["username"])
+            self._check_response_size(shard_number, shard_users)
+            resource = CustomResource(
+                self,
+                id=f"Shard{shard_number}",
+                resource_type="Custom::SsoUserBatch",
+                service_token=provider.service_token,
+                properties={"Users": [dict(user) for user in shard_users]},
+            )
+            for user_attributes in shard_users:
+                username = user_attributes["username"]
+                if username in self._users:
+                    raise ValueError(f"Duplicate username {username} in SsoUserBatch {batch_name}")
+                user_id = resource.get_att_string(self.user_id_attribute_name(username))
+                self._users[username] = SsoBatchedUser(
+                    user_id=user_id,
+                    user_arn=f"arn:{sso_environment.sso_region}:identitystore:::user/{user_id}",
+                    email=user_attributes["email"],
+                    username=username,
+                    attributes=user_attributes,
+                )
+        self.batch_name = batch_name
+
+    @staticmethod
+    def shard_for_username(username: str, shard_count: int) -> int:
+        """Stable across synths and Python versions, unlike the builtin hash()."""
+        return zlib.crc32(username.encode("utf-8")) % shard_count
+
+    @staticmethod
+    def user_id_attribute_name(username: str) -> str:
+        """Must match batch_user_id_attribute_name() in the Lambda handler."""
+        return f"UserId.{username}"
+
+    def _check_response_size(self, shard_number: int, shard_users: List[SsoUserAttributes]) -> None:
+        response_data_bytes = len(
+            json.dumps(
+                {
+                    self.user_id_attribute_name(user["username"]): "x" * MAX_USER_ID_LENGTH
+                    for user in shard_users
+                }
+            )
+        )
+        if response_data_bytes > MAX_RESPONSE_DATA_BYTES:
+            raise ValueError(
+                f"Shard {shard_number} of SsoUserBatch {self.node.id} holds {len(shard_users)} users, "
+                f"whose IDs would take ~{response_data_bytes} bytes of the 4KB custom resource "
+                "response limit. Increase shard_count."
+            )
+
+    @property
+    def users(self) -> List[SsoBatchedUser]:
+        """All users in this batch, sorted by username."""
+        return [self._users[username] for username in sorted(self._users)]
+
+    def user(self, username: str) -> SsoBatchedUser:
+        """Look up a single user in this batch by username."""
+        return self._users[username]
@@ -1,7 +1,8 @@
 import os
-from typing import TypedDict, cast
+from typing import Optional, TypedDict, cast
 
-from aws_cdk import BundlingOptions, RemovalPolicy, Stack
+from aws_cdk import BundlingOptions, Duration, RemovalPolicy, Stack
+from aws_cdk import aws_dynamodb as dynamodb
 from aws_cdk import aws_iam as iam
 from aws_cdk import aws_lambda as lambda_
 from aws_cdk import aws_logs as logs
@@ -11,10 +12,29 @@ from cdk_nag import NagSuppressions
 from cdk_nag import RegexAppliesTo as NagRegex
 from constructs import Construct
 
-from .. import SsoConfig
+from ..config import SsoEnvironment
+from .local_bundling import LocalPythonBundling
+from .sso_nag import SsoNagChecks
+from .sso_shard_router import top_level_stack
 
 dirname = os.path.dirname(__file__)
 
+BUNDLING_COMMAND = "pip install -r requirements.txt -t /asset-output && cp -au . /asset-output"
+
+# The Lambda filesystem is read-only, so Python can't cache bytecode at runtime and
+# recompiles every module on each cold start unless we ship .pyc files. CDK zips assets
+# with fixed timestamps, so the .pyc files must not be validated against source mtimes.
+SLIM_BUNDLING_COMMAND = " && ".join(
+    [
+        "pip install --no-compile -r requirements.txt -t /asset-output",
+        "cp -au . /asset-output",
+        "cd /asset-output",
+        "find . -depth -type d \\( -name tests -o -name test -o -name __pycache__ -o -name '*.dist-info' -o -name '*.egg-info' \\) -exec rm -rf {} +",
+        "rm -f requirements.txt *.md",
+        "python -m compileall -q --invalidation-mode unchecked-hash .",
+    ]
+)
+
 
 class SsoUserAttributes(TypedDict):
     username: str
@@ -30,18 +50,83 @@ class SsoUserProvider(Construct):
 
     service_token: str
     provider: cr.Provider
+    code: lambda_.Code
 
     @classmethod
-    def get_or_create(cls, scope: Construct) -> cr.Provider:
-        stack = Stack.of(scope)
+    def get_or_create(
+        cls,
+        scope: Construct,
+        *,
+        async_mode: bool = False,
+        query_interval: Optional[Duration] = None,
+        total_timeout: Optional[Duration] = None,
+        max_operations_per_is_complete: Optional[int] = None,
+        slim_bundle: bool = False,
+        local_bundling: bool = True,
+        request_journal: bool = False,
+        request_journal_ttl: Optional[Duration] = None,
+    ) -> cr.Provider:
+        """
+        Returns the stack's provider, creating it on first use. The keyword arguments only
+        take effect when the provider is created, so to use async mode, call this before
+        creating any SsoUser or SsoUserBatch. Nested stacks (e.g. SsoShardRouter shards)
+        share the provider of their top-level stack.
+        """
+        stack = top_level_stack(scope)
         id = "Custom::SsoUser"
         provider= cast(cr.Provider, stack.node.try_find_child(id))
         if provider is None:
-            provider = SsoUserProvider(stack, id)
+            provider = SsoUserProvider(
+                stack,
+                id,
+                async_mode=async_mode,
+                query_interval=query_interval,
+                total_timeout=total_timeout,
+                max_operations_per_is_complete=max_operations_per_is_complete,
+                slim_bundle=slim_bundle,
+                local_bundling=local_bundling,
+                request_journal=request_journal,
+                request_journal_ttl=request_journal_ttl,
+            )
         return provider
 
-    def __init__(self, scope: Construct, id: str) -> None:
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        *,
+        async_mode: bool = False,
+        query_interval: Optional[Duration] = None,
+        total_timeout: Optional[Duration] = None,
+        max_operations_per_is_complete: Optional[int] = None,
+        slim_bundle: bool = False,
+        local_bundling: bool = True,
+        request_journal: bool = False,
+        request_journal_ttl: Optional[Duration] = None,
+    ) -> None:
+        """
+        With async_mode=True, the provider also registers an is_complete handler. on_event
+        then only validates SsoUserBatch requests and returns, and is_complete applies the
+        changes in resumable chunks every query_interval until done or total_timeout
+        passes. SsoAssignments requests are submitted by on_event and polled by
+        is_complete the same way. Use this when a batch or assignment matrix is too large
+        to finish inside one Lambda invocation.
+
+        With slim_bundle=True, the Lambda bundle is pruned of tests, caches, package
+        metadata, and docs, and shipped with precompiled bytecode, to shorten cold starts.
+
+        With local_bundling=True (the default), the bundle is built with the local Python
+        interpreter instead of Docker whenever its version matches the Lambda runtime, and
+        cached under a hash of the handler's sources and requirements.
+
+        With request_journal=True, on_event claims each request in a DynamoDB table, keyed
+        by RequestId, before handling it, and records its response there for
+        request_journal_ttl (default 2 hours). Redeliveries of the same request are
+        answered from it without calling identitystore again, and wait for the response
+        while the first delivery is still running.
+        """
         super().__init__(scope, id)
+        sso_environment = SsoEnvironment.of(self)
 
         stack = Stack.of(scope)
         region = stack.region
@@ -52,6 +137,9 @@ class SsoUserProvider(Construct):
         on_event_handler_function_name = (
             f"{stack.stack_name}-CustomSsoUser-onEventHandler"
         )
+        is_complete_handler_function_name = (
+            f"{stack.stack_name}-CustomSsoUser-isCompleteHandler"
+        )
 
         on_event_handler_role = iam.Role(
             self,
@@ -69,7 +157,8 @@ class SsoUserProvider(Construct):
                             effect=iam.Effect.ALLOW,
                             actions=["logs:CreateLogStream", "logs:PutLogEvents"],
                             resources=[
-                                f"arn:aws:logs:{region}:{account}:log-group:/aws/lambda/{on_event_handler_function_name}*"
+                                f"arn:aws:logs:{region}:{account}:log-group:/aws/lambda/{on_event_handler_function_name}*",
+                                f"arn:aws:logs:{region}:{account}:log-group:/aws/lambda/{is_complete_handler_function_name}*",
                             ],
                         ),
                     ]
@@ -85,48 +174,164 @@ class SsoUserProvider(Construct):
                                 "identitystore:ListUsers",
                             ],
                             resources=[
-                                f"arn:aws:identitystore::{account}:identitystore/{SsoConfig.identity_store_id.value}",  # ARN used to create,
+                                f"arn:aws:identitystore::{account}:identitystore/{sso_environment.identity_store_id}",  # ARN used to create,
                                 "arn:aws:identitystore:::user/*",  # ARN used to update and delete
                             ],
-                        )
+                        ),
+                        # For SsoAssignments. Provisioning an assignment creates or
+                        # updates the permission set's role in the target account.
+                        iam.PolicyStatement(
+                            effect=iam.Effect.ALLOW,
+                            actions=[
+                                "sso:CreateAccountAssignment",
+                                "sso:DeleteAccountAssignment",
+                                "sso:DescribeAccountAssignmentCreationStatus",
+                                "sso:DescribeAccountAssignmentDeletionStatus",
+                                # For SsoPermissionSetProvisioning
+                                "sso:ProvisionPermissionSet",
+                                "sso:DescribePermissionSetProvisioningStatus",
+                            ],
+                            resources=[
+                                sso_environment.instance_arn,
+                                "arn:aws:sso:::permissionSet/*",
+                                "arn:aws:sso:::account/*",
+                            ],
+                        ),
+                        iam.PolicyStatement(
+                            effect=iam.Effect.ALLOW,
+                            actions=[
+                                "iam:AttachRolePolicy",
+                                "iam:CreateRole",
+                                "iam:DeleteRole",
+                                "iam:DeleteRolePolicy",
+                                "iam:DetachRolePolicy",
+                                "iam:GetRole",
+                                "iam:ListAttachedRolePolicies",
+                                "iam:ListRolePolicies",
+                                "iam:PutRolePolicy",
+                                "iam:UpdateRole",
+                            ],
+                            resources=["arn:aws:iam::*:role/aws-reserved/sso.amazonaws.com/*"],
+                        ),
+                        iam.PolicyStatement(
+                            effect=iam.Effect.ALLOW,
+                            actions=["iam:CreateSAMLProvider", "iam:GetSAMLProvider", "iam:UpdateSAMLProvider"],
+                            resources=["arn:aws:iam::*:saml-provider/AWSSSO_*"],
+                        ),
+                        # For SsoGroupMembers
+                        iam.PolicyStatement(
+                            effect=iam.Effect.ALLOW,
+                            actions=[
+                                "identitystore:CreateGroupMembership",
+                                "identitystore:DeleteGroupMembership",
+                                "identitystore:ListGroupMemberships",
+                            ],
+                            resources=[
+                                f"arn:aws:identitystore::{account}:identitystore/{sso_environment.identity_store_id}",
+                                "arn:aws:identitystore:::group/*",
+                                "arn:aws:identitystore:::membership/*",
+                                "arn:aws:identitystore:::user/*",
+                            ],
+                        ),
                     ]
                 ),
             },
         )
 
+        source_dir = os.path.join(dirname, "lambda_functions/sso_user")
+        code = lambda_.Code.from_asset(
+            source_dir,
+            bundling=BundlingOptions(
+                image=lambda_.Runtime.PYTHON_3_11.bundling_image,
+                command=[
+                    "bash",
+                    "-c",
+                    SLIM_BUNDLING_COMMAND if slim_bundle else BUNDLING_COMMAND,
+                ],
+                local=LocalPythonBundling(
+                    source_dir, python_version="3.11", slim=slim_bundle
+                ) if local_bundling else None,
+            ),
+        )
+        # Shared with other functions running the same handler, e.g. SsoDriftDetector's
+        self.code = code
+        environment = {
+            "SSO_IDENTITY_STORE_ID": sso_environment.identity_store_id,
+            "SSO_INSTANCE_ARN": sso_environment.instance_arn,
+            "SSO_REGION": sso_environment.sso_region,
+        }
+        if async_mode:
+            environment["ASYNC_MODE"] = "true"
+            if max_operations_per_is_complete is not None:
+                environment["MAX_OPERATIONS_PER_IS_COMPLETE"] = str(max_operations_per_is_complete)
+
+        self.request_journal_table: Optional[dynamodb.Table] = None
+        if request_journal:
+            self.request_journal_table = dynamodb.Table(
+                self,
+                id="RequestJournal",
+                partition_key=dynamodb.Attribute(name="RequestId", type=dynamodb.AttributeType.STRING),
+                billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+                time_to_live_attribute="ExpiresAt",
+                # Entries only matter for a couple of hours, while CloudFormation may retry
+                removal_policy=RemovalPolicy.DESTROY,
+            )
+            self.request_journal_table.grant(
+                on_event_handler_role, "dynamodb:GetItem", "dynamodb:PutItem", "dynamodb:DeleteItem"
+            )
+            environment["REQUEST_JOURNAL_TABLE"] = self.request_journal_table.table_name
+            if request_journal_ttl is not None:
+                environment["REQUEST_JOURNAL_TTL_SECONDS"] = str(request_journal_ttl.to_seconds())
+            NagSuppressions.add_resource_suppressions(
+                construct=self.request_journal_table,
+                suppressions=[
+                    Nag(
+                        id="AwsSolutions-DDB3",
+                        reason="Journal entries expire within hours and are recreated by retrying the request, so there is nothing to recover",
+                    ),
+                ],
+            )
+
         on_event_handler_function = lambda_.Function(
             self,
             id="OnEventFunction",
             function_name=on_event_handler_function_name,
             runtime=lambda_.Runtime.PYTHON_3_11,
             role=on_event_handler_role,
-            code=lambda_.Code.from_asset(
-                os.path.join(dirname, "lambda_functions/sso_user"),
-                bundling=BundlingOptions(
-                    image=lambda_.Runtime.PYTHON_3_11.bundling_image,
-                    command=[
-                        "bash",
-                        "-c",
-                        "pip install -r requirements.txt -t /asset-output && cp -au . /asset-output",
-                    ],
-                ),
-            ),
+            code=code,
             handler="index.on_event",
-            environment={
-                "SSO_IDENTITY_STORE_ID": SsoConfig.identity_store_id.value,
-                "SSO_INSTANCE_ARN": SsoConfig.instance_arn.value,
-                "SSO_REGION": SsoConfig.sso_region.value,
-            },
+            # Batches make many identitystore calls per invocation
+            timeout=Duration.minutes(5),
+            environment=environment,
         )
 
+        is_complete_handler_function = None
+        if async_mode:
+            is_complete_handler_function = lambda_.Function(
+                self,
+                id="IsCompleteFunction",
+                function_name=is_complete_handler_function_name,
+                runtime=lambda_.Runtime.PYTHON_3_11,
+                role=on_event_handler_role,
+                code=code,
+                handler="index.is_complete",
+                timeout=Duration.minutes(5),
+                environment=environment,
+            )
+
         self.provider = cr.Provider(
             stack,
             id="Provider",
             on_event_handler=on_event_handler_function,
+            is_complete_handler=is_complete_handler_function,
+            query_interval=query_interval if async_mode else None,
+            total_timeout=total_timeout if async_mode else None,
             provider_function_name=provider_framework_function_name,
         )
 
         self.service_token = self.provider.service_token
+        SsoNagChecks.check(self)
+        SsoNagChecks.check(self.provider)
 
         NagSuppressions.add_resource_suppressions(
             construct=on_event_handler_role,
@@ -138,6 +343,7 @@ class SsoUserProvider(Construct):
                     applies_to=[
                         f"Resource::arn:aws:logs:{region}:{account}:*",
                         f"Resource::arn:aws:logs:{region}:{account}:log-group:/aws/lambda/{on_event_handler_function_name}*",
+                        f"Resource::arn:aws:logs:{region}:{account}:log-group:/aws/lambda/{is_complete_handler_function_name}*",
                         NagRegex(
                             regex="\/Resource::<CustomSsoUserOnEventFunction.{8}\.Arn>:\*/"
                         ),
@@ -145,34 +351,58 @@ class SsoUserProvider(Construct):
                 ),
                 Nag(
                     id="AwsSolutions-IAM5",
-                    reason="Allow our Lambda to create, modify, or delete SSO users",
+                    reason="Allow our Lambda to create, modify, or delete SSO users and group memberships",
                     applies_to=[
                         "Resource::arn:aws:identitystore:::user/*",
-                    ],
-                ),
-            ],
-        )
-
-        NagSuppressions.add_resource_suppressions_by_path(
-            stack=stack,
-            path="/SsoStack/Provider/framework-onEvent",
-            apply_to_children=True,
-            suppressions=[
-                Nag(
-                    id="AwsSolutions-IAM4",
-                    reason="Safe - only allows CDK-created helper function to write logs to CloudWatch",
-                    applies_to=[
-                        "Policy::arn:<AWS::Partition>:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"
+                        "Resource::arn:aws:identitystore:::group/*",
+                        "Resource::arn:aws:identitystore:::membership/*",
                     ],
                 ),
                 Nag(
                     id="AwsSolutions-IAM5",
-                    reason="Safe - allows helper function to invoke our OnEvent function to proxy request/response to/from CloudFormation",
+                    reason="Allow our Lambda to provision account assignments for any permission set and account, as CloudFormation does for CfnAssignment",
                     applies_to=[
-                        NagRegex(
-                            regex="\/Resource::<CustomSsoUserOnEventFunction.{8}\.Arn>:\*/"
-                        ),
+                        "Resource::arn:aws:sso:::permissionSet/*",
+                        "Resource::arn:aws:sso:::account/*",
+                        "Resource::arn:aws:iam::*:role/aws-reserved/sso.amazonaws.com/*",
+                        "Resource::arn:aws:iam::*:saml-provider/AWSSSO_*",
                     ],
                 ),
             ],
-        )
\ No newline at end of file
+        )
+
+        # The async waiter adds more framework functions and a state machine, all of which
+        # need the same permissions as framework-onEvent
+        framework_paths = ["framework-onEvent"]
+        if async_mode:
+            framework_paths += ["framework-isComplete", "framework-onTimeout", "waiter-state-machine"]
+        for framework_path in framework_paths:
+            NagSuppressions.add_resource_suppressions_by_path(
+                stack=stack,
+                path=f"/{stack.node.path}/Provider/{framework_path}",
+                apply_to_children=True,
+                suppressions=[
+                    Nag(
+                        id="AwsSolutions-IAM4",
+                        reason="Safe - only allows CDK-created helper function to write logs to CloudWatch",
+                        applies_to=[
+                            "Policy::arn:<AWS::Partition>:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole"
+                        ],
+                    ),
+                    Nag(
+                        id="AwsSolutions-IAM5",
+                        reason="Safe - allows helper function to invoke our OnEvent function to proxy request/response to/from CloudFormation",
+                        applies_to=[
+                            NagRegex(
+                                regex="\/Resource::<CustomSsoUserOnEventFunction.{8}\.Arn>:\*/"
+                            ),
+                            NagRegex(
+                                regex="\/Resource::<CustomSsoUserIsCompleteFunction.{8}\.Arn>:\*/"
+                            ),
+                            NagRegex(
+                                regex="\/Resource::<Providerframework(isComplete|onTimeout).{8}\.Arn>:\*/"
+                            ),
+                        ],
+                    ),
+                ],
+            )
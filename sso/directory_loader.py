@@ -0,0 +1,315 @@
+import csv
+import json
+import os
+import re
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, Union
+
+from constructs import Construct
+
+from .config import SsoEnvironment
+from .constructs import SsoAssignments, SsoGroup, SsoPermissionSet, SsoUser, SsoUserAttributes
+from .fast_template import SsoTemplate, TemplateGroup, TemplatePermissionSet, TemplateUser
+
+# Max number of row errors spelled out in a DirectoryLoadError message; the rest are
+# only counted
+MAX_ERRORS_IN_MESSAGE = 20
+
+FORMATS_BY_EXTENSION = {
+    ".csv": "csv",
+    ".jsonl": "jsonl",
+    ".ndjson": "jsonl",
+    ".yaml": "yaml",
+    ".yml": "yaml",
+}
+
+USER_FIELDS = ("username", "email", "first_name", "last_name")
+GROUP_FIELDS = ("group_name",)
+ASSIGNMENT_FIELDS = ("group", "permission_set", "account")
+
+ACCOUNT_ID_PATTERN = re.compile(r"^\d{12}$")
+
+# A row's parsed fields, and the line of the file it starts on
+Row = Tuple[int, Dict[str, Any]]
+
+
+class DirectoryLoadError(Exception):
+    """
+    Raised after a directory file has been read in full, listing every invalid row with
+    its line number. Valid rows have already been added to the stack by then, but the
+    error stops the synth.
+    """
+
+    def __init__(self, path: str, errors: List[Tuple[int, str]]):
+        self.path = path
+        self.errors = errors
+        lines = [f"{path}:{line}: {message}" for line, message in errors[:MAX_ERRORS_IN_MESSAGE]]
+        if len(errors) > MAX_ERRORS_IN_MESSAGE:
+            lines.append(f"... and {len(errors) - MAX_ERRORS_IN_MESSAGE} more")
+        super().__init__(f"{len(errors)} invalid rows in {path}:\n" + "\n".join(lines))
+
+
+def read_rows(path: str, format: Optional[str] = None) -> Iterator[Row]:
+    """
+    Streams (line number, row) pairs from a CSV (with a header row), JSON Lines, or YAML
+    (a top-level list of mappings) file, one row at a time, so memory use doesn't grow
+    with the size of the file. The format is taken from the file extension unless given.
+    Rows that can't be parsed are yielded as ValueError instances instead of dicts.
+    """
+    format = format or FORMATS_BY_EXTENSION.get(os.path.splitext(path)[1].lower())
+    if format == "csv":
+        return _read_csv(path)
+    if format == "jsonl":
+        return _read_jsonl(path)
+    if format == "yaml":
+        return _read_yaml(path)
+    raise ValueError(
+        f"Can't tell the format of {path}; use one of the extensions "
+        f"{', '.join(sorted(FORMATS_BY_EXTENSION))} or pass format"
+    )
+
+
+def _read_csv(path: str) -> Iterator[Row]:
+    with open(path, newline="", encoding="utf-8-sig") as f:
+        reader = csv.DictReader(f)
+        reader.fieldnames  # Reads the header row
+        # line_num is the last physical line read, so a row starts one past the last one
+        row_start_line = reader.line_num + 1
+        for row in reader:
+            if None in row:
+                yield row_start_line, ValueError(f"more fields than the header ({len(reader.fieldnames or [])})")
+            else:
+                yield row_start_line, {key.strip(): value for key, value in row.items() if key}
+            row_start_line = reader.line_num + 1
+
+
+def _read_jsonl(path: str) -> Iterator[Row]:
+    with open(path, encoding="utf-8") as f:
+        for line_number, line in enumerate(f, start=1):
+            if not line.strip():
+                continue
+            try:
+                row = json.loads(line)
+            except json.JSONDecodeError as error:
+                yield line_number, ValueError(f"invalid JSON: {error.msg}")
+                continue
+            yield line_number, row
+
+
+def _read_yaml(path: str) -> Iterator[Row]:
+    try:
+        # Optional, only needed to load YAML files
+        import yaml
+    except ImportError as error:
+        raise ImportError("Loading YAML directory files requires PyYAML (pip install pyyaml)") from error
+
+    with open(path, encoding="utf-8") as f:
+        # The pure-Python loader, since the libyaml one can't compose single nodes
+        loader = yaml.SafeLoader(f)
+        try:
+            # Compose one list item at a time instead of the whole document
+            loader.get_event()  # StreamStartEvent
+            if loader.check_event(yaml.StreamEndEvent):
+                return
+            loader.get_event()  # DocumentStartEvent
+            if not loader.check_event(yaml.SequenceStartEvent):
+                raise ValueError(f"{path} must contain a list of rows")
+            loader.get_event()
+            while not loader.check_event(yaml.SequenceEndEvent):
+                node = loader.compose_node(None, None)
+                yield node.start_mark.line + 1, loader.construct_document(node)
+        finally:
+            loader.dispose()
+
+
+def _text(row: Mapping[str, Any], field: str) -> str:
+    value = row.get(field)
+    return "" if value is None else str(value).strip()
+
+
+def _list(value: Any) -> List[str]:
+    """A list column: a YAML/JSON list, or a ;-separated string (in CSV)."""
+    if value is None:
+        return []
+    if isinstance(value, (list, tuple)):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in str(value).split(";") if item.strip()]
+
+
+class DirectoryLoader:
+    """
+    Adds users, groups, group memberships, and group assignments to a stack from
+    directory files (e.g. an HR export), instead of one Python call per user.
+
+    - load_groups(): rows of group_name and an optional description, each creating an
+      SsoGroup.
+    - load_users(): rows of username, email, first_name, last_name, and an optional
+      groups list (;-separated in CSV), each creating an SsoUser and adding it to its
+      groups.
+    - load_assignments(): rows of group, permission_set, and account (an account ID or
+      one of the stack's SsoEnvironment account names, by default AwsAccounts names),
+      each calling grant_to_group_for_account().
+
+    Groups and permission sets can also be passed in, e.g. ones imported with
+    from_existing_group(). With member_sets=True, memberships are added with
+    SsoGroup.add_members() (one resource per group) instead of add_users() (one resource
+    per membership). Given an SsoAssignments matrix, assignments are added to it instead
+    of creating one CfnAssignment each. Given an SsoTemplate, groups and users are emitted
+    with it instead of created as constructs. Each file is read in a single streaming pass. Duplicate
+    usernames and emails (compared case-insensitively, as identitystore does) are caught
+    with an index of the ones seen so far, across every file this loader has read, and
+    every invalid row is reported with its line number in one DirectoryLoadError.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        *,
+        groups: Optional[Sequence[Union[SsoGroup, TemplateGroup]]] = None,
+        permission_sets: Optional[Sequence[Union[SsoPermissionSet, TemplatePermissionSet]]] = None,
+        member_sets: bool = False,
+        assignments: Optional[SsoAssignments] = None,
+        template: Optional[SsoTemplate] = None,
+    ):
+        if template is not None and (member_sets or assignments is not None):
+            raise ValueError("member_sets and assignments can't be used with an SsoTemplate")
+        self.scope = scope
+        self.member_sets = member_sets
+        self.assignments = assignments
+        self.template = template
+        self.groups: Dict[str, Union[SsoGroup, TemplateGroup]] = {group.group_name: group for group in groups or []}
+        self.permission_sets: Dict[str, Union[SsoPermissionSet, TemplatePermissionSet]] = {
+            permission_set.permission_set_name: permission_set
+            for permission_set in permission_sets or []
+        }
+        self.users: Dict[str, Union[SsoUser, TemplateUser]] = {}
+        # Case-folded username/email -> where it was first seen
+        self._usernames: Dict[str, str] = {}
+        self._emails: Dict[str, str] = {}
+
+    def load_groups(self, path: str, *, format: Optional[str] = None) -> int:
+        """Creates an SsoGroup per row. Returns the number of groups created."""
+        count = 0
+        errors: List[Tuple[int, str]] = []
+        for line, row in read_rows(path, format):
+            error = self._check_row(row, GROUP_FIELDS)
+            group_name = "" if error else _text(row, "group_name")
+            if not error and group_name in self.groups:
+                error = f"duplicate group {group_name}"
+            if error:
+                errors.append((line, error))
+                continue
+            description = _text(row, "description") or group_name
+            if self.template is not None:
+                self.groups[group_name] = self.template.add_group(group_name=group_name, description=description)
+            else:
+                self.groups[group_name] = SsoGroup(self.scope, group_name=group_name, description=description)
+            count += 1
+        if errors:
+            raise DirectoryLoadError(path, errors)
+        return count
+
+    def load_users(self, path: str, *, format: Optional[str] = None) -> int:
+        """
+        Creates an SsoUser per row and adds it to the groups in its groups column.
+        Returns the number of users created.
+        """
+        count = 0
+        errors: List[Tuple[int, str]] = []
+        for line, row in read_rows(path, format):
+            error = self._check_row(row, USER_FIELDS)
+            group_names = [] if error else _list(row.get("groups"))
+            unknown_groups = [name for name in group_names if name not in self.groups]
+            if not error and unknown_groups:
+                error = f"unknown groups {', '.join(unknown_groups)}"
+            if not error:
+                # Last, so only users that are actually created are indexed
+                error = self._index_user(row, f"{path}:{line}")
+            if error:
+                errors.append((line, error))
+                continue
+            user_attributes = SsoUserAttributes(
+                username=_text(row, "username"),
+                email=_text(row, "email"),
+                first_name=_text(row, "first_name"),
+                last_name=_text(row, "last_name"),
+            )
+            user: Union[SsoUser, TemplateUser]
+            if self.template is not None:
+                user = self.template.add_user(user_attributes)
+            else:
+                user = SsoUser(self.scope, user_attributes=user_attributes)
+            self.users[user.username] = user
+            for group_name in group_names:
+                if self.member_sets:
+                    self.groups[group_name].add_members([user])
+                else:
+                    self.groups[group_name].add_users([user])
+            count += 1
+        if errors:
+            raise DirectoryLoadError(path, errors)
+        return count
+
+    def load_assignments(self, path: str, *, format: Optional[str] = None) -> int:
+        """
+        Grants a group a permission set for an account per row. Returns the number of
+        assignments created.
+        """
+        count = 0
+        errors: List[Tuple[int, str]] = []
+        seen: Dict[Tuple[str, str, str], int] = {}
+        for line, row in read_rows(path, format):
+            error = self._check_row(row, ASSIGNMENT_FIELDS)
+            if not error:
+                group_name = _text(row, "group")
+                permission_set_name = _text(row, "permission_set")
+                account_id = self._account_id(_text(row, "account"))
+                key = (group_name, permission_set_name, account_id or "")
+                if group_name not in self.groups:
+                    error = f"unknown group {group_name}"
+                elif permission_set_name not in self.permission_sets:
+                    error = f"unknown permission set {permission_set_name}"
+                elif account_id is None:
+                    error = (
+                        f"account {_text(row, 'account')} is neither a 12-digit account ID "
+                        f"nor an account name of environment {SsoEnvironment.of(self.scope).name}"
+                    )
+                elif key in seen:
+                    error = f"duplicate of the assignment on line {seen[key]}"
+            if error:
+                errors.append((line, error))
+                continue
+            seen[key] = line
+            self.permission_sets[permission_set_name].grant_to_group_for_account(
+                self.groups[group_name], account_id, assignments=self.assignments
+            )
+            count += 1
+        if errors:
+            raise DirectoryLoadError(path, errors)
+        return count
+
+    @staticmethod
+    def _check_row(row: Any, required_fields: Sequence[str]) -> Optional[str]:
+        if isinstance(row, Exception):
+            return str(row)
+        if not isinstance(row, Mapping):
+            return f"expected a mapping of fields, got {type(row).__name__}"
+        missing = [field for field in required_fields if not _text(row, field)]
+        if missing:
+            return f"missing {', '.join(missing)}"
+        return None
+
+    def _index_user(self, row: Mapping[str, Any], location: str) -> Optional[str]:
+        username = _text(row, "username").casefold()
+        email = _text(row, "email").casefold()
+        if username in self._usernames:
+            return f"duplicate username {_text(row, 'username')} (first seen at {self._usernames[username]})"
+        if email in self._emails:
+            return f"duplicate email {_text(row, 'email')} (first seen at {self._emails[email]})"
+        self._usernames[username] = location
+        self._emails[email] = location
+        return None
+
+    def _account_id(self, account: str) -> Optional[str]:
+        if ACCOUNT_ID_PATTERN.match(account):
+            return account
+        return SsoEnvironment.of(self.scope).accounts.get(account)
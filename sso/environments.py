@@ -0,0 +1,102 @@
+import json
+import os
+import re
+from typing import Any, Dict, List, Sequence
+
+from constructs import Construct
+
+from .config import SsoEnvironment
+from .sso_stack import SsoStack
+
+ENVIRONMENT_FIELDS = ("sso_account", "sso_region", "identity_store_id", "instance_arn")
+EXTENSIONS = (".json", ".yaml", ".yml")
+
+ACCOUNT_ID_PATTERN = re.compile(r"^\d{12}$")
+# Becomes part of the stack name
+NAME_PATTERN = re.compile(r"^[A-Za-z][A-Za-z0-9-]*$")
+
+
+def load_environment(path: str) -> SsoEnvironment:
+    """
+    Reads one environment from a JSON or YAML file named after it, e.g. prod.yaml:
+
+        sso_account: "123456789012"
+        sso_region: us-east-1
+        identity_store_id: d-1234567890
+        instance_arn: arn:aws:sso:::instance/ssoins-1234567890abcdef
+        accounts:
+          SANDBOX: "333333333333"
+        context:
+          sso:usersFile: directory/prod-users.csv
+
+    accounts (friendly names for account IDs, like AwsAccounts) and context (values set
+    on the environment's stack) are optional. Raises ValueError listing every problem.
+    """
+    name, extension = os.path.splitext(os.path.basename(path))
+    if extension.lower() not in EXTENSIONS:
+        raise ValueError(f"Can't tell the format of {path}; use one of the extensions {', '.join(EXTENSIONS)}")
+    with open(path, encoding="utf-8") as f:
+        if extension.lower() == ".json":
+            config = json.load(f)
+        else:
+            try:
+                # Optional, only needed to load YAML environment files
+                import yaml
+            except ImportError as error:
+                raise ImportError("Loading YAML environment files requires PyYAML (pip install pyyaml)") from error
+            config = yaml.safe_load(f)
+
+    if not isinstance(config, dict):
+        raise ValueError(f"{path} must contain a mapping of environment settings")
+    errors: List[str] = []
+    if not NAME_PATTERN.match(name):
+        errors.append(f"name {name} (from the file name) must be letters, digits, and dashes")
+    values: Dict[str, Any] = {}
+    for field in ENVIRONMENT_FIELDS:
+        value = config.get(field)
+        if not value:
+            errors.append(f"missing {field}")
+        values[field] = "" if value is None else str(value)
+    if values["sso_account"] and not ACCOUNT_ID_PATTERN.match(values["sso_account"]):
+        errors.append(f"sso_account {values['sso_account']} isn't a 12-digit account ID")
+    accounts = {str(key): str(value) for key, value in (config.get("accounts") or {}).items()}
+    for account_name, account_id in accounts.items():
+        if not ACCOUNT_ID_PATTERN.match(account_id):
+            errors.append(f"account {account_name} ({account_id}) isn't a 12-digit account ID")
+    unknown = set(config) - set(ENVIRONMENT_FIELDS) - {"accounts", "context"}
+    if unknown:
+        errors.append(f"unknown settings {', '.join(sorted(unknown))}")
+    if errors:
+        raise ValueError(f"Invalid environment file {path}: {'; '.join(errors)}")
+    return SsoEnvironment(name=name, accounts=accounts, context=dict(config.get("context") or {}), **values)
+
+
+def load_environments(directory: str) -> List[SsoEnvironment]:
+    """Every environment file in directory, sorted by name."""
+    paths = sorted(
+        os.path.join(directory, file_name)
+        for file_name in os.listdir(directory)
+        if os.path.splitext(file_name)[1].lower() in EXTENSIONS
+    )
+    environments = [load_environment(path) for path in paths]
+    names = [environment.name for environment in environments]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise ValueError(f"Environments {', '.join(duplicates)} are defined in more than one file in {directory}")
+    if not environments:
+        raise ValueError(f"No environment files ({', '.join(EXTENSIONS)}) in {directory}")
+    return environments
+
+
+def stack_name(environment: SsoEnvironment, *, prefix: str = "SsoStack") -> str:
+    return f"{prefix}-{environment.name}"
+
+
+def create_stacks(
+    scope: Construct, environments: Sequence[SsoEnvironment], *, prefix: str = "SsoStack", **kwargs: Any
+) -> List[SsoStack]:
+    """An SsoStack per environment, named <prefix>-<environment name>; kwargs go to each."""
+    return [
+        SsoStack(scope, stack_name(environment, prefix=prefix), sso_environment=environment, **kwargs)
+        for environment in environments
+    ]
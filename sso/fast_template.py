@@ -0,0 +1,349 @@
+import json
+from typing import Any, Callable, Dict, List, Mapping, Optional, Sequence
+
+from .config import SsoConfig
+from .constructs.sso_logical_ids import LogicalIdMap, logical_id
+from .template_size import SsoStackSynthesizer
+
+# CloudFormation's (and CDK's default) limit on resources per template
+MAX_RESOURCES = 500
+
+# Where the CDK-synthesized resources (the provider) go among the emitted ones
+CDK_SLOT = object()
+
+
+def get_att(logical_id: str, attribute: str) -> Dict[str, Any]:
+    return {"Fn::GetAtt": [logical_id, attribute]}
+
+
+class TemplateUser:
+    """A user added with SsoTemplate.add_user(); stands in for an SsoUser."""
+
+    def __init__(self, attributes: Mapping[str, str], resource_id: str):
+        self.attributes = attributes
+        self.username = attributes["username"]
+        self.email = attributes["email"]
+        self.user_id = get_att(resource_id, "UserId")
+        self.user_arn = get_att(resource_id, "Arn")
+
+
+class TemplateGroup:
+    """
+    A group added with SsoTemplate.add_group() or existing_group(); stands in for an
+    SsoGroup. Memberships are one GroupMembership resource each, as with
+    SsoGroup.add_users().
+    """
+
+    def __init__(self, template: "SsoTemplate", scope_id: str, group_name: str, group_id: Any):
+        self._template = template
+        self._scope_id = scope_id
+        self.group_name = group_name
+        self.group_id = group_id
+        self.member_users: Dict[str, TemplateUser] = {}
+
+    def add_user(self, user: TemplateUser) -> None:
+        self.member_users[user.username] = user
+        self._template._add_resource(
+            self._scope_id,
+            f"GroupMember_{user.username}",
+            "AWS::IdentityStore::GroupMembership",
+            {
+                "GroupId": self.group_id,
+                "IdentityStoreId": self._template.identity_store_id,
+                "MemberId": {"UserId": user.user_id},
+            },
+            compact_prefix="Member",
+        )
+
+    def add_users(self, users: Sequence[TemplateUser]) -> None:
+        for user in users:
+            self.add_user(user)
+
+
+class TemplatePermissionSet:
+    """
+    A permission set added with SsoTemplate.add_permission_set() or
+    existing_permission_set(); stands in for an SsoPermissionSet. Grants are one
+    Assignment resource each.
+    """
+
+    def __init__(self, template: "SsoTemplate", scope_id: str, permission_set_name: str, permission_set_arn: Any):
+        self._template = template
+        self._scope_id = scope_id
+        self.permission_set_name = permission_set_name
+        self.permission_set_arn = permission_set_arn
+
+    def _assign(self, principal_type: str, principal_name: str, principal_id: Any, account_id: str) -> None:
+        to = "_toGroup_" if principal_type == "GROUP" else "_toUser_"
+        self._template._add_resource(
+            self._scope_id,
+            "Assign_" + self.permission_set_name + to + principal_name + "_for_" + account_id,
+            "AWS::SSO::Assignment",
+            {
+                "InstanceArn": self._template.instance_arn,
+                "PermissionSetArn": self.permission_set_arn,
+                "PrincipalId": principal_id,
+                "PrincipalType": principal_type,
+                "TargetId": account_id,
+                "TargetType": "AWS_ACCOUNT",
+            },
+            compact_prefix="Assign",
+        )
+
+    def grant_to_group_for_account(self, group: TemplateGroup, account_id: str, *, assignments: Any = None) -> None:
+        if assignments is not None:
+            raise ValueError("SsoTemplate doesn't support SsoAssignments matrices")
+        self._assign("GROUP", group.group_name, group.group_id, account_id)
+
+    def grant_to_group_for_accounts(self, group: TemplateGroup, account_ids: Sequence[str]) -> None:
+        for account_id in account_ids:
+            self.grant_to_group_for_account(group, account_id)
+
+    def grant_to_group_for_ou(self, group: TemplateGroup, ou_id: str, *, recursive: bool = True) -> None:
+        self.grant_to_group_for_accounts(group, self._template._accounts_for_ou(ou_id, recursive))
+
+    def grant_to_user_for_account(self, user: TemplateUser, account_id: str, *, assignments: Any = None) -> None:
+        if assignments is not None:
+            raise ValueError("SsoTemplate doesn't support SsoAssignments matrices")
+        self._assign("USER", user.username, user.user_id, account_id)
+
+    def grant_to_user_for_accounts(self, user: TemplateUser, account_ids: Sequence[str]) -> None:
+        for account_id in account_ids:
+            self.grant_to_user_for_account(user, account_id)
+
+    def grant_to_user_for_ou(self, user: TemplateUser, ou_id: str, *, recursive: bool = True) -> None:
+        self.grant_to_user_for_accounts(user, self._template._accounts_for_ou(ou_id, recursive))
+
+
+class SsoTemplate:
+    """
+    Emits the CloudFormation resources for users, groups, memberships, permission sets,
+    and assignments directly as JSON, instead of building an SsoUser, SsoGroup,
+    CfnGroupMembership, CfnPermissionSet, or CfnAssignment construct per resource. Each
+    of those is a round trip through jsii into the Node process, which dominates synth
+    time for large directories. The resources come out exactly as the constructs would
+    render them: same logical IDs, properties, and order, as if every construct were
+    created directly in the stack.
+
+    The stack still creates the SsoUser provider with CDK; service_token is called for
+    its token on the first add_user(). SsoTemplateSynthesizer then merges the emitted
+    resources into the stack's template. Being plain JSON, they aren't visited by aspects
+    (cdk-nag, AssignmentCompactor) and can't be sharded; ValueError is raised for
+    anything the constructs would reject at synth, e.g. duplicate IDs.
+    """
+
+    def __init__(
+        self,
+        *,
+        service_token: Callable[[], Any],
+        tags: Optional[Mapping[str, str]] = None,
+        identity_store_id: str = SsoConfig.identity_store_id.value,
+        instance_arn: str = SsoConfig.instance_arn.value,
+        path_metadata: Optional[str] = None,
+        logical_ids: Optional[LogicalIdMap] = None,
+        ou_accounts: Optional[Callable[[str, bool], List[str]]] = None,
+    ):
+        """
+        tags are added to the taggable resources (permission sets), as Tags.of(stack)
+        would. With path_metadata set to the stack's construct path, resources get the
+        aws:cdk:path metadata CDK adds when aws:cdk:enable-path-metadata is set. With
+        logical_ids, memberships and assignments get compact IDs, as with SsoLogicalIds.
+        ou_accounts(ou_id, recursive) resolves OUs for grant_*_for_ou(), as
+        SsoOrganizations.accounts_for_ou() does.
+        """
+        self.identity_store_id = identity_store_id
+        self.instance_arn = instance_arn
+        self.path_metadata = path_metadata
+        self.logical_ids = logical_ids
+        self.ou_accounts = ou_accounts
+        self._service_token_factory = service_token
+        self._service_token: Any = None
+        # Sorted by key, as CDK's TagManager renders them
+        self._tags = [
+            {"Key": key, "Value": value} for key, value in sorted((tags or {}).items(), key=lambda tag: tag[0].lower())
+        ]
+        # Construct ID of each top-level construct, in creation order (which is the order
+        # CDK renders them in) -> its resources by logical ID
+        self._scopes: Dict[Any, Dict[str, Dict[str, Any]]] = {}
+        self._logical_ids: Dict[str, str] = {}
+
+    def __len__(self) -> int:
+        return len(self._logical_ids)
+
+    @property
+    def service_token(self) -> Any:
+        if self._service_token is None:
+            self._scopes[CDK_SLOT] = {}
+            self._service_token = self._service_token_factory()
+        return self._service_token
+
+    def _accounts_for_ou(self, ou_id: str, recursive: bool) -> List[str]:
+        if self.ou_accounts is None:
+            raise ValueError("This SsoTemplate can't resolve organizational units; pass ou_accounts")
+        return self.ou_accounts(ou_id, recursive)
+
+    def _add_scope(self, scope_id: str) -> str:
+        if scope_id in self._scopes:
+            raise ValueError(f"There is already a Construct with name '{scope_id}' in the stack")
+        self._scopes[scope_id] = {}
+        return scope_id
+
+    def _add_resource(
+        self,
+        scope_id: str,
+        id: str,
+        type: str,
+        properties: Mapping[str, Any],
+        *,
+        compact_prefix: Optional[str] = None,
+        **attributes: Any,
+    ) -> str:
+        compact_id = None
+        if compact_prefix is not None and self.logical_ids is not None:
+            compact_id = self.logical_ids.allocate(f"{scope_id}/{id}", compact_prefix, logical_id(scope_id, id))
+        if compact_id is not None:
+            # As SsoLogicalIds.compact_id() makes the constructs do
+            id = resource_id = compact_id
+        else:
+            resource_id = logical_id(scope_id, id)
+        if resource_id in self._logical_ids:
+            raise ValueError(
+                f"There is already a Construct with name '{id}' in {scope_id}"
+                if self._logical_ids[resource_id] == f"{scope_id}/{id}"
+                else f"Logical ID {resource_id} of {scope_id}/{id} is already used by {self._logical_ids[resource_id]}"
+            )
+        resource = {"Type": type, "Properties": {key: value for key, value in properties.items() if value is not None}}
+        resource.update(attributes)
+        if self.path_metadata is not None:
+            # L1s are their own default child; CustomResource wraps one named "Default"
+            path = f"{scope_id}/{id}/Default" if type.startswith("Custom::") else f"{scope_id}/{id}"
+            resource["Metadata"] = {"aws:cdk:path": f"{self.path_metadata}/{path}"}
+        self._logical_ids[resource_id] = f"{scope_id}/{id}"
+        self._scopes[scope_id][resource_id] = resource
+        return resource_id
+
+    def add_user(self, user_attributes: Mapping[str, str]) -> TemplateUser:
+        """A Custom::SsoUser, as SsoUser(stack, user_attributes=user_attributes) creates."""
+        id = "SsoUser-" + user_attributes["username"]
+        self._add_scope(id)
+        service_token = self.service_token
+        resource_id = self._add_resource(
+            id,
+            id,
+            "Custom::SsoUser",
+            {"ServiceToken": service_token, **user_attributes},
+            UpdateReplacePolicy="Delete",
+            DeletionPolicy="Delete",
+        )
+        return TemplateUser(user_attributes, resource_id)
+
+    def add_group(self, *, group_name: str, description: str) -> TemplateGroup:
+        """An AWS::IdentityStore::Group, as SsoGroup(stack, ...) creates."""
+        id = self._add_scope("SsoGroup-" + group_name)
+        resource_id = self._add_resource(
+            id,
+            id,
+            "AWS::IdentityStore::Group",
+            {"Description": description, "DisplayName": group_name, "IdentityStoreId": self.identity_store_id},
+        )
+        return TemplateGroup(self, id, group_name, get_att(resource_id, "GroupId"))
+
+    def existing_group(self, *, group_name: str, group_id: str) -> TemplateGroup:
+        """A group created outside the stack, as SsoGroup.from_existing_group() references."""
+        return TemplateGroup(self, self._add_scope("SsoGroup" + group_name), group_name, group_id)
+
+    def add_permission_set(
+        self,
+        *,
+        name: str,
+        description: Optional[str] = None,
+        inline_policy: Any = None,
+        managed_policies: Optional[Sequence[str]] = None,
+        customer_managed_policy_references: Optional[Sequence[Mapping[str, str]]] = None,
+        permissions_boundary: Optional[Mapping[str, Any]] = None,
+        relay_state_type: Optional[str] = None,
+        session_duration: Optional[str] = None,
+    ) -> TemplatePermissionSet:
+        """
+        An AWS::SSO::PermissionSet, as SsoPermissionSet(stack, ...) creates. Values are
+        taken as CloudFormation JSON, e.g. an inline policy document as a dict and
+        customer managed policy references as {"Name": ..., "Path": ...}.
+        """
+        id = self._add_scope("SsoPermissionSet_" + name)
+        resource_id = self._add_resource(
+            id,
+            id,
+            "AWS::SSO::PermissionSet",
+            {
+                "CustomerManagedPolicyReferences": customer_managed_policy_references,
+                "Description": description,
+                "InlinePolicy": inline_policy,
+                "InstanceArn": self.instance_arn,
+                "ManagedPolicies": managed_policies,
+                "Name": name,
+                "PermissionsBoundary": permissions_boundary,
+                "RelayStateType": relay_state_type,
+                "SessionDuration": session_duration,
+                "Tags": self._tags or None,
+            },
+        )
+        return TemplatePermissionSet(self, id, name, get_att(resource_id, "PermissionSetArn"))
+
+    def existing_permission_set(self, *, permission_set_name: str, permission_set_arn: str) -> TemplatePermissionSet:
+        """
+        A permission set created outside the stack, as
+        SsoPermissionSet.from_existing_permission_set() references.
+        """
+        id = self._add_scope("SsoPermissionSet_" + permission_set_name)
+        return TemplatePermissionSet(self, id, permission_set_name, permission_set_arn)
+
+    def merge(self, cdk_resources: Mapping[str, Any]) -> Dict[str, Any]:
+        """
+        The emitted resources with cdk_resources, those CDK synthesized, where the
+        provider was created (the first add_user()), or else after them. CDKMetadata,
+        which CDK adds last, stays last.
+        """
+        resources: Dict[str, Any] = {}
+        cdk_resources = dict(cdk_resources)
+        metadata = cdk_resources.pop("CDKMetadata", None)
+        if CDK_SLOT not in self._scopes:
+            self._scopes[CDK_SLOT] = {}
+        for scope_id, scope_resources in self._scopes.items():
+            for resource_id, resource in (cdk_resources if scope_id is CDK_SLOT else scope_resources).items():
+                if resource_id in resources:
+                    raise ValueError(f"Logical ID {resource_id} is used by both CDK and SsoTemplate")
+                resources[resource_id] = resource
+        if metadata is not None:
+            resources["CDKMetadata"] = metadata
+        return resources
+
+
+def merge_template(template_text: str, template: SsoTemplate, *, max_resources: int = MAX_RESOURCES) -> str:
+    """
+    A CDK-synthesized template file's contents with template's resources merged in,
+    serialized the way CDK serializes it (JSON.stringify() with an indent of 1, or none).
+    """
+    cdk_template = json.loads(template_text)
+    cdk_template["Resources"] = template.merge(cdk_template.get("Resources", {}))
+    count = len(cdk_template["Resources"])
+    if max_resources and count > max_resources:
+        raise ValueError(f"Number of resources: {count} is greater than allowed maximum of {max_resources}")
+    if template_text.startswith("{\n"):
+        return json.dumps(cdk_template, indent=1, ensure_ascii=False)
+    return json.dumps(cdk_template, separators=(",", ":"), ensure_ascii=False)
+
+
+class SsoTemplateSynthesizer(SsoStackSynthesizer):
+    """
+    An SsoStackSynthesizer that merges an SsoTemplate's resources into the template CDK
+    writes, before the template is measured and hashed as an asset, so the asset
+    manifest and cdk deploy see the merged template.
+    """
+
+    def __init__(self, template: SsoTemplate, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.template = template
+
+    def rewrite_template(self, template_text: str) -> str:
+        limit = self._bound_stack.node.try_get_context("@aws-cdk/core:stackResourceLimit")
+        return merge_template(template_text, self.template, max_resources=MAX_RESOURCES if limit is None else int(limit))
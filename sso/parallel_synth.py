@@ -0,0 +1,155 @@
+"""
+Synthesizes one SsoStack per environment (see sso.environments) in parallel worker
+processes, then merges their cloud assemblies into one, which the CDK CLI deploys like
+any other. Each environment's synth runs on its own jsii runtime, so synth takes about as
+long as the slowest environment instead of the sum of all of them.
+"""
+
+import json
+import multiprocessing
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Dict, List, Mapping, Optional, Sequence, Set, Tuple
+
+import aws_cdk as cdk
+
+from .config import SsoEnvironment
+from .environments import create_stacks
+
+# Written by each worker; merged rather than copied
+MANIFEST_FILE = "manifest.json"
+TREE_FILE = "tree.json"
+
+# Where workers write their assemblies, below the output directory
+WORK_DIR = ".environments"
+
+
+def _synth_environment(
+    environment: SsoEnvironment,
+    outdir: str,
+    context: Optional[Mapping[str, Any]],
+    stack_kwargs: Mapping[str, Any],
+) -> Tuple[str, float]:
+    """Runs in a worker: synthesizes environment's stack into outdir."""
+    start = time.perf_counter()
+    # Context from the CLI (CDK_CONTEXT_JSON) is inherited through the environment
+    app = cdk.App(outdir=outdir, context=dict(context) if context is not None else None)
+    create_stacks(app, [environment], **stack_kwargs)
+    app.synth()
+    return outdir, time.perf_counter() - start
+
+
+def synth_environments(
+    environments: Sequence[SsoEnvironment],
+    *,
+    outdir: str,
+    workers: Optional[int] = None,
+    context: Optional[Mapping[str, Any]] = None,
+    **stack_kwargs: Any,
+) -> Dict[str, float]:
+    """
+    Synthesizes every environment's stack, workers at a time (by default, as many as
+    there are environments, up to the number of CPUs), into a single cloud assembly in
+    outdir. stack_kwargs go to each SsoStack. Returns each environment's synth time in
+    seconds. With workers=1, environments are synthesized one after another in this
+    process instead.
+    """
+    names = [environment.name for environment in environments]
+    if len(set(names)) != len(names):
+        raise ValueError(f"Duplicate environment names in {', '.join(names)}")
+    work_dir = os.path.join(outdir, WORK_DIR)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    jobs = [
+        (environment, os.path.join(work_dir, environment.name), context, stack_kwargs)
+        for environment in environments
+    ]
+
+    workers = workers or min(len(environments), os.cpu_count() or 1)
+    results: List[Tuple[str, float]] = []
+    if workers == 1:
+        results = [_synth_environment(*job) for job in jobs]
+    else:
+        # Spawned rather than forked: a forked jsii runtime would share the parent's
+        # node process, if it has one
+        with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context("spawn")) as executor:
+            futures = [executor.submit(_synth_environment, *job) for job in jobs]
+            for name, future in zip(names, futures):
+                try:
+                    results.append(future.result())
+                except Exception as error:
+                    raise RuntimeError(f"Synth of environment {name} failed: {error}") from error
+
+    merge_assemblies([directory for directory, _ in results], outdir)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    return {name: seconds for name, (_, seconds) in zip(names, results)}
+
+
+def merge_assemblies(directories: Sequence[str], outdir: str) -> None:
+    """
+    Moves the cloud assemblies in directories into outdir, combining their manifests
+    and construct trees. Their apps must not have stacks (or other artifacts) in common;
+    files they share, such as content-hashed assets, must be identical.
+    """
+    os.makedirs(outdir, exist_ok=True)
+    manifest: Dict[str, Any] = {}
+    tree: Dict[str, Any] = {}
+    # Entries moved so far; others in outdir are left over from an earlier synth
+    moved: Set[str] = set()
+    for directory in directories:
+        with open(os.path.join(directory, MANIFEST_FILE), encoding="utf-8") as f:
+            _merge_manifest(manifest, json.load(f), directory)
+        tree_path = os.path.join(directory, TREE_FILE)
+        if os.path.exists(tree_path):
+            with open(tree_path, encoding="utf-8") as f:
+                _merge_tree(tree, json.load(f))
+        for entry in os.listdir(directory):
+            if entry in (MANIFEST_FILE, TREE_FILE):
+                continue
+            _move(os.path.join(directory, entry), os.path.join(outdir, entry), merging=entry in moved)
+            moved.add(entry)
+
+    if not manifest["missing"]:
+        del manifest["missing"]
+    with open(os.path.join(outdir, MANIFEST_FILE), "w", encoding="utf-8") as f:
+        json.dump(manifest, f, indent=2)
+    if tree:
+        with open(os.path.join(outdir, TREE_FILE), "w", encoding="utf-8") as f:
+            json.dump(tree, f, indent=2)
+
+
+def _merge_manifest(manifest: Dict[str, Any], other: Dict[str, Any], directory: str) -> None:
+    if not manifest:
+        manifest.update(other, artifacts={}, missing=[])
+    elif other["version"] != manifest["version"]:
+        raise ValueError(f"{directory} is a version {other['version']} cloud assembly, not {manifest['version']}")
+    for artifact_id, artifact in other.get("artifacts", {}).items():
+        existing = manifest["artifacts"].get(artifact_id)
+        if existing is not None and existing != artifact:
+            raise ValueError(f"Artifact {artifact_id} in {directory} conflicts with another environment's")
+        manifest["artifacts"][artifact_id] = artifact
+    for missing in other.get("missing", []):
+        if missing not in manifest["missing"]:
+            manifest["missing"].append(missing)
+
+
+def _merge_tree(tree: Dict[str, Any], other: Dict[str, Any]) -> None:
+    if not tree:
+        tree.update(other)
+        return
+    tree["tree"].setdefault("children", {}).update(other["tree"].get("children", {}))
+
+
+def _move(source: str, destination: str, *, merging: bool) -> None:
+    if os.path.isdir(source):
+        # Asset directories are named after a hash of their content
+        if not os.path.exists(destination):
+            os.replace(source, destination)
+        return
+    if merging:
+        with open(source, "rb") as f, open(destination, "rb") as g:
+            if f.read() != g.read():
+                raise ValueError(f"{os.path.basename(source)} differs between environments")
+        return
+    os.replace(source, destination)
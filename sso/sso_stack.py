@@ -1,42 +1,139 @@
-from typing import Any
+from typing import Any, Literal, Optional, Union
 
-from aws_cdk import Aspects, Stack, Tags
+from aws_cdk import Aspects, Environment, Stack, Tags
 from aws_cdk import aws_iam as iam
-from cdk_nag import AwsSolutionsChecks
 from constructs import Construct
 
-from . import AwsAccounts, SsoConfig
+from .config import ENVIRONMENT_METADATA_TYPE, SsoEnvironment
+from .directory_loader import DirectoryLoader
+from .fast_template import (
+    SsoTemplate,
+    SsoTemplateSynthesizer,
+    TemplateGroup,
+    TemplatePermissionSet,
+    TemplateUser
+)
 from .constructs import (
+    AssignmentCompactor,
     SsoGroup,
     SsoPermissionSet,
+    SsoShardRouter,
     SsoUser,
     SsoUserAttributes
 )
+from .constructs.sso_logical_ids import SsoLogicalIds
+from .constructs.sso_nag import NagMode, SsoNagChecks
+from .constructs.sso_organizations import SsoOrganizations
+from .constructs.sso_user_provider import SsoUserProvider
+from .template_size import SsoStackSynthesizer
+
+# Added to all taggable resources created in this stack
+TAGS = {
+    "created-by-cdk": "true",
+    "cdk-project-name": "cdk-sso",
+}
 
 
 class SsoStack(Stack):
-    def __init__(self, scope: Construct, construct_id: str, **kwargs: Any) -> None:
+    def __init__(
+        self,
+        scope: Construct,
+        construct_id: str,
+        *,
+        shard_count: Optional[int] = None,
+        nag_checks: bool = True,
+        nag_mode: Optional[NagMode] = None,
+        nag_cache_file: Optional[str] = None,
+        fast_synth: bool = False,
+        logical_ids_file: Optional[str] = None,
+        sso_environment: Optional[SsoEnvironment] = None,
+        compact_assignments: Optional[Literal["report", "remove"]] = None,
+        **kwargs: Any,
+    ) -> None:
+        # The Identity Center instance to deploy to, read by the constructs with
+        # SsoEnvironment.of(); SsoConfig and AwsAccounts unless given. The stack is
+        # deployed to the environment's SSO account and region unless env is given.
+        self.sso_environment = sso_environment or SsoEnvironment.default()
+        if sso_environment is not None:
+            kwargs.setdefault(
+                "env", Environment(account=sso_environment.sso_account, region=sso_environment.sso_region)
+            )
+        # With fast_synth, users, groups, memberships, permission sets, and assignments
+        # are emitted as JSON by SsoTemplate instead of as constructs, and only the
+        # SsoUser provider is built with CDK. The template is the same either way.
+        self.template: Optional[SsoTemplate] = None
+        if fast_synth:
+            if shard_count:
+                raise ValueError("fast_synth can't be combined with shard_count")
+            if "synthesizer" in kwargs:
+                raise ValueError("fast_synth uses its own synthesizer, SsoTemplateSynthesizer")
+            self.template = SsoTemplate(
+                service_token=lambda: self.resolve(SsoUserProvider.get_or_create(self).service_token),
+                tags=TAGS,
+                identity_store_id=self.sso_environment.identity_store_id,
+                instance_arn=self.sso_environment.instance_arn,
+                ou_accounts=lambda ou_id, recursive: SsoOrganizations.get_or_create(self).accounts_for_ou(
+                    ou_id, recursive=recursive
+                ),
+            )
+            kwargs["synthesizer"] = SsoTemplateSynthesizer(self.template)
+        # Reports the template's size by resource type at synth, and warns as it nears
+        # CloudFormation's limit
+        kwargs.setdefault("synthesizer", SsoStackSynthesizer())
         super().__init__(scope, construct_id, **kwargs)
+        # Recorded in the cloud assembly, for resolving account names offline (see
+        # sso.access_index); not part of the template
+        self.node.add_metadata(
+            ENVIRONMENT_METADATA_TYPE,
+            {"name": self.sso_environment.name, "accounts": dict(self.sso_environment.accounts)},
+        )
+        # E.g. the environment's own directory files (sso:usersFile)
+        for key, value in self.sso_environment.context.items():
+            self.node.set_context(key, value)
+        if self.template is not None and self.node.try_get_context("aws:cdk:enable-path-metadata"):
+            self.template.path_metadata = self.node.path
+
+        # Give memberships and assignments short hashed logical IDs, which shrinks large
+        # templates, except for those already deployed, as recorded in logical_ids_file
+        if logical_ids_file:
+            logical_ids = SsoLogicalIds.get_or_create(self, mapping_file=logical_ids_file)
+            if self.template is not None:
+                self.template.logical_ids = logical_ids.map
 
-        # Apply cdk-nag linting for (common) security best practices
-        Aspects.of(self).add(AwsSolutionsChecks())
+        # Apply cdk-nag linting for (common) security best practices. Only turn this off
+        # to measure synth without it, e.g. in benchmarks/synth_scaling.py. nag_mode (or
+        # -c sso:nagMode=...) picks how much of the stack is checked, see SsoNagChecks;
+        # NagMode.SCOPED doesn't slow down as the directory grows.
+        nag_mode = NagMode(nag_mode or self.node.try_get_context("sso:nagMode") or NagMode.FULL)
+        if nag_checks and nag_mode != NagMode.OFF:
+            SsoNagChecks.get_or_create(self, mode=nag_mode, cache_file=nag_cache_file)
+
+        # Opt-in: with "report", fail synth on user assignments a group already grants and
+        # on duplicate group grants; with "remove", drop them from the template instead
+        if compact_assignments is not None:
+            if compact_assignments not in ("report", "remove"):
+                raise ValueError(f'compact_assignments must be "report" or "remove", not {compact_assignments!r}')
+            Aspects.of(self).add(AssignmentCompactor(remove=compact_assignments == "remove"))
 
         # Auto-assign tags to all taggable resources created in this stack
-        Tags.of(self).add(key="created-by-cdk", value="true")
-        Tags.of(self).add(key="cdk-project-name", value="cdk-sso")
+        for key, value in TAGS.items():
+            Tags.of(self).add(key=key, value=value)
+
+        # Spread users, memberships, and assignments over nested stacks once the directory
+        # outgrows a single stack's 500 resources. Must be set before the first deploy.
+        if shard_count:
+            SsoShardRouter.get_or_create(self, shard_count=shard_count)
 
-        user_foo = SsoUser(
-            self,
-            user_attributes=SsoUserAttributes(
+        user_foo = self._user(
+            SsoUserAttributes(
                 email="someuser1@",
                 username="username",    # can be same as email, if you want
                 first_name="Foo",
                 last_name="Foo",
             ),
         )
-        user_bar = SsoUser(
-            self,
-            user_attributes=SsoUserAttributes(
+        user_bar = self._user(
+            SsoUserAttributes(
                 email="someuser2@",
                 username="username2",    # can be same as email, if you want
                 first_name="Bar",
@@ -53,76 +150,62 @@ class SsoStack(Stack):
         #
         # If you're not using Control Tower or don't want to use the SSO
         #  resources it created, you can remove the imports below. 
-        SsoPermissionSet.from_existing_permission_set(
-            self,
+        self._existing_permission_set(
             permission_set_name="AWSOrganizationsFullAccess",
-            permission_set_arn=f"{SsoConfig.instance_arn.value}/ps-xxxxxxxxxxxxxx",       # You will need to look up "xxxxxxxxxxxxxx" from IAM Identity Center/SSO
+            permission_set_arn=f"{self.sso_environment.instance_arn}/ps-xxxxxxxxxxxxxx",       # You will need to look up "xxxxxxxxxxxxxx" from IAM Identity Center/SSO
         )
-        readonly_permissions = SsoPermissionSet.from_existing_permission_set(
-            self,
+        readonly_permissions = self._existing_permission_set(
             permission_set_name="AWSReadOnlyAccess",
-            permission_set_arn=f"{SsoConfig.instance_arn.value}/ps-xxxxxxxxxxxxxx",
+            permission_set_arn=f"{self.sso_environment.instance_arn}/ps-xxxxxxxxxxxxxx",
         )
-        admin_permissions = SsoPermissionSet.from_existing_permission_set(
-            self,
+        admin_permissions = self._existing_permission_set(
             permission_set_name="AWSAdministratorAccess",
-            permission_set_arn=f"{SsoConfig.instance_arn.value}/ps-xxxxxxxxxxxxxx",
+            permission_set_arn=f"{self.sso_environment.instance_arn}/ps-xxxxxxxxxxxxxx",
         )
-        SsoPermissionSet.from_existing_permission_set(
-            self,
+        self._existing_permission_set(
             permission_set_name="AWSPowerUserAccess",
-            permission_set_arn=f"{SsoConfig.instance_arn.value}/ps-xxxxxxxxxxxxxx",
+            permission_set_arn=f"{self.sso_environment.instance_arn}/ps-xxxxxxxxxxxxxx",
         )
-        SsoPermissionSet.from_existing_permission_set(
-            self,
+        self._existing_permission_set(
             permission_set_name="AWSServiceCatalogEndUserAccess",
-            permission_set_arn=f"{SsoConfig.instance_arn.value}/ps-xxxxxxxxxxxxxx",
+            permission_set_arn=f"{self.sso_environment.instance_arn}/ps-xxxxxxxxxxxxxx",
         )
-        SsoPermissionSet.from_existing_permission_set(
-            self,
+        self._existing_permission_set(
             permission_set_name="AWSServiceCatalogAdminFullAccess",
-            permission_set_arn=f"{SsoConfig.instance_arn.value}/ps-xxxxxxxxxxxxxx",
+            permission_set_arn=f"{self.sso_environment.instance_arn}/ps-xxxxxxxxxxxxxx",
         )
         # ========== AWS Control Tower Groups =========#
         # Same comments as above. You don't need to import these values if you're
         # not using Control Tower or don't want to use them in this project
-        ctt_account_factory_group = SsoGroup.from_existing_group(
-            self,
+        ctt_account_factory_group = self._existing_group(
             group_name="AWSAccountFactory",
             group_id="xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx", # You need to look these up for your account's specific groups
         )
-        ctt_audit_account_admin_group = SsoGroup.from_existing_group(
-            self,
+        ctt_audit_account_admin_group = self._existing_group(
             group_name="AWSAuditAccountAdmins",
             group_id="xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx",
         )
-        ctt_service_catalog_admin_group = SsoGroup.from_existing_group(
-            self,
+        ctt_service_catalog_admin_group = self._existing_group(
             group_name="AWSServiceCatalogAdmins",
             group_id="xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx",
         )
-        ctt_security_audit_poweruser_group = SsoGroup.from_existing_group(
-            self,
+        ctt_security_audit_poweruser_group = self._existing_group(
             group_name="AWSSecurityAuditPowerUsers",
             group_id="xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx",
         )
-        ctt_log_archive_admin_group = SsoGroup.from_existing_group(
-            self,
+        ctt_log_archive_admin_group = self._existing_group(
             group_name="AWSLogArchiveAdmins",
             group_id="xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx",
         )
-        ctt_control_tower_admin_group = SsoGroup.from_existing_group(
-            self,
+        ctt_control_tower_admin_group = self._existing_group(
             group_name="AWSControlTowerAdmins",
             group_id="xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx",
         )
-        ctt_security_auditors_group = SsoGroup.from_existing_group(
-            self,
+        ctt_security_auditors_group = self._existing_group(
             group_name="AWSSecurityAuditors",
             group_id="xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx",
         )
-        ctt_log_archive_viewer_group = SsoGroup.from_existing_group(
-            self,
+        ctt_log_archive_viewer_group = self._existing_group(
             group_name="AWSLogArchiveViewers",
             group_id="xxxxxxxx-xxxx-xxxx-xxxx-xxxxxxxxxxxx",
         )
@@ -139,8 +222,7 @@ class SsoStack(Stack):
         # ===== END OF CONTROL TOWER GROUPS & PERMISSION SETS =====#
 
         # Create a custom permission set. Wrapper around aws_sso.CfnPermissionSet
-        demo_permission_set = SsoPermissionSet(
-            self,
+        demo_permission_set = self._permission_set(
             name="DemoPermissionSet",
             description="demo permission set",
             inline_policy=iam.PolicyDocument(
@@ -151,12 +233,11 @@ class SsoStack(Stack):
                         resources=["*"],
                     )
                 ]
-            ).to_string()
+            ),
         )
 
         # Create a group
-        demo_group = SsoGroup(
-            self,
+        demo_group = self._group(
             group_name="Demo User Group",
             description="Admin and read-only role to sandbox account",
         )
@@ -164,5 +245,63 @@ class SsoStack(Stack):
         # add user(s) to a group
         demo_group.add_users(all_users)
 
-        # add permission set to a group
-        demo_permission_set.grant_to_group_for_account(demo_group, AwsAccounts.SANDBOX.value)
\ No newline at end of file
+        # add permission set to a group, for the environment's sandbox account if it has one
+        sandbox_account_id = self.sso_environment.account_id("SANDBOX")
+        if sandbox_account_id is not None:
+            demo_permission_set.grant_to_group_for_account(demo_group, sandbox_account_id)
+
+        # Optionally load more groups, users, and group assignments from directory files
+        # (CSV, JSON Lines, or YAML), e.g.:
+        #   cdk synth -c sso:groupsFile=groups.yaml -c sso:usersFile=users.csv -c sso:assignmentsFile=assignments.jsonl
+        directory_files = [
+            (self.node.try_get_context("sso:groupsFile"), DirectoryLoader.load_groups),
+            (self.node.try_get_context("sso:usersFile"), DirectoryLoader.load_users),
+            (self.node.try_get_context("sso:assignmentsFile"), DirectoryLoader.load_assignments),
+        ]
+        if any(path for path, _ in directory_files):
+            loader = DirectoryLoader(
+                self,
+                template=self.template,
+                groups=all_control_tower_default_groups + [demo_group],
+                permission_sets=[readonly_permissions, admin_permissions, demo_permission_set],
+            )
+            for path, load in directory_files:
+                if path:
+                    load(loader, path)
+
+    # Each of the following creates a construct, or with fast_synth, its SsoTemplate stand-in
+
+    def _user(self, user_attributes: SsoUserAttributes) -> Union[SsoUser, TemplateUser]:
+        if self.template is not None:
+            return self.template.add_user(user_attributes)
+        return SsoUser(self, user_attributes=user_attributes)
+
+    def _group(self, *, group_name: str, description: str) -> Union[SsoGroup, TemplateGroup]:
+        if self.template is not None:
+            return self.template.add_group(group_name=group_name, description=description)
+        return SsoGroup(self, group_name=group_name, description=description)
+
+    def _existing_group(self, *, group_name: str, group_id: str) -> Union[SsoGroup, TemplateGroup]:
+        if self.template is not None:
+            return self.template.existing_group(group_name=group_name, group_id=group_id)
+        return SsoGroup.from_existing_group(self, group_name=group_name, group_id=group_id)
+
+    def _permission_set(
+        self, *, name: str, description: str, inline_policy: iam.PolicyDocument
+    ) -> Union[SsoPermissionSet, TemplatePermissionSet]:
+        if self.template is not None:
+            return self.template.add_permission_set(
+                name=name, description=description, inline_policy=self.resolve(inline_policy)
+            )
+        return SsoPermissionSet(self, name=name, description=description, inline_policy=inline_policy.to_string())
+
+    def _existing_permission_set(
+        self, *, permission_set_name: str, permission_set_arn: str
+    ) -> Union[SsoPermissionSet, TemplatePermissionSet]:
+        if self.template is not None:
+            return self.template.existing_permission_set(
+                permission_set_name=permission_set_name, permission_set_arn=permission_set_arn
+            )
+        return SsoPermissionSet.from_existing_permission_set(
+            self, permission_set_name=permission_set_name, permission_set_arn=permission_set_arn
+        )
@@ -0,0 +1,135 @@
+import hashlib
+import json
+import os
+from typing import Any, Dict, Optional
+
+from aws_cdk import Annotations, DefaultStackSynthesizer, FileAssetPackaging, FileAssetSource, Stack
+
+from .constructs.sso_shard_router import SsoShardRouter
+
+# CloudFormation's limit on the size of a template uploaded to S3, which is how CDK
+# deploys them
+TEMPLATE_SIZE_LIMIT = 1024 * 1024
+
+# Share of TEMPLATE_SIZE_LIMIT past which synth warns, like CDK does for resource counts
+WARNING_THRESHOLD = 0.8
+
+# Resource types spelled out in a warning
+TYPES_IN_WARNING = 3
+
+
+def template_size_report(template_text: str, *, limit: int = TEMPLATE_SIZE_LIMIT) -> Dict[str, Any]:
+    """
+    The size of a template in bytes, and how much of it each resource type takes up,
+    largest first. A resource's bytes are those of its entry in the template as
+    serialized (so including its logical ID and indentation); what isn't in any resource
+    (parameters, outputs, and so on) is counted in other_bytes.
+    """
+    template = json.loads(template_text)
+    indent = 1 if template_text.startswith("{\n") else None
+    types: Dict[str, Dict[str, int]] = {}
+    for resource_id, resource in template.get("Resources", {}).items():
+        entry = types.setdefault(resource.get("Type", "?"), {"resources": 0, "bytes": 0})
+        entry["resources"] += 1
+        entry["bytes"] += _entry_size(resource_id, resource, indent)
+    total = len(template_text.encode("utf-8"))
+    return {
+        "bytes": total,
+        "limit": limit,
+        "share_of_limit": round(total / limit, 4),
+        "resources": sum(entry["resources"] for entry in types.values()),
+        "types": [
+            {"type": type, **entry, "share": round(entry["bytes"] / total, 4)}
+            for type, entry in sorted(types.items(), key=lambda item: -item[1]["bytes"])
+        ],
+        "other_bytes": total - sum(entry["bytes"] for entry in types.values()),
+    }
+
+
+def _entry_size(resource_id: str, resource: Any, indent: Optional[int]) -> int:
+    if indent is None:
+        # "Id":{...}, i.e. without the braces around it but with a comma
+        return len(json.dumps({resource_id: resource}, separators=(",", ":"), ensure_ascii=False).encode("utf-8")) - 1
+    # Resources are two levels deep, one more than the entry's lines are indented here;
+    # plus a newline per line and the comma after the entry
+    text = json.dumps({resource_id: resource}, indent=indent, ensure_ascii=False)
+    lines = text.split("\n")[1:-1]
+    return sum(len(line.encode("utf-8")) + indent + 1 for line in lines) + 1
+
+
+def size_warning(template_file: str, report: Dict[str, Any]) -> Optional[str]:
+    """A message if the template is past WARNING_THRESHOLD of the limit, else None."""
+    if report["share_of_limit"] < WARNING_THRESHOLD:
+        return None
+    largest = ", ".join(
+        f"{entry['type']} {entry['share']:.0%} ({entry['resources']} resources)"
+        for entry in report["types"][:TYPES_IN_WARNING]
+    )
+    return (
+        f"{template_file} is {report['bytes']} bytes, {report['share_of_limit']:.0%} of CloudFormation's "
+        f"{report['limit']} byte template size limit. Largest: {largest}. Consider compact logical IDs "
+        f"(SsoStack(logical_ids_file=...)), suppress_template_indentation=True, or more shards."
+    )
+
+
+class SsoStackSynthesizer(DefaultStackSynthesizer):
+    """
+    A DefaultStackSynthesizer that reports the size of the stack's template, and of its
+    SsoShardRouter shards' templates, by resource type. The report is written next to
+    the template as <stack>.template-size.json, and synth warns about any template
+    nearing CloudFormation's size limit, or fails for one past it. Subclasses can
+    rewrite the template before it's measured and hashed as an asset.
+    """
+
+    def __init__(self, *, template_size_limit: int = TEMPLATE_SIZE_LIMIT, **kwargs: Any):
+        super().__init__(**kwargs)
+        self.template_size_limit = template_size_limit
+
+    def reusable_bind(self, stack: Stack) -> "SsoStackSynthesizer":
+        # CDK binds a copy of the synthesizer by default, and the copy's calls to the
+        # overridden method below wouldn't reach this object; so bind this one instead
+        self.bind(stack)
+        return self
+
+    def rewrite_template(self, template_text: str) -> str:
+        return template_text
+
+    def _synthesize_template(self, session: Any, lookup_role_arn: Optional[str] = None) -> FileAssetSource:
+        source = super()._synthesize_template(session, lookup_role_arn)
+        outdir = session.assembly.outdir
+        path = os.path.join(outdir, source.file_name)
+        with open(path, encoding="utf-8") as f:
+            template_text = f.read()
+        rewritten = self.rewrite_template(template_text)
+        if rewritten != template_text:
+            with open(path, "w", encoding="utf-8") as f:
+                f.write(rewritten)
+            source = FileAssetSource(
+                file_name=source.file_name,
+                packaging=FileAssetPackaging.FILE,
+                source_hash=hashlib.sha256(rewritten.encode("utf-8")).hexdigest(),
+            )
+
+        stack = self._bound_stack
+        # Nested stacks are synthesized before their parent, so the shards' are written
+        templates = {source.file_name: rewritten}
+        router = SsoShardRouter.find(stack)
+        for shard in router.shards if router is not None else []:
+            with open(os.path.join(outdir, shard.template_file), encoding="utf-8") as f:
+                templates[shard.template_file] = f.read()
+        reports = {
+            template_file: template_size_report(text, limit=self.template_size_limit)
+            for template_file, text in templates.items()
+        }
+        report_file = source.file_name.replace(".template.json", ".template-size.json")
+        with open(os.path.join(outdir, report_file), "w", encoding="utf-8") as f:
+            json.dump(reports, f, indent=1)
+        for template_file, report in reports.items():
+            message = size_warning(template_file, report)
+            if message is None:
+                continue
+            if report["bytes"] > report["limit"]:
+                Annotations.of(stack).add_error(message)
+            else:
+                Annotations.of(stack).add_warning(message)
+        return source
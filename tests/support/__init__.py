@@ -0,0 +1 @@
+"""Fakes and helpers shared by the unit tests and the benchmarks."""
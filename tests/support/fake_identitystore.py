@@ -0,0 +1,228 @@
+"""
+An in-process stand-in for the identitystore API, for testing and benchmarking the
+sso_user handler without an AWS account. It implements the user, group, and group membership calls the
+handler makes, with the same request and response shapes as boto3, plus:
+
+- latency: every call sleeps latency_ms (+/- jitter_ms) before answering
+- throttling: each API has its own token bucket of throttle_rate requests per second;
+  calls that find it empty raise a ThrottlingException shaped like botocore's ClientError
+- call counts per API (CreateUser, ListUsers, ...), counting throttled attempts separately
+"""
+import copy
+import random
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+
+
+class FakeClientError(Exception):
+    """Duck-types botocore's ClientError: the handler only looks at error.response."""
+
+    def __init__(self, code: str, message: str, operation_name: str):
+        super().__init__(f"An error occurred ({code}) when calling the {operation_name} operation: {message}")
+        self.response = {"Error": {"Code": code, "Message": message}}
+
+
+class FakeIdentityStore:
+    def __init__(
+        self,
+        *,
+        latency_ms: float = 0.0,
+        jitter_ms: float = 0.0,
+        throttle_rate: Optional[float] = None,
+        seed: int = 0,
+    ):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.throttle_rate = throttle_rate
+        self.calls: Dict[str, int] = {}
+        self.throttled: Dict[str, int] = {}
+        self._users: Dict[str, Dict[str, Any]] = {}
+        # So the fake's own lookups don't slow down with the number of users
+        self._user_ids_by_username: Dict[str, str] = {}
+        self._groups: Dict[str, Dict[str, Any]] = {}
+        self._memberships: Dict[str, Dict[str, Any]] = {}
+        self._buckets: Dict[str, List[float]] = {}
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def seed_users(self, users: List[Dict[str, Any]], identity_store_id: str) -> None:
+        """Adds users as if created outside of CloudFormation, without counting any calls."""
+        with self._lock:
+            for attributes in users:
+                self._put(attributes, identity_store_id)
+
+    def seed_group(self, display_name: str, identity_store_id: str) -> str:
+        """Adds a group, without counting any calls. Returns its ID."""
+        with self._lock:
+            group_id = self._new_id()
+            self._groups[group_id] = {
+                "GroupId": group_id,
+                "DisplayName": display_name,
+                "IdentityStoreId": identity_store_id,
+            }
+            return group_id
+
+    def seed_membership(self, group_id: str, user_id: str, identity_store_id: str) -> str:
+        """Adds a user to a group, without counting any calls. Returns the membership ID."""
+        with self._lock:
+            return self._put_membership(group_id, user_id, identity_store_id)
+
+    def members(self, group_id: str) -> List[str]:
+        """User IDs of a group's members, sorted."""
+        with self._lock:
+            return sorted(
+                membership["MemberId"]["UserId"]
+                for membership in self._memberships.values()
+                if membership["GroupId"] == group_id
+            )
+
+    def reset_counts(self) -> None:
+        with self._lock:
+            self.calls = {}
+            self.throttled = {}
+
+    @property
+    def user_count(self) -> int:
+        return len(self._users)
+
+    def _begin(self, api: str) -> None:
+        with self._lock:
+            if self.throttle_rate is not None:
+                tokens, updated_at = self._buckets.get(api, [self.throttle_rate, time.monotonic()])
+                now = time.monotonic()
+                tokens = min(self.throttle_rate, tokens + (now - updated_at) * self.throttle_rate)
+                if tokens < 1:
+                    self._buckets[api] = [tokens, now]
+                    self.throttled[api] = self.throttled.get(api, 0) + 1
+                    raise FakeClientError("ThrottlingException", "Rate exceeded", api)
+                self._buckets[api] = [tokens - 1, now]
+            self.calls[api] = self.calls.get(api, 0) + 1
+            delay_ms = self.latency_ms + self._random.uniform(-self.jitter_ms, self.jitter_ms)
+        if delay_ms > 0:
+            time.sleep(delay_ms / 1000)
+
+    def _new_id(self) -> str:
+        return str(uuid.UUID(int=self._random.getrandbits(128)))
+
+    def _put(self, attributes: Dict[str, Any], identity_store_id: str) -> str:
+        user_id = self._new_id()
+        self._users[user_id] = dict(copy.deepcopy(attributes), UserId=user_id, IdentityStoreId=identity_store_id)
+        self._user_ids_by_username[attributes["UserName"]] = user_id
+        return user_id
+
+    def _user(self, user_id: str, api: str) -> Dict[str, Any]:
+        user = self._users.get(user_id)
+        if user is None:
+            raise FakeClientError("ResourceNotFoundException", f"User {user_id} not found", api)
+        return user
+
+    def _put_membership(self, group_id: str, user_id: str, identity_store_id: str) -> str:
+        membership_id = self._new_id()
+        self._memberships[membership_id] = {
+            "MembershipId": membership_id,
+            "GroupId": group_id,
+            "MemberId": {"UserId": user_id},
+            "IdentityStoreId": identity_store_id,
+        }
+        return membership_id
+
+    @staticmethod
+    def _page(key: str, items: List[Dict[str, Any]], max_results: int, next_token: Optional[str]) -> Dict[str, Any]:
+        start = int(next_token or 0)
+        response: Dict[str, Any] = {key: copy.deepcopy(items[start : start + max_results])}
+        if start + max_results < len(items):
+            response["NextToken"] = str(start + max_results)
+        return response
+
+    def list_users(
+        self,
+        *,
+        IdentityStoreId: str,
+        Filters: Optional[List[Dict[str, str]]] = None,
+        MaxResults: int = 100,
+        NextToken: Optional[str] = None,
+    ) -> Dict[str, Any]:
+        self._begin("ListUsers")
+        with self._lock:
+            if Filters:
+                # identitystore only supports filtering on UserName
+                (filter,) = Filters
+                user_id = self._user_ids_by_username.get(filter["AttributeValue"])
+                users = [self._users[user_id]] if user_id else []
+            else:
+                users = list(self._users.values())
+        return self._page("Users", users, MaxResults, NextToken)
+
+    def create_user(self, *, IdentityStoreId: str, **attributes: Any) -> Dict[str, Any]:
+        self._begin("CreateUser")
+        with self._lock:
+            if attributes["UserName"] in self._user_ids_by_username:
+                raise FakeClientError("ConflictException", "Duplicate UserName", "CreateUser")
+            user_id = self._put(attributes, IdentityStoreId)
+        return {"UserId": user_id, "IdentityStoreId": IdentityStoreId}
+
+    def update_user(self, *, IdentityStoreId: str, UserId: str, Operations: List[Dict[str, Any]]) -> Dict[str, Any]:
+        self._begin("UpdateUser")
+        with self._lock:
+            user = self._user(UserId, "UpdateUser")
+            for operation in Operations:
+                path = operation["AttributePath"]
+                key = path[0].upper() + path[1:]
+                if "AttributeValue" in operation:
+                    user[key] = copy.deepcopy(operation["AttributeValue"])
+                else:
+                    user.pop(key, None)
+        return {}
+
+    def delete_user(self, *, IdentityStoreId: str, UserId: str) -> Dict[str, Any]:
+        self._begin("DeleteUser")
+        with self._lock:
+            user = self._user(UserId, "DeleteUser")
+            del self._users[UserId]
+            del self._user_ids_by_username[user["UserName"]]
+        return {}
+
+    def list_groups(
+        self, *, IdentityStoreId: str, MaxResults: int = 100, NextToken: Optional[str] = None
+    ) -> Dict[str, Any]:
+        self._begin("ListGroups")
+        with self._lock:
+            groups = list(self._groups.values())
+        return self._page("Groups", groups, MaxResults, NextToken)
+
+    def list_group_memberships(
+        self, *, IdentityStoreId: str, GroupId: str, MaxResults: int = 100, NextToken: Optional[str] = None
+    ) -> Dict[str, Any]:
+        self._begin("ListGroupMemberships")
+        with self._lock:
+            if GroupId not in self._groups:
+                raise FakeClientError("ResourceNotFoundException", f"Group {GroupId} not found", "ListGroupMemberships")
+            memberships = [
+                membership for membership in self._memberships.values() if membership["GroupId"] == GroupId
+            ]
+        return self._page("GroupMemberships", memberships, MaxResults, NextToken)
+
+    def create_group_membership(
+        self, *, IdentityStoreId: str, GroupId: str, MemberId: Dict[str, str]
+    ) -> Dict[str, Any]:
+        self._begin("CreateGroupMembership")
+        with self._lock:
+            if GroupId not in self._groups:
+                raise FakeClientError("ResourceNotFoundException", f"Group {GroupId} not found", "CreateGroupMembership")
+            self._user(MemberId["UserId"], "CreateGroupMembership")
+            for membership in self._memberships.values():
+                if membership["GroupId"] == GroupId and membership["MemberId"] == MemberId:
+                    raise FakeClientError("ConflictException", "Member already exists", "CreateGroupMembership")
+            membership_id = self._put_membership(GroupId, MemberId["UserId"], IdentityStoreId)
+        return {"MembershipId": membership_id, "IdentityStoreId": IdentityStoreId}
+
+    def delete_group_membership(self, *, IdentityStoreId: str, MembershipId: str) -> Dict[str, Any]:
+        self._begin("DeleteGroupMembership")
+        with self._lock:
+            if self._memberships.pop(MembershipId, None) is None:
+                raise FakeClientError(
+                    "ResourceNotFoundException", f"Membership {MembershipId} not found", "DeleteGroupMembership"
+                )
+        return {}
@@ -0,0 +1,127 @@
+"""
+An in-process stand-in for the sso-admin API's asynchronous requests, for running the
+sso_user handler's Custom::SsoAssignments and Custom::SsoPermissionSetProvisioning code
+without an AWS account. Account assignment and permission set provisioning requests
+start IN_PROGRESS, like the real ones, and finish after polls_to_finish describe calls:
+
+- requests for an account in fail_accounts finish FAILED, with a FailureReason
+- other requests finish SUCCEEDED, and then take effect
+
+Calls are counted per API (CreateAccountAssignment, ...), as in fake_identitystore.
+"""
+import threading
+import uuid
+from typing import Any, Callable, Dict, Iterable, Optional, Set, Tuple
+
+from .fake_identitystore import FakeClientError
+
+ASSIGNMENT_FIELDS = ("PermissionSetArn", "PrincipalType", "PrincipalId", "TargetId")
+
+# (PermissionSetArn, PrincipalType, PrincipalId, TargetId)
+AssignmentKey = Tuple[str, str, str, str]
+
+
+class FakeSsoAdmin:
+    def __init__(self, *, polls_to_finish: int = 1, fail_accounts: Iterable[str] = ()):
+        self.polls_to_finish = polls_to_finish
+        self.fail_accounts = set(fail_accounts)
+        self.calls: Dict[str, int] = {}
+        self.assignments: Set[AssignmentKey] = set()
+        # Provisioning requests that succeeded, as (PermissionSetArn, account ID)
+        self.provisioned: Set[Tuple[str, str]] = set()
+        self._requests: Dict[str, Dict[str, Any]] = {}
+        self._lock = threading.Lock()
+
+    def reset_counts(self) -> None:
+        with self._lock:
+            self.calls = {}
+
+    def _begin(self, api: str) -> None:
+        with self._lock:
+            self.calls[api] = self.calls.get(api, 0) + 1
+
+    def _start(self, kind: str, status: Dict[str, Any], on_success: Callable[[], None]) -> Dict[str, Any]:
+        request_id = str(uuid.uuid4())
+        status = dict(status, RequestId=request_id, Status="IN_PROGRESS")
+        with self._lock:
+            self._requests[request_id] = {
+                "kind": kind,
+                "status": status,
+                "polls_left": self.polls_to_finish,
+                "on_success": on_success,
+            }
+        return dict(status)
+
+    def _describe(self, kind: str, request_id: str, api: str) -> Dict[str, Any]:
+        self._begin(api)
+        with self._lock:
+            request = self._requests.get(request_id)
+            if request is None or request["kind"] != kind:
+                raise FakeClientError("ResourceNotFoundException", f"Request {request_id} not found", api)
+            status = request["status"]
+            if status["Status"] == "IN_PROGRESS":
+                request["polls_left"] -= 1
+                if request["polls_left"] <= 0:
+                    account_id = status.get("TargetId") or status.get("AccountId")
+                    if account_id in self.fail_accounts:
+                        status.update(Status="FAILED", FailureReason=f"Account {account_id} is suspended")
+                    else:
+                        status["Status"] = "SUCCEEDED"
+                        request["on_success"]()
+            return dict(status)
+
+    @staticmethod
+    def _assignment(kwargs: Dict[str, Any]) -> AssignmentKey:
+        return tuple(kwargs[field] for field in ASSIGNMENT_FIELDS)  # type: ignore[return-value]
+
+    def create_account_assignment(self, *, InstanceArn: str, TargetType: str, **kwargs: Any) -> Dict[str, Any]:
+        self._begin("CreateAccountAssignment")
+        assignment = self._assignment(kwargs)
+        status = self._start("create", dict(kwargs, TargetType=TargetType), lambda: self.assignments.add(assignment))
+        return {"AccountAssignmentCreationStatus": status}
+
+    def delete_account_assignment(self, *, InstanceArn: str, TargetType: str, **kwargs: Any) -> Dict[str, Any]:
+        self._begin("DeleteAccountAssignment")
+        assignment = self._assignment(kwargs)
+        if assignment not in self.assignments:
+            raise FakeClientError("ResourceNotFoundException", "Assignment not found", "DeleteAccountAssignment")
+        status = self._start(
+            "delete", dict(kwargs, TargetType=TargetType), lambda: self.assignments.discard(assignment)
+        )
+        return {"AccountAssignmentDeletionStatus": status}
+
+    def describe_account_assignment_creation_status(
+        self, *, InstanceArn: str, AccountAssignmentCreationRequestId: str
+    ) -> Dict[str, Any]:
+        status = self._describe(
+            "create", AccountAssignmentCreationRequestId, "DescribeAccountAssignmentCreationStatus"
+        )
+        return {"AccountAssignmentCreationStatus": status}
+
+    def describe_account_assignment_deletion_status(
+        self, *, InstanceArn: str, AccountAssignmentDeletionRequestId: str
+    ) -> Dict[str, Any]:
+        status = self._describe(
+            "delete", AccountAssignmentDeletionRequestId, "DescribeAccountAssignmentDeletionStatus"
+        )
+        return {"AccountAssignmentDeletionStatus": status}
+
+    def provision_permission_set(
+        self, *, InstanceArn: str, PermissionSetArn: str, TargetId: Optional[str] = None, TargetType: str
+    ) -> Dict[str, Any]:
+        self._begin("ProvisionPermissionSet")
+        target = (PermissionSetArn, TargetId or "")
+        status = self._start(
+            "provision",
+            {"PermissionSetArn": PermissionSetArn, "AccountId": TargetId},
+            lambda: self.provisioned.add(target),
+        )
+        return {"PermissionSetProvisioningStatus": status}
+
+    def describe_permission_set_provisioning_status(
+        self, *, InstanceArn: str, ProvisionPermissionSetRequestId: str
+    ) -> Dict[str, Any]:
+        status = self._describe(
+            "provision", ProvisionPermissionSetRequestId, "DescribePermissionSetProvisioningStatus"
+        )
+        return {"PermissionSetProvisioningStatus": status}
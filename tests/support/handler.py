@@ -0,0 +1,56 @@
+"""
+Helpers for driving the sso_user Lambda handler in-process. Expects the handler's
+directory on sys.path and its environment set, as tests/unit/conftest.py and
+benchmarks/handler_throughput.py do before importing this.
+"""
+import contextlib
+from typing import Any, Dict, Iterator
+
+import index
+from throttled_client import ThrottledClient
+
+from .fake_identitystore import FakeIdentityStore
+
+IDENTITY_STORE_ID = "d-1234567890"
+UNPACED_RATE = 1e9
+
+
+def user_properties(i: int, first_name: str = "Jane") -> Dict[str, str]:
+    return {
+        "username": f"user{i:05d}",
+        "first_name": first_name,
+        "last_name": f"Doe{i}",
+        "email": f"user{i:05d}@example.com",
+    }
+
+
+def event(request_type: str, i: int, properties: Dict[str, str], **extra: Any) -> Dict[str, Any]:
+    return {
+        "RequestType": request_type,
+        "ResourceType": "Custom::SsoUser",
+        "LogicalResourceId": f"SsoUser{i}",
+        "RequestId": f"{request_type.lower()}-{i}",
+        "StackId": "arn:aws:cloudformation:us-east-1:111111111111:stack/Benchmark/1",
+        "ResourceProperties": properties,
+        **extra,
+    }
+
+
+@contextlib.contextmanager
+def use_fake(fake: FakeIdentityStore, paced: bool = False) -> Iterator[None]:
+    """
+    Points the handler's identitystore client at the fake, with or without its rate
+    limits, and restores the real client (and an empty user directory) afterwards.
+    """
+    identitystore_client = index.identitystore_client
+    index.identitystore_client = ThrottledClient(
+        lambda: fake,
+        rate_limits=index.IDENTITYSTORE_RATE_LIMITS if paced else {},
+        default_rate=index.IDENTITYSTORE_DEFAULT_RATE_LIMIT if paced else UNPACED_RATE,
+    )
+    index.user_directory.invalidate()
+    try:
+        yield
+    finally:
+        index.identitystore_client = identitystore_client
+        index.user_directory.invalidate()
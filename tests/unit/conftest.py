@@ -0,0 +1,17 @@
+import os
+import sys
+
+REPO_ROOT = os.path.join(os.path.dirname(__file__), "..", "..")
+LAMBDA_DIR = os.path.join(REPO_ROOT, "sso", "constructs", "lambda_functions", "sso_user")
+BENCHMARKS_DIR = os.path.join(REPO_ROOT, "benchmarks")
+
+# The sso_user handler's modules (index, user_diff, ...) are imported by name, as in
+# Lambda. They go first, since benchmarks/user_diff.py would shadow the handler's.
+sys.path.insert(0, LAMBDA_DIR)
+sys.path.append(BENCHMARKS_DIR)
+
+os.environ.setdefault("SSO_IDENTITY_STORE_ID", "d-1234567890")
+os.environ.setdefault("SSO_REGION", "us-east-1")
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+# Keep bytecode out of the Lambda source dir, where it would change the asset hash
+sys.dont_write_bytecode = True
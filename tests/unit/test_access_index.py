@@ -0,0 +1,180 @@
+import csv
+import io
+import json
+import os
+
+import aws_cdk as cdk
+import pytest
+
+from sso import SsoStack
+from sso.access_index import AccessIndex, AccessRow, main
+from sso.config import SsoEnvironment
+from sso.constructs import SsoAssignments, SsoPermissionSet, SsoUserAttributes, SsoUserBatch
+from sso.environments import create_stacks
+
+CONTEXT = {"aws:cdk:bundling-stacks": []}
+SANDBOX = "333333333333"
+
+# What add_directory() adds to SsoStack's demo group, users, and permission set
+EXPECTED_ACCESS = {
+    "username": {SANDBOX: {"DemoPermissionSet": ["Demo User Group"]}},
+    "username2": {SANDBOX: {"DemoPermissionSet": ["Demo User Group"]}},
+    "bsmith": {"111111111111": {"Audit": ["direct", "Ops"]}, "222222222222": {"Audit": ["Ops"]}},
+    "cjones": {"111111111111": {"Audit": ["Ops"]}, "222222222222": {"Audit": ["Ops"]}},
+}
+
+
+def add_directory(stack):
+    batch = SsoUserBatch(
+        stack,
+        batch_name="Batch",
+        users=[
+            SsoUserAttributes(email=f"{name}@example.com", username=name, first_name="First", last_name="Last")
+            for name in ("bsmith", "cjones")
+        ],
+    )
+    ops = stack._group(group_name="Ops", description="Ops")
+    ops.add_members(batch.users)
+    audit = SsoPermissionSet(stack, name="Audit", managed_policies=["arn:aws:iam::aws:policy/SecurityAudit"])
+    audit.grant_to_group_for_accounts(ops, ["111111111111", "222222222222"], assignments=SsoAssignments.get_or_create(stack))
+    audit.grant_to_user_for_account(batch.users[0], "111111111111")
+
+
+def new_stack(app, **kwargs):
+    stack = SsoStack(app, "SsoStack", nag_checks=False, **kwargs)
+    add_directory(stack)
+    return stack
+
+
+@pytest.fixture(scope="module")
+def assembly(tmp_path_factory):
+    """A synthesized, sharded SsoStack, so references go through nested stack parameters and outputs."""
+    outdir = str(tmp_path_factory.mktemp("cdk.out"))
+    app = cdk.App(outdir=outdir, context=CONTEXT)
+    new_stack(app, shard_count=3)
+    app.synth()
+    return outdir
+
+
+def access(index):
+    return {username: index.accounts_for_user(username) for username in sorted(index.users)}
+
+
+def test_index_from_the_construct_tree():
+    index = AccessIndex.from_stack(new_stack(cdk.App(context=CONTEXT)))
+    assert access(index) == EXPECTED_ACCESS
+    assert index.groups_for_user("bsmith") == {"Ops"}
+    assert index.group_members["Demo User Group"] == {"username", "username2"}
+
+
+def test_index_from_a_sharded_cloud_assembly(assembly):
+    with open(os.path.join(assembly, "manifest.json")) as f:
+        artifacts = json.load(f)["artifacts"]
+    # Memberships and assignments in shards refer to users, groups, and permission sets
+    # in other shards and the parent stack
+    assert any(name.endswith(".nested.template.json") for name in os.listdir(assembly))
+    assert "SsoStack" in artifacts
+    index = AccessIndex.from_cloud_assembly(assembly)
+    assert access(index) == EXPECTED_ACCESS
+    assert index.accounts == {"111111111111", "222222222222", SANDBOX}
+    assert access(AccessIndex.from_cloud_assembly(assembly, "SsoStack")) == EXPECTED_ACCESS
+    assert AccessIndex.from_cloud_assembly(assembly, "OtherStack").users == set()
+
+
+def test_index_from_a_single_template(tmp_path):
+    app = cdk.App(outdir=str(tmp_path), context=CONTEXT)
+    new_stack(app)
+    app.synth()
+    index = AccessIndex.from_template(str(tmp_path / "SsoStack.template.json"))
+    assert access(index) == EXPECTED_ACCESS
+
+
+def test_account_and_permission_set_queries():
+    index = AccessIndex.from_stack(new_stack(cdk.App(context=CONTEXT)))
+    assert index.principals_for_account("111111111111") == {("GROUP", "Ops"): {"Audit"}, ("USER", "bsmith"): {"Audit"}}
+    # Users reach accounts through their groups
+    assert index.users_for_account("222222222222") == {"bsmith": {"Audit"}, "cjones": {"Audit"}}
+    assert index.users_for_account(SANDBOX) == {"username": {"DemoPermissionSet"}, "username2": {"DemoPermissionSet"}}
+    assert index.users_for_account("444444444444") == {}
+    assert index.accounts_for_permission_set("Audit") == {"111111111111", "222222222222"}
+    assert index.accounts_for_permission_set("Nothing") == set()
+    assert index.permission_sets == {"Audit", "DemoPermissionSet"}
+
+    # Indexes are rebuilt after changes
+    index.add_membership("Ops", "dlee")
+    assert sorted(index.users_for_account("222222222222")) == ["bsmith", "cjones", "dlee"]
+
+
+def test_export():
+    index = AccessIndex.from_stack(new_stack(cdk.App(context=CONTEXT)))
+    rows = list(index.rows())
+    assert rows[0] == AccessRow("bsmith", "111111111111", "Audit", direct=True, groups=("Ops",))
+    assert [row.username for row in rows] == ["bsmith", "bsmith", "cjones", "cjones", "username", "username2"]
+
+    output = io.StringIO()
+    assert index.export(output, "csv") == 6
+    lines = list(csv.reader(io.StringIO(output.getvalue())))
+    assert lines[0] == ["username", "account_id", "permission_set", "direct", "groups"]
+    assert lines[1] == ["bsmith", "111111111111", "Audit", "true", "Ops"]
+
+    output = io.StringIO()
+    assert index.export(output, "jsonl") == 6
+    first = json.loads(output.getvalue().splitlines()[0])
+    assert first == {"username": "bsmith", "account_id": "111111111111", "permission_set": "Audit", "direct": True, "groups": ["Ops"]}
+
+    with pytest.raises(ValueError, match="Unknown export format xml"):
+        index.export(io.StringIO(), "xml")
+
+
+def test_cli(assembly, tmp_path, capsys):
+    assert main([assembly, "user", "bsmith"]) == 0
+    assert json.loads(capsys.readouterr().out) == EXPECTED_ACCESS["bsmith"]
+
+    assert main([assembly, "user", "nobody"]) == 1
+    assert "Unknown user nobody" in capsys.readouterr().err
+
+    assert main([assembly, "account", "SANDBOX"]) == 0
+    account = json.loads(capsys.readouterr().out)
+    assert account["principals"] == [{"type": "GROUP", "name": "Demo User Group", "permission_sets": ["DemoPermissionSet"]}]
+    assert account["users"] == {"username": ["DemoPermissionSet"], "username2": ["DemoPermissionSet"]}
+
+    assert main([assembly, "permission-set", "Audit"]) == 0
+    assert capsys.readouterr().out.split() == ["111111111111", "222222222222"]
+
+    output = tmp_path / "access.jsonl"
+    assert main([assembly, "--stack", "SsoStack", "export", "--format", "jsonl", "--output", str(output)]) == 0
+    assert "Wrote 6 rows" in capsys.readouterr().err
+    assert len(output.read_text().splitlines()) == 6
+
+    assert main([assembly, "export"]) == 0
+    assert capsys.readouterr().out.splitlines()[0] == "username,account_id,permission_set,direct,groups"
+
+
+def test_account_names_come_from_the_stack_environment():
+    environment = SsoEnvironment.default()._replace(name="prod", accounts={"WORKLOADS": "555555555555"})
+    index = AccessIndex.from_stack(SsoStack(cdk.App(context=CONTEXT), "SsoStack", sso_environment=environment, nag_checks=False))
+    assert index.account_id("WORKLOADS") == "555555555555"
+    assert index.account_id("444444444444") == "444444444444"
+    with pytest.raises(ValueError, match="Account SANDBOX is neither a 12-digit account ID nor an account name"):
+        index.account_id("SANDBOX")
+
+
+def test_cli_resolves_account_names_per_stack(tmp_path, capsys):
+    app = cdk.App(outdir=str(tmp_path), context=CONTEXT)
+    environments = [
+        SsoEnvironment.default()._replace(name=name, sso_account=account_id, accounts={"WORKLOADS": account_id})
+        for name, account_id in (("prod", "555555555555"), ("dev", "666666666666"))
+    ]
+    for stack in create_stacks(app, environments, nag_checks=False):
+        ops = stack._group(group_name="Ops", description="Ops")
+        permission_set = SsoPermissionSet(stack, name="Audit", managed_policies=[])
+        permission_set.grant_to_group_for_account(ops, stack.sso_environment.accounts["WORKLOADS"])
+    app.synth()
+
+    assert main([str(tmp_path), "account", "WORKLOADS"]) == 1
+    assert "different account in each of the environments dev, prod" in capsys.readouterr().err
+
+    assert main([str(tmp_path), "--stack", "SsoStack-dev", "account", "WORKLOADS"]) == 0
+    principals = json.loads(capsys.readouterr().out)["principals"]
+    assert principals == [{"type": "GROUP", "name": "Ops", "permission_sets": ["Audit"]}]
+    assert AccessIndex.from_cloud_assembly(str(tmp_path), "SsoStack-prod").account_id("WORKLOADS") == "555555555555"
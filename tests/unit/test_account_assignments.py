@@ -0,0 +1,197 @@
+import pytest
+
+from tests.support.fake_sso_admin import FakeSsoAdmin
+
+import index
+from account_assignments import assignment_delta
+from fan_out import FanOutError
+from throttled_client import ThrottledClient
+
+READ_ONLY = "arn:aws:sso:::permissionSet/ssoins-1/ps-1"
+
+
+def assignment(principal_id, account_id, permission_set_arn=READ_ONLY, principal_type="GROUP"):
+    return {
+        "PermissionSetArn": permission_set_arn,
+        "PrincipalType": principal_type,
+        "PrincipalId": principal_id,
+        "TargetId": account_id,
+    }
+
+
+def key(assignment):
+    return "|".join(assignment[field] for field in ("PermissionSetArn", "PrincipalType", "PrincipalId", "TargetId"))
+
+
+def assignments_event(request_type, assignments, old=None, physical_id=None):
+    event = {
+        "RequestType": request_type,
+        "ResourceType": "Custom::SsoAssignments",
+        "LogicalResourceId": "Assignments",
+        "RequestId": "request-1",
+        "StackId": "arn:aws:cloudformation:us-east-1:111111111111:stack/Test/1",
+        "ResourceProperties": {"Assignments": assignments},
+    }
+    if old is not None:
+        event["OldResourceProperties"] = {"Assignments": old}
+    if physical_id is not None:
+        event["PhysicalResourceId"] = physical_id
+    return event
+
+
+def is_complete_event(event, response):
+    """What the Provider framework passes to is_complete: the event merged with on_event's response."""
+    return {**event, **response}
+
+
+class Context:
+    """A Lambda context whose remaining time runs low after the given number of checks."""
+
+    def __init__(self, checks_with_time_left):
+        self.checks_with_time_left = checks_with_time_left
+
+    def get_remaining_time_in_millis(self):
+        self.checks_with_time_left -= 1
+        return 60_000 if self.checks_with_time_left >= 0 else 1_000
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeSsoAdmin()
+    monkeypatch.setattr(index, "sso_admin_client", ThrottledClient(lambda: fake, rate_limits={}, default_rate=1e9))
+    monkeypatch.setattr(index, "ASSIGNMENT_POLL_SECONDS", 0)
+    return fake
+
+
+@pytest.fixture
+def async_mode(monkeypatch):
+    monkeypatch.setattr(index, "ASYNC_MODE", True)
+
+
+def test_assignment_delta():
+    a, b, c = assignment("g1", "111111111111"), assignment("g1", "222222222222"), assignment("g2", "111111111111")
+    # Create
+    assert assignment_delta([], [a, b]) == ({key(a): a, key(b): b}, {})
+    # Update: unchanged assignments are left alone
+    assert assignment_delta([a, b], [b, c]) == ({key(c): c}, {key(a): a})
+    # Delete
+    assert assignment_delta([a, b], []) == ({}, {key(a): a, key(b): b})
+    # Duplicates collapse
+    assert assignment_delta([a], [a, a]) == ({}, {})
+
+
+def test_renamed_principal_is_one_create_and_one_delete():
+    old = assignment("g-old", "111111111111")
+    new = assignment("g-new", "111111111111")
+    assert assignment_delta([old], [new]) == ({key(new): new}, {key(old): old})
+
+
+def test_create_update_and_delete(fake):
+    a, b, c = assignment("g1", "111111111111"), assignment("g1", "222222222222"), assignment("g2", "111111111111")
+    response = index.on_event(assignments_event("Create", [a, b]), None)
+    physical_id = response["PhysicalResourceId"]
+    assert response["Data"]["AssignmentCount"] == 2
+    assert fake.assignments == {tuple(a.values()), tuple(b.values())}
+
+    fake.reset_counts()
+    update = assignments_event("Update", [b, c], old=[a, b], physical_id=physical_id)
+    # The matrix changed, but the physical ID doesn't, so CloudFormation won't delete it
+    assert index.on_event(update, None)["PhysicalResourceId"] == physical_id
+    assert fake.assignments == {tuple(b.values()), tuple(c.values())}
+    assert fake.calls == {
+        "CreateAccountAssignment": 1,
+        "DeleteAccountAssignment": 1,
+        "DescribeAccountAssignmentCreationStatus": 1,
+        "DescribeAccountAssignmentDeletionStatus": 1,
+    }
+
+    index.on_event(assignments_event("Delete", [b, c], physical_id=physical_id), None)
+    assert fake.assignments == set()
+
+
+def test_deleting_assignments_that_are_gone_succeeds(fake):
+    response = index.on_event(assignments_event("Delete", [assignment("g1", "111111111111")], physical_id="p"), None)
+    assert response["PhysicalResourceId"] == "p"
+
+
+def test_failed_assignments_are_reported(fake):
+    fake.fail_accounts = {"222222222222"}
+    event = assignments_event("Create", [assignment("g1", "111111111111"), assignment("g1", "222222222222")])
+    with pytest.raises(FanOutError, match="222222222222 is suspended"):
+        index.on_event(event, None)
+    # The other one isn't rolled back
+    assert fake.assignments == {tuple(assignment("g1", "111111111111").values())}
+
+
+def test_async_mode_polls_from_is_complete(fake, async_mode):
+    fake.polls_to_finish = 2
+    assignments = [assignment("g1", account_id) for account_id in ("111111111111", "222222222222")]
+    event = assignments_event("Create", assignments)
+    response = index.on_event(event, None)
+    assert sorted(response) == ["AssignmentRequests", "Data", "PhysicalResourceId"]
+    assert len(response["AssignmentRequests"]["create"]) == 2
+    assert "AssignmentRequests" not in response["Data"]
+    assert fake.assignments == set()
+
+    poll = is_complete_event(event, response)
+    assert index.is_complete(poll, None) == {"IsComplete": False}
+    result = index.is_complete(poll, None)
+    assert result["IsComplete"] is True
+    assert result["Data"]["ApiStats.DescribeAccountAssignmentCreationStatus"].startswith("calls=2 ")
+    assert len(fake.assignments) == 2
+
+
+def test_async_polls_stop_when_time_runs_low(fake, async_mode):
+    assignments = [assignment("g1", f"{i:012d}") for i in range(1, 6)]
+    event = assignments_event("Create", assignments)
+    poll = is_complete_event(event, index.on_event(event, None))
+
+    fake.reset_counts()
+    assert index.is_complete(poll, Context(checks_with_time_left=2)) == {"IsComplete": False}
+    # Finished requests are polled again, since nothing is kept between polls
+    assert fake.calls == {"DescribeAccountAssignmentCreationStatus": 2}
+    assert len(fake.assignments) == 2
+    assert index.is_complete(poll, Context(checks_with_time_left=5))["IsComplete"] is True
+    assert len(fake.assignments) == 5
+
+
+def test_async_failures_are_raised_once_nothing_is_in_progress(fake, async_mode):
+    fake.polls_to_finish = 2
+    fake.fail_accounts = {"222222222222"}
+    assignments = [assignment("g1", account_id) for account_id in ("111111111111", "222222222222")]
+    event = assignments_event("Create", assignments)
+    poll = is_complete_event(event, index.on_event(event, None))
+    assert index.is_complete(poll, None) == {"IsComplete": False}
+    with pytest.raises(FanOutError, match=r"create .*\|222222222222: Account 222222222222 is suspended"):
+        index.is_complete(poll, None)
+
+
+def test_async_submit_errors_fail_on_event(fake, async_mode):
+    old = assignment("g1", "111111111111")
+    fake.assignments.add(tuple(old.values()))
+
+    def create_account_assignment(**kwargs):
+        raise Exception("Permission set not provisioned")
+
+    fake.create_account_assignment = create_account_assignment
+    update = assignments_event("Update", [assignment("g2", "111111111111")], old=[old], physical_id="p")
+    with pytest.raises(FanOutError, match="Permission set not provisioned"):
+        index.on_event(update, None)
+
+
+def test_async_delete_with_nothing_to_do_completes_right_away(fake, async_mode):
+    event = assignments_event("Delete", [assignment("g1", "111111111111")], physical_id="p")
+    response = index.on_event(event, None)
+    assert response["AssignmentRequests"] == {"create": [], "delete": []}
+    assert index.is_complete(is_complete_event(event, response), None)["IsComplete"] is True
+
+
+def test_sso_admin_clients_have_their_own_pacing_and_retries(monkeypatch):
+    monkeypatch.setattr(index, "IDENTITYSTORE_MAX_ATTEMPTS", 4)
+    monkeypatch.setattr(index, "SSO_ADMIN_MAX_ATTEMPTS", 6)
+    # botocore counts the first attempt in total_max_attempts
+    assert index.create_identitystore_client().meta.config.retries == {"mode": "adaptive", "total_max_attempts": 5}
+    assert index.create_sso_admin_client().meta.config.retries == {"mode": "adaptive", "total_max_attempts": 7}
+    # Other services keep botocore's default
+    assert index.create_client("dynamodb").meta.config.retries == {"mode": "adaptive"}
+    assert index.sso_admin_client._default_rate == index.SSO_ADMIN_DEFAULT_RATE_LIMIT
@@ -0,0 +1,142 @@
+import aws_cdk as cdk
+import pytest
+from aws_cdk.assertions import Annotations, Match, Template
+
+from sso import SsoStack
+from sso.constructs import (
+    AssignmentCompactor,
+    SsoAssignments,
+    SsoGroup,
+    SsoPermissionSet,
+    SsoShardRouter,
+    SsoUser,
+    SsoUserAttributes,
+)
+
+CONTEXT = {"aws:cdk:bundling-stacks": []}
+ACCOUNT_ID = "111111111111"
+
+
+def new_stack(*, remove=False, shard_count=None):
+    stack = cdk.Stack(cdk.App(context=CONTEXT), "Stack")
+    if shard_count:
+        SsoShardRouter.get_or_create(stack, shard_count=shard_count)
+    cdk.Aspects.of(stack).add(AssignmentCompactor(remove=remove))
+    return stack
+
+
+def user(stack, username):
+    return SsoUser(
+        stack,
+        user_attributes=SsoUserAttributes(
+            email=f"{username}@example.com", username=username, first_name="Jane", last_name="Doe"
+        ),
+    )
+
+
+def read_only(stack):
+    return SsoPermissionSet.from_existing_permission_set(
+        stack, permission_set_name="ReadOnly", permission_set_arn="arn:aws:sso:::permissionSet/ps-1"
+    )
+
+
+def messages(stack, find):
+    return [entry.entry.data for entry in find(Annotations.from_stack(stack))("*", Match.string_like_regexp("AssignmentCompactor"))]
+
+
+def errors(stack):
+    return messages(stack, lambda annotations: annotations.find_error)
+
+
+def infos(stack):
+    return messages(stack, lambda annotations: annotations.find_info)
+
+
+def assignments(stack):
+    """(principal type, account) of every CfnAssignment in the stack and its nested stacks."""
+    found = []
+    for construct in stack.node.find_all():
+        if isinstance(construct, cdk.aws_sso.CfnAssignment):
+            found.append((construct.principal_type, construct.target_id))
+    return sorted(found)
+
+
+def user_grant_covered_by_a_group(stack):
+    jdoe, asmith = user(stack, "jdoe"), user(stack, "asmith")
+    group = SsoGroup(stack, group_name="Admins", description="Admins")
+    group.add_members([jdoe])
+    permission_set = read_only(stack)
+    permission_set.grant_to_group_for_account(group, ACCOUNT_ID)
+    permission_set.grant_to_user_for_account(jdoe, ACCOUNT_ID)
+    # Not a member, so not redundant
+    permission_set.grant_to_user_for_account(asmith, ACCOUNT_ID)
+
+
+def test_user_grants_a_group_covers_are_errors():
+    stack = new_stack()
+    user_grant_covered_by_a_group(stack)
+    assert errors(stack) == [
+        "[AssignmentCompactor] Redundant grant of ReadOnly to user jdoe for 111111111111: it is covered by "
+        "ReadOnly to group Admins for 111111111111. Remove it, or drop it at synth time with "
+        "AssignmentCompactor(remove=True) (SsoStack(compact_assignments=\"remove\"))."
+    ]
+    assert assignments(stack) == [("GROUP", ACCOUNT_ID), ("USER", ACCOUNT_ID), ("USER", ACCOUNT_ID)]
+
+
+def test_user_grants_a_group_covers_are_removed():
+    stack = new_stack(remove=True)
+    user_grant_covered_by_a_group(stack)
+    Template.from_stack(stack).resource_count_is("AWS::SSO::Assignment", 2)
+    assert errors(stack) == []
+    assert infos(stack) == [
+        "[AssignmentCompactor] Removed redundant grant of ReadOnly to user jdoe for 111111111111: it is covered by "
+        "ReadOnly to group Admins for 111111111111"
+    ]
+
+
+def test_duplicate_grants_to_an_existing_group_in_a_matrix():
+    for remove in (False, True):
+        stack = new_stack(remove=remove)
+        matrix = SsoAssignments.get_or_create(stack)
+        group = SsoGroup.from_existing_group(stack, group_name="Admins", group_id="g-1")
+        permission_set = read_only(stack)
+        permission_set.grant_to_group_for_account(group, ACCOUNT_ID, assignments=matrix)
+        permission_set.grant_to_group_for_accounts(group, [ACCOUNT_ID, "222222222222"], assignments=matrix)
+        cdk.App.of(stack).synth()
+        assert len(permission_set.grants) == (2 if remove else 3)
+        (reported,) = infos(stack) if remove else errors(stack)
+        assert "ReadOnly to group Admins for 111111111111: it duplicates ReadOnly to group Admins" in reported
+        # The matrix only ever had one of them, but removing the duplicate mustn't take
+        # the original out of it
+        resource = Template.from_stack(stack).find_resources("Custom::SsoAssignments")
+        (properties,) = [value["Properties"] for value in resource.values()]
+        assert [assignment["TargetId"] for assignment in properties["Assignments"]] == [ACCOUNT_ID, "222222222222"]
+
+
+def test_sharded_stacks_are_compacted_across_shards():
+    stack = new_stack(remove=True, shard_count=4)
+    jdoe = user(stack, "jdoe")
+    admins = SsoGroup(stack, group_name="Admins", description="Admins")
+    devs = SsoGroup(stack, group_name="Devs", description="Devs")
+    admins.add_members([jdoe])
+    devs.add_members([jdoe])
+    permission_set = read_only(stack)
+    permission_set.grant_to_group_for_account(devs, ACCOUNT_ID)
+    permission_set.grant_to_group_for_account(admins, ACCOUNT_ID)
+    permission_set.grant_to_user_for_account(jdoe, ACCOUNT_ID)
+    permission_set.grant_to_user_for_account(jdoe, "222222222222")
+    cdk.App.of(stack).synth()
+    assert assignments(stack) == [("GROUP", ACCOUNT_ID), ("GROUP", ACCOUNT_ID), ("USER", "222222222222")]
+    assert len(infos(stack)) == 1
+
+
+def test_sso_stack_compacts_assignments_only_when_asked():
+    expected = {None: (0, 0), "report": (1, 0), "remove": (0, 1)}
+    for mode, (error_count, info_count) in expected.items():
+        stack = SsoStack(cdk.App(context=CONTEXT), "SsoStack", nag_checks=False, compact_assignments=mode)
+        user_grant_covered_by_a_group(stack)
+        assert (len(errors(stack)), len(infos(stack))) == (error_count, info_count)
+        assert len(assignments(stack)) == (2 if mode == "remove" else 3) + 1
+
+    with pytest.raises(ValueError, match='compact_assignments must be "report" or "remove", not \'warn\''):
+        SsoStack(cdk.App(context=CONTEXT), "SsoStack", nag_checks=False, compact_assignments="warn")
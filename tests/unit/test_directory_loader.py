@@ -0,0 +1,197 @@
+import json
+
+import aws_cdk as cdk
+import pytest
+
+from sso import DirectoryLoader, SsoStack
+from sso.config import SsoEnvironment
+from sso.constructs import SsoPermissionSet
+from sso.directory_loader import MAX_ERRORS_IN_MESSAGE, DirectoryLoadError, read_rows
+
+CONTEXT = {"aws:cdk:bundling-stacks": []}
+
+
+def new_loader(**kwargs):
+    stack = cdk.Stack(cdk.App(context=CONTEXT), "Stack")
+    permission_set = SsoPermissionSet.from_existing_permission_set(
+        stack, permission_set_name="ReadOnly", permission_set_arn="arn:aws:sso:::permissionSet/ps-1"
+    )
+    return DirectoryLoader(stack, permission_sets=[permission_set], **kwargs)
+
+
+def write(path, text):
+    path.write_text(text, encoding="utf-8")
+    return str(path)
+
+
+def group_descriptions(loader):
+    groups = cdk.assertions.Template.from_stack(loader.scope).find_resources("AWS::IdentityStore::Group")
+    return {group["Properties"]["DisplayName"]: group["Properties"]["Description"] for group in groups.values()}
+
+
+def member_usernames(loader, group_name):
+    return sorted(loader.groups[group_name].member_users)
+
+
+def test_csv_files(tmp_path):
+    loader = new_loader()
+    # Excel writes a byte order mark; a quoted field may span lines
+    groups = write(tmp_path / "groups.csv", '﻿group_name,description\nAdmins,"Admins,\nall of them"\nDevs,\n')
+    users = write(
+        tmp_path / "users.csv",
+        "username,email,first_name,last_name,groups\n"
+        "jdoe,jdoe@example.com,Jane,Doe,Admins;Devs\n"
+        " asmith ,asmith@example.com,Al,Smith,\n",
+    )
+    assert loader.load_groups(groups) == 2
+    assert loader.load_users(users) == 2
+    assert sorted(loader.users) == ["asmith", "jdoe"]
+    assert group_descriptions(loader) == {"Admins": "Admins,\nall of them", "Devs": "Devs"}
+    assert member_usernames(loader, "Admins") == member_usernames(loader, "Devs") == ["jdoe"]
+
+
+def test_json_lines_files(tmp_path):
+    loader = new_loader()
+    groups = write(tmp_path / "groups.ndjson", '{"group_name": "Admins"}\n\n{"group_name": "Devs"}\n')
+    users = write(
+        tmp_path / "users.jsonl",
+        json.dumps({"username": "jdoe", "email": "jdoe@example.com", "first_name": "Jane", "last_name": "Doe", "groups": ["Admins", "Devs"]})
+        + "\n",
+    )
+    assert loader.load_groups(groups) == 2
+    assert loader.load_users(users) == 1
+    assert member_usernames(loader, "Devs") == ["jdoe"]
+
+
+def test_yaml_files(tmp_path):
+    pytest.importorskip("yaml")
+    loader = new_loader()
+    groups = write(tmp_path / "groups.yaml", "- group_name: Admins\n  description: All admins\n- group_name: Devs\n")
+    users = write(
+        tmp_path / "users.yml",
+        "- username: jdoe\n  email: jdoe@example.com\n  first_name: Jane\n  last_name: Doe\n  groups: [Admins]\n",
+    )
+    assert loader.load_groups(groups) == 2
+    assert loader.load_users(users) == 1
+    assert group_descriptions(loader) == {"Admins": "All admins", "Devs": "Devs"}
+    assert member_usernames(loader, "Admins") == ["jdoe"]
+    assert list(read_rows(write(tmp_path / "empty.yaml", ""))) == []
+    with pytest.raises(ValueError, match="must contain a list of rows"):
+        list(read_rows(write(tmp_path / "mapping.yaml", "group_name: Admins\n")))
+
+
+def test_unknown_formats_are_rejected(tmp_path):
+    path = write(tmp_path / "users.txt", "")
+    with pytest.raises(ValueError, match="Can't tell the format"):
+        read_rows(path)
+    assert list(read_rows(path, "jsonl")) == []
+
+
+def test_duplicate_usernames_and_emails_are_caught_across_files_case_insensitively(tmp_path):
+    loader = new_loader()
+    first = write(tmp_path / "users.csv", "username,email,first_name,last_name\njdoe,jdoe@example.com,Jane,Doe\n")
+    second = write(
+        tmp_path / "more-users.csv",
+        "username,email,first_name,last_name\n"
+        "JDoe,other@example.com,Jane,Doe\n"
+        "asmith,JDOE@Example.com,Al,Smith\n"
+        "bsmith,bsmith@example.com,Bo,Smith\n",
+    )
+    assert loader.load_users(first) == 1
+    with pytest.raises(DirectoryLoadError) as raised:
+        loader.load_users(second)
+    assert raised.value.errors == [
+        (2, f"duplicate username JDoe (first seen at {first}:2)"),
+        (3, f"duplicate email JDOE@Example.com (first seen at {first}:2)"),
+    ]
+    # Valid rows are still added
+    assert sorted(loader.users) == ["bsmith", "jdoe"]
+
+
+def test_every_invalid_row_is_reported_with_its_line(tmp_path):
+    loader = new_loader()
+    write(tmp_path / "groups.csv", "group_name\nAdmins\n")
+    loader.load_groups(str(tmp_path / "groups.csv"))
+    users = write(
+        tmp_path / "users.jsonl",
+        "\n".join(
+            [
+                json.dumps({"username": "jdoe", "email": "jdoe@example.com", "first_name": "Jane", "last_name": "Doe"}),
+                "{not json",
+                "",
+                json.dumps({"username": "asmith", "email": " "}),
+                json.dumps(["a", "list"]),
+                json.dumps({"username": "bsmith", "email": "b@example.com", "first_name": "Bo", "last_name": "Smith", "groups": "Admins;Ops;QA"}),
+            ]
+        )
+        + "\n",
+    )
+    with pytest.raises(DirectoryLoadError) as raised:
+        loader.load_users(users)
+    assert [line for line, _ in raised.value.errors] == [2, 4, 5, 6]
+    messages = [message for _, message in raised.value.errors]
+    assert messages[0].startswith("invalid JSON")
+    assert messages[1:] == [
+        "missing email, first_name, last_name",
+        "expected a mapping of fields, got list",
+        "unknown groups Ops, QA",
+    ]
+    assert str(raised.value).startswith(f"4 invalid rows in {users}:\n{users}:2: invalid JSON")
+    assert list(loader.users) == ["jdoe"]
+
+    csv_users = write(tmp_path / "users.csv", "username,email\njdoe2,a@example.com,extra\n")
+    with pytest.raises(DirectoryLoadError, match=r"users.csv:2: more fields than the header \(2\)"):
+        loader.load_users(csv_users)
+
+
+def test_long_error_lists_are_truncated(tmp_path):
+    groups = write(tmp_path / "groups.csv", "group_name,description\n" + ",x\n" * (MAX_ERRORS_IN_MESSAGE + 5))
+    with pytest.raises(DirectoryLoadError) as raised:
+        new_loader().load_groups(groups, format="csv")
+    assert len(raised.value.errors) == MAX_ERRORS_IN_MESSAGE + 5
+    assert str(raised.value).endswith("... and 5 more")
+
+
+def test_assignments(tmp_path):
+    loader = new_loader()
+    loader.load_groups(write(tmp_path / "groups.csv", "group_name\nAdmins\n"))
+    assignments = write(
+        tmp_path / "assignments.csv",
+        "group,permission_set,account\n"
+        "Admins,ReadOnly,SANDBOX\n"
+        "Admins,ReadOnly,444444444444\n"
+        "Admins,ReadOnly,333333333333\n"
+        "Ops,ReadOnly,SANDBOX\n"
+        "Admins,Admin,SANDBOX\n"
+        "Admins,ReadOnly,NOWHERE\n"
+        "Admins,ReadOnly,\n",
+    )
+    with pytest.raises(DirectoryLoadError) as raised:
+        loader.load_assignments(assignments)
+    assert raised.value.errors == [
+        (4, "duplicate of the assignment on line 2"),
+        (5, "unknown group Ops"),
+        (6, "unknown permission set Admin"),
+        (7, "account NOWHERE is neither a 12-digit account ID nor an account name of environment default"),
+        (8, "missing account"),
+    ]
+    target_ids = sorted(
+        resource["Properties"]["TargetId"]
+        for resource in cdk.assertions.Template.from_stack(loader.scope).find_resources("AWS::SSO::Assignment").values()
+    )
+    assert target_ids == ["333333333333", "444444444444"]
+
+
+def test_account_names_come_from_the_stack_environment(tmp_path):
+    environment = SsoEnvironment.default()._replace(name="prod", accounts={"WORKLOADS": "555555555555"})
+    stack = SsoStack(cdk.App(context=CONTEXT), "SsoStack", sso_environment=environment, nag_checks=False)
+    loader = DirectoryLoader(stack, groups=[stack._group(group_name="Admins", description="Admins")])
+    loader.permission_sets["ReadOnly"] = stack._existing_permission_set(
+        permission_set_name="ReadOnly", permission_set_arn="arn:aws:sso:::permissionSet/ps-1"
+    )
+    assignments = write(tmp_path / "assignments.csv", "group,permission_set,account\nAdmins,ReadOnly,WORKLOADS\nAdmins,ReadOnly,SANDBOX\n")
+    with pytest.raises(DirectoryLoadError) as raised:
+        loader.load_assignments(assignments)
+    assert raised.value.errors == [
+        (3, "account SANDBOX is neither a 12-digit account ID nor an account name of environment prod")
+    ]
@@ -0,0 +1,160 @@
+import io
+import json
+
+import pytest
+
+from tests.support import handler
+from tests.support.fake_identitystore import FakeIdentityStore
+
+import index
+from drift_detection import detect_drift, drift_counts, reconcile_operations, take_snapshot
+
+IDENTITY_STORE_ID = handler.IDENTITY_STORE_ID
+
+# As SsoDriftDetector embeds it: users in SsoUser's format, whether each group is
+# managed by the stack, and the usernames the stack adds to each group
+DESIRED_STATE = {
+    "users": {f"user{i:05d}": handler.user_properties(i) for i in range(5)},
+    "groups": {"Admins": True, "Console": False, "Gone": True},
+    "memberships": {
+        "Admins": ["user00000", "user00001", "user00002", "user00004"],
+        "Console": ["user00000"],
+        "Gone": ["user00000"],
+    },
+}
+
+EXPECTED_DRIFT = {
+    "MissingUsers": ["user00004"],
+    "ChangedUsers": {"user00001": ["Name", "DisplayName"]},
+    "MissingGroups": ["Gone"],
+    # user00004 is missing altogether
+    "MissingMemberships": {"Admins": ["user00001", "user00002", "user00004"]},
+    # Members of groups the stack only references aren't drift
+    "ExtraMemberships": {"Admins": ["user00003"]},
+}
+
+
+class FakeS3:
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_object(self, *, Bucket, Key):
+        return {"Body": io.BytesIO(self.objects[(Bucket, Key)])}
+
+    def put_object(self, *, Bucket, Key, Body, ContentType):
+        self.objects[(Bucket, Key)] = Body
+        return {}
+
+
+@pytest.fixture
+def fake():
+    """An identity store that has drifted from DESIRED_STATE in every way EXPECTED_DRIFT lists."""
+    fake = FakeIdentityStore()
+    users = [handler.user_properties(i) for i in range(4)]
+    users[1] = handler.user_properties(1, first_name="Janet")
+    fake.seed_users([index.toAwsIdentityStoreUserFormat(user) for user in users], IDENTITY_STORE_ID)
+    user_ids = {
+        user["UserName"]: user["UserId"]
+        for user in fake.list_users(IdentityStoreId=IDENTITY_STORE_ID, MaxResults=100)["Users"]
+    }
+    for group_name in ("Admins", "Console"):
+        group_id = fake.seed_group(group_name, IDENTITY_STORE_ID)
+        for username in ("user00000", "user00003"):
+            fake.seed_membership(group_id, user_ids[username], IDENTITY_STORE_ID)
+    fake.reset_counts()
+    with handler.use_fake(fake):
+        yield fake
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    s3 = FakeS3({(index.DESIRED_STATE_BUCKET, index.DESIRED_STATE_KEY): json.dumps(DESIRED_STATE).encode()})
+    monkeypatch.setattr(index, "create_client", lambda service_name: s3)
+    monkeypatch.setattr(index, "STACK_NAME", "SsoStack")
+    return s3
+
+
+def desired_state():
+    return dict(
+        DESIRED_STATE,
+        users={username: index.toAwsIdentityStoreUserFormat(user) for username, user in DESIRED_STATE["users"].items()},
+    )
+
+
+def group_members(fake, group_name):
+    group_id = {group["DisplayName"]: group["GroupId"] for group in fake.list_groups(IdentityStoreId=IDENTITY_STORE_ID)["Groups"]}[group_name]
+    usernames = {user["UserId"]: user["UserName"] for user in fake.list_users(IdentityStoreId=IDENTITY_STORE_ID, MaxResults=100)["Users"]}
+    return sorted(usernames[user_id] for user_id in fake.members(group_id))
+
+
+def test_detect_drift(fake):
+    desired = desired_state()
+    snapshot = take_snapshot(lambda: fake, IDENTITY_STORE_ID, desired, max_workers=4)
+    # Only the members of desired groups that exist are listed
+    assert sorted(snapshot.memberships) == ["Admins", "Console"]
+    drift = detect_drift(desired, snapshot)
+    assert drift == EXPECTED_DRIFT
+    assert drift_counts(drift) == {
+        "MissingUsers": 1,
+        "ChangedUsers": 1,
+        "MissingGroups": 1,
+        "MissingMemberships": 3,
+        "ExtraMemberships": 1,
+    }
+
+
+def test_reconcile_only_updates_users_and_adds_memberships(fake):
+    desired = desired_state()
+    snapshot = take_snapshot(lambda: fake, IDENTITY_STORE_ID, desired, max_workers=4)
+    operations = reconcile_operations(IDENTITY_STORE_ID, desired, snapshot, detect_drift(desired, snapshot))
+    assert sorted(operations) == ["add user00001 to Admins", "add user00002 to Admins", "update user user00001"]
+    fake.reset_counts()
+    for operation in operations.values():
+        operation(fake)
+    assert fake.calls == {"UpdateUser": 1, "CreateGroupMembership": 2}
+    drift = detect_drift(desired, take_snapshot(lambda: fake, IDENTITY_STORE_ID, desired, max_workers=4))
+    assert drift == dict(
+        EXPECTED_DRIFT, ChangedUsers={}, MissingMemberships={"Admins": ["user00004"]}
+    )
+
+
+def test_on_schedule_reports_drift(fake, s3, monkeypatch):
+    monkeypatch.setattr(index, "DRIFT_REPORT_BUCKET", "reports")
+    counts = index.on_schedule({}, None)["Counts"]
+    assert counts["DriftTotal"] == 7
+    assert (counts["Reconciled"], counts["ReconcileFailures"]) == (0, 0)
+    # Only reports
+    assert set(fake.calls) == {"ListUsers", "ListGroups", "ListGroupMemberships"}
+    report = json.loads(s3.objects[("reports", "sso-drift/SsoStack/latest.json")])
+    assert report["Drift"] == EXPECTED_DRIFT
+    assert report["StackName"] == "SsoStack"
+    assert ("reports", f"sso-drift/SsoStack/{report['CheckedAt']}.json") in s3.objects
+
+
+def test_on_schedule_reconciles(fake, s3, monkeypatch):
+    monkeypatch.setattr(index, "DRIFT_RECONCILE", True)
+    counts = index.on_schedule({}, None)["Counts"]
+    assert (counts["Reconciled"], counts["ReconcileFailures"]) == (3, 0)
+    assert group_members(fake, "Admins") == ["user00000", "user00001", "user00002", "user00003"]
+    assert fake.list_users(
+        IdentityStoreId=IDENTITY_STORE_ID,
+        Filters=[{"AttributePath": "UserName", "AttributeValue": "user00001"}],
+    )["Users"][0]["Name"]["GivenName"] == "Jane"
+
+    counts = index.on_schedule({}, None)["Counts"]
+    assert (counts["ChangedUsers"], counts["MissingMemberships"], counts["Reconciled"]) == (0, 1, 0)
+
+
+def test_memberships_added_since_the_snapshot_are_not_failures(fake, s3, monkeypatch):
+    monkeypatch.setattr(index, "DRIFT_RECONCILE", True)
+    create_group_membership = fake.create_group_membership
+
+    def added_by_a_deploy_first(**kwargs):
+        # Which makes the reconciler's own add a ConflictException
+        create_group_membership(**kwargs)
+        return create_group_membership(**kwargs)
+
+    monkeypatch.setattr(fake, "create_group_membership", added_by_a_deploy_first)
+    counts = index.on_schedule({}, None)["Counts"]
+    assert (counts["Reconciled"], counts["ReconcileFailures"]) == (3, 0)
+    assert group_members(fake, "Admins") == ["user00000", "user00001", "user00002", "user00003"]
@@ -0,0 +1,94 @@
+import json
+import os
+
+import aws_cdk as cdk
+import pytest
+
+from sso.config import SsoEnvironment
+from sso.environments import create_stacks, load_environment, load_environments
+from sso.parallel_synth import synth_environments
+
+CONTEXT = {"aws:cdk:bundling-stacks": []}
+
+
+def write_environment(directory, name, identity_store_id, **extra):
+    config = {
+        "sso_account": "123456789012",
+        "sso_region": "eu-west-1",
+        "identity_store_id": identity_store_id,
+        "instance_arn": f"arn:aws:sso:::instance/ssoins-{name}",
+        "accounts": {"SANDBOX": "333333333333", "PROD": "444444444444"},
+        **extra,
+    }
+    with open(os.path.join(directory, f"{name}.json"), "w") as f:
+        json.dump(config, f)
+
+
+def identity_store_ids(template):
+    return {
+        resource["Properties"]["IdentityStoreId"]
+        for resource in template["Resources"].values()
+        if resource["Type"] == "AWS::IdentityStore::Group"
+    }
+
+
+def test_invalid_environment_files_are_rejected(tmp_path):
+    write_environment(tmp_path, "prod", "", sso_account="1234", accounts={"X": "nope"}, extra=True)
+    with pytest.raises(ValueError) as error:
+        load_environment(str(tmp_path / "prod.json"))
+    for problem in ["missing identity_store_id", "sso_account 1234", "account X (nope)", "unknown settings extra"]:
+        assert problem in str(error.value)
+
+
+def test_each_environment_gets_its_own_stack_and_settings(tmp_path):
+    assignments = tmp_path / "assignments.jsonl"
+    assignments.write_text(
+        json.dumps({"group": "Demo User Group", "permission_set": "DemoPermissionSet", "account": "PROD"}) + "\n"
+    )
+    write_environment(tmp_path, "prod", "d-prod", context={"sso:assignmentsFile": str(assignments)})
+    write_environment(tmp_path, "sandbox", "d-sandbox")
+    environments = load_environments(str(tmp_path))
+    assert [environment.name for environment in environments] == ["prod", "sandbox"]
+
+    app = cdk.App(context=CONTEXT)
+    create_stacks(app, environments, nag_checks=False)
+    assembly = app.synth()
+    prod = assembly.get_stack_by_name("SsoStack-prod")
+    sandbox = assembly.get_stack_by_name("SsoStack-sandbox")
+    assert prod.environment.account == "123456789012" and prod.environment.region == "eu-west-1"
+    assert identity_store_ids(prod.template) == {"d-prod"}
+    assert identity_store_ids(sandbox.template) == {"d-sandbox"}
+
+    def target_ids(template):
+        return sorted(
+            resource["Properties"]["TargetId"]
+            for resource in template["Resources"].values()
+            if resource["Type"] == "AWS::SSO::Assignment"
+        )
+
+    assert target_ids(prod.template) == ["333333333333", "444444444444"]
+    assert target_ids(sandbox.template) == ["333333333333"]
+
+
+def test_stacks_outside_an_environment_use_sso_config():
+    stack = cdk.Stack(cdk.App(), "Stack")
+    assert SsoEnvironment.of(stack) == SsoEnvironment.default()
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_environments_synthesize_into_one_assembly(tmp_path, workers):
+    write_environment(tmp_path, "prod", "d-prod")
+    write_environment(tmp_path, "sandbox", "d-sandbox")
+    outdir = str(tmp_path / "cdk.out")
+    times = synth_environments(
+        load_environments(str(tmp_path)), outdir=outdir, workers=workers, context=CONTEXT, nag_checks=False
+    )
+    assert sorted(times) == ["prod", "sandbox"]
+    assert not os.path.exists(os.path.join(outdir, ".environments"))
+
+    assembly = cdk.cx_api.CloudAssembly(outdir)
+    stacks = {stack.stack_name: stack for stack in assembly.stacks}
+    assert sorted(stacks) == ["SsoStack-prod", "SsoStack-sandbox"]
+    assert identity_store_ids(stacks["SsoStack-sandbox"].template) == {"d-sandbox"}
+    with open(os.path.join(outdir, "tree.json")) as f:
+        assert {"SsoStack-prod", "SsoStack-sandbox"} <= set(json.load(f)["tree"]["children"])
@@ -0,0 +1,71 @@
+import itertools
+
+import pytest
+
+from fan_out import MAX_ERRORS_IN_MESSAGE, FanOutError, fan_out
+
+
+def fail(message):
+    def task():
+        raise ValueError(message)
+
+    return task
+
+
+def test_failures_keep_the_other_results():
+    tasks = {"a": lambda: 1, "b": fail("b is broken"), "c": lambda: 3}
+    result = fan_out(tasks, max_workers=3)
+    assert result.results == {"a": 1, "c": 3}
+    assert list(result.errors) == ["b"]
+    assert result.skipped == []
+    assert not result.complete
+
+
+def test_raise_for_errors_lists_every_failed_key():
+    tasks = {"a": lambda: 1, "b": fail("b is broken"), "c": fail("c is broken")}
+    result = fan_out(tasks, max_workers=2)
+    with pytest.raises(FanOutError) as raised:
+        result.raise_for_errors("Creating users")
+    assert str(raised.value) == (
+        "Creating users failed for 2 of 3 (1 succeeded): b: b is broken; c: c is broken"
+    )
+    # The successful work is still reachable from the error
+    assert raised.value.result.results == {"a": 1}
+
+    fan_out({"a": lambda: 1}, max_workers=1).raise_for_errors("Creating users")
+
+
+def test_long_error_lists_are_truncated_in_the_message():
+    tasks = {f"user{i:02d}": fail("broken") for i in range(MAX_ERRORS_IN_MESSAGE + 5)}
+    with pytest.raises(FanOutError, match=f"failed for {MAX_ERRORS_IN_MESSAGE + 5} of") as raised:
+        fan_out(tasks, max_workers=4).raise_for_errors("Creating users")
+    assert str(raised.value).count(": broken") == MAX_ERRORS_IN_MESSAGE
+    assert len(raised.value.result.errors) == MAX_ERRORS_IN_MESSAGE + 5
+
+
+def test_tasks_should_start_rejects_are_skipped_without_running():
+    ran = []
+    budget = itertools.count()
+
+    def task(key):
+        def run():
+            ran.append(key)
+            return key
+
+        return run
+
+    tasks = {key: task(key) for key in "abcde"}
+    # One worker, so tasks start in order
+    result = fan_out(tasks, max_workers=1, should_start=lambda: next(budget) < 2)
+    assert result.results == {"a": "a", "b": "b"}
+    assert result.skipped == ["c", "d", "e"]
+    assert ran == ["a", "b"]
+    assert not result.complete
+    # Skipped tasks aren't errors
+    result.raise_for_errors("Creating users")
+
+
+def test_no_tasks():
+    result = fan_out({}, max_workers=4)
+    assert result.complete
+    assert (result.results, result.errors, result.skipped) == ({}, {}, [])
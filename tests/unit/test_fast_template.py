@@ -0,0 +1,86 @@
+import hashlib
+import json
+import os
+
+import aws_cdk as cdk
+import pytest
+from constructs import Construct
+
+from sso import DirectoryLoader, SsoStack
+from sso.fast_template import SsoTemplate, logical_id, merge_template
+
+import synth_scaling
+
+
+def user(username):
+    return {"username": username, "email": f"{username}@example.com", "first_name": "First", "last_name": "Last"}
+
+
+def new_template():
+    return SsoTemplate(service_token=lambda: {"Fn::GetAtt": ["Provider", "Arn"]})
+
+
+@pytest.mark.parametrize(
+    "path",
+    [
+        ["SsoUser-jdoe", "SsoUser-jdoe", "Default"],
+        ["SsoGroup-Demo User Group", "GroupMember_j.doe@example.com"],
+        ["SsoPermissionSet_Admin", "Assign_Admin_toGroup_Ops_for_123456789012"],
+        ["Single-Component"],
+        ["Outer", "Resource"],
+        ["x" * 150, "y" * 150],
+    ],
+)
+def test_logical_id_matches_cdk(path):
+    stack = cdk.Stack(cdk.App(), "Stack")
+    scope: Construct = stack
+    for id in path[:-1]:
+        scope = Construct(scope, id)
+    resource = cdk.CfnResource(scope, path[-1], type="AWS::SNS::Topic")
+    assert logical_id(*path) == stack.get_logical_id(resource)
+
+
+@pytest.mark.parametrize("path_metadata", [False, True])
+def test_fast_synth_template_is_identical(tmp_path, path_metadata):
+    context = {
+        "aws:cdk:bundling-stacks": [],
+        "aws:cdk:enable-path-metadata": path_metadata,
+        **synth_scaling.generate_directory(str(tmp_path), users=6, groups=2, assignments=4),
+    }
+    templates = []
+    for fast_synth in (False, True):
+        app = cdk.App(outdir=str(tmp_path / f"cdk.out.{fast_synth}"), context=context)
+        SsoStack(app, "SsoStack", fast_synth=fast_synth)
+        assembly = app.synth()
+        with open(os.path.join(assembly.directory, "SsoStack.template.json"), "rb") as f:
+            template = f.read()
+        # The asset manifest points at the merged template
+        url = assembly.get_stack_by_name("SsoStack").stack_template_asset_object_url
+        assert url.endswith(hashlib.sha256(template).hexdigest() + ".json")
+        templates.append(template)
+
+    assert templates[0] == templates[1]
+    types = {resource["Type"] for resource in json.loads(templates[1])["Resources"].values()}
+    assert {"Custom::SsoUser", "AWS::IdentityStore::GroupMembership", "AWS::SSO::Assignment"} <= types
+
+
+def test_duplicate_users_are_rejected():
+    template = new_template()
+    template.add_user(user("jdoe"))
+    with pytest.raises(ValueError, match="SsoUser-jdoe"):
+        template.add_user(user("jdoe"))
+
+
+def test_too_many_resources_are_rejected():
+    template = new_template()
+    for i in range(10):
+        template.add_user(user(f"user{i}"))
+    cdk_template = json.dumps({"Resources": {"Provider": {"Type": "AWS::Lambda::Function"}}}, indent=1)
+    assert len(json.loads(merge_template(cdk_template, template, max_resources=11))["Resources"]) == 11
+    with pytest.raises(ValueError, match="11 is greater than allowed maximum of 10"):
+        merge_template(cdk_template, template, max_resources=10)
+
+
+def test_directory_loader_rejects_member_sets_with_a_template():
+    with pytest.raises(ValueError):
+        DirectoryLoader(cdk.Stack(cdk.App(), "Stack"), template=new_template(), member_sets=True)
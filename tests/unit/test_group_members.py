@@ -0,0 +1,122 @@
+import pytest
+
+from tests.support import handler
+from tests.support.fake_identitystore import FakeIdentityStore
+
+import index
+from group_members import list_group_memberships, membership_delta
+
+IDENTITY_STORE_ID = handler.IDENTITY_STORE_ID
+
+
+@pytest.fixture
+def fake():
+    fake = FakeIdentityStore()
+    with handler.use_fake(fake):
+        yield fake
+
+
+def seed_users(fake, count):
+    fake.seed_users(
+        [index.toAwsIdentityStoreUserFormat(handler.user_properties(i)) for i in range(count)],
+        IDENTITY_STORE_ID,
+    )
+    users = fake.list_users(IdentityStoreId=IDENTITY_STORE_ID, MaxResults=1000)["Users"]
+    fake.reset_counts()
+    return sorted(user["UserId"] for user in users)
+
+
+def members_event(request_type, group_id, member_user_ids, old=None, physical_id=None):
+    event = {
+        "RequestType": request_type,
+        "ResourceType": "Custom::SsoGroupMembers",
+        "LogicalResourceId": "Members",
+        "RequestId": "request-1",
+        "StackId": "arn:aws:cloudformation:us-east-1:111111111111:stack/Test/1",
+        "ResourceProperties": {"GroupId": group_id, "MemberUserIds": member_user_ids},
+    }
+    if old is not None:
+        event["OldResourceProperties"] = {"GroupId": old[0], "MemberUserIds": old[1]}
+    if physical_id is not None:
+        event["PhysicalResourceId"] = physical_id
+    return event
+
+
+def test_membership_delta_only_touches_its_own_members():
+    current = {"u1": "m1", "u2": "m2", "console": "m3"}
+    # Create: adds whoever isn't a member yet
+    assert membership_delta(current, [], ["u1", "u4"]) == (["u4"], [])
+    # Update: removes old members that are gone from the new set, if still members
+    assert membership_delta(current, ["u1", "u2", "u5"], ["u1", "u3"]) == (["u3"], ["m2"])
+    # Delete: removes every old member, but never ones added elsewhere
+    assert membership_delta(current, ["u1", "u2"], []) == ([], ["m1", "m2"])
+    assert membership_delta({}, [], []) == ([], [])
+
+
+def test_list_group_memberships_pages(fake):
+    user_ids = seed_users(fake, 150)
+    group_id = fake.seed_group("Admins", IDENTITY_STORE_ID)
+    for user_id in user_ids:
+        fake.seed_membership(group_id, user_id, IDENTITY_STORE_ID)
+    memberships = list_group_memberships(lambda: fake, IDENTITY_STORE_ID, group_id)
+    assert sorted(memberships) == user_ids
+    assert fake.calls == {"ListGroupMemberships": 2}
+
+
+def test_create_update_and_delete(fake):
+    user_ids = seed_users(fake, 5)
+    group_id = fake.seed_group("Admins", IDENTITY_STORE_ID)
+    # Added in the console, so never removed
+    fake.seed_membership(group_id, user_ids[4], IDENTITY_STORE_ID)
+
+    response = index.on_event(members_event("Create", group_id, user_ids[:3]), None)
+    assert response["PhysicalResourceId"] == f"{group_id}/members"
+    assert fake.members(group_id) == sorted(user_ids[:3] + [user_ids[4]])
+
+    fake.reset_counts()
+    update = members_event("Update", group_id, user_ids[1:4], old=(group_id, user_ids[:3]), physical_id=f"{group_id}/members")
+    assert index.on_event(update, None)["PhysicalResourceId"] == f"{group_id}/members"
+    assert fake.members(group_id) == sorted(user_ids[1:5])
+    assert fake.calls == {"ListGroupMemberships": 1, "CreateGroupMembership": 1, "DeleteGroupMembership": 1}
+
+    index.on_event(members_event("Delete", group_id, user_ids[1:4], physical_id=f"{group_id}/members"), None)
+    assert fake.members(group_id) == [user_ids[4]]
+
+
+def test_moving_to_another_group_changes_the_physical_id(fake):
+    user_ids = seed_users(fake, 3)
+    old_group_id = fake.seed_group("Admins", IDENTITY_STORE_ID)
+    new_group_id = fake.seed_group("Administrators", IDENTITY_STORE_ID)
+    index.on_event(members_event("Create", old_group_id, user_ids), None)
+
+    update = members_event(
+        "Update", new_group_id, user_ids[:2], old=(old_group_id, user_ids), physical_id=f"{old_group_id}/members"
+    )
+    response = index.on_event(update, None)
+    # CloudFormation then deletes the old resource, which empties the old group
+    assert response["PhysicalResourceId"] == f"{new_group_id}/members"
+    assert fake.members(new_group_id) == user_ids[:2]
+    assert fake.members(old_group_id) == user_ids
+    index.on_event(members_event("Delete", old_group_id, user_ids, physical_id=f"{old_group_id}/members"), None)
+    assert fake.members(old_group_id) == []
+
+
+def test_members_added_concurrently_are_not_errors(fake, monkeypatch):
+    user_ids = seed_users(fake, 2)
+    group_id = fake.seed_group("Admins", IDENTITY_STORE_ID)
+    list_memberships = fake.list_group_memberships
+
+    def list_then_add(**kwargs):
+        response = list_memberships(**kwargs)
+        # E.g. by a retry of the same request
+        fake.seed_membership(group_id, user_ids[0], IDENTITY_STORE_ID)
+        return response
+
+    monkeypatch.setattr(fake, "list_group_memberships", list_then_add)
+    index.on_event(members_event("Create", group_id, user_ids), None)
+    assert fake.members(group_id) == user_ids
+
+
+def test_deleting_members_of_a_deleted_group_succeeds(fake):
+    response = index.on_event(members_event("Delete", "gone", ["u1"], physical_id="gone/members"), None)
+    assert response["PhysicalResourceId"] == "gone/members"
@@ -0,0 +1,90 @@
+import json
+
+import pytest
+
+from tests.support.fake_identitystore import FakeClientError, FakeIdentityStore
+
+import handler_throughput
+
+USERS = 25
+
+
+def by_scenario(results):
+    return {result["scenario"]: result for result in results}
+
+
+def test_scenarios_make_the_expected_identitystore_calls():
+    results = by_scenario(handler_throughput.run_user_count(USERS))
+    assert list(results) == list(handler_throughput.SCENARIOS)
+    for result in results.values():
+        assert result["errors"] == 0, result["first_errors"]
+        assert result["users"] == result["requests"] == USERS
+        assert result["ops_per_second"] > 0
+        assert 0 < result["latency_ms"]["p50"] <= result["latency_ms"]["p99"] <= result["latency_ms"]["max"]
+    # One snapshot per scenario serves every lookup
+    assert results["create"]["api_calls"] == {"CreateUser": USERS, "ListUsers": 1}
+    assert results["update"]["api_calls"] == {"UpdateUser": USERS}
+    assert "CreateUser" not in results["import"]["api_calls"]
+    assert results["delete"]["api_calls"] == {"DeleteUser": USERS}
+
+
+def test_delete_scenario_restores_allow_delete_users():
+    allow_delete_users = handler_throughput.index.ALLOW_DELETE_USERS
+    handler_throughput.run_user_count(3, scenarios=["create", "delete"])
+    assert handler_throughput.index.ALLOW_DELETE_USERS == allow_delete_users
+
+
+def test_runs_restore_the_handler_client():
+    identitystore_client = handler_throughput.index.identitystore_client
+    handler_throughput.run_user_count(3, scenarios=["create"])
+    assert handler_throughput.index.identitystore_client is identitystore_client
+
+
+def test_fake_throttles_each_api_separately():
+    fake = FakeIdentityStore(throttle_rate=2)
+    fake.list_users(IdentityStoreId="d-1")
+    fake.list_users(IdentityStoreId="d-1")
+    with pytest.raises(FakeClientError) as raised:
+        fake.list_users(IdentityStoreId="d-1")
+    assert raised.value.response["Error"]["Code"] == "ThrottlingException"
+    fake.create_user(IdentityStoreId="d-1", UserName="jdoe")
+    assert fake.calls == {"ListUsers": 2, "CreateUser": 1}
+    assert fake.throttled == {"ListUsers": 1}
+
+
+def test_fake_paginates_and_filters_list_users():
+    fake = FakeIdentityStore()
+    fake.seed_users([{"UserName": f"user{i}"} for i in range(150)], "d-1")
+    first = fake.list_users(IdentityStoreId="d-1")
+    second = fake.list_users(IdentityStoreId="d-1", NextToken=first["NextToken"])
+    assert len(first["Users"]) == 100 and len(second["Users"]) == 50
+    assert "NextToken" not in second
+    filtered = fake.list_users(
+        IdentityStoreId="d-1", Filters=[{"AttributePath": "UserName", "AttributeValue": "user7"}]
+    )
+    assert [user["UserName"] for user in filtered["Users"]] == ["user7"]
+
+
+def test_regressions_flag_slower_and_chattier_scenarios():
+    baseline = {
+        "results": [
+            {"scenario": "create", "users": 100, "ops_per_second": 1000.0, "api_calls": {"CreateUser": 100}, "errors": 0}
+        ]
+    }
+    same = json.loads(json.dumps(baseline))
+    assert handler_throughput.regressions(baseline, same, 0.2) == []
+    slower = json.loads(json.dumps(baseline))
+    slower["results"][0]["ops_per_second"] = 700.0
+    chattier = json.loads(json.dumps(baseline))
+    chattier["results"][0]["api_calls"]["ListUsers"] = 100
+    assert len(handler_throughput.regressions(baseline, slower, 0.2)) == 1
+    assert len(handler_throughput.regressions(baseline, chattier, 0.2)) == 1
+
+
+def test_main_writes_results_and_compares_with_baseline(tmp_path):
+    output = tmp_path / "results.json"
+    assert handler_throughput.main(["--users", "5", "--output", str(output)]) == 0
+    results = json.loads(output.read_text())
+    assert [result["scenario"] for result in results["results"]] == list(handler_throughput.SCENARIOS)
+    # API calls are deterministic, and a run is never 100% slower than itself
+    assert handler_throughput.main(["--users", "5", "--output", str(tmp_path / "again.json"), "--baseline", str(output), "--tolerance", "0.99"]) == 0
@@ -0,0 +1,102 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+from sso.constructs import local_bundling
+from sso.constructs.local_bundling import LocalPythonBundling
+
+LOCAL_VERSION = f"{sys.version_info.major}.{sys.version_info.minor}"
+
+
+@pytest.fixture
+def source_dir(tmp_path):
+    source_dir = tmp_path / "handler"
+    source_dir.mkdir()
+    (source_dir / "index.py").write_text("def on_event(event, context):\n    return {}\n")
+    (source_dir / "requirements.txt").write_text("requests==2.31.0\n")
+    (source_dir / "README.md").write_text("Handler\n")
+    return source_dir
+
+
+@pytest.fixture
+def pip_installs(monkeypatch):
+    """Stands in for pip, recording each install instead of downloading anything."""
+    installs = []
+
+    def run(command, check):
+        installs.append(command)
+        target = command[command.index("-t") + 1]
+        os.makedirs(os.path.join(target, "requests"))
+        with open(os.path.join(target, "requests", "__init__.py"), "w") as f:
+            f.write("")
+        os.makedirs(os.path.join(target, "requests-2.31.0.dist-info"))
+
+    monkeypatch.setattr(local_bundling.subprocess, "run", run)
+    return installs
+
+
+def bundling(source_dir, tmp_path, **kwargs):
+    return LocalPythonBundling(
+        str(source_dir), python_version=LOCAL_VERSION, cache_dir=str(tmp_path / "cache"), **kwargs
+    )
+
+
+def test_content_hash_follows_the_sources(source_dir, tmp_path):
+    content_hash = bundling(source_dir, tmp_path).content_hash()
+    assert bundling(source_dir, tmp_path).content_hash() == content_hash
+    # Bytecode doesn't count
+    (source_dir / "__pycache__").mkdir()
+    (source_dir / "__pycache__" / "index.cpython.pyc").write_bytes(b"\0")
+    assert bundling(source_dir, tmp_path).content_hash() == content_hash
+    assert bundling(source_dir, tmp_path, slim=True).content_hash() != content_hash
+
+    (source_dir / "requirements.txt").write_text("requests==2.32.0\n")
+    requirements_changed = bundling(source_dir, tmp_path).content_hash()
+    assert requirements_changed != content_hash
+
+    (source_dir / "index.py").write_text("def on_event(event, context):\n    return None\n")
+    assert bundling(source_dir, tmp_path).content_hash() not in (content_hash, requirements_changed)
+
+
+def test_cached_bundles_skip_pip(source_dir, tmp_path, pip_installs):
+    output_dir = tmp_path / "asset"
+    assert bundling(source_dir, tmp_path).try_bundle(str(output_dir))
+    assert len(pip_installs) == 1
+    assert sorted(os.listdir(output_dir)) == ["README.md", "index.py", "requests", "requests-2.31.0.dist-info", "requirements.txt"]
+
+    again = tmp_path / "asset-again"
+    assert bundling(source_dir, tmp_path).try_bundle(str(again))
+    assert len(pip_installs) == 1
+    assert sorted(os.listdir(again)) == sorted(os.listdir(output_dir))
+    # Only the finished bundle is left in the cache
+    assert os.listdir(tmp_path / "cache") == [bundling(source_dir, tmp_path).content_hash()]
+
+
+def test_slim_bundles_are_pruned_and_precompiled(source_dir, tmp_path, pip_installs):
+    output_dir = tmp_path / "asset"
+    assert bundling(source_dir, tmp_path, slim=True).try_bundle(str(output_dir))
+    assert sorted(os.listdir(output_dir)) == ["__pycache__", "index.py", "requests"]
+
+
+def test_other_python_versions_fall_back_to_docker(source_dir, tmp_path, pip_installs, capsys):
+    other = LocalPythonBundling(str(source_dir), python_version="2.7", cache_dir=str(tmp_path / "cache"))
+    assert not other.try_bundle(str(tmp_path / "asset"))
+    assert pip_installs == []
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert f"Local Python {LOCAL_VERSION} doesn't match Lambda runtime Python 2.7" in captured.err
+
+
+def test_pip_failures_fall_back_to_docker(source_dir, tmp_path, monkeypatch, capsys):
+    def run(command, check):
+        raise subprocess.CalledProcessError(1, command)
+
+    monkeypatch.setattr(local_bundling.subprocess, "run", run)
+    assert not bundling(source_dir, tmp_path).try_bundle(str(tmp_path / "asset"))
+    captured = capsys.readouterr()
+    assert captured.out == ""
+    assert "failed, falling back to Docker" in captured.err
+    # Nothing half-built is cached
+    assert os.listdir(tmp_path / "cache") == []
@@ -0,0 +1,139 @@
+import json
+import os
+
+import aws_cdk as cdk
+import pytest
+from constructs import Construct
+
+from sso.constructs import SsoGroup, SsoLogicalIds, SsoPermissionSet, SsoUser
+from sso.constructs import sso_logical_ids
+from sso.constructs.sso_logical_ids import LogicalIdMap, logical_id
+from sso.template_size import SsoStackSynthesizer, template_size_report
+
+CONTEXT = {"aws:cdk:bundling-stacks": []}
+
+
+def synth_directory(mapping_file, usernames):
+    app = cdk.App(context=CONTEXT)
+    stack = cdk.Stack(app, "Stack")
+    SsoLogicalIds.get_or_create(stack, mapping_file=mapping_file)
+    group = SsoGroup(stack, group_name="Admins", description="Admins")
+    permission_set = SsoPermissionSet.from_existing_permission_set(
+        stack, permission_set_name="Admin", permission_set_arn="arn:aws:sso:::permissionSet/ps-1"
+    )
+    permission_set.grant_to_group_for_account(group, "123456789012")
+    for username in usernames:
+        user = SsoUser(
+            stack,
+            user_attributes={
+                "username": username,
+                "email": f"{username}@example.com",
+                "first_name": "First",
+                "last_name": "Last",
+            },
+        )
+        group.add_user(user)
+    return app.synth().get_stack_by_name("Stack").template["Resources"]
+
+
+def test_resources_in_the_app_keep_their_ids_when_opting_in(tmp_path):
+    mapping_file = str(tmp_path / "logical-ids.json")
+    resources = synth_directory(mapping_file, ["jdoe"])
+    with open(mapping_file) as f:
+        mapping = json.load(f)
+    assert mapping == {
+        "SsoGroup-Admins/GroupMember_jdoe": "SsoGroupAdminsGroupMemberjdoe3EBA70DF",
+        "SsoPermissionSet_Admin/Assign_Admin_toGroup_Admins_for_123456789012":
+            "SsoPermissionSetAdminAssignAdmintoGroupAdminsfor12345678901215CEA6B8",
+    }
+    assert set(mapping.values()) <= set(resources)
+
+    # Resources added later get compact IDs; the earlier ones stay where they were
+    resources = synth_directory(mapping_file, ["jdoe", "asmith"])
+    with open(mapping_file) as f:
+        mapping = json.load(f)
+    assert mapping["SsoGroup-Admins/GroupMember_asmith"] == "MemberEBA0B636D3BC"
+    assert set(mapping.values()) <= set(resources)
+
+
+def test_empty_mapping_file_gives_every_resource_a_compact_id(tmp_path):
+    mapping_file = tmp_path / "logical-ids.json"
+    mapping_file.write_text("{}")
+    resources = synth_directory(str(mapping_file), ["jdoe"])
+    compact_ids = sorted(json.loads(mapping_file.read_text()).values())
+    assert [id[:6] for id in compact_ids] == ["Assign", "Member"]
+    assert all(len(id) == 18 and id in resources for id in compact_ids)
+
+
+def test_mapping_keys_are_paths_below_the_stack(tmp_path):
+    mapping_file = str(tmp_path / "logical-ids.json")
+    app = cdk.App(context=CONTEXT)
+    stack = cdk.Stack(app, "Stack")
+    SsoLogicalIds.get_or_create(stack, mapping_file=mapping_file)
+    user = SsoUser(
+        stack,
+        user_attributes={"username": "jdoe", "email": "jdoe@example.com", "first_name": "J", "last_name": "Doe"},
+    )
+    for team in ("TeamA", "TeamB"):
+        SsoGroup(Construct(stack, team), group_name="Admins", description="Admins").add_user(user)
+    resources = app.synth().get_stack_by_name("Stack").template["Resources"]
+    with open(mapping_file) as f:
+        mapping = json.load(f)
+    # The same group in two scopes gets two entries, each keeping its original ID
+    assert mapping == {
+        "TeamA/SsoGroup-Admins/GroupMember_jdoe": logical_id("TeamA", "SsoGroup-Admins", "GroupMember_jdoe"),
+        "TeamB/SsoGroup-Admins/GroupMember_jdoe": logical_id("TeamB", "SsoGroup-Admins", "GroupMember_jdoe"),
+    }
+    assert set(mapping.values()) <= set(resources)
+
+
+def test_compact_id_collisions_are_rejected(tmp_path, monkeypatch):
+    monkeypatch.setattr(sso_logical_ids, "HASH_LENGTH", 1)
+    logical_ids = LogicalIdMap(str(tmp_path / "missing.json"))
+    logical_ids.existing = {}
+    with pytest.raises(ValueError, match="collides"):
+        for i in range(17):
+            logical_ids.allocate(f"Group/member{i}", "Member", f"GroupMember{i}")
+
+
+def test_template_size_report_accounts_for_every_byte():
+    template = {
+        "Resources": {
+            "A": {"Type": "AWS::SSO::Assignment", "Properties": {"TargetId": "123456789012"}},
+            "B": {"Type": "AWS::SSO::Assignment", "Properties": {"TargetId": "é"}},
+            "C": {"Type": "Custom::SsoUser"},
+        },
+    }
+    # What's left is {"Resources": {...}} around the entries, less the comma the last
+    # entry doesn't have
+    for text, other_bytes in (
+        (json.dumps(template, indent=1, ensure_ascii=False), len('{\n "Resources": {\n }\n}') - 1),
+        (json.dumps(template, separators=(",", ":"), ensure_ascii=False), len('{"Resources":{}}') - 1),
+    ):
+        report = template_size_report(text)
+        assert report["bytes"] == len(text.encode("utf-8"))
+        assert report["other_bytes"] == other_bytes
+        assert [(entry["type"], entry["resources"]) for entry in report["types"]] == [
+            ("AWS::SSO::Assignment", 2),
+            ("Custom::SsoUser", 1),
+        ]
+
+
+# The template is about 1,300 bytes
+@pytest.mark.parametrize("limit,level", [(100000, None), (1500, "WARNING"), (1000, "ERROR")])
+def test_synth_reports_template_size(tmp_path, limit, level):
+    app = cdk.App(outdir=str(tmp_path))
+    stack = cdk.Stack(app, "Stack", synthesizer=SsoStackSynthesizer(template_size_limit=limit))
+    for i in range(10):
+        cdk.CfnResource(stack, f"Topic{i}", type="AWS::SNS::Topic")
+    assembly = app.synth()
+
+    with open(os.path.join(assembly.directory, "Stack.template-size.json")) as f:
+        report = json.load(f)["Stack.template.json"]
+    assert report["limit"] == limit
+    assert report["types"][0]["type"] == "AWS::SNS::Topic" and report["types"][0]["resources"] == 10
+    messages = [
+        message.level.value for message in assembly.get_stack_by_name("Stack").messages
+        if "template size limit" in str(message.entry.data)
+    ]
+    assert messages == ([level] if level else [])
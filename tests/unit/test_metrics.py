@@ -0,0 +1,72 @@
+import json
+
+import pytest
+
+from metrics import MAX_VALUES_PER_RECORD, Metrics, embedded_metrics
+
+
+def definition(record):
+    (metric_directive,) = record["_aws"]["CloudWatchMetrics"]
+    return metric_directive
+
+
+def test_records_are_split_at_the_values_limit():
+    metrics = Metrics("Sso")
+    for i in range(MAX_VALUES_PER_RECORD + 1):
+        metrics.put("Retries", i)
+    metrics.put("Throttles", 7)
+    first, second = metrics.records()
+    assert first["Retries"] == list(range(MAX_VALUES_PER_RECORD))
+    assert first["Throttles"] == 7
+    # A single sample is written as a plain value
+    assert second["Retries"] == MAX_VALUES_PER_RECORD
+    assert "Throttles" not in second
+    assert [metric["Name"] for metric in definition(second)["Metrics"]] == ["Retries"]
+
+
+def test_each_set_of_dimensions_is_its_own_record():
+    metrics = Metrics("Sso")
+    metrics.put("RequestLatency", 12.5, "Milliseconds", ResourceType="Custom::SsoUser", RequestType="Create")
+    metrics.put("Retries", 2, ResourceType="Custom::SsoUser", RequestType="Create")
+    metrics.put("ApiCalls", 3)
+    no_dimensions, by_request = metrics.records()
+
+    assert definition(no_dimensions)["Dimensions"] == [[]]
+    assert definition(no_dimensions)["Metrics"] == [{"Name": "ApiCalls", "Unit": "Count"}]
+
+    assert definition(by_request)["Namespace"] == "Sso"
+    assert definition(by_request)["Dimensions"] == [["RequestType", "ResourceType"]]
+    assert definition(by_request)["Metrics"] == [
+        {"Name": "RequestLatency", "Unit": "Milliseconds"},
+        {"Name": "Retries", "Unit": "Count"},
+    ]
+    assert (by_request["ResourceType"], by_request["RequestType"]) == ("Custom::SsoUser", "Create")
+    assert (by_request["RequestLatency"], by_request["Retries"]) == (12.5, 2)
+
+
+def test_default_units():
+    record = embedded_metrics("Sso", {}, {"WaitSeconds": 1.5, "Calls": 2}, 0)
+    assert definition(record)["Metrics"] == [
+        {"Name": "WaitSeconds", "Unit": "Seconds"},
+        {"Name": "Calls", "Unit": "Count"},
+    ]
+
+
+def test_timer_records_even_when_the_block_raises():
+    metrics = Metrics("Sso")
+    with pytest.raises(ValueError):
+        with metrics.timer("PhaseLatency", Phase="lookup"):
+            raise ValueError("lookup failed")
+    (record,) = metrics.records()
+    assert record["Phase"] == "lookup"
+    assert isinstance(record["PhaseLatency"], float) and record["PhaseLatency"] >= 0
+    assert definition(record)["Metrics"] == [{"Name": "PhaseLatency", "Unit": "Milliseconds"}]
+
+
+def test_flush_prints_records_and_starts_over(capsys):
+    metrics = Metrics("Sso")
+    metrics.put("Calls", 1)
+    metrics.flush()
+    (line,) = capsys.readouterr().out.splitlines()
+    assert json.loads(line)["Calls"] == 1
+    assert metrics.records() == []
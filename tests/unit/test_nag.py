@@ -0,0 +1,69 @@
+import json
+
+import aws_cdk as cdk
+import pytest
+from aws_cdk import aws_s3 as s3
+from constructs import Construct
+
+from sso import SsoStack
+from sso.constructs import NagMode, SsoNagChecks, SsoUser
+
+CONTEXT = {"aws:cdk:bundling-stacks": []}
+
+
+def nag_messages(assembly, stack_name):
+    return sorted(
+        (message.id, message.entry.type, message.entry.data)
+        for message in assembly.get_stack_by_name(stack_name).messages
+        if str(message.entry.data).startswith("AwsSolutions-") or "[AwsSolutions-" in str(message.entry.data)
+    )
+
+
+@pytest.mark.parametrize("mode", [NagMode.SCOPED, "scoped"])
+def test_scoped_checks_find_what_full_checks_do(tmp_path, mode):
+    messages = {}
+    for nag_mode in (NagMode.FULL, mode):
+        app = cdk.App(outdir=str(tmp_path / f"cdk.out.{nag_mode}"), context=CONTEXT)
+        SsoStack(app, "SsoStack", nag_mode=nag_mode)
+        messages[nag_mode] = nag_messages(app.synth(), "SsoStack")
+    assert messages[NagMode.FULL]
+    assert messages[mode] == messages[NagMode.FULL]
+
+
+def synth_with_bucket(tmp_path, cache_file, *, enforce_ssl=False):
+    app = cdk.App(outdir=str(tmp_path / "cdk.out"), context=CONTEXT)
+    stack = cdk.Stack(app, "Stack")
+    SsoNagChecks.get_or_create(stack, mode=NagMode.SCOPED, cache_file=cache_file)
+    infrastructure = Construct(stack, "Infrastructure")
+    s3.Bucket(infrastructure, "Bucket", enforce_ssl=enforce_ssl)
+    SsoNagChecks.check(infrastructure)
+    # Outside any checked scope
+    s3.Bucket(stack, "Unchecked")
+    SsoUser(stack, user_attributes={"username": "jdoe", "email": "j@example.com", "first_name": "J", "last_name": "D"})
+    return nag_messages(app.synth(), "Stack")
+
+
+def test_scoped_checks_replay_cached_findings(tmp_path, monkeypatch):
+    cache_file = str(tmp_path / "nag-cache.json")
+    messages = synth_with_bucket(tmp_path, cache_file)
+    paths = {path for path, _, _ in messages}
+    assert "/Stack/Infrastructure/Bucket/Resource" in paths
+    assert not any(path.startswith("/Stack/Unchecked/") for path in paths)
+    with open(cache_file) as f:
+        # Infrastructure, and SsoUserProvider and its Provider
+        assert len(json.load(f)) == 3
+
+    # Unchanged scopes aren't checked again
+    monkeypatch.setattr("cdk_nag.AwsSolutionsChecks.visit", lambda self, node: pytest.fail("checked again"))
+    assert synth_with_bucket(tmp_path, cache_file) == messages
+    monkeypatch.undo()
+
+    # Changed ones are
+    changed = synth_with_bucket(tmp_path, cache_file, enforce_ssl=True)
+    assert [message for message in messages if "AwsSolutions-S10" in message[2]]
+    assert [message for message in changed if "AwsSolutions-S10" in message[2]] == []
+
+
+def test_cache_file_needs_scoped_mode():
+    with pytest.raises(ValueError, match="SCOPED"):
+        SsoNagChecks.get_or_create(cdk.Stack(cdk.App(), "Stack"), mode=NagMode.FULL, cache_file="nag-cache.json")
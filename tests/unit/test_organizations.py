@@ -0,0 +1,175 @@
+import json
+from concurrent.futures import ThreadPoolExecutor
+
+import aws_cdk as cdk
+import pytest
+
+from sso import SsoStack
+from sso.constructs import OrganizationsFixture, SsoGroup, SsoOrganizations, SsoPermissionSet
+from sso.constructs.sso_organizations import OrganizationsApi, OrganizationsSource
+
+CONTEXT = {"aws:cdk:bundling-stacks": []}
+
+ORGANIZATION = {
+    "ou-ab12-workloads": {"accounts": ["111111111111"], "organizational_units": ["ou-ab12-prod0001"]},
+    "ou-ab12-prod0001": {"accounts": ["333333333333", "222222222222"]},
+}
+
+
+class FakeOrganizations(OrganizationsSource):
+    """Serves an organization like OrganizationsFixture does, but is cached like the API."""
+
+    def __init__(self, organization):
+        self.fixture = OrganizationsFixture(organization)
+        self.lookups = self.fixture.lookups
+
+    def list_accounts(self, parent_id):
+        return self.fixture.list_accounts(parent_id)
+
+    def list_organizational_units(self, parent_id):
+        return self.fixture.list_organizational_units(parent_id)
+
+
+def synth_ou_grant(tmp_path, source, context=None, *, recursive=True):
+    app = cdk.App(context={**CONTEXT, **(context or {})})
+    stack = cdk.Stack(app, "Stack")
+    SsoOrganizations.get_or_create(stack, source=source, context_file=str(tmp_path / "cdk.context.json"))
+    group = SsoGroup(stack, group_name="Admins", description="Admins")
+    permission_set = SsoPermissionSet.from_existing_permission_set(
+        stack, permission_set_name="Admin", permission_set_arn="arn:aws:sso:::permissionSet/ps-1"
+    )
+    permission_set.grant_to_group_for_ou(group, "ou-ab12-workloads", recursive=recursive)
+    resources = app.synth().get_stack_by_name("Stack").template["Resources"]
+    return sorted(
+        resource["Properties"]["TargetId"]
+        for resource in resources.values()
+        if resource["Type"] == "AWS::SSO::Assignment"
+    )
+
+
+def test_ou_grants_are_cached_in_the_context_file(tmp_path):
+    source = FakeOrganizations(ORGANIZATION)
+    assert synth_ou_grant(tmp_path, source) == ["111111111111", "222222222222", "333333333333"]
+    with open(tmp_path / "cdk.context.json") as f:
+        assert json.load(f) == {
+            "sso:organizations:accounts:ou-ab12-workloads:recursive": ["111111111111", "222222222222", "333333333333"]
+        }
+
+    # The next synth doesn't look anything up, even as the OU changes
+    source = FakeOrganizations({"ou-ab12-workloads": {"accounts": ["444444444444"]}})
+    assert synth_ou_grant(tmp_path, source) == ["111111111111", "222222222222", "333333333333"]
+    assert source.lookups == []
+
+    # Until it's refreshed
+    assert synth_ou_grant(tmp_path, source, {"sso:organizations:refresh": "true"}) == ["444444444444"]
+    assert synth_ou_grant(tmp_path, source) == ["444444444444"]
+
+
+def test_non_recursive_grants_and_cli_context(tmp_path):
+    assert synth_ou_grant(tmp_path, FakeOrganizations(ORGANIZATION), recursive=False) == ["111111111111"]
+    # Values the CLI passes in from cdk.context.json take precedence over the file
+    context = {"sso:organizations:accounts:ou-ab12-workloads:direct": ["555555555555"]}
+    assert synth_ou_grant(tmp_path, FakeOrganizations({}), context, recursive=False) == ["555555555555"]
+
+
+def test_fixture_file_from_context(tmp_path):
+    fixture = tmp_path / "organization.json"
+    fixture.write_text(json.dumps(ORGANIZATION))
+    context = {"sso:organizations:fixture": str(fixture)}
+    assert synth_ou_grant(tmp_path, None, context, recursive=False) == ["111111111111"]
+    # A fixture's accounts aren't the organization's, so they aren't cached
+    assert not (tmp_path / "cdk.context.json").exists()
+    assert synth_ou_grant(tmp_path, FakeOrganizations({}), recursive=False) == []
+
+
+def test_concurrent_lookups_keep_each_others_entries(tmp_path):
+    context_file = tmp_path / "cdk.context.json"
+    context_file.write_text(json.dumps({"other": "kept"}))
+    ou_ids = [f"ou-ab12-{i:08d}" for i in range(16)]
+    organization = {ou_id: {"accounts": [f"{i:012d}"]} for i, ou_id in enumerate(ou_ids)}
+
+    organizations = SsoOrganizations.get_or_create(
+        cdk.Stack(cdk.App(), "Stack"), source=FakeOrganizations(organization), context_file=str(context_file)
+    )
+
+    def cache(ou_id):
+        # As parallel_synth's workers do after their lookups
+        organizations._write_context_file(SsoOrganizations.context_key(ou_id), organization[ou_id]["accounts"])
+
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(cache, ou_ids))
+    context = json.loads(context_file.read_text())
+    assert context.pop("other") == "kept"
+    assert context == {SsoOrganizations.context_key(ou_id): organization[ou_id]["accounts"] for ou_id in ou_ids}
+    assert sorted(path.name for path in tmp_path.iterdir()) == ["cdk.context.json", "cdk.context.json.lock"]
+
+
+def test_invalid_ou_ids_are_rejected(tmp_path):
+    organizations = SsoOrganizations.get_or_create(
+        cdk.Stack(cdk.App(), "Stack"), source=OrganizationsFixture({}), context_file=str(tmp_path / "cdk.context.json")
+    )
+    with pytest.raises(ValueError, match="123456789012 is neither"):
+        organizations.accounts_for_ou("123456789012")
+
+
+class FakeOrganizationsClient:
+    def __init__(self, pages):
+        self.pages = pages
+
+    def get_paginator(self, operation):
+        client = self
+
+        class Paginator:
+            def paginate(self, ParentId):
+                return client.pages[(operation, ParentId)]
+
+        return Paginator()
+
+
+def test_api_source_pages_and_skips_suspended_accounts():
+    client = FakeOrganizationsClient(
+        {
+            ("list_accounts_for_parent", "r-ab12"): [
+                {"Accounts": [{"Id": "111111111111", "Status": "ACTIVE"}]},
+                {"Accounts": [{"Id": "222222222222", "Status": "SUSPENDED"}]},
+            ],
+            ("list_organizational_units_for_parent", "r-ab12"): [{"OrganizationalUnits": [{"Id": "ou-ab12-prod0001"}]}],
+            ("list_accounts_for_parent", "ou-ab12-prod0001"): [{"Accounts": [{"Id": "333333333333", "Status": "ACTIVE"}]}],
+            ("list_organizational_units_for_parent", "ou-ab12-prod0001"): [{"OrganizationalUnits": []}],
+        }
+    )
+    assert OrganizationsApi(client).accounts_for_ou("r-ab12") == ["111111111111", "333333333333"]
+
+
+def test_fast_synth_resolves_ous_the_same_way(tmp_path, monkeypatch):
+    fixture = tmp_path / "organization.json"
+    fixture.write_text(json.dumps(ORGANIZATION))
+    monkeypatch.chdir(tmp_path)
+    templates = []
+    for fast_synth in (False, True):
+        context = {**CONTEXT, "sso:organizations:fixture": str(fixture)}
+        app = cdk.App(outdir=str(tmp_path / f"cdk.out.{fast_synth}"), context=context)
+        stack = SsoStack(app, "SsoStack", fast_synth=fast_synth, nag_checks=False)
+        group = stack._group(group_name="Workloads", description="Workloads")
+        permission_set = stack._existing_permission_set(
+            permission_set_name="Admin", permission_set_arn="arn:aws:sso:::permissionSet/ps-1"
+        )
+        permission_set.grant_to_group_for_ou(group, "ou-ab12-workloads")
+        templates.append(app.synth().get_stack_by_name("SsoStack").template)
+    assert templates[0] == templates[1]
+    target_ids = [
+        resource["Properties"]["TargetId"]
+        for resource in templates[1]["Resources"].values()
+        if resource["Type"] == "AWS::SSO::Assignment"
+    ]
+    assert sorted(target_ids) == ["111111111111", "222222222222", "333333333333", "333333333333"]
+    assert not (tmp_path / "cdk.context.json").exists()
+
+
+def test_sources_must_implement_both_lookups():
+    class AccountsOnly(OrganizationsSource):
+        def list_accounts(self, parent_id):
+            return []
+
+    with pytest.raises(TypeError, match="list_organizational_units"):
+        AccountsOnly()
@@ -0,0 +1,174 @@
+import aws_cdk as cdk
+import pytest
+
+from sso.constructs import SsoAssignments, SsoGroup, SsoPermissionSet
+from tests.support.fake_sso_admin import FakeSsoAdmin
+
+import index
+from fan_out import FanOutError
+from permission_set_provisioning import latency_summary, provision_permission_set
+from request_poller import submit_and_poll
+from throttled_client import ThrottledClient
+
+CONTEXT = {"aws:cdk:bundling-stacks": []}
+PERMISSION_SET_ARN = "arn:aws:sso:::permissionSet/ssoins-1/ps-1"
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeSsoAdmin()
+    monkeypatch.setattr(index, "sso_admin_client", ThrottledClient(lambda: fake, rate_limits={}, default_rate=1e9))
+    monkeypatch.setattr(index, "ASSIGNMENT_POLL_SECONDS", 0)
+    return fake
+
+
+def provisioning_event(request_type, account_ids, policy_hash, old=None):
+    event = {
+        "RequestType": request_type,
+        "ResourceType": "Custom::SsoPermissionSetProvisioning",
+        "LogicalResourceId": "Provisioning",
+        "RequestId": "request-1",
+        "StackId": "arn:aws:cloudformation:us-east-1:111111111111:stack/Test/1",
+        "ResourceProperties": {
+            "PermissionSetArn": PERMISSION_SET_ARN,
+            "AccountIds": account_ids,
+            "PolicyHash": policy_hash,
+        },
+    }
+    if old is not None:
+        event["OldResourceProperties"] = dict(event["ResourceProperties"], AccountIds=old[0], PolicyHash=old[1])
+        event["PhysicalResourceId"] = f"{PERMISSION_SET_ARN}/provisioning"
+    return event
+
+
+def provisioning_properties(build):
+    """Synthesizes a stack that build(stack) adds a targeted permission set to."""
+    stack = cdk.Stack(cdk.App(context=CONTEXT), "Stack")
+    build(stack)
+    resources = cdk.assertions.Template.from_stack(stack).find_resources("Custom::SsoPermissionSetProvisioning")
+    (resource,) = resources.values()
+    return resource["Properties"]
+
+
+def read_only(stack, managed_policies=("arn:aws:iam::aws:policy/ReadOnlyAccess",)):
+    return SsoPermissionSet(stack, name="ReadOnly", managed_policies=list(managed_policies), targeted_provisioning=True)
+
+
+def test_submit_and_poll_reports_latencies_and_failures():
+    # What each poll reads back
+    statuses = {"a": ["SUCCEEDED"], "b": ["IN_PROGRESS", "FAILED"]}
+    sleeps = []
+
+    def describe(key, request_id):
+        assert request_id == f"request-{key}"
+        status = statuses[key].pop(0)
+        return {"Status": status, "RequestId": request_id, "FailureReason": "Account suspended" if status == "FAILED" else None}
+
+    submissions = {
+        "a": lambda: {"Status": "IN_PROGRESS", "RequestId": "request-a"},
+        "b": lambda: {"Status": "IN_PROGRESS", "RequestId": "request-b"},
+        # Nothing to do
+        "c": lambda: None,
+        "d": lambda: {"Status": "FAILED", "RequestId": "request-d"},
+    }
+    result = submit_and_poll(submissions, describe, max_workers=4, poll_interval_seconds=2, sleep=sleeps.append)
+    assert sorted(result.results) == ["a", "c"]
+    assert result.results["c"] == 0.0
+    assert {key: str(error) for key, error in result.errors.items()} == {"b": "Account suspended", "d": "FAILED"}
+    assert sleeps == [2, 2]
+
+
+def test_submit_and_poll_times_out_while_requests_are_pending():
+    remaining = [10.0, 3.0]
+    with pytest.raises(TimeoutError, match="1 requests still in progress: a"):
+        submit_and_poll(
+            {"a": lambda: {"Status": "IN_PROGRESS", "RequestId": "request-a"}},
+            lambda key, request_id: {"Status": "IN_PROGRESS", "RequestId": request_id},
+            max_workers=1,
+            poll_interval_seconds=2,
+            time_left=lambda: remaining.pop(0),
+            sleep=lambda seconds: None,
+        )
+    assert remaining == []
+
+
+def test_provision_permission_set_to_each_account_once(fake):
+    fake.polls_to_finish = 2
+    latencies = provision_permission_set(
+        lambda: fake,
+        "arn:aws:sso:::instance/ssoins-1",
+        PERMISSION_SET_ARN,
+        ["222222222222", "111111111111", "222222222222"],
+        max_workers=4,
+        poll_interval_seconds=0,
+    )
+    assert sorted(latencies) == ["111111111111", "222222222222"]
+    assert fake.provisioned == {(PERMISSION_SET_ARN, "111111111111"), (PERMISSION_SET_ARN, "222222222222")}
+    assert fake.calls == {"ProvisionPermissionSet": 2, "DescribePermissionSetProvisioningStatus": 4}
+    summary = latency_summary(latencies)
+    assert summary["ProvisionedAccounts"] == "2"
+    assert summary["ProvisioningLatencyMs"].startswith("p50=")
+    assert latency_summary({}) == {"ProvisionedAccounts": "0"}
+
+
+def test_policy_changes_are_provisioned_to_the_listed_accounts(fake):
+    event = provisioning_event("Update", ["111111111111", "222222222222"], "new", old=(["111111111111"], "old"))
+    response = index.on_event(event, None)
+    assert response["PhysicalResourceId"] == f"{PERMISSION_SET_ARN}/provisioning"
+    assert response["Data"]["ProvisionedAccounts"] == "2"
+    assert fake.provisioned == {(PERMISSION_SET_ARN, "111111111111"), (PERMISSION_SET_ARN, "222222222222")}
+
+
+def test_nothing_is_provisioned_unless_the_policies_changed(fake):
+    accounts = ["111111111111"]
+    index.on_event(provisioning_event("Create", accounts, "hash"), None)
+    index.on_event(provisioning_event("Update", accounts + ["222222222222"], "hash", old=(accounts, "hash")), None)
+    delete = dict(provisioning_event("Delete", accounts, "hash"), PhysicalResourceId=f"{PERMISSION_SET_ARN}/provisioning")
+    index.on_event(delete, None)
+    assert fake.calls == {}
+
+
+def test_failed_accounts_fail_the_update(fake):
+    fake.fail_accounts = {"222222222222"}
+    event = provisioning_event("Update", ["111111111111", "222222222222"], "new", old=(["111111111111"], "old"))
+    with pytest.raises(FanOutError, match="222222222222: Account 222222222222 is suspended"):
+        index.on_event(event, None)
+    assert fake.provisioned == {(PERMISSION_SET_ARN, "111111111111")}
+
+
+def test_account_ids_are_the_indexed_assignments():
+    stack = cdk.Stack(cdk.App(context=CONTEXT), "Stack")
+    permission_set = read_only(stack)
+    admins = SsoGroup(stack, group_name="Admins", description="Admins")
+    devs = SsoGroup(stack, group_name="Devs", description="Devs")
+    permission_set.grant_to_group_for_accounts(admins, ["222222222222", "111111111111"])
+    permission_set.grant_to_group_for_account(devs, "333333333333", assignments=SsoAssignments.get_or_create(stack))
+    permission_set.grant_to_group_for_account(devs, "111111111111")
+    # Another permission set's accounts aren't included
+    other = SsoPermissionSet(stack, name="Admin", managed_policies=[], targeted_provisioning=True)
+    other.grant_to_group_for_account(admins, "444444444444")
+    template = cdk.assertions.Template.from_stack(stack)
+    account_ids = sorted(
+        resource["Properties"]["AccountIds"]
+        for resource in template.find_resources("Custom::SsoPermissionSetProvisioning").values()
+    )
+    assert account_ids == [["111111111111", "222222222222", "333333333333"], ["444444444444"]]
+
+
+def test_policy_hash_changes_only_with_the_policies():
+    def granted(managed_policies, account_ids):
+        def build(stack):
+            permission_set = read_only(stack, managed_policies)
+            group = SsoGroup(stack, group_name="Admins", description="Admins")
+            permission_set.grant_to_group_for_accounts(group, account_ids)
+
+        return provisioning_properties(build)
+
+    base = granted(["arn:aws:iam::aws:policy/ReadOnlyAccess"], ["111111111111"])
+    more_accounts = granted(["arn:aws:iam::aws:policy/ReadOnlyAccess"], ["111111111111", "222222222222"])
+    more_policies = granted(
+        ["arn:aws:iam::aws:policy/ReadOnlyAccess", "arn:aws:iam::aws:policy/AWSSupportAccess"], ["111111111111"]
+    )
+    assert more_accounts["AccountIds"] != base["AccountIds"]
+    assert more_accounts["PolicyHash"] == base["PolicyHash"]
+    assert more_policies["PolicyHash"] != base["PolicyHash"]
@@ -0,0 +1,237 @@
+import pytest
+
+from tests.support import handler
+from tests.support.fake_identitystore import FakeClientError, FakeIdentityStore
+
+import index
+import request_journal
+
+
+class Clock:
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeDynamoDb:
+    """Supports the two conditions DynamoDbJournal writes with."""
+
+    def __init__(self):
+        self.items = {}
+
+    def get_item(self, *, TableName, Key, ConsistentRead):
+        item = self.items.get((TableName, Key["RequestId"]["S"]))
+        return {"Item": item} if item else {}
+
+    def put_item(self, *, TableName, Item, ConditionExpression=None, ExpressionAttributeValues=None):
+        key = (TableName, Item["RequestId"]["S"])
+        existing = self.items.get(key)
+        if ConditionExpression is not None and existing is not None:
+            assert ConditionExpression == "attribute_not_exists(RequestId) OR ExpiresAt <= :now"
+            if int(existing["ExpiresAt"]["N"]) > int(ExpressionAttributeValues[":now"]["N"]):
+                raise FakeClientError("ConditionalCheckFailedException", "The conditional request failed", "PutItem")
+        self.items[key] = Item
+
+    def delete_item(self, *, TableName, Key, ConditionExpression, ExpressionAttributeNames):
+        assert ConditionExpression == "attribute_not_exists(#response)"
+        item = self.items.get((TableName, Key["RequestId"]["S"]))
+        if item is not None and ExpressionAttributeNames["#response"] in item:
+            raise FakeClientError("ConditionalCheckFailedException", "The conditional request failed", "DeleteItem")
+        self.items.pop((TableName, Key["RequestId"]["S"]), None)
+
+
+def new_journal(backend, tmp_path, clock):
+    if backend == "sqlite":
+        return request_journal.SqliteJournal(
+            str(tmp_path / "journal.sqlite"), ttl_seconds=60, clock=clock, sleep=clock.sleep
+        )
+    return request_journal.DynamoDbJournal(FakeDynamoDb, "journal", ttl_seconds=60, clock=clock, sleep=clock.sleep)
+
+
+@pytest.fixture
+def journal(tmp_path):
+    return request_journal.SqliteJournal(str(tmp_path / "journal.sqlite"), ttl_seconds=60, clock=Clock())
+
+
+@pytest.fixture
+def fake(monkeypatch, journal):
+    fake = FakeIdentityStore()
+    monkeypatch.setattr(index, "request_journal", journal)
+    with handler.use_fake(fake):
+        yield fake
+
+
+def create_event(request_id="request-1"):
+    return handler.event("Create", 1, handler.user_properties(1), RequestId=request_id)
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "dynamodb"])
+def test_journal_returns_responses_until_they_expire(tmp_path, backend):
+    clock = Clock()
+    journal = new_journal(backend, tmp_path, clock)
+    assert journal.get("request-1") is None
+    journal.put("request-1", {"PhysicalResourceId": "user-1", "Data": {"UserId": "user-1"}})
+    clock.now += 59
+    assert journal.get("request-1") == {"PhysicalResourceId": "user-1", "Data": {"UserId": "user-1"}}
+    assert journal.get("request-2") is None
+    clock.now += 1
+    assert journal.get("request-1") is None
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "dynamodb"])
+def test_only_the_first_claim_succeeds(tmp_path, backend):
+    clock = Clock()
+    journal = new_journal(backend, tmp_path, clock)
+    assert journal.claim("request-1", 300) is None
+    # Claimed, but no response yet
+    assert journal.get("request-1") is None
+    with pytest.raises(request_journal.RequestInProgress, match="expires in 300s"):
+        journal.claim("request-1", 300)
+    assert journal.claim("request-2", 300) is None
+
+    journal.put("request-1", {"PhysicalResourceId": "user-1"})
+    assert journal.claim("request-1", 300) == {"PhysicalResourceId": "user-1"}
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "dynamodb"])
+def test_expired_claims_are_taken_over(tmp_path, backend):
+    clock = Clock()
+    journal = new_journal(backend, tmp_path, clock)
+    assert journal.claim("request-1", 300) is None
+    # The invocation holding it timed out
+    clock.now += 300
+    assert journal.claim("request-1", 300) is None
+    with pytest.raises(request_journal.RequestInProgress):
+        journal.claim("request-1", 300)
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "dynamodb"])
+def test_claims_wait_for_the_response(tmp_path, backend):
+    clock = Clock()
+    journal = new_journal(backend, tmp_path, clock)
+    journal.claim("request-1", 300)
+    sleep = clock.sleep
+
+    def respond_while_sleeping(seconds):
+        sleep(seconds)
+        if len(clock.sleeps) == 3:
+            journal.put("request-1", {"PhysicalResourceId": "user-1"})
+
+    journal._sleep = respond_while_sleeping
+    assert journal.claim("request-1", 300, max_wait_seconds=600) == {"PhysicalResourceId": "user-1"}
+    assert clock.sleeps == [request_journal.CLAIM_POLL_SECONDS] * 3
+
+    # Or for the claim to expire, then take over
+    journal.claim("request-2", 2)
+    assert journal.claim("request-2", 300, max_wait_seconds=600) is None
+    assert clock.sleeps[3:] == [request_journal.CLAIM_POLL_SECONDS] * 2
+
+
+@pytest.mark.parametrize("backend", ["sqlite", "dynamodb"])
+def test_release_only_removes_claims(tmp_path, backend):
+    clock = Clock()
+    journal = new_journal(backend, tmp_path, clock)
+    journal.claim("request-1", 300)
+    journal.release("request-1")
+    assert journal.claim("request-1", 300) is None
+    journal.put("request-1", {"PhysicalResourceId": "user-1"})
+    journal.release("request-1")
+    assert journal.get("request-1") == {"PhysicalResourceId": "user-1"}
+    journal.release("request-2")
+
+
+def test_sqlite_journal_persists_across_instances(tmp_path):
+    path = str(tmp_path / "journal.sqlite")
+    request_journal.SqliteJournal(path).put("request-1", {"PhysicalResourceId": "user-1"})
+    assert request_journal.SqliteJournal(path).get("request-1") == {"PhysicalResourceId": "user-1"}
+
+
+def test_journal_from_environment_is_off_by_default(tmp_path):
+    assert request_journal.journal_from_environment({}, FakeDynamoDb) is None
+    journal = request_journal.journal_from_environment(
+        {"REQUEST_JOURNAL_TABLE": "journal", "REQUEST_JOURNAL_TTL_SECONDS": "30"}, FakeDynamoDb
+    )
+    assert isinstance(journal, request_journal.DynamoDbJournal) and journal.ttl_seconds == 30
+    journal = request_journal.journal_from_environment(
+        {"REQUEST_JOURNAL_PATH": str(tmp_path / "journal.sqlite")}, FakeDynamoDb
+    )
+    assert isinstance(journal, request_journal.SqliteJournal)
+
+
+def test_redelivered_request_is_answered_without_identitystore_calls(fake):
+    first = index.on_event(create_event(), None)
+    assert fake.calls == {"ListUsers": 1, "CreateUser": 1}
+
+    fake.reset_counts()
+    index.user_directory.invalidate()
+    again = index.on_event(create_event(), None)
+    assert again == first
+    assert fake.calls == {}
+
+
+def test_request_being_handled_elsewhere_is_not_repeated(fake, journal):
+    journal.claim("request-1", 300)
+    with pytest.raises(request_journal.RequestInProgress):
+        index.on_event(create_event(), None)
+    assert fake.calls == {}
+
+
+def test_other_requests_are_not_answered_from_the_journal(fake):
+    index.on_event(create_event("request-1"), None)
+    fake.reset_counts()
+    # Same user, new request: handled as usual, which imports the existing user
+    response = index.on_event(create_event("request-2"), None)
+    assert fake.calls.get("CreateUser") is None
+    assert response["PhysicalResourceId"]
+
+
+def test_failed_requests_are_not_recorded(fake, journal):
+    event = create_event()
+    event["RequestType"] = "Bogus"
+    with pytest.raises(Exception, match="Invalid request type"):
+        index.on_event(event, None)
+    assert journal.get("request-1") is None
+    # The claim is released, so a retry is handled right away
+    assert journal.claim("request-1", 300) is None
+
+
+def test_unreadable_journal_does_not_fail_the_request(fake, monkeypatch):
+    class BrokenJournal(request_journal.RequestJournal):
+        def _read(self, request_id):
+            raise RuntimeError("table not found")
+
+        def _claim(self, request_id, now, claimed_until):
+            raise RuntimeError("table not found")
+
+        def _write(self, request_id, response, expires_at):
+            raise RuntimeError("table not found")
+
+        def _release(self, request_id):
+            raise RuntimeError("table not found")
+
+    monkeypatch.setattr(index, "request_journal", BrokenJournal())
+    response = index.on_event(create_event(), None)
+    assert response["PhysicalResourceId"]
+    assert fake.calls == {"ListUsers": 1, "CreateUser": 1}
+
+
+def test_incomplete_journals_fail_when_constructed():
+    class NoRelease(request_journal.RequestJournal):
+        def _read(self, request_id):
+            return None
+
+        def _claim(self, request_id, now, claimed_until):
+            return None
+
+        def _write(self, request_id, response, expires_at):
+            pass
+
+    with pytest.raises(TypeError, match="_release"):
+        NoRelease()
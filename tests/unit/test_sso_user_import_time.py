@@ -0,0 +1,57 @@
+import os
+import subprocess
+import sys
+
+LAMBDA_DIR = os.path.join(
+    os.path.dirname(__file__), "..", "..", "sso", "constructs", "lambda_functions", "sso_user"
+)
+
+# Cumulative import time of the handler module, best of a few fresh interpreters.
+# Cold starts run in parallel for every user in a deploy, so init time is on the
+# critical path. Override with SSO_USER_IMPORT_BUDGET_MS on slow CI runners.
+IMPORT_BUDGET_MS = float(os.environ.get("SSO_USER_IMPORT_BUDGET_MS") or 100)
+RUNS = 3
+
+
+def capture_import_times():
+    """Returns {module: cumulative microseconds} from `python -X importtime -c 'import index'`."""
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import index"],
+        cwd=LAMBDA_DIR,
+        capture_output=True,
+        text=True,
+        env=dict(
+            os.environ,
+            SSO_IDENTITY_STORE_ID="d-1234567890",
+            SSO_REGION="us-east-1",
+            PYTHONPATH=LAMBDA_DIR,
+            # Keep bytecode out of the Lambda source dir, where it would change the asset hash
+            PYTHONDONTWRITEBYTECODE="1",
+        ),
+    )
+    assert completed.returncode == 0, completed.stderr
+    import_times = {}
+    for line in completed.stderr.splitlines():
+        # "import time:   self [us] | cumulative | imported package"
+        fields = [field.strip() for field in line.split("|")]
+        if len(fields) == 3 and fields[1].isdigit():
+            import_times[fields[2].strip()] = int(fields[1])
+    return import_times
+
+
+def test_handler_import_does_not_load_boto3():
+    # The identitystore client is created lazily on the first API call
+    import_times = capture_import_times()
+    assert "boto3" not in import_times
+    assert "botocore" not in import_times
+
+
+def test_handler_import_time_within_budget():
+    runs = [capture_import_times() for _ in range(RUNS)]
+    best = min(runs, key=lambda import_times: import_times["index"])
+    import_ms = best["index"] / 1000
+    slowest = sorted(best.items(), key=lambda item: item[1], reverse=True)[:10]
+    assert import_ms <= IMPORT_BUDGET_MS, (
+        f"Importing the sso_user handler took {import_ms:.1f}ms, over the "
+        f"{IMPORT_BUDGET_MS:.0f}ms budget. Slowest imports (cumulative us): {slowest}"
+    )
@@ -0,0 +1,92 @@
+import io
+import json
+import logging
+
+import pytest
+
+import structured_log
+from structured_log import JsonFormatter, fields, get_logger, set_context
+
+
+class Expensive:
+    """Counts how often it's turned into a string."""
+
+    def __init__(self):
+        self.formatted = 0
+
+    def __str__(self):
+        self.formatted += 1
+        return "expensive"
+
+
+class Output(io.StringIO):
+    def entries(self):
+        """The JSON lines written since the last call."""
+        lines = self.getvalue().splitlines()
+        self.seek(0)
+        self.truncate()
+        return [json.loads(line) for line in lines]
+
+
+@pytest.fixture
+def output():
+    return Output()
+
+
+@pytest.fixture
+def logger(request, output):
+    logger = get_logger(f"test_structured_log.{request.node.name}")
+    logger.setLevel(logging.INFO)
+    # Rather than stdout, which get_logger() writes to
+    logger.handlers[0].setStream(output)
+    yield logger
+    set_context()
+
+
+def test_records_merge_the_context_and_fields(logger, output):
+    set_context(request_id="request-1", resource_type="Custom::SsoUser", physical_id=None)
+    logger.info("Created user %s", "jdoe", extra=fields(user_id="u-1", request_id="override"))
+    (entry,) = output.entries()
+    assert entry["message"] == "Created user jdoe"
+    assert entry["level"] == "INFO"
+    assert entry["logger"] == logger.name
+    assert entry["resource_type"] == "Custom::SsoUser"
+    assert entry["user_id"] == "u-1"
+    # Fields win over the context; None context values are left out
+    assert entry["request_id"] == "override"
+    assert "physical_id" not in entry
+    assert entry["timestamp"].endswith("Z")
+
+    # Context is replaced, not merged
+    set_context(request_id="request-2")
+    logger.info("Next")
+    (entry,) = output.entries()
+    assert (entry["request_id"], "resource_type" in entry) == ("request-2", False)
+
+
+def test_exceptions_are_included(logger, output):
+    try:
+        raise ValueError("bad")
+    except ValueError:
+        logger.exception("Request failed")
+    (entry,) = output.entries()
+    assert "ValueError: bad" in entry["exception"]
+
+
+def test_debug_below_the_level_is_never_formatted(logger, output):
+    message_argument, field = Expensive(), Expensive()
+    logger.debug("Event %s", message_argument, extra=fields(event=field))
+    assert output.entries() == []
+    assert (message_argument.formatted, field.formatted) == (0, 0)
+
+    logger.info("Event %s", message_argument, extra=fields(event=field))
+    (entry,) = output.entries()
+    assert (entry["message"], entry["event"]) == ("Event expensive", "expensive")
+
+
+def test_formatter_serializes_anything():
+    record = logging.LogRecord("test", logging.INFO, __file__, 1, "Done", None, None)
+    record.fields = {"count": 2, "when": structured_log}
+    entry = json.loads(JsonFormatter().format(record))
+    assert entry["count"] == 2
+    assert entry["when"].startswith("<module 'structured_log'")
@@ -0,0 +1,46 @@
+import csv
+import json
+
+import synth_scaling
+
+
+def test_generated_directory_has_the_requested_sizes(tmp_path):
+    context = synth_scaling.generate_directory(str(tmp_path), users=40, groups=7, assignments=50)
+    with open(context["sso:groupsFile"]) as f:
+        groups = [json.loads(line)["group_name"] for line in f]
+    with open(context["sso:usersFile"], newline="") as f:
+        users = list(csv.DictReader(f))
+    with open(context["sso:assignmentsFile"]) as f:
+        assignments = [json.loads(line) for line in f]
+
+    assert len(set(groups)) == 7
+    assert len({user["username"] for user in users}) == 40
+    for user in users:
+        memberships = user["groups"].split(";")
+        assert len(memberships) == synth_scaling.GROUPS_PER_USER
+        assert set(memberships) <= set(groups)
+    triples = {(row["group"], row["permission_set"], row["account"]) for row in assignments}
+    assert len(triples) == 50
+    assert {row["permission_set"] for row in assignments} <= set(synth_scaling.PERMISSION_SETS)
+    assert all(len(row["account"]) == 12 for row in assignments)
+
+
+def test_default_shard_count_keeps_small_directories_unsharded():
+    assert synth_scaling.default_shard_count(users=50, groups=10, assignments=60) is None
+    shards = synth_scaling.default_shard_count(users=5000, groups=500, assignments=20000)
+    assert shards is not None
+    assert (5000 * 3 + 20000) / shards <= synth_scaling.RESOURCES_PER_SHARD
+
+
+def test_worker_synthesizes_the_stack_with_and_without_nag():
+    results = synth_scaling.benchmark(
+        users=6, groups=2, assignments=4, scales=[1.0], nag_modes=[False, True]
+    )
+    assert [result["nag"] for result in results] == [False, True]
+    for result in results:
+        assert "error" not in result, result["error"]
+        assert result["construct_seconds"] > 0 and result["synth_seconds"] > 0
+        assert result["template_bytes"] > 0
+        assert result["peak_rss_mb"]["python"] > 0
+    assert results[0]["resource_count"] == results[1]["resource_count"]
+    assert "nag_seconds" in results[1]
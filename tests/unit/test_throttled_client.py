@@ -0,0 +1,150 @@
+import pytest
+
+from tests.support.fake_identitystore import FakeClientError
+
+from throttled_client import ThrottledClient, TokenBucket, api_name
+
+
+class Clock:
+    """Time that only passes when something sleeps, or a fake API call takes a while."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class FakeClient:
+    """Answers each call with the next of its outcomes: an exception to raise, or a response."""
+
+    def __init__(self, clock, outcomes, latency_seconds=0.01):
+        self.clock = clock
+        self.outcomes = outcomes
+        self.latency_seconds = latency_seconds
+        self.calls = []
+
+    def _call(self, api, kwargs):
+        self.calls.append((api, kwargs))
+        self.clock.now += self.latency_seconds
+        outcome = self.outcomes.pop(0) if self.outcomes else {}
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    def create_user(self, **kwargs):
+        return self._call("CreateUser", kwargs)
+
+    def list_users(self, **kwargs):
+        return self._call("ListUsers", kwargs)
+
+
+def throttled():
+    return FakeClientError("ThrottlingException", "Rate exceeded", "CreateUser")
+
+
+def client_for(clock, outcomes, **kwargs):
+    fake = FakeClient(clock, outcomes)
+    options = dict(rate_limits={}, default_rate=1000.0, sleep=clock.sleep, clock=clock)
+    return fake, ThrottledClient(lambda: fake, **{**options, **kwargs})
+
+
+def test_api_names():
+    assert api_name("create_user") == "CreateUser"
+    assert api_name("list_group_memberships") == "ListGroupMemberships"
+
+
+def test_token_bucket_spaces_out_calls_beyond_its_burst():
+    clock = Clock()
+    bucket = TokenBucket(2, clock=clock, sleep=clock.sleep)
+    assert [bucket.acquire() for _ in range(4)] == [0.0, 0.0, 0.5, 0.5]
+    assert clock.sleeps == [0.5, 0.5]
+    # Refills at the rate, up to capacity
+    clock.now += 10
+    assert [bucket.acquire() for _ in range(3)] == [0.0, 0.0, 0.5]
+
+
+def test_each_api_has_its_own_rate_limit():
+    clock = Clock()
+    _, client = client_for(clock, [], rate_limits={"CreateUser": 1.0})
+    client.create_user(UserName="a")
+    client.list_users(IdentityStoreId="d-1")
+    client.list_users(IdentityStoreId="d-1")
+    assert clock.sleeps == []
+    client.create_user(UserName="b")
+    assert clock.sleeps == [pytest.approx(1.0 - 0.03)]
+
+
+def test_throttled_calls_are_retried_with_backoff():
+    clock = Clock()
+    fake, client = client_for(clock, [throttled(), throttled(), {"UserId": "user-1"}])
+    assert client.create_user(UserName="jdoe") == {"UserId": "user-1"}
+    assert len(fake.calls) == 3
+    # Full jitter, below an exponentially growing cap
+    assert len(clock.sleeps) == 2
+    assert 0 <= clock.sleeps[0] <= 1.0 and 0 <= clock.sleeps[1] <= 2.0
+    stats = client.api_stats()["CreateUser"]
+    assert (stats.calls, stats.retries, stats.throttles) == (3, 2, 2)
+    assert stats.latency_ms == pytest.approx(30)
+
+
+def test_throttled_calls_give_up_after_max_retries():
+    clock = Clock()
+    fake, client = client_for(clock, [throttled() for _ in range(10)], max_throttle_retries=2)
+    with pytest.raises(FakeClientError, match="ThrottlingException"):
+        client.create_user(UserName="jdoe")
+    assert len(fake.calls) == 3
+    assert len(clock.sleeps) == 2
+    stats = client.api_stats()["CreateUser"]
+    assert (stats.calls, stats.retries, stats.throttles) == (3, 2, 3)
+
+
+def test_other_errors_are_raised_right_away():
+    clock = Clock()
+    error = FakeClientError("ConflictException", "Duplicate UserName", "CreateUser")
+    fake, client = client_for(clock, [error, {}])
+    with pytest.raises(FakeClientError) as raised:
+        client.create_user(UserName="jdoe")
+    assert raised.value is error
+    assert len(fake.calls) == 1 and clock.sleeps == []
+    stats = client.api_stats()["CreateUser"]
+    assert (stats.calls, stats.retries, stats.throttles) == (1, 0, 0)
+
+
+def test_stats_are_kept_per_api_until_reset():
+    clock = Clock()
+    sdk_retried = {"Users": [], "ResponseMetadata": {"RetryAttempts": 2}}
+    _, client = client_for(clock, [{}, sdk_retried, throttled(), {}])
+    client.create_user(UserName="a")
+    client.list_users(IdentityStoreId="d-1")
+    client.create_user(UserName="b")
+    stats = client.api_stats()
+    assert sorted(stats) == ["CreateUser", "ListUsers"]
+    assert (stats["CreateUser"].calls, stats["CreateUser"].retries, stats["CreateUser"].throttles) == (3, 1, 1)
+    # Retries botocore made on its own count too
+    assert (stats["ListUsers"].calls, stats["ListUsers"].retries, stats["ListUsers"].throttles) == (1, 2, 0)
+    assert client.stats_data() == {
+        "ApiStats.CreateUser": "calls=3 retries=1 throttles=1 latencyMs=30",
+        "ApiStats.ListUsers": "calls=1 retries=2 throttles=0 latencyMs=10",
+    }
+    client.reset_stats()
+    assert client.api_stats() == {} and client.stats_data() == {}
+
+
+def test_client_is_created_on_first_call():
+    created = []
+
+    def create():
+        created.append(True)
+        return FakeClient(Clock(), [])
+
+    client = ThrottledClient(create, rate_limits={}, default_rate=1000.0)
+    assert created == []
+    client.list_users(IdentityStoreId="d-1")
+    client.list_users(IdentityStoreId="d-1")
+    assert created == [True]
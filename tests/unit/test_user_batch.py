@@ -0,0 +1,245 @@
+import aws_cdk as cdk
+import pytest
+from aws_cdk.assertions import Template
+
+from sso.constructs import SsoUserAttributes, SsoUserBatch
+from tests.support import handler
+from tests.support.fake_identitystore import FakeIdentityStore
+
+import index
+
+CONTEXT = {"aws:cdk:bundling-stacks": []}
+IDENTITY_STORE_ID = handler.IDENTITY_STORE_ID
+
+
+def attributes(i, first_name="Jane"):
+    properties = handler.user_properties(i, first_name)
+    return SsoUserAttributes(
+        email=properties["email"],
+        username=properties["username"],
+        first_name=properties["first_name"],
+        last_name=properties["last_name"],
+    )
+
+
+def new_batch(users, shard_count=1):
+    stack = cdk.Stack(cdk.App(context=CONTEXT), "Stack")
+    return stack, SsoUserBatch(stack, batch_name="Team", users=users, shard_count=shard_count)
+
+
+def batch_event(request_type, users, old_users=None, physical_id=None):
+    event = {
+        "RequestType": request_type,
+        "ResourceType": "Custom::SsoUserBatch",
+        "LogicalResourceId": "Batch",
+        "RequestId": f"{request_type.lower()}-batch",
+        "StackId": "arn:aws:cloudformation:us-east-1:111111111111:stack/Test/1",
+        "ResourceProperties": {"Users": users},
+    }
+    if old_users is not None:
+        event["OldResourceProperties"] = {"Users": old_users}
+    if physical_id is not None:
+        event["PhysicalResourceId"] = physical_id
+    return event
+
+
+def user_ids(fake):
+    return {
+        user["UserName"]: user["UserId"]
+        for user in fake.list_users(IdentityStoreId=IDENTITY_STORE_ID, MaxResults=100)["Users"]
+    }
+
+
+@pytest.fixture
+def fake():
+    fake = FakeIdentityStore()
+    with handler.use_fake(fake):
+        yield fake
+
+
+def test_one_resource_per_shard_with_its_users_sorted():
+    stack, batch = new_batch([attributes(i) for i in (4, 3, 1, 2, 0)], shard_count=3)
+    resources = Template.from_stack(stack).find_resources("Custom::SsoUserBatch")
+    assert len(resources) == 3
+    shards = [resource["Properties"]["Users"] for resource in resources.values()]
+    assert sorted(user["username"] for users in shards for user in users) == [f"user{i:05d}" for i in range(5)]
+    for users in shards:
+        usernames = [user["username"] for user in users]
+        assert usernames == sorted(usernames)
+        assert len({SsoUserBatch.shard_for_username(username, 3) for username in usernames}) == 1
+        # The attributes, as the handler reads them
+        for user in users:
+            assert user == dict(attributes(int(user["username"][4:])))
+    assert [user.username for user in batch.users] == [f"user{i:05d}" for i in range(5)]
+
+
+def test_user_ids_are_per_user_attributes():
+    stack, batch = new_batch([attributes(0), attributes(1)])
+    (logical_id,) = Template.from_stack(stack).find_resources("Custom::SsoUserBatch")
+    for username in ("user00000", "user00001"):
+        assert stack.resolve(batch.user(username).user_id) == {"Fn::GetAtt": [logical_id, f"UserId.{username}"]}
+    assert SsoUserBatch.user_id_attribute_name("user00000") == index.batch_user_id_attribute_name("user00000")
+
+
+def test_shards_must_fit_the_response_size_limit():
+    users = [attributes(i) for i in range(60)]
+    with pytest.raises(ValueError, match=r"Shard 0 of SsoUserBatch SsoUserBatch-Team holds 60 users.*Increase shard_count"):
+        new_batch(users)
+    # Spread over more shards, they fit
+    new_batch(users, shard_count=3)
+
+
+def test_create(fake):
+    users = [handler.user_properties(i) for i in range(3)]
+    response = index.on_event(batch_event("Create", users), None)
+    assert response["PhysicalResourceId"] == "create-batch"
+    ids = user_ids(fake)
+    assert sorted(ids) == ["user00000", "user00001", "user00002"]
+    for username, user_id in ids.items():
+        assert response["Data"][f"UserId.{username}"] == user_id
+    assert response["Data"]["IdentityStoreId"] == IDENTITY_STORE_ID
+    assert fake.calls["CreateUser"] == 3
+
+
+def test_update_adds_removes_and_changes_users(fake, monkeypatch):
+    monkeypatch.setattr(index, "ALLOW_DELETE_USERS", True)
+    old = [handler.user_properties(i) for i in range(3)]
+    index.on_event(batch_event("Create", old), None)
+    before = user_ids(fake)
+    fake.reset_counts()
+
+    new = [handler.user_properties(0, first_name="Janet"), handler.user_properties(2), handler.user_properties(3)]
+    response = index.on_event(batch_event("Update", new, old_users=old, physical_id="p"), None)
+    assert response["PhysicalResourceId"] == "p"
+    after = user_ids(fake)
+    assert sorted(after) == ["user00000", "user00002", "user00003"]
+    # Users that didn't change keep their IDs
+    assert (after["user00000"], after["user00002"]) == (before["user00000"], before["user00002"])
+    assert sorted(key for key in response["Data"] if key.startswith("UserId.")) == [
+        f"UserId.{username}" for username in sorted(after)
+    ]
+    assert {api: fake.calls.get(api) for api in ("CreateUser", "UpdateUser", "DeleteUser")} == {
+        "CreateUser": 1,
+        "UpdateUser": 1,
+        "DeleteUser": 1,
+    }
+    janet = fake.list_users(
+        IdentityStoreId=IDENTITY_STORE_ID, Filters=[{"AttributePath": "UserName", "AttributeValue": "user00000"}]
+    )["Users"][0]
+    assert janet["Name"]["GivenName"] == "Janet"
+
+
+def test_removed_users_are_kept_unless_deleting_is_allowed(fake):
+    users = [handler.user_properties(i) for i in range(2)]
+    index.on_event(batch_event("Create", users), None)
+    fake.reset_counts()
+    index.on_event(batch_event("Update", users[:1], old_users=users, physical_id="p"), None)
+    index.on_event(batch_event("Delete", users[:1], physical_id="p"), None)
+    assert sorted(user_ids(fake)) == ["user00000", "user00001"]
+    assert "DeleteUser" not in fake.calls
+
+
+def test_delete_fails_when_deleting_is_not_allowed(fake, monkeypatch):
+    monkeypatch.setattr(index, "RETURN_DELETE_SUCCESS_EVEN_IF_DELETE_NOT_ALLOWED", False)
+    users = [handler.user_properties(i) for i in range(2)]
+    index.on_event(batch_event("Create", users), None)
+    fake.reset_counts()
+    with pytest.raises(Exception, match="Deleting users not allowed"):
+        index.on_event(batch_event("Delete", users, physical_id="p"), None)
+    assert fake.calls == {}
+    assert fake.user_count == 2
+
+
+class Context:
+    def __init__(self, remaining_ms):
+        self.remaining_ms = remaining_ms
+
+    def get_remaining_time_in_millis(self):
+        return self.remaining_ms
+
+
+@pytest.fixture
+def async_mode(monkeypatch):
+    monkeypatch.setattr(index, "ASYNC_MODE", True)
+    monkeypatch.setattr(index, "MAX_OPERATIONS_PER_IS_COMPLETE", 2)
+
+
+def poll_until_complete(event, response, context=None):
+    """Calls is_complete as the Provider framework does, until it's done; returns the polls' results."""
+    results = []
+    while not results or not results[-1]["IsComplete"]:
+        results.append(index.is_complete({**event, **response}, context))
+        assert len(results) <= 10
+    return results
+
+
+def test_async_create_is_applied_in_chunks(fake, async_mode):
+    event = batch_event("Create", [handler.user_properties(i) for i in range(5)])
+    response = index.on_event(event, None)
+    assert response["PhysicalResourceId"] == "create-batch"
+    assert not any(key.startswith("UserId.") for key in response["Data"])
+    assert "CreateUser" not in fake.calls
+
+    results = poll_until_complete(event, response)
+    # Each poll resumes from the users that already exist
+    assert [result["IsComplete"] for result in results] == [False, False, True]
+    assert fake.calls["CreateUser"] == 5
+    data = results[-1]["Data"]
+    assert {key: value for key, value in data.items() if key.startswith("UserId.")} == {
+        f"UserId.{username}": user_id for username, user_id in user_ids(fake).items()
+    }
+    assert data["IdentityStoreId"] == IDENTITY_STORE_ID
+
+
+def test_async_update_resumes_from_the_identity_store(fake, async_mode, monkeypatch):
+    monkeypatch.setattr(index, "ALLOW_DELETE_USERS", True)
+    old = [handler.user_properties(i) for i in range(3)]
+    create = batch_event("Create", old)
+    poll_until_complete(create, index.on_event(create, None))
+    fake.reset_counts()
+
+    new = [handler.user_properties(i, first_name="Janet") for i in (1, 2)] + [handler.user_properties(3)]
+    update = batch_event("Update", new, old_users=old, physical_id="create-batch")
+    results = poll_until_complete(update, index.on_event(update, None))
+    # The delete and one write, then the other two writes
+    assert [result["IsComplete"] for result in results] == [False, True]
+    assert {api: fake.calls.get(api) for api in ("CreateUser", "UpdateUser", "DeleteUser")} == {
+        "CreateUser": 1,
+        "UpdateUser": 2,
+        "DeleteUser": 1,
+    }
+    assert sorted(user_ids(fake)) == ["user00001", "user00002", "user00003"]
+
+
+def test_async_polls_stop_when_time_runs_low(fake, async_mode):
+    event = batch_event("Create", [handler.user_properties(0)])
+    response = index.on_event(event, None)
+    low = Context(index.MIN_REMAINING_TIME_MS - 1)
+    assert index.is_complete({**event, **response}, low) == {"IsComplete": False}
+    assert "CreateUser" not in fake.calls
+    assert poll_until_complete(event, response, Context(60_000))[-1]["IsComplete"]
+    assert fake.calls["CreateUser"] == 1
+
+
+def test_async_delete_returns_no_data(fake, async_mode, monkeypatch):
+    monkeypatch.setattr(index, "ALLOW_DELETE_USERS", True)
+    users = [handler.user_properties(i) for i in range(3)]
+    create = batch_event("Create", users)
+    poll_until_complete(create, index.on_event(create, None))
+
+    delete = batch_event("Delete", users, physical_id="create-batch")
+    results = poll_until_complete(delete, index.on_event(delete, None))
+    assert [result["IsComplete"] for result in results] == [False, True]
+    assert {key: value for key, value in results[-1]["Data"].items() if not key.startswith("ApiStats.")} == {}
+    assert fake.user_count == 0
+
+
+def test_conflicting_users_fail_on_event_before_any_write(fake, async_mode):
+    fake.seed_users(
+        [index.toAwsIdentityStoreUserFormat(handler.user_properties(1, first_name="Janet"))], IDENTITY_STORE_ID
+    )
+    fake.reset_counts()
+    event = batch_event("Create", [handler.user_properties(i) for i in range(3)])
+    with pytest.raises(Exception, match="user00001 already taken"):
+        index.on_event(event, None)
+    assert set(fake.calls) == {"ListUsers"}
@@ -0,0 +1,55 @@
+from user_diff import differing_keys, get_change_operations
+
+USER = {
+    "UserName": "jdoe",
+    "Name": {"GivenName": "Jane", "FamilyName": "Doe"},
+    "DisplayName": "Jane Doe",
+    "Emails": [{"Value": "jdoe@example.com", "Type": "work", "Primary": True}],
+}
+EMAILS = [
+    {"Value": "jdoe@example.com", "Type": "work", "Primary": True},
+    {"Value": "jane@example.com", "Type": "home", "Primary": False},
+]
+
+
+def existing(**attributes):
+    """USER as list_users() returns it."""
+    return {"IdentityStoreId": "d-1234567890", "UserId": "u-1", **USER, **attributes}
+
+
+def test_changing_a_name_is_one_operation():
+    new = dict(USER, Name={"GivenName": "Janet", "FamilyName": "Doe"})
+    assert get_change_operations(USER, new) == [
+        {"AttributePath": "name", "AttributeValue": {"GivenName": "Janet", "FamilyName": "Doe"}}
+    ]
+    assert get_change_operations(USER, dict(USER)) == []
+
+
+def test_email_order_only_matters_to_updates():
+    old, new = dict(USER, Emails=EMAILS), dict(USER, Emails=EMAILS[::-1])
+    assert differing_keys(existing(Emails=EMAILS), new) == []
+    # Updates replace the whole list, so still send the new order
+    assert get_change_operations(old, new) == [{"AttributePath": "emails", "AttributeValue": EMAILS[::-1]}]
+
+
+def test_attributes_set_outside_the_stack_are_differences():
+    addresses = [{"StreetAddress": "1 Main St", "Primary": True}]
+    assert differing_keys(existing(Addresses=addresses), USER) == ["Addresses"]
+
+
+def test_identifiers_are_ignored():
+    assert differing_keys(existing(), USER) == []
+    assert differing_keys(existing(UserId="u-2", IdentityStoreId="d-0987654321"), USER) == []
+
+
+def test_keys_missing_on_one_side():
+    without_display_name = {key: value for key, value in USER.items() if key != "DisplayName"}
+    assert differing_keys(existing(), without_display_name) == ["DisplayName"]
+    existing_without_display_name = {key: value for key, value in existing().items() if key != "DisplayName"}
+    assert differing_keys(existing_without_display_name, USER) == ["DisplayName"]
+    assert get_change_operations(without_display_name, USER) == [
+        {"AttributePath": "displayName", "AttributeValue": "Jane Doe"}
+    ]
+    assert get_change_operations(USER, without_display_name) == [
+        {"AttributePath": "displayName", "AttributeValue": None}
+    ]
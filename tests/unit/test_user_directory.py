@@ -0,0 +1,133 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tests.support import handler
+from tests.support.fake_identitystore import FakeClientError, FakeIdentityStore
+
+import index
+from user_directory import UserDirectory
+
+IDENTITY_STORE_ID = handler.IDENTITY_STORE_ID
+
+
+@pytest.fixture
+def fake():
+    fake = FakeIdentityStore()
+    with handler.use_fake(fake):
+        yield fake
+
+
+def create_event(i, **properties):
+    return handler.event("Create", i, {**handler.user_properties(i), **properties})
+
+
+def seed_user(fake, i, **properties):
+    """A user created outside of this container, e.g. by another one or in the console."""
+    attributes = index.toAwsIdentityStoreUserFormat({**handler.user_properties(i), **properties})
+    fake.seed_users([attributes], IDENTITY_STORE_ID)
+    return fake.list_users(
+        IdentityStoreId=IDENTITY_STORE_ID,
+        Filters=[{"AttributePath": "UserName", "AttributeValue": attributes["UserName"]}],
+    )["Users"][0]["UserId"]
+
+
+def test_lookups_share_one_snapshot(fake):
+    for i in range(3):
+        seed_user(fake, i)
+    fake.reset_counts()
+    directory = UserDirectory(lambda: fake, IDENTITY_STORE_ID, ttl_seconds=60, max_users=10)
+    assert directory.get_by_username("user00001")["UserName"] == "user00001"
+    assert directory.get_by_username("nobody") is None
+    assert directory.get_by_email("USER00002@example.com")["UserName"] == "user00002"
+    assert fake.calls == {"ListUsers": 1}
+
+
+def test_partial_snapshots_look_up_misses(fake):
+    for i in range(3):
+        seed_user(fake, i)
+    directory = UserDirectory(lambda: fake, IDENTITY_STORE_ID, ttl_seconds=60, max_users=2)
+    assert sorted(directory.all_users()) == ["user00000", "user00001", "user00002"]
+    fake.reset_counts()
+    assert directory.get_by_username("user00002")["UserName"] == "user00002"
+    assert directory.get_by_username("nobody") is None
+    assert fake.calls == {"ListUsers": 2}
+
+
+def test_misses_on_partial_snapshots_are_looked_up_concurrently(fake, monkeypatch):
+    for i in range(4):
+        seed_user(fake, i)
+    directory = UserDirectory(lambda: fake, IDENTITY_STORE_ID, ttl_seconds=60, max_users=1)
+    directory.all_users()
+    list_users = fake.list_users
+    # Both lookups must be in flight at once to get past it
+    barrier = threading.Barrier(2, timeout=5)
+
+    def slow_filtered_list_users(**kwargs):
+        if "Filters" in kwargs:
+            barrier.wait()
+        return list_users(**kwargs)
+
+    monkeypatch.setattr(fake, "list_users", slow_filtered_list_users)
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        users = list(executor.map(directory.get_by_username, ["user00002", "user00003"]))
+    assert [user["UserName"] for user in users] == ["user00002", "user00003"]
+
+
+def test_lookups_racing_a_delete_are_not_cached(fake, monkeypatch):
+    for i in range(3):
+        seed_user(fake, i)
+    directory = UserDirectory(lambda: fake, IDENTITY_STORE_ID, ttl_seconds=60, max_users=2)
+    directory.all_users()
+    user_id = directory.get_by_username("user00002")["UserId"]
+    # Out of the index again, so the next lookup misses
+    directory.record_delete(user_id)
+    list_users = fake.list_users
+
+    def deleted_while_looking_up(**kwargs):
+        response = list_users(**kwargs)
+        fake.delete_user(IdentityStoreId=IDENTITY_STORE_ID, UserId=user_id)
+        directory.record_delete(user_id)
+        return response
+
+    monkeypatch.setattr(fake, "list_users", deleted_while_looking_up)
+    assert directory.get_by_username("user00002")["UserId"] == user_id
+    monkeypatch.setattr(fake, "list_users", list_users)
+    assert directory.get_by_username("user00002") is None
+
+
+def test_user_created_elsewhere_since_the_snapshot_is_imported(fake):
+    index.on_event(create_event(0), None)
+    user_id = seed_user(fake, 1)
+    # The warm directory's snapshot is complete, but doesn't have user 1 yet
+    response = index.on_event(create_event(1), None)
+    assert response["PhysicalResourceId"] == user_id
+    assert fake.user_count == 2
+
+
+def test_user_created_elsewhere_with_other_attributes_is_not_imported(fake):
+    index.on_event(create_event(0), None)
+    seed_user(fake, 1, first_name="Janet")
+    with pytest.raises(Exception, match="already taken"):
+        index.on_event(create_event(1), None)
+
+
+def test_batch_imports_users_created_elsewhere_since_the_snapshot(fake):
+    properties = {"Users": [handler.user_properties(i) for i in range(3)]}
+    snapshot = index.list_all_users()
+    assert snapshot == {}
+    user_id = seed_user(fake, 1)
+    event = dict(create_event(0), ResourceType="Custom::SsoUserBatch", ResourceProperties=properties)
+    user_ids = index.advance_batch(event, index.OperationBudget())
+    assert user_ids["user00001"] == user_id
+    assert sorted(user_ids) == ["user00000", "user00001", "user00002"]
+
+
+def test_other_create_errors_are_raised(fake, monkeypatch):
+    def create_user(**kwargs):
+        raise FakeClientError("ValidationException", "Bad email", "CreateUser")
+
+    monkeypatch.setattr(fake, "create_user", create_user)
+    with pytest.raises(FakeClientError, match="Bad email"):
+        index.on_event(create_event(0), None)